@@ -52,6 +52,12 @@ class ArgumentParser:
             default=False,
             help="enables the dashboard timeline to display events",
         )
+        self.parser.add_argument(
+            "--live_task_scheduler",
+            action="store_true",
+            default=False,
+            help="keep unfinished tasks as python objects instead of pickling them every step",
+        )
 
     def add_nsp_parser(self):
         nsp_parser = self.parser.add_argument_group("Neural Semantic Parser Args")
@@ -80,6 +86,24 @@ class ArgumentParser:
             default=False,
             help="do not load from ground truth",
         )
+        nsp_parser.add_argument(
+            "--nsp_cache_path",
+            default="cache/nsp_parse_cache.db",
+            help="SQLite file of the parses of the semantic parser kept across runs, "
+            "empty to only cache them in memory",
+        )
+        nsp_parser.add_argument(
+            "--ground_truth_index_path",
+            default="cache/ground_truth_index.db",
+            help="SQLite index of the ground truth commands, rebuilt when they change, "
+            "empty to index them in memory on each run",
+        )
+        nsp_parser.add_argument(
+            "--nsp_cache_size",
+            type=int,
+            default=10000,
+            help="maximum number of parses in the cache, the least recently used are evicted",
+        )
         nsp_parser.add_argument(
             "--dev",
             action="store_true",
@@ -96,6 +120,18 @@ class ArgumentParser:
             "--geoscorer_model_path", default="", help="path to geoscorer model"
         )
         mc_parser.add_argument("--port", type=int, default=25565)
+        mc_parser.add_argument(
+            "--incremental_perception",
+            action="store_true",
+            default=False,
+            help="only rerun the heuristic perception on the parts of the world that changed",
+        )
+        mc_parser.add_argument(
+            "--cached_pathfinding",
+            action="store_true",
+            default=False,
+            help="cache the blocks read by the path finding, updated by block changes",
+        )
 
     def add_loco_parser(self):
         loco_parser = self.parser.add_argument_group("Locobot Agent Args")
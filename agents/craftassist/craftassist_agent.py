@@ -42,7 +42,7 @@ from droidlet.lowlevel.minecraft.mc_util import cluster_areas, MCTime, SPAWN_OBJ
 from droidlet.perception.craftassist.voxel_models.subcomponent_classifier import (
     SubcomponentClassifierWrapper,
 )
-from droidlet.perception.craftassist.search import astar
+from droidlet.perception.craftassist.search import astar, PathFinder
 from droidlet.lowlevel.minecraft import craftassist_specs
 from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import COLOR_BID_MAP
 from droidlet.lowlevel.minecraft import shape_helpers
@@ -190,8 +190,19 @@ class CraftAssistAgent(LocoMCAgent):
         self.perception_modules = {}
         self.perception_modules["low_level"] = LowLevelMCPerception(self)
         self.perception_modules["heuristic"] = heuristic_perception.PerceptionWrapper(
-            self, low_level_data=self.low_level_data
+            self,
+            low_level_data=self.low_level_data,
+            incremental=self.opts.incremental_perception,
         )
+        if self.opts.incremental_perception:
+            self.perception_modules["low_level"].block_change_listeners.append(
+                self.perception_modules["heuristic"].on_block_changed
+            )
+        if self.opts.cached_pathfinding:
+            self.path_finder = PathFinder(self.get_blocks)
+            self.perception_modules["low_level"].block_change_listeners.append(
+                self.path_finder.on_block_changed
+            )
         # set up the SubComponentClassifier model
         if os.path.isfile(self.opts.semseg_model_path):
             self.perception_modules["semseg"] = SubcomponentClassifierWrapper(
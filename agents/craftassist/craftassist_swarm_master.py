@@ -122,9 +122,11 @@ class CraftAssistSwarmMaster(CraftAssistAgent):
             "_db_read_one": self.memory._db_read_one,
             "_db_write": self.memory._db_write,
             "db_write": self.memory.db_write,
+            "_db_write_many": self.memory._db_write_many,
             "tag": self.memory.tag,
             "untag": self.memory.untag,
             "forget": self.memory.forget,
+            "merge_triples": self.memory.merge_triples,
             "add_triple": self.memory.add_triple,
             "get_triples": self.memory.get_triples,
             "check_memid_exists": self.memory.check_memid_exists,
@@ -137,6 +139,8 @@ class CraftAssistSwarmMaster(CraftAssistAgent):
             "get_object_by_id": self.memory.get_object_by_id,
             "get_instseg_object_ids_by_xyz": self.memory.get_instseg_object_ids_by_xyz,
             "upsert_block": self.memory.upsert_block,
+            "upsert_blocks": self.memory.upsert_blocks,
+            "get_object_ids_by_xyzs": self.memory.get_object_ids_by_xyzs,
             "_update_voxel_count": self.memory._update_voxel_count,
             "_update_voxel_mean": self.memory._update_voxel_mean,
             "remove_voxel": self.memory.remove_voxel,
@@ -26,7 +26,7 @@ from droidlet.interpreter.craftassist import dance
 from droidlet.lowlevel.minecraft.mc_util import SPAWN_OBJECTS
 from droidlet.lowlevel.minecraft import craftassist_specs
 from droidlet.perception.semantic_parsing.nsp_querier import NSPQuerier
-from droidlet.perception.craftassist.search import astar
+from droidlet.perception.craftassist.search import astar, PathFinder
 from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import COLOR_BID_MAP
 from droidlet.perception.craftassist import heuristic_perception
 
@@ -287,8 +287,19 @@ class FakeAgent(LocoMCAgent):
         self.perception_modules = {}
         self.perception_modules["low_level"] = LowLevelMCPerception(self, perceive_freq=1)
         self.perception_modules["heuristic"] = PerceptionWrapper(
-            self, low_level_data=self.low_level_data
+            self,
+            low_level_data=self.low_level_data,
+            incremental=self.opts.incremental_perception,
         )
+        if self.opts.incremental_perception:
+            self.perception_modules["low_level"].block_change_listeners.append(
+                self.perception_modules["heuristic"].on_block_changed
+            )
+        if self.opts.cached_pathfinding:
+            self.path_finder = PathFinder(self.get_blocks)
+            self.perception_modules["low_level"].block_change_listeners.append(
+                self.path_finder.on_block_changed
+            )
         self.on_demand_perception = {}
         self.on_demand_perception["check_inside"] = check_inside
 
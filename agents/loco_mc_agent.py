@@ -34,8 +34,13 @@ class LocoMCAgent(BaseAgent):
         self.opts = opts
         self.init_physical_interfaces()
         super(LocoMCAgent, self).__init__(opts, name=self.name)
+        if opts.live_task_scheduler:
+            self.memory.set_live_tasks(True)
         self.uncaught_error_count = 0
         self.last_chat_time = 0
+        # (speaker, chat, preprocessed chat, future of the logical form, time received) of the
+        # chats being parsed, in the order they were received
+        self.pending_parses = []
         self.last_task_memid = None
         self.dashboard_chat = None
         self.areas_to_perceive = []
@@ -305,9 +310,20 @@ class LocoMCAgent(BaseAgent):
             if self.perceive_on_chat:
                 force = True
             self.last_chat_time = time.time()
-            # For now just process the first incoming chat, where chat -> [speaker, chat]
-            speaker, chat = incoming_chats[0]
-            preprocessed_chat, chat_parse = self.chat_parser.get_parse(chat)
+            # the chats are parsed by the parser service, in the background and batched
+            # together, so that the agent keeps stepping while they are parsed
+            for speaker, chat in incoming_chats:
+                preprocessed_chat, chat_parse = self.chat_parser.get_parse_async(chat)
+                self.pending_parses.append(
+                    (speaker, chat, preprocessed_chat, chat_parse, start_time)
+                )
+
+        # add the oldest chat to memory once it is parsed, one chat per step, as the dialogue
+        # manager handles the most recent chat
+        if self.pending_parses and self.pending_parses[0][3].done():
+            speaker, chat, preprocessed_chat, chat_parse, received_time = self.pending_parses[0]
+            self.pending_parses.pop(0)
+            chat_parse = chat_parse.result()
             # add postprocessed chat here
             chat_memid = self.memory.add_chat(self.memory.get_player_by_name(speaker).memid, preprocessed_chat)
             logical_form_memid = self.memory.add_logical_form(chat_parse)
@@ -318,9 +334,9 @@ class LocoMCAgent(BaseAgent):
             end_time = datetime.datetime.now()
             hook_data = {
                 "name" : "perceive",
-                "start_time" : start_time,
+                "start_time" : received_time,
                 "end_time" : end_time,
-                "elapsed_time" : (end_time - start_time).total_seconds(),
+                "elapsed_time" : (end_time - received_time).total_seconds(),
                 "agent_time" : self.get_time(),
                 "speaker" : speaker, 
                 "chat" : chat, 
@@ -228,7 +228,8 @@ class LocobotAgent(LocoMCAgent):
             "map": self.mover.get_obstacles_in_canonical_coords()
         })
 
-        previous_objects = DetectedObjectNode.get_all(self.memory)
+        # the deduplicator reads the features of the previous objects from the memory cache
+        previous_objects = self.memory.detected_objects
         new_state = self.perception_modules["vision"].perceive(rgb_depth,
                                                                xyz,
                                                                previous_objects,
@@ -406,17 +406,18 @@ class Build(Task):
             if manhat_dist(agent.pos, target) <= self.DIG_REACH:
                 success = agent.dig(*target)
                 if success:
-                    agent.perception_modules["low_level"].maybe_remove_inst_seg(target)
-                    if self.is_destroy_schm:
-                        agent.perception_modules["low_level"].maybe_remove_block_from_memory(
-                            target, (0, 0)
-                        )
-                    else:
-                        agent.perception_modules["low_level"].maybe_add_block_to_memory(
-                            target, (0, 0), agent_placed=True
-                        )
-                        self.add_tags(agent, (target, (0, 0)))
-                    agent.get_changed_blocks()
+                    with agent.memory.transaction():
+                        agent.perception_modules["low_level"].maybe_remove_inst_seg(target)
+                        if self.is_destroy_schm:
+                            agent.perception_modules["low_level"].maybe_remove_block_from_memory(
+                                target, (0, 0)
+                            )
+                        else:
+                            agent.perception_modules["low_level"].maybe_add_block_to_memory(
+                                target, (0, 0), agent_placed=True
+                            )
+                            self.add_tags(agent, (target, (0, 0)))
+                    agent.perception_modules["low_level"].drain_changed_blocks()
             else:
                 mv = Move(agent, {"target": target, "approx": self.DIG_REACH})
                 self.add_child_task(mv)
@@ -443,6 +444,7 @@ class Build(Task):
             return
         if manhat_dist(agent.pos, target) <= self.PLACE_REACH:
             # block is within reach
+            low_level_perception = agent.perception_modules["low_level"]
             assert current_idm[0] != idm[0], "current={} idm={}".format(current_idm, idm)
             if current_idm[0] != 0:
                 logging.debug(
@@ -456,12 +458,13 @@ class Build(Task):
                 if agent.place_block(x, y, z):
                     B = agent.get_blocks(x, x, y, y, z, z)
                     if B[0, 0, 0, 0] == idm[0]:
-                        agent.perception_modules["low_level"].maybe_add_block_to_memory(
-                            (x, y, z), tuple(idm), agent_placed=True
-                        )
-                        changed_blocks = agent.get_changed_blocks()
-                        self.new_blocks.append(((x, y, z), tuple(idm)))
-                        self.add_tags(agent, ((x, y, z), tuple(idm)))
+                        with agent.memory.transaction():
+                            low_level_perception.maybe_add_block_to_memory(
+                                (x, y, z), tuple(idm), agent_placed=True
+                            )
+                            changed_blocks = low_level_perception.drain_changed_blocks()
+                            self.new_blocks.append(((x, y, z), tuple(idm)))
+                            self.add_tags(agent, ((x, y, z), tuple(idm)))
                     else:
                         logging.error(
                             "failed to place block {} @ {}, but place_block returned True. \
@@ -478,7 +481,7 @@ class Build(Task):
                         x, y, z = sapling_pos
                         for _ in range(6):  # use at most 6 bone meal (should be enough)
                             agent.use_item_on_block(x, y, z)
-                            changed_blocks = agent.get_changed_blocks()
+                            changed_blocks = low_level_perception.drain_changed_blocks()
                             changed_block_poss = {block[0] for block in changed_blocks}
                             # sapling has grown to a full tree, stop using bone meal
                             if (x, y, z) in changed_block_poss:
@@ -0,0 +1,87 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+
+import numpy as np
+
+from droidlet.interpreter.tests.all_test_commands import *
+from droidlet.perception.craftassist.heuristic_perception import PerceptionWrapper
+from droidlet.perception.craftassist.search import PathFinder
+from droidlet.perception.craftassist.tests.test_heuristic_perception import (
+    PerceptionAgent,
+    block_objects,
+)
+from droidlet.shared_data_structs import MockOpt
+from agents.craftassist.tests.base_craftassist_test_case import BaseCraftassistTestCase
+
+
+class IncrementalPerceptionTaskTest(BaseCraftassistTestCase):
+    """the blocks changed by the agent's tasks reach the incremental heuristic perception"""
+
+    def setUp(self):
+        opts = MockOpt()
+        opts.incremental_perception = True
+        super().setUp(agent_opts=opts)
+        self.set_looking_at((0, 63, 0))
+        # the fake agent does not run the heuristic perception in its steps
+        self.agent.perception_modules["heuristic"].perceive(force=True)
+
+    def assert_same_as_full_perception(self):
+        perception = self.agent.perception_modules["heuristic"]
+        bounds = perception.window.bounds()
+        np.testing.assert_array_equal(
+            perception.window.get_blocks(*bounds), self.agent.get_blocks(*bounds)
+        )
+        perception.perceive(force=True)
+        full = PerceptionAgent(self.world, pos=self.agent.pos)
+        PerceptionWrapper(full, self.agent.low_level_data).perceive(force=True)
+        self.assertEqual(block_objects(self.agent.memory), block_objects(full.memory))
+
+    def test_build_and_destroy(self):
+        # the blocks are placed, then dug by Build tasks
+        changes = self.handle_logical_form(BUILD_COMMANDS["build a red cube"])
+        self.assertGreater(len(changes), 0)
+        self.assert_same_as_full_perception()
+
+        changes = self.handle_logical_form(DESTROY_COMMANDS["destroy the red cube"])
+        self.assertGreater(len(changes), 0)
+        self.assert_same_as_full_perception()
+
+
+class CachedPathfindingTaskTest(BaseCraftassistTestCase):
+    """the blocks changed by the agent's tasks reach the cached PathFinder"""
+
+    def setUp(self):
+        opts = MockOpt()
+        opts.cached_pathfinding = True
+        super().setUp(agent_opts=opts)
+        self.set_looking_at((0, 63, 0))
+
+    def assert_same_as_uncached(self, start, target):
+        path_finder = self.agent.path_finder
+        uncached = PathFinder(self.agent.get_blocks, max_chunks=0)
+        box = (-12, 12, 60, 70, -12, 12)
+        np.testing.assert_array_equal(path_finder.get_blocked(*box), uncached.get_blocked(*box))
+        path = path_finder.find_path(start, target)
+        self.assertEqual(path, uncached.find_path(start, target))
+        return path
+
+    def test_build_and_replan(self):
+        start, target = (-10, 63, 0), (10, 63, 0)
+        self.assert_same_as_uncached(start, target)
+        changes = self.handle_logical_form(BUILD_COMMANDS["build a red cube"])
+        placed = {xyz for xyz, idm in changes.items() if idm[0] != 0}
+        self.assertGreater(len(placed), 0)
+        x, y, z = sorted(placed)[0]
+        # a path along the row of the cube goes around it
+        start, target = (-10, y, z), (10, y, z)
+        path = self.assert_same_as_uncached(start, target)
+        self.assertFalse(placed & set(path))
+
+        self.handle_logical_form(DESTROY_COMMANDS["destroy the red cube"])
+        self.assertTrue(set(self.assert_same_as_uncached(start, target)) & placed)
+
+
+if __name__ == "__main__":
+    unittest.main()
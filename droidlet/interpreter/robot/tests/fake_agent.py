@@ -399,6 +399,7 @@ class FakeAgent(LocoMCAgent):
             opts.no_ground_truth = True
             opts.log_timeline = False
             opts.enable_timeline = False
+            opts.live_task_scheduler = False
         super(FakeAgent, self).__init__(opts)
         self.no_default_behavior = True
         self.last_task_memid = None
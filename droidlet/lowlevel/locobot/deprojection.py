@@ -0,0 +1,174 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+
+Deprojection of depth images into point clouds.  The rays of the pixels of a camera are
+computed once per intrinsics and image size (see get_deprojector), and the camera to base
+to world transforms are fused into one 4x4 matrix, so that a frame is deprojected with a
+single matrix product into one output array, without temporary point clouds.
+
+This module only depends on numpy, so it can be imported on the robot (with sys.path, as
+in remote_locobot.py) as well as by the agent.
+"""
+import threading
+
+import numpy as np
+
+# the habitat camera frame in the ros camera frame
+ROS_TO_HABITAT_FRAME = np.array([[0.0, -1.0, 0.0], [0.0, 0.0, -1.0], [1.0, 0.0, 0.0]])
+
+# at most this many Deprojectors are cached by get_deprojector
+MAX_CACHED = 8
+_deprojectors = {}
+_deprojectors_lock = threading.Lock()
+
+
+def rigid_transform(rot=None, trans=None):
+    """4x4 matrix of the transform p -> rot @ p + trans"""
+    T = np.eye(4)
+    if rot is not None:
+        T[:3, :3] = rot
+    if trans is not None:
+        T[:3, 3] = np.asarray(trans).reshape(-1)
+    return T
+
+
+def pose_transform(pose):
+    """
+    4x4 matrix of transform_pose(p, pose): the rotation of pose[2] radians around z,
+    followed by the translation of (pose[0], pose[1], 0)
+    """
+    c, s = np.cos(pose[2]), np.sin(pose[2])
+    return rigid_transform([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]], [pose[0], pose[1], 0.0])
+
+
+def camera_to_base(rot, trans, backend="locobot"):
+    """
+    4x4 matrix from the camera frame to the robot base frame, given the camera rot and trans
+    returned by RemoteLocobot.get_pcd_data.  In habitat, these are in the habitat frame,
+    which is converted back to the ros frame.
+    """
+    T = rigid_transform(rot, trans)
+    if backend == "habitat":
+        T = rigid_transform(ROS_TO_HABITAT_FRAME.T) @ T
+    return T
+
+
+class Deprojector(object):
+    """
+    Deprojects depth images of one camera into point clouds, with the pixel rays precomputed.
+
+    Args:
+        intrinsics: 3x3 intrinsic matrix of the camera
+        height, width: size of the depth images
+        stride: only deproject every stride-th row and column of the images
+        dtype: dtype of the point clouds
+
+    Examples::
+        >>> deprojector = get_deprojector(intrinsics, 480, 640)
+        >>> transform = pose_transform(base_pose) @ camera_to_base(rot, trans)
+        >>> pts = deprojector.deproject(depth_mm, transform, scale=0.001)
+    """
+
+    def __init__(self, intrinsics, height, width, stride=1, dtype=np.float64):
+        self.height, self.width, self.stride = height, width, stride
+        self.dtype = np.dtype(dtype)
+        rows, cols = np.mgrid[0:height:stride, 0:width:stride]
+        self.shape = rows.shape
+        uv_one = np.stack([cols.reshape(-1), rows.reshape(-1), np.ones(rows.size)])
+        rays = np.linalg.inv(np.asarray(intrinsics, dtype=np.float64)) @ uv_one
+        # (n, 3) rays at depth 1 of the pixels, in the order of the flattened image
+        self.rays = np.ascontiguousarray(rays.T, dtype=self.dtype)
+
+    def __len__(self):
+        return self.rays.shape[0]
+
+    def _check(self, depth):
+        if depth.shape[:2] != (self.height, self.width):
+            raise ValueError(
+                "depth image is {}, not {}".format(depth.shape[:2], (self.height, self.width))
+            )
+
+    def deproject(self, depth, transform=None, scale=1.0, out=None):
+        """
+        returns the point cloud of a depth image, one point per pixel (every stride-th one)
+        in the order of the flattened image, as transform @ (depth * scale * ray)
+
+        :param depth: the depth image, of any numeric dtype
+        :param transform: 4x4 matrix from the camera frame to the frame of the points,
+            None for the camera frame
+        :param scale: depth units to the units of the points, e.g. 0.001 for depth in mm
+        :param out: array of shape (len(self), 3) and dtype self.dtype to write the points in,
+            e.g. to reuse the buffer of the previous frame; None allocates a new one
+
+        :rtype: np.ndarray [len(self), 3]
+        """
+        self._check(depth)
+        if out is None:
+            out = np.empty(self.rays.shape, dtype=self.dtype)
+        s = self.stride
+        # the Deprojectors are shared by the threads of a process (e.g. the Pyro server),
+        # so the depths are not written in a buffer of the Deprojector
+        z = np.multiply(depth[::s, ::s], scale, dtype=self.dtype).reshape(-1, 1)
+        if transform is None:
+            return np.multiply(self.rays, z, out=out)
+        transform = np.asarray(transform, dtype=self.dtype)
+        np.dot(self.rays, transform[:3, :3].T, out=out)
+        out *= z
+        out += transform[:3, 3]
+        return out
+
+    def mask(self, depth, min_depth=0.0, max_depth=np.inf):
+        """
+        returns the flat mask of the pixels (every stride-th one) with
+        min_depth < depth < max_depth, in depth units
+        """
+        self._check(depth)
+        s = self.stride
+        d = depth[::s, ::s]
+        return ((d > min_depth) & (d < max_depth)).reshape(-1)
+
+
+def threshold_range(depth_threshold):
+    """
+    (min_depth, max_depth) of Deprojector.mask for the depth_threshold of a pyrobot
+    DepthImgProcessor: None, (min,) or (min, max).  The pixels without depth are always
+    masked out.
+    """
+    if depth_threshold is None:
+        return 0.0, np.inf
+    min_depth = max(depth_threshold[0], 0.0)
+    max_depth = depth_threshold[1] if len(depth_threshold) > 1 else np.inf
+    return min_depth, max_depth
+
+
+def get_deprojector(intrinsics, height, width, stride=1, dtype=np.float64):
+    """returns a cached Deprojector for these intrinsics and image size, see Deprojector"""
+    intrinsics = np.asarray(intrinsics, dtype=np.float64)
+    key = (intrinsics.tobytes(), int(height), int(width), stride, np.dtype(dtype).str)
+    with _deprojectors_lock:
+        deprojector = _deprojectors.get(key)
+        if deprojector is None:
+            if len(_deprojectors) >= MAX_CACHED:
+                _deprojectors.pop(next(iter(_deprojectors)))
+            deprojector = Deprojector(intrinsics, height, width, stride=stride, dtype=dtype)
+            _deprojectors[key] = deprojector
+    return deprojector
+
+
+def voxel_indices(pts, voxel_size):
+    """
+    voxel grid filter: returns the sorted indices of one point (the first one) per voxel of
+    side voxel_size, ignoring the points which are not finite
+
+    :param pts: the points
+    :type pts: np.ndarray [n, 3]
+    :rtype: np.ndarray
+    """
+    finite = np.nonzero(np.isfinite(pts).all(axis=1))[0]
+    if len(finite) == 0:
+        return finite
+    keys = np.floor(pts[finite] / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    flat = np.ravel_multi_index(keys.T, keys.max(axis=0) + 1)
+    _, first = np.unique(flat, return_index=True)
+    return finite[np.sort(first)]
@@ -0,0 +1,201 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+
+Transport of camera frames (e.g. uint8 rgb and uint16 depth) from RemoteLocobot to
+LoCoBotMover without pickling them through Pyro, when both run on the same host.  The
+remote side writes each frame in a FrameRing, a ring buffer of the last few frames in
+shared memory, and returns only the frame's metadata over Pyro; the client reads the
+frame from the shared memory.  On another host, the frames go through Pyro: streaming
+the raw arrays over TCP was not faster than pickling them through Pyro.
+
+This module only depends on numpy and the standard library, so it can be imported
+on the robot (with sys.path, as in remote_locobot.py) as well as by the agent.
+"""
+import struct
+import time
+import uuid
+import logging
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+# frames kept in a FrameRing before they are overwritten
+RING_SLOTS = 4
+# slot header: seq at the start of the write, seq at the end of the write, timestamp
+SLOT_HEADER = struct.Struct("<QQd")
+# ring header: latest seq
+RING_HEADER = struct.Struct("<Q")
+ALIGN = 64
+
+
+class FrameTransportError(Exception):
+    pass
+
+
+# names of the shared memories created by this process
+_created = set()
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+class FrameRing:
+    """
+    A ring buffer of frames in shared memory.  A frame is a list of arrays with fixed
+    shapes and dtypes (the spec), written by a single writer; each slot is guarded by
+    a seqlock, so readers detect frames overwritten while they were reading them.
+
+    Args:
+        spec: list of (shape, dtype) of the arrays of a frame
+        name: name of the shared memory; None creates a new one (the writer),
+            otherwise the existing one is attached (a reader)
+        slots: number of frames in the ring
+        unregister: a reader unregisters the ring from its resource tracker, so that the
+            tracker does not unlink it when the reader exits; False when the reader shares the
+            resource tracker of the writer, e.g. in a process spawned by it
+
+    Examples::
+        >>> ring = FrameRing([((480, 640, 3), "uint8"), ((480, 640), "uint16")])
+        >>> seq, timestamp = ring.write([rgb, depth])
+        >>> reader = FrameRing(ring.spec, name=ring.name)
+        >>> rgb, depth = reader.read(seq)[2]
+    """
+
+    def __init__(self, spec, name=None, slots=RING_SLOTS, unregister=True):
+        self.spec = [(tuple(int(d) for d in shape), np.dtype(dtype).str) for shape, dtype in spec]
+        self.slots = slots
+        self.offsets = []
+        offset = SLOT_HEADER.size
+        for shape, dtype in self.spec:
+            offset = _aligned(offset)
+            self.offsets.append(offset)
+            offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        self.slot_size = _aligned(offset)
+        size = _aligned(RING_HEADER.size) + self.slot_size * slots
+        self.owner = name is None
+        if self.owner:
+            name = "droidlet_frames_" + uuid.uuid4().hex[:16]
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+            _created.add(name)
+        else:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name)
+            except FileNotFoundError:
+                raise FrameTransportError("no shared memory frame ring {}".format(name))
+            if unregister and name not in _created:
+                # only the writer unlinks the ring, not the resource tracker of a reader
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+            if self.shm.size < size:
+                self.shm.close()
+                raise FrameTransportError("frame ring {} does not match the spec".format(name))
+        self.name = name
+        self.seq = self.latest()
+
+    def metadata(self):
+        """what a reader needs to attach to the ring"""
+        spec = [[list(shape), dtype] for shape, dtype in self.spec]
+        return {"shm_name": self.name, "spec": spec, "slots": self.slots}
+
+    def _slot(self, seq):
+        return _aligned(RING_HEADER.size) + (seq % self.slots) * self.slot_size
+
+    def _arrays(self, start):
+        return [
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=start + offset)
+            for (shape, dtype), offset in zip(self.spec, self.offsets)
+        ]
+
+    def latest(self):
+        """seq of the last frame written, 0 if there is none"""
+        return RING_HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def write(self, arrays, timestamp=None):
+        """copies the arrays of a frame in the next slot, returns its (seq, timestamp)"""
+        timestamp = time.time() if timestamp is None else timestamp
+        self.seq = max(self.seq, self.latest()) + 1
+        start = self._slot(self.seq)
+        SLOT_HEADER.pack_into(self.shm.buf, start, self.seq, 0, timestamp)
+        for dst, src in zip(self._arrays(start), arrays):
+            if dst.shape != np.shape(src):
+                raise FrameTransportError(
+                    "frame shape {} is not {}".format(np.shape(src), dst.shape)
+                )
+            dst[...] = src
+        SLOT_HEADER.pack_into(self.shm.buf, start, self.seq, self.seq, timestamp)
+        RING_HEADER.pack_into(self.shm.buf, 0, self.seq)
+        return self.seq, timestamp
+
+    def read(self, seq=None, copy=True):
+        """
+        returns (seq, timestamp, arrays) of frame seq, or of the latest frame if seq is None.
+        with copy=False the arrays are views of the shared memory, which the writer
+        overwrites slots frames later.
+        raises FrameTransportError if the frame is not in the ring anymore
+        """
+        if seq is None:
+            seq = self.latest()
+        if seq <= 0:
+            raise FrameTransportError("no frame in the ring")
+        start = self._slot(seq)
+        begin, end, timestamp = SLOT_HEADER.unpack_from(self.shm.buf, start)
+        if begin != seq or end != seq:
+            raise FrameTransportError("frame {} was overwritten".format(seq))
+        arrays = self._arrays(start)
+        if copy:
+            arrays = [a.copy() for a in arrays]
+            # the writer may have started writing the slot during the copy
+            if SLOT_HEADER.unpack_from(self.shm.buf, start)[0] != seq:
+                raise FrameTransportError("frame {} was overwritten".format(seq))
+        return seq, timestamp, arrays
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.name)
+
+
+class FrameClient:
+    """
+    Fetches the frames announced by the metadata of a frame (see RemoteLocobot.get_pcd_frame)
+    from the shared memory ring, on the host of the ring.
+
+    Examples::
+        >>> client = FrameClient()
+        >>> if client.attach(meta):
+        >>>     rgb, depth = client.fetch(meta)
+    """
+
+    def __init__(self):
+        self.ring = None
+
+    def attach(self, meta):
+        """attaches the ring of the frame with metadata meta, returns False if it is not on
+        this host"""
+        if self.ring is not None and self.ring.name == meta["shm_name"]:
+            return True
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        try:
+            self.ring = FrameRing(meta["spec"], name=meta["shm_name"], slots=meta["slots"])
+        except FrameTransportError:
+            return False
+        logging.info("reading frames from shared memory {}".format(meta["shm_name"]))
+        return True
+
+    def fetch(self, meta):
+        """returns the arrays of the frame with metadata meta
+
+        raises FrameTransportError if the ring can not be attached (e.g. it was replaced), or
+        the frame is not in it anymore
+        """
+        if not self.attach(meta):
+            raise FrameTransportError("no shared memory frame ring {}".format(meta["shm_name"]))
+        return self.ring.read(meta["seq"])[2]
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
@@ -4,7 +4,6 @@ Copyright (c) Facebook, Inc. and its affiliates.
 import os
 import sys
 import math
-import copy
 import time
 import logging
 from collections.abc import Iterable
@@ -18,6 +17,8 @@ if "/opt/ros/kinetic/lib/python2.7/dist-packages" in sys.path:
 from droidlet.shared_data_structs import ErrorWithResponse
 from agents.argument_parser import ArgumentParser
 from droidlet.shared_data_structs import RGBDepth
+from .frame_transport import FrameClient, FrameTransportError
+from .deprojection import get_deprojector, camera_to_base, pose_transform
 
 from .locobot_mover_utils import (
     get_camera_angles,
@@ -25,7 +26,6 @@ from .locobot_mover_utils import (
     MAX_PAN_RAD,
     CAMERA_HEIGHT,
     ARM_HEIGHT,
-    transform_pose,
     base_canonical_coords_to_pyrobot_coords,
     xyz_pyrobot_to_canonical_coords,
 )
@@ -50,22 +50,35 @@ class LoCoBotMover:
     Arguments:
         ip (string): IP of the Locobot.
         backend (string): backend where the Locobot lives, either "habitat" or "locobot"
+        use_frame_transport (bool): read the camera frames from shared memory instead of
+            through Pyro when the robot runs on the same host, see frame_transport.py
     """
 
-    def __init__(self, ip=None, backend="locobot"):
+    def __init__(self, ip=None, backend="locobot", use_frame_transport=True):
         self.bot = Pyro4.Proxy("PYRONAME:remotelocobot@" + ip)
         self.close_loop = False if backend == "habitat" else True
         self.curr_look_dir = np.array([0, 0, 1])  # initial look dir is along the z-axis
 
-        intrinsic_mat = safe_call(self.bot.get_intrinsics)
-        intrinsic_mat_inv = np.linalg.inv(intrinsic_mat)
+        self.intrinsic_mat = np.array(safe_call(self.bot.get_intrinsics))
         img_resolution = safe_call(self.bot.get_img_resolution)
-        img_pixs = np.mgrid[0 : img_resolution[0] : 1, 0 : img_resolution[1] : 1]
-        img_pixs = img_pixs.reshape(2, -1)
-        img_pixs[[0, 1], :] = img_pixs[[1, 0], :]
-        uv_one = np.concatenate((img_pixs, np.ones((1, img_pixs.shape[1]))))
-        self.uv_one_in_cam = np.dot(intrinsic_mat_inv, uv_one)
+        # precomputes the pixel rays, see get_rgb_depth
+        get_deprojector(self.intrinsic_mat, *img_resolution)
         self.backend = backend
+        self.frame_client = self.init_frame_client() if use_frame_transport else None
+
+    def init_frame_client(self):
+        """Returns a FrameClient reading the camera frames of the robot from shared memory,
+        or None if the robot has no frame transport or runs on another host"""
+        # Pyro proxies raise AttributeError for the methods the remote object does not expose
+        if not hasattr(self.bot, "get_pcd_frame"):
+            logging.info("no frame transport on the robot, fetching frames through Pyro")
+            return None
+        frame_client = FrameClient()
+        meta = self.bot.get_pcd_frame()
+        if meta is not None and not frame_client.attach(meta):
+            logging.info("the robot runs on another host, fetching frames through Pyro")
+            return None
+        return frame_client
 
     def check(self):
         """
@@ -333,24 +346,34 @@ class LoCoBotMover:
         Returns:
             an RGBDepth object
         """
-        rgb, depth, rot, trans = self.bot.get_pcd_data()
-        depth = depth.astype(np.float32)
-        d = copy.deepcopy(depth)
-        depth /= 1000.0
-        depth = depth.reshape(-1)
-        pts_in_cam = np.multiply(self.uv_one_in_cam, depth)
-        pts_in_cam = np.concatenate((pts_in_cam, np.ones((1, pts_in_cam.shape[1]))), axis=0)
-        pts = pts_in_cam[:3, :].T
-        pts = np.dot(pts, rot.T)
-        pts = pts + trans.reshape(-1)
-        if self.backend == "habitat":
-            ros_to_habitat_frame = np.array([[0.0, -1.0, 0.0], [0.0, 0.0, -1.0], [1.0, 0.0, 0.0]])
-            pts = ros_to_habitat_frame.T @ pts.T
-            pts = pts.T
-        pts = transform_pose(pts, self.bot.get_base_state("odom"))
+        rgb, depth, rot, trans = self.get_pcd_data()
+        d = depth.astype(np.float32)
+        # camera -> base -> world in one transform
+        transform = pose_transform(self.bot.get_base_state("odom")) @ camera_to_base(
+            rot, trans, self.backend
+        )
+        deprojector = get_deprojector(self.intrinsic_mat, *depth.shape)
+        pts = deprojector.deproject(depth, transform, scale=0.001)
         logging.info("Fetched all camera sensor input.")
         return RGBDepth(rgb, d, pts)
 
+    def get_pcd_data(self):
+        """Fetches rgb, depth (uint16, in mm) and the camera rotation and translation.
+        Only the metadata of the frame goes through Pyro if the frames are read from shared
+        memory (see init_frame_client); otherwise, or if the frame was overwritten before it
+        was read, the frame is fetched through Pyro.
+        """
+        if self.frame_client is not None:
+            meta = self.bot.get_pcd_frame()
+            if meta is None:
+                return None
+            try:
+                rgb, depth = self.frame_client.fetch(meta)
+                return rgb, depth, np.array(meta["rot"]), np.array(meta["trans"])
+            except FrameTransportError as e:
+                logging.warning("frame transport failed, fetching the frame through Pyro: %s", e)
+        return self.bot.get_pcd_data()
+
     def dance(self):
         self.bot.dance()
 
@@ -8,12 +8,24 @@ import numpy as np
 from scipy.spatial.transform import Rotation
 import logging
 import os
+import sys
 import json
+import threading
 import skfmm
 import skimage
 from pyrobot.locobot.camera import DepthImgProcessor
 from slam_pkg.slam import Slam
 
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from frame_transport import FrameRing
+from deprojection import (
+    get_deprojector,
+    camera_to_base,
+    pose_transform,
+    threshold_range,
+    voxel_indices,
+)
+
 Pyro4.config.SERIALIZERS_ACCEPTED.add("pickle")
 Pyro4.config.ITER_STREAMING = True
 
@@ -61,11 +73,15 @@ class RemoteLocobot(object):
         else:
             raise RuntimeError("Unknown backend", backend)
 
+        self.backend = backend
         # check skfmm, skimage in installed, its necessary for slam
-        self._slam = Slam(self._robot, backend)
+        self._slam = Slam(self._robot, backend, get_pcd=lambda: self.get_current_pcd()[0])
         self._slam_step_size = 25  # step size in cm
         self._done = True
-        self.backend = backend
+        # shared memory ring of the frames of get_pcd_frame, created on the first frame; the
+        # ring has a single writer, but the Pyro server calls get_pcd_frame from its threads
+        self._frames = None
+        self._frames_lock = threading.Lock()
 
     def restart_habitat(self):
         if hasattr(self, "_robot"):
@@ -102,19 +118,27 @@ class RemoteLocobot(object):
             return None
 
     def get_pcd_data(self):
-        """Gets all the data to calculate the point cloud for a given rgb, depth frame."""
+        """Gets all the data to calculate the point cloud for a given rgb, depth frame.
+        The frames are pickled by Pyro, see get_pcd_frame for a faster transport."""
         rgb, depth = self._robot.camera.get_rgb_depth()
         depth *= 1000  # convert to mm
         # cap anything more than np.power(2,16)~ 65 meter
         depth[depth > np.power(2, 16) - 1] = np.power(2, 16) - 1
         depth = depth.astype(np.uint16)
+        camera_pose = self._get_camera_pose()
+        if camera_pose is None:
+            return None
+        return (rgb, depth) + camera_pose
+
+    def _get_camera_pose(self):
+        """rotation and translation of the camera in the base frame (habitat frame in habitat)"""
         if self.backend == "locobot":
             trans, rot, T = self._robot.camera.get_link_transform(
                 self._robot.camera.cam_cf, self._robot.camera.base_f
             )
             base2cam_trans = np.array(trans).reshape(-1, 1)
             base2cam_rot = np.array(rot)
-            return rgb, depth, base2cam_rot, base2cam_trans
+            return base2cam_rot, base2cam_trans
         elif self.backend == "habitat":
             cur_state = self._robot.camera.agent.get_state()
             cur_sensor_state = cur_state.sensor_states["rgb"]
@@ -124,9 +148,41 @@ class RemoteLocobot(object):
             relative_position = rot_init_rotation.T @ relative_position
             cur_rotation = self._robot.camera._rot_matrix(cur_sensor_state.rotation)
             cur_rotation = rot_init_rotation.T @ cur_rotation
-            return rgb, depth, cur_rotation, -relative_position
+            return cur_rotation, -relative_position
         return None
 
+    def get_pcd_frame(self):
+        """Same as get_pcd_data, but the rgb (uint8) and depth (uint16, in mm) frame is written
+        in a shared memory ring buffer; only its metadata is sent over Pyro.  Use
+        frame_transport.FrameClient.fetch(metadata) to get the frame, on the same host.
+
+        :return: metadata of the frame: its seq, timestamp, the camera rot and trans, and
+            how to read it: shm_name, spec and slots
+        :rtype: dict or None
+        """
+        data = self.get_pcd_data()
+        if data is None:
+            return None
+        rgb, depth, rot, trans = data
+        rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+        shapes = [rgb.shape, depth.shape]
+        with self._frames_lock:
+            if self._frames is None or [shape for shape, _ in self._frames.spec] != shapes:
+                if self._frames is not None:
+                    self._frames.close()
+                self._frames = FrameRing([(rgb.shape, "uint8"), (depth.shape, "uint16")])
+            seq, timestamp = self._frames.write([rgb, depth])
+            meta = self._frames.metadata()
+        meta.update(
+            {
+                "seq": seq,
+                "timestamp": timestamp,
+                "rot": np.asarray(rot).tolist(),
+                "trans": np.asarray(trans).tolist(),
+            }
+        )
+        return meta
+
     # Navigation wrapper
     @Pyro4.oneway
     def go_home(self, use_dslam=False):
@@ -408,11 +464,13 @@ class RemoteLocobot(object):
     def get_depth_bytes(self):
         """Returns the depth image perceived by the camera.
 
-        :return: depth image in meters, dtype-> bytes
-        :rtype: np.ndarray or None
+        :return: depth image in millimeters, as the bytes of a uint16 array
+        :rtype: bytes or None
         """
-        depth = self._robot.camera.get_depth().astype(np.int64)
+        depth = self._robot.camera.get_depth()
         if depth is not None:
+            # cap anything more than np.power(2,16)~ 65 meter
+            depth = np.minimum(depth * 1000, np.power(2, 16) - 1).astype(np.uint16)
             return depth.tobytes()
         return None
 
@@ -448,12 +506,12 @@ class RemoteLocobot(object):
     def get_rgb_bytes(self):
         """Returns the RGB image perceived by the camera.
 
-        :return: image in the RGB, [h,w,c] format, dtype->bytes
-        :rtype: np.ndarray or None
+        :return: image in the RGB, [h,w,c] format, as the bytes of a uint8 array
+        :rtype: bytes or None
         """
-        rgb = self._robot.camera.get_rgb().astype(np.int64)
+        rgb = self._robot.camera.get_rgb()
         if rgb is not None:
-            return rgb.tobytes()
+            return rgb.astype(np.uint8).tobytes()
         return None
 
     def transform_pose(self, XYZ, current_pose):
@@ -473,25 +531,51 @@ class RemoteLocobot(object):
         XYZ[:, 1] = XYZ[:, 1] + current_pose[1]
         return XYZ
 
-    def get_current_pcd(self, in_cam=False, in_global=False):
+    def get_current_pcd(self, in_cam=False, in_global=False, stride=None, voxel_size=None):
         """Return the point cloud at current time step.
+        As with the DepthImgProcessor, only the pixels within its depth thresholds are kept.
 
         :param in_cam: return points in camera frame,
                        otherwise, return points in base frame
+        :param in_global: return points in the odometry frame
+        :param stride: only use every stride-th row and column of the depth image,
+                       by default the subsampling of the DepthImgProcessor
+        :param voxel_size: if not None, only keep one point per voxel of this size,
+                           in metric unit
 
         :type in_cam: bool
+        :type in_global: bool
+        :type stride: int
+        :type voxel_size: float
 
         :returns: tuple (pts, colors)
 
                   pts: point coordinates (shape: :math:`[N, 3]`) in metric unit
 
                   colors: rgb values (shape: :math:`[N, 3]`)
-        :rtype: tuple(list, list)
+        :rtype: tuple(np.ndarray, np.ndarray)
         """
-        pts, colors = self._robot.camera.get_current_pcd(in_cam=in_cam)
-
+        rgb, depth = self._robot.camera.get_rgb_depth()
+        if stride is None:
+            stride = int(self._dip.subsample_pixs)
+        deprojector = get_deprojector(
+            self._robot.camera.get_intrinsics(), depth.shape[0], depth.shape[1], stride=stride
+        )
+        # camera -> base -> odometry frame in one transform
+        transform = None
+        if not in_cam:
+            transform = camera_to_base(*self._get_camera_pose(), backend=self.backend)
         if in_global:
-            pts = self.transform_pose(pts, self._robot.base.get_state("odom"))
+            odom = pose_transform(self._robot.base.get_state("odom"))
+            transform = odom if transform is None else odom @ transform
+        pts = deprojector.deproject(depth, transform)
+        # only the pixels with a depth within the thresholds, e.g. not the max range ones
+        valid = deprojector.mask(depth, *threshold_range(self._dip.depth_threshold))
+        pts = pts[valid]
+        colors = rgb[::stride, ::stride].reshape(-1, 3)[valid]
+        if voxel_size is not None:
+            keep = voxel_indices(pts, voxel_size)
+            pts, colors = pts[keep], colors[keep]
         return pts, colors
 
     def pix_to_3dpt(self, rs, cs, in_cam=False):
@@ -679,7 +763,7 @@ class RemoteLocobot(object):
     def get_map(self):
         """returns the location of obstacles created by slam only for the obstacles,"""
         # get the index correspnding to obstacles
-        indices = np.where(self._slam.map_builder.map[:, :, 1] >= 1.0)
+        indices = self._slam.map_builder.get_obstacle_cells()
         # convert them into robot frame
         real_world_locations = [
             self._slam.map2real([indice[0], indice[1]]).tolist()
@@ -0,0 +1,129 @@
+"""
+Replays point clouds through the mapping and planning of Slam.take_step, and compares the step
+latency of the incremental TraversableMap and FMMPlanner with recomputing the dilated map and the
+distance field from scratch on every step, as take_step did before.
+
+The recording is a .npz file with the arrays pcd_0, pose_0, pcd_1, pose_1, ... : the point clouds
+in robot base frame in meter, and the robot (x, y, yaw) in the init frame, as passed to
+MapBuilder.update_map, e.g. saved with np.savez(path, pcd_0=pcd_0, pose_0=pose_0, ...)
+
+Without a recording, the robot drives around a synthetic room with boxes.
+
+    python replay_benchmark.py --map_sizes 2000 4000 8000 --goal 3 2
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from scipy import ndimage
+from skimage.morphology import disk
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
+from slam_pkg.utils.map_builder import MapBuilder
+from slam_pkg.utils.fmm_planner import FMMPlanner
+from slam_pkg.utils.traversable_map import TraversableMap
+from slam_pkg.utils import depth_util as du
+from slam_pkg.utils.recording import load_recording, synthetic_recording
+
+
+def real2map(loc, map_builder):
+    loc = np.array([loc[0] * 100, loc[1] * 100, 0])
+    map_loc = du.transform_pose(
+        loc, (map_builder.map_size_cm / 2.0, map_builder.map_size_cm / 2.0, np.pi / 2.0)
+    )
+    map_loc = map_loc.reshape(3) / map_builder.resolution
+    return map_loc[:2]
+
+
+def replay_full(recording, map_size, goal, robot_rad, step_size, resolution=5):
+    """as take_step before: dilate the whole map and compute the distances on every step"""
+    map_builder = MapBuilder(map_size_cm=map_size, resolution=resolution)
+    selem = disk(robot_rad / resolution)
+    goal_map = real2map(goal, map_builder)
+    times = []
+    for pcd, pose in recording:
+        start = time.time()
+        map_builder.update_map(pcd, pose)
+        obstacle = map_builder.map[:, :, 1] >= 1.0
+        traversable = ndimage.binary_dilation(obstacle, structure=selem) != True
+        planner = FMMPlanner(traversable, step_size=step_size)
+        planner.set_goal(goal_map)
+        robot_map_loc = real2map(pose, map_builder)
+        planner.get_short_term_goal((robot_map_loc[1], robot_map_loc[0]))
+        times.append(time.time() - start)
+    return times
+
+
+def replay_incremental(recording, map_size, goal, robot_rad, step_size, window, resolution=5):
+    map_builder = MapBuilder(map_size_cm=map_size, resolution=resolution)
+    traversable_map = TraversableMap(map_builder, robot_rad=robot_rad)
+    goal_map = real2map(goal, map_builder)
+    planner = None
+    times = []
+    for pcd, pose in recording:
+        start = time.time()
+        traversable = traversable_map.update(pcd, pose)
+        robot_map_loc = real2map(pose, map_builder)
+        if planner is None:
+            planner = FMMPlanner(traversable, step_size=step_size, window=window)
+            traversable_map.pop_dirty()
+            planner.set_goal(goal_map, (robot_map_loc[1], robot_map_loc[0]))
+        else:
+            planner.update(traversable_map.pop_dirty())
+        planner.get_short_term_goal((robot_map_loc[1], robot_map_loc[0]))
+        times.append(time.time() - start)
+    return times
+
+
+def main(args):
+    if args.recording:
+        recording = load_recording(args.recording)
+    else:
+        recording = synthetic_recording(args.num_steps)
+    step_size = int(args.step_size / args.resolution)
+    for map_size in args.map_sizes:
+        results = [
+            ("full", replay_full(recording, map_size, args.goal, args.robot_rad, step_size)),
+            (
+                "incremental",
+                replay_incremental(
+                    recording, map_size, args.goal, args.robot_rad, step_size, None
+                ),
+            ),
+        ]
+        if args.plan_window is not None:
+            times = replay_incremental(
+                recording, map_size, args.goal, args.robot_rad, step_size, args.plan_window
+            )
+            results.append(("incremental, window {}".format(args.plan_window), times))
+        for name, times in results:
+            print(
+                "map {} cm, {}: {:.1f} ms mean, {:.1f} ms max per step".format(
+                    map_size, name, 1000 * np.mean(times), 1000 * np.max(times)
+                )
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay point clouds through the slam map")
+    parser.add_argument("--recording", help=".npz file of point clouds and poses", type=str)
+    parser.add_argument(
+        "--num_steps", help="steps of the synthetic recording", type=int, default=100
+    )
+    parser.add_argument(
+        "--map_sizes", help="lenghts and widths of maps in cm", nargs="+", type=int, default=[4000]
+    )
+    parser.add_argument(
+        "--goal", help="goal in metric unit", nargs="+", type=float, default=[3, 2]
+    )
+    parser.add_argument(
+        "--resolution", help="per pixel resolution of map in cm", type=int, default=5
+    )
+    parser.add_argument("--step_size", help="step size in cm", type=int, default=25)
+    parser.add_argument("--robot_rad", help="robot radius in cm", type=int, default=25)
+    parser.add_argument(
+        "--plan_window", help="also replay with this planning window", type=int, default=100
+    )
+    args = parser.parse_args()
+    main(args)
@@ -20,9 +20,9 @@ cv2 = try_cv2_import()
 
 # for slam modules
 sys.path.append(os.path.join(os.path.dirname(__file__), "../"))
-from skimage.morphology import disk, binary_dilation
 from slam_pkg.utils.map_builder import MapBuilder as mb
 from slam_pkg.utils.fmm_planner import FMMPlanner
+from slam_pkg.utils.traversable_map import TraversableMap
 from slam_pkg.utils import depth_util as du
 
 
@@ -39,6 +39,8 @@ class Slam(object):
         vis=False,
         save_vis=os.getenv("SAVE_VIS", 'False').lower() in ('true'),
         save_folder=os.getenv("SLAM_SAVE_FOLDER", '../slam_logs'),
+        plan_window=None,
+        get_pcd=None,
     ):
         """
 
@@ -52,6 +54,10 @@ class Slam(object):
         :param vis: whether to show visualization
         :param save_vis: whether to save visualization
         :param save_folder: path to save visualization
+        :param plan_window: if not None, margin (in map cells) of the box around the robot and the goal
+            in which the planner computes distances to the goal, see FMMPlanner
+        :param get_pcd: function returning the current point cloud in robot base frame, in meter;
+            defaults to the point cloud of the robot's camera
 
         :type robot: pytobot.Robot
         :type robot_name: str
@@ -63,8 +69,13 @@ class Slam(object):
         :type vis: bool
         :type save_vis: bool
         :type save_folder: str
+        :type plan_window: int
+        :type get_pcd: callable
         """
         self.robot = robot
+        if get_pcd is None:
+            get_pcd = lambda: robot.camera.get_current_pcd(in_cam=False)[0]
+        self.get_pcd = get_pcd
         self.robot_name = robot_name
         self.robot_rad = robot_rad
         self.map_builder = mb(
@@ -73,6 +84,9 @@ class Slam(object):
             agent_min_z=agent_min_z,
             agent_max_z=agent_max_z,
         )
+        self.traversable_map = TraversableMap(self.map_builder, robot_rad=robot_rad)
+        self.plan_window = plan_window
+        self.planner = None
 
         # initialize variable
         robot.camera.reset()
@@ -80,7 +94,7 @@ class Slam(object):
 
         self.init_state = self.get_robot_global_state()
         self.prev_bot_state = (0, 0, 0)
-        self.col_map = np.zeros((self.map_builder.map.shape[0], self.map_builder.map.shape[1]))
+        self.col_map = self.traversable_map.col_map
         self.robot_loc_list_map = np.array(
             [
                 self.real2map(
@@ -88,8 +102,8 @@ class Slam(object):
                 )
             ]
         )
-        self.map_builder.update_map(
-            self.robot.camera.get_current_pcd(in_cam=False)[0],
+        self.traversable_map.update(
+            self.get_pcd(),
             self.get_rel_state(self.get_robot_global_state(), self.init_state),
         )
 
@@ -196,26 +210,14 @@ class Slam(object):
             continue
 
     def update_map(self):
-        """Updtes map , explore it by the radius of robot, add collison map to it and return the traversible area
+        """Updtes map , explore it by the radius of robot, add collison map to it and return the traversible area.
+        Only the part of the traversible area seen by the camera is recomputed, see TraversableMap
 
         Returns:
             [np.ndarray]: [traversible space]
         """
         robot_state = self.get_rel_state(self.get_robot_global_state(), self.init_state)
-        self.map_builder.update_map(
-            self.robot.camera.get_current_pcd(in_cam=False)[0], robot_state
-        )
-
-        # explode the map by robot shape
-        obstacle = self.map_builder.map[:, :, 1] >= 1.0
-        selem = disk(self.robot_rad / self.map_builder.resolution)
-        traversable = binary_dilation(obstacle, selem) != True
-
-        # add robot collision map to traversable area
-        unknown_region = self.map_builder.map.sum(axis=-1) < 1
-        col_map_unknown = np.logical_and(self.col_map > 0.1, unknown_region)
-        traversable = np.logical_and(traversable, np.logical_not(col_map_unknown))
-        return traversable
+        return self.traversable_map.update(self.get_pcd(), robot_state)
 
     def take_step(self, step_size):
         """
@@ -225,19 +227,29 @@ class Slam(object):
         """
         # update map
         traversable = self.update_map()
-
-        # call the planner
-        self.planner = FMMPlanner(
-            traversable, step_size=int(step_size / self.map_builder.resolution)
+        robot_map_loc = self.real2map(
+            self.get_rel_state(self.get_robot_global_state(), self.init_state)
         )
 
-        # set the goal
-        self.planner.set_goal(self.goal_loc_map)
+        # call the planner, it is kept while the goal is the same and
+        # only recomputes the distances if the map changed around the robot
+        map_step_size = int(step_size / self.map_builder.resolution)
+        goal_map = (int(self.goal_loc_map[0]), int(self.goal_loc_map[1]))
+        if (
+            self.planner is None
+            or self.planner.step_size != map_step_size
+            or self.planner.goal != goal_map
+        ):
+            self.planner = FMMPlanner(
+                traversable, step_size=map_step_size, window=self.plan_window
+            )
+            self.traversable_map.pop_dirty()
+            # set the goal
+            self.planner.set_goal(self.goal_loc_map, (robot_map_loc[1], robot_map_loc[0]))
+        else:
+            self.planner.update(self.traversable_map.pop_dirty())
 
         # get the short term goal
-        robot_map_loc = self.real2map(
-            self.get_rel_state(self.get_robot_global_state(), self.init_state)
-        )
         self.stg = self.planner.get_short_term_goal((robot_map_loc[1], robot_map_loc[0]))
 
         # convert goal from map space to robot space
@@ -317,16 +329,18 @@ class Slam(object):
         # if robot collides
         if not exec:
             # add obstacle in front of  cur location
-            self.col_map += self.get_collision_map(robot_state)
+            self.traversable_map.add_collision(*self.get_collision_patch(robot_state))
         # in case of locobot we need to check bumper state
         if self.robot_name == "locobot":
             if len(self.bumper_state.bumper_state) > 0:
                 for bumper_num in self.bumper_state.bumper_state:
-                    self.col_map += self.get_collision_map(
-                        (
-                            robot_state[0],
-                            robot_state[1],
-                            robot_state[2] + self.bumper_num2ang[bumper_num],
+                    self.traversable_map.add_collision(
+                        *self.get_collision_patch(
+                            (
+                                robot_state[0],
+                                robot_state[1],
+                                robot_state[2] + self.bumper_num2ang[bumper_num],
+                            )
                         )
                     )
 
@@ -444,8 +458,8 @@ class Slam(object):
         real_loc = du.transform_pose(
             loc,
             (
-                -self.map_builder.map.shape[0] / 2.0,
-                self.map_builder.map.shape[1] / 2.0,
+                -self.map_builder.shape[0] / 2.0,
+                self.map_builder.shape[1] / 2.0,
                 -np.pi / 2.0,
             ),
         )
@@ -467,43 +481,39 @@ class Slam(object):
         :return: collision map
         :rtype: np.ndarray
         """
-        # get the collision map for robot collision based on sensor reading
-        col_map = np.zeros((self.map_builder.map.shape[0], self.map_builder.map.shape[1]))
+        col_map = np.zeros(self.map_builder.shape[:2])
+        patch, (y0, x0) = self.get_collision_patch(state, obstacle_size)
+        h, w = col_map.shape
+        cy0, cy1 = max(y0, 0), min(y0 + patch.shape[0], h)
+        cx0, cx1 = max(x0, 0), min(x0 + patch.shape[1], w)
+        col_map[cy0:cy1, cx0:cx1] = patch[cy0 - y0 : cy1 - y0, cx0 - x0 : cx1 - x0]
+        return col_map
+
+    def get_collision_patch(self, state, obstacle_size=(10, 10)):
+        """
+        The non zero part of get_collision_map: the obstacle in front of the robot is drawn
+        and rotated in a window of 4 * max(obstacle_size) map cells, instead of the whole map
+        :param state: robot state in metric unit
+        :param obstacle_size: size of obstacle in map space
+
+        :type state: tuple
+        :type obstacle_size: tuple
+
+        :return: the collision patch, and the map cell [row, col] of its top left corner
+        :rtype: tuple
+        """
         map_state = self.real2map((state[0], state[1]))
         map_state = [int(x) for x in map_state]
-        center_map_state = self.real2map((0, 0))
-        center_map_state = [int(x) for x in center_map_state]
+        pad_len = 2 * max(obstacle_size)
+        col_map = np.zeros((2 * pad_len, 2 * pad_len))
         col_map[
-            center_map_state[1] + 2 : center_map_state[1] + 2 + obstacle_size[1],
-            center_map_state[0]
-            - int(obstacle_size[0] / 2) : center_map_state[0]
-            + int(obstacle_size[0] / 2),
+            pad_len + 2 : pad_len + 2 + obstacle_size[1],
+            pad_len - int(obstacle_size[0] / 2) : pad_len + int(obstacle_size[0] / 2),
         ] = True
 
-        # rotate col_map based on the state
+        # rotate col_map based on the state, around the robot
         col_map = ndimage.rotate(col_map, -np.rad2deg(state[2]), reshape=False)
-
-        # take crop around the center
-        pad_len = 2 * max(obstacle_size)
-        cropped_map = copy(
-            col_map[
-                center_map_state[1] - pad_len : center_map_state[1] + pad_len,
-                center_map_state[0] - pad_len : center_map_state[0] + pad_len,
-            ]
-        )
-
-        # make the crop value zero
-        col_map = np.zeros((self.map_builder.map.shape[0], self.map_builder.map.shape[1]))
-
-        # pad the col_map
-        col_map = np.pad(col_map, pad_len)
-
-        # paste the crop robot location shifted by pad len
-        col_map[
-            map_state[1] - pad_len + pad_len : map_state[1] + pad_len + pad_len,
-            map_state[0] - pad_len + pad_len : map_state[0] + pad_len + pad_len,
-        ] = cropped_map
-        return col_map[pad_len:-pad_len, pad_len:-pad_len]
+        return col_map, (map_state[1] - pad_len, map_state[0] - pad_len)
 
     def get_rel_state(self, cur_state, init_state):
         """
@@ -643,6 +653,7 @@ def main(args):
                 args.vis,
                 args.save_vis,
                 args.store_path,
+                args.plan_window,
             )
             slam.set_goal(tuple(args.goal))
             while slam.take_step(step_size=args.step_size) is None:
@@ -682,6 +693,7 @@ def main(args):
             args.vis,
             args.save_vis,
             args.store_path,
+            args.plan_window,
         )
         slam.set_goal(tuple(args.goal))
         while slam.take_step(step_size=args.step_size) is None:
@@ -714,6 +726,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--store_path", help="path to store visualization", type=str, default="./tmp"
     )
+    parser.add_argument(
+        "--plan_window",
+        help="margin in map cells of the planning box around robot and goal, default whole map",
+        type=int,
+        default=None,
+    )
     parser.add_argument(
         "--dataset_path",
         help="path where Replica dataset is stored",
@@ -52,3 +52,16 @@ def bin_points(XYZ_cm, map_size, z_bins, xy_resolution):
     counts = np.reshape(count, [map_size, map_size, n_z_bins])
 
     return counts
+
+
+def bin_cells(XYZ_cm, z_bins, xy_resolution):
+    """Bins of the points, as in bin_points but without bounds on x and y
+    XYZ_cms is ... x3
+    Outputs Y_bin, X_bin, Z_bin: the bins of the points whose x and y are finite
+    """
+    XYZ_cm = XYZ_cm.reshape(-1, 3)
+    XYZ_cm = XYZ_cm[np.isfinite(XYZ_cm[:, :2]).all(axis=1)]
+    X_bin = np.round(XYZ_cm[:, 0] / xy_resolution).astype(np.int64)
+    Y_bin = np.round(XYZ_cm[:, 1] / xy_resolution).astype(np.int64)
+    Z_bin = np.digitize(XYZ_cm[:, 2], bins=z_bins).astype(np.int64)
+    return Y_bin, X_bin, Z_bin
@@ -4,31 +4,117 @@ from numpy import ma
 
 
 class FMMPlanner(object):
-    def __init__(self, traversable, step_size=5):
+    def __init__(self, traversable, step_size=5, window=None):
         """
+        The distance field to the goal is kept between short term goals. When the
+        traversable map changes (see update) it is only recomputed if the distances
+        around the robot may have changed.
 
         :param traversable: 2D np.ndarray boolean map , False for obstacle and True for free, unknow space
         :param step_size: number of stapes agent suppose to travel in every short steps it takes towards goal
+        :param window: if not None, the distance field is computed in the box around the goal
+            and the robot padded by window cells, and on the whole map only if the robot
+            can not reach the goal inside the box.  paths leaving the box are not found,
+            but the cost of a step does not grow with the map size
 
         :type traversable: np.ndarray
         :type step_size: int
+        :type window: int
         """
         self.step_size = step_size
         self.traversable = traversable
+        self.window = window
+        self.goal = None
+        self.fmm_dist = None
 
-    def set_goal(self, goal):
+    def set_goal(self, goal, state=None):
         """
         Helps to set the goal and calculate distance from goal, try to visualize dd to get more intuition
         :param goal: goal points in map space [x_goal_co-ordinate, y_goal_co-ordinate]
+        :param state: state of robot in map space [x_robot_map_co-ordinate, y_robot_map_co-ordinate],
+            used to place the window
         :type goal: list
+        :type state: list
+        """
+        self.goal = (int(goal[0]), int(goal[1]))
+        self.compute_distance(state)
+
+    def compute_distance(self, state=None):
+        """
+        computes the distance field to the goal, in the window around the goal and state if
+        there is a window and a state, otherwise on the whole map
         """
-        traversable_ma = ma.masked_values(self.traversable * 1, 0)
-        goal_x, goal_y = int(goal[0]), int(goal[1])
-        traversable_ma[goal_y, goal_x] = 0
+        h, w = self.traversable.shape
+        goal_x, goal_y = self.goal
+        bounds = (0, h, 0, w)
+        if self.window is not None and state is not None:
+            state = [int(x) for x in state]
+            bounds = (
+                max(min(goal_y, state[0]) - self.window, 0),
+                min(max(goal_y, state[0]) + self.window + 1, h),
+                max(min(goal_x, state[1]) - self.window, 0),
+                min(max(goal_x, state[1]) + self.window + 1, w),
+            )
+        y0, y1, x0, x1 = bounds
+        traversable_ma = ma.masked_values(self.traversable[y0:y1, x0:x1] * 1, 0)
+        traversable_ma[goal_y - y0, goal_x - x0] = 0
         dd = skfmm.distance(traversable_ma, dx=1)
-        dd_mask = np.invert(np.isnan(ma.filled(dd, np.nan)))
-        dd = ma.filled(dd, np.max(dd) + 1)
-        self.fmm_dist = dd
+        # unreachable cells get the max distance + 1
+        self.unreachable = np.max(dd) + 1
+        dd = ma.filled(dd, self.unreachable)
+        if bounds == (0, h, 0, w):
+            self.fmm_dist = dd
+        else:
+            self.fmm_dist = np.full((h, w), self.unreachable, dtype=dd.dtype)
+            self.fmm_dist[y0:y1, x0:x1] = dd
+            if self.fmm_dist[state[0], state[1]] >= self.unreachable:
+                self.compute_distance()
+                return
+        self.bounds = bounds
+        # distances below exact_below are not changed by the updates since the computation
+        self.exact_below = np.inf
+        self.dirty = []
+
+    def update(self, dirty):
+        """
+        Marks the part of the traversable map that changed since the last update; the distance
+        field is recomputed in get_short_term_goal if it is needed there
+        :param dirty: box (y_min, y_max, x_min, x_max) of the changed cells, or None if none changed
+        :type dirty: tuple
+        """
+        if dirty is None or self.fmm_dist is None:
+            return
+        h, w = self.fmm_dist.shape
+        # pad the box by one cell, for the neighbours of freed cells
+        y0, y1 = max(dirty[0] - 1, 0), min(dirty[1] + 1, h)
+        x0, x1 = max(dirty[2] - 1, 0), min(dirty[3] + 1, w)
+        self.dirty.append((y0, y1, x0, x1))
+        # a path from the goal into the changed box is at least as long as the smallest
+        # distance in the box, so smaller distances are still the shortest ones
+        self.exact_below = min(self.exact_below, self.fmm_dist[y0:y1, x0:x1].min())
+
+    def is_stale(self, y0, y1, x0, x1):
+        """
+        :return: True if the distances in the box may have changed since they were computed
+        :rtype: bool
+        """
+        if self.fmm_dist is None:
+            return True
+        h, w = self.fmm_dist.shape
+        by0, by1, bx0, bx1 = self.bounds
+        if self.bounds != (0, h, 0, w) and (y0 < by0 or y1 > by1 or x0 < bx0 or x1 > bx1):
+            return True
+        dist = self.fmm_dist[y0:y1, x0:x1]
+        # once the map changed, the traversable cells which could not reach the goal may
+        # have been connected to it; the obstacles stay unreachable
+        stale = (dist >= self.exact_below) & (
+            (dist < self.unreachable) | self.traversable[y0:y1, x0:x1]
+        )
+        if stale.any():
+            return True
+        return any(
+            y0 < dy1 and dy0 < y1 and x0 < dx1 and dx0 < x1 for dy0, dy1, dx0, dx1 in self.dirty
+        )
 
     def get_short_term_goal(self, state):
         """
@@ -39,16 +125,16 @@ class FMMPlanner(object):
         :rtype: list
         """
         state = [int(x) for x in state]
-        # pad the map with
-        # to handle corners pad the dist with step size and values equal to max
-        dist = np.pad(
-            self.fmm_dist, self.step_size, "constant", constant_values=self.fmm_dist.shape[0] ** 2
-        )
-        # take subset fo distance around the start, as its padded start should be corner instead of center
-        subset = dist[
-            state[0] : state[0] + 2 * self.step_size + 1,
-            state[1] : state[1] + 2 * self.step_size + 1,
-        ]
+        h, w = self.traversable.shape
+        y0, y1 = max(state[0] - self.step_size, 0), min(state[0] + self.step_size + 1, h)
+        x0, x1 = max(state[1] - self.step_size, 0), min(state[1] + self.step_size + 1, w)
+        if self.is_stale(y0, y1, x0, x1):
+            self.compute_distance(state)
+        # take subset fo distance around the start, to handle corners pad it
+        # to 2 * step size + 1 with values equal to max
+        subset = np.full((2 * self.step_size + 1,) * 2, float(self.fmm_dist.shape[0] ** 2))
+        sy, sx = y0 - (state[0] - self.step_size), x0 - (state[1] - self.step_size)
+        subset[sy : sy + y1 - y0, sx : sx + x1 - x0] = self.fmm_dist[y0:y1, x0:x1]
 
         # find the index which has minimum distance
         (stg_x, stg_y) = np.unravel_index(np.argmin(subset), subset.shape)
@@ -3,37 +3,64 @@ import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
-from slam_pkg.utils.depth_util import transform_pose, bin_points
+from slam_pkg.utils.depth_util import transform_pose, bin_cells
 
 
 class MapBuilder(object):
-    def __init__(self, map_size_cm=4000, resolution=5, obs_thr=1, agent_min_z=5, agent_max_z=70):
+    def __init__(
+        self,
+        map_size_cm=4000,
+        resolution=5,
+        obs_thr=1,
+        agent_min_z=5,
+        agent_max_z=70,
+        tile_size=64,
+        max_range_cm=1000,
+    ):
         """
+        The map is stored in square tiles of tile_size cells, allocated when a point falls in them,
+        so its memory grows with the explored area.  Points outside of the map_size_cm square are
+        kept too; map_size_cm only sets the origin of the map cells and the extent of the dense
+        map returned by get_map, use get_region for a dense view of any other part of the map.
+        Points farther than max_range_cm from the robot are depth outliers, and are dropped.
+
         :param map_size_cm: size of map in cm, assumes square map
         :param resolution: resolution of map, 1 pix = resolution distance(in cm) in real world
         :param obs_thr: number of depth points to be in bin to considered it as obstacle
         :param agent_min_z: robot min z (in cm), depth points below this will be considered as free space
         :param agent_max_z: robot max z (in cm), depth points above this will be considered as free space
+        :param tile_size: side of the tiles of the map, in cells
+        :param max_range_cm: range of the depth sensor (in cm), farther points are dropped
 
         :type map_size_cm: int
         :type resolution: int
         :type obs_thr: int
         :type agent_min_z: int
         :type agent_max_z: int
+        :type tile_size: int
+        :type max_range_cm: int
         """
         self.map_size_cm = map_size_cm
         self.resolution = resolution
         self.obs_threshold = obs_thr
         self.z_bins = [agent_min_z, agent_max_z]
+        self.tile_size = tile_size
+        self.max_range_cm = max_range_cm
+        self.reset_map(map_size_cm)
 
-        self.map = np.zeros(
-            (
-                int(self.map_size_cm // self.resolution),
-                int(self.map_size_cm // self.resolution),
-                len(self.z_bins) + 1,
-            ),
-            dtype=np.float32,
-        )
+    @property
+    def shape(self):
+        """shape of the dense map returned by get_map"""
+        map_size = int(self.map_size_cm // self.resolution)
+        return (map_size, map_size, len(self.z_bins) + 1)
+
+    @property
+    def map(self):
+        """the dense map, see get_map.  It is cached until the next update_map or reset_map,
+        and should not be modified"""
+        if self._map is None:
+            self._map = self.get_map()
+        return self._map
 
     def update_map(self, pcd, pose):
         """
@@ -43,9 +70,14 @@ class MapBuilder(object):
 
         :type pcd: np.ndarray [num_points, 3]
         :type pose: [x_robot_co-ordinate, y_robot_co-ordinate, robot_orientation]
-        :return: map of the environment, values [1-> obstacle, 0->free, unknown space]
+        :return: map of the cells in updated_bounds, values [1-> obstacle, 0->free, unknown space]
         :rtype: np.ndarray
         """
+        # drop the depth outliers, which would blow up the region of the update
+        pcd = pcd.reshape(-1, 3)
+        pcd = pcd[np.hypot(pcd[:, 0], pcd[:, 1]) * 100 <= self.max_range_cm]
+        self._map = None
+
         # transfer points from base frame to global frame
         pcd = transform_pose(pcd, pose)
 
@@ -56,18 +88,80 @@ class MapBuilder(object):
         geocentric_pc_for_map = transform_pose(
             pcd, (self.map_size_cm / 2.0, self.map_size_cm / 2.0, np.pi / 2.0)
         )
-        geocentric_flat = bin_points(
-            geocentric_pc_for_map, self.map.shape[0], self.z_bins, self.resolution
+        Y_bin, X_bin, Z_bin = bin_cells(geocentric_pc_for_map, self.z_bins, self.resolution)
+        if len(Y_bin) == 0:
+            self.updated_bounds = None
+            return np.zeros((0, 0))
+        self.updated_bounds = (
+            int(Y_bin.min()),
+            int(Y_bin.max()) + 1,
+            int(X_bin.min()),
+            int(X_bin.max()) + 1,
         )
 
-        self.map = self.map + geocentric_flat
+        # count the points of all the touched tiles with one bincount, and add
+        # the counts to the tiles in place
+        ts = self.tile_size
+        n_z_bins = len(self.z_bins) + 1
+        ty_min, tx_min = Y_bin.min() // ts, X_bin.min() // ts
+        tx_count = X_bin.max() // ts - tx_min + 1
+        tile_keys, tile_index = np.unique(
+            (Y_bin // ts - ty_min) * tx_count + (X_bin // ts - tx_min), return_inverse=True
+        )
+        ind = ((tile_index * ts + Y_bin % ts) * ts + X_bin % ts) * n_z_bins + Z_bin
+        counts = np.bincount(ind, minlength=len(tile_keys) * ts * ts * n_z_bins)
+        counts = counts.reshape(len(tile_keys), ts, ts, n_z_bins)
+        for key, count in zip(tile_keys.tolist(), counts):
+            ty, tx = int(ty_min) + key // tx_count, int(tx_min) + key % tx_count
+            tile = self.tiles.get((ty, tx))
+            if tile is None:
+                tile = np.zeros((ts, ts, n_z_bins), dtype=np.float32)
+                self.tiles[(ty, tx)] = tile
+            tile += count
 
-        map_gt = self.map[:, :, 1] / self.obs_threshold
+        map_gt = self.get_region(*self.updated_bounds)[:, :, 1] / self.obs_threshold
         map_gt[map_gt >= 0.5] = 1.0
         map_gt[map_gt < 0.5] = 0.0
 
         return map_gt
 
+    def get_region(self, y_min, y_max, x_min, x_max):
+        """
+        returns a dense copy of the map cells [y_min:y_max, x_min:x_max], which can be outside
+        of the map_size_cm square; cells without points are 0
+        :rtype: np.ndarray dim:[y_max - y_min, x_max - x_min, 3]
+        """
+        ts = self.tile_size
+        region = np.zeros(
+            (max(y_max - y_min, 0), max(x_max - x_min, 0), len(self.z_bins) + 1), dtype=np.float32
+        )
+        if region.size == 0:
+            return region
+        for ty in range(y_min // ts, (y_max - 1) // ts + 1):
+            for tx in range(x_min // ts, (x_max - 1) // ts + 1):
+                tile = self.tiles.get((ty, tx))
+                if tile is None:
+                    continue
+                y0, y1 = max(ty * ts, y_min), min((ty + 1) * ts, y_max)
+                x0, x1 = max(tx * ts, x_min), min((tx + 1) * ts, x_max)
+                region[y0 - y_min : y1 - y_min, x0 - x_min : x1 - x_min] = tile[
+                    y0 - ty * ts : y1 - ty * ts, x0 - tx * ts : x1 - tx * ts
+                ]
+        return region
+
+    def get_obstacle_cells(self):
+        """
+        returns the rows and the columns of the cells with points between agent_min_z and
+        agent_max_z, in all the map
+        :rtype: tuple (np.ndarray, np.ndarray)
+        """
+        rows, cols = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for (ty, tx), tile in self.tiles.items():
+            r, c = np.nonzero(tile[:, :, 1] >= 1.0)
+            rows.append(r + ty * self.tile_size)
+            cols.append(c + tx * self.tile_size)
+        return np.concatenate(rows), np.concatenate(cols)
+
     def reset_map(self, map_size):
         """
         resets the map to unknown
@@ -75,21 +169,19 @@ class MapBuilder(object):
         :type map_size: int
         """
         self.map_size_cm = map_size
-
-        self.map = np.zeros(
-            (
-                self.map_size_cm // self.resolution,
-                self.map_size_cm // self.resolution,
-                len(self.z_bins) + 1,
-            ),
-            dtype=np.float32,
-        )
+        # (row, col) of the tile -> tile_size x tile_size x (len(z_bins) + 1) point counts
+        self.tiles = {}
+        # (y_min, y_max, x_min, x_max) of the cells changed by the last update_map, or None
+        self.updated_bounds = None
+        # dense map, see map
+        self._map = None
 
     def get_map(self):
         """
-        returns the map of the environment
+        returns the map of the environment, in the map_size_cm square
         :return: 3 channel map of the environment, value [channel 1: points below agent_min_z,
         channel 2: points in between agent_min_z & agent_max_z, channel 3: points above agent_max_z ]
         :rtype: np.ndarray dim:[map_size, map_size, 3]
         """
-        return self.map
+        map_size = self.shape[0]
+        return self.get_region(0, map_size, 0, map_size)
@@ -0,0 +1,47 @@
+import numpy as np
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../../"))
+from slam_pkg.utils.depth_util import transform_pose
+
+
+def load_recording(path):
+    data = np.load(path)
+    n = len([k for k in data.files if k.startswith("pcd_")])
+    return [(data["pcd_{}".format(i)], data["pose_{}".format(i)]) for i in range(n)]
+
+
+def synthetic_recording(num_steps=100, room_size=8.0, sensor_range=3.0, seed=0):
+    """point clouds seen by a robot driving around a room_size m square room with boxes"""
+    rng = np.random.RandomState(seed)
+    res = 0.05
+    # obstacle points: the walls and 10 boxes
+    side = np.arange(-room_size / 2, room_size / 2, res)
+    walls = [np.stack([side, np.full_like(side, c)], 1) for c in (-room_size / 2, room_size / 2)]
+    walls += [w[:, ::-1] for w in walls]
+    boxes = []
+    for _ in range(10):
+        cx, cy = rng.uniform(-room_size / 3, room_size / 3, 2)
+        xs, ys = np.meshgrid(np.arange(cx, cx + 0.4, res), np.arange(cy, cy + 0.4, res))
+        boxes.append(np.stack([xs.ravel(), ys.ravel()], 1))
+    obstacles = np.concatenate(walls + boxes)
+    floor = np.stack(np.meshgrid(side, side), -1).reshape(-1, 2)
+
+    recording = []
+    for i in range(num_steps):
+        # drive on a circle, looking ahead
+        a = 2 * np.pi * i / num_steps
+        pose = np.array([room_size / 4 * np.cos(a), room_size / 4 * np.sin(a), a + np.pi / 2])
+        points = []
+        for xy, z in ((obstacles, (10, 60)), (floor, (0, 0))):
+            rel = transform_pose(
+                np.concatenate([xy - pose[:2], np.zeros((len(xy), 1))], 1), (0, 0, -pose[2])
+            )
+            seen = (rel[:, 0] > 0.1) & (np.linalg.norm(rel[:, :2], axis=1) < sensor_range)
+            seen &= np.abs(rel[:, 1]) < rel[:, 0]
+            rel = rel[seen]
+            rel[:, 2] = rng.uniform(z[0], z[1], len(rel)) / 100.0
+            points.append(rel)
+        recording.append((np.concatenate(points), pose))
+    return recording
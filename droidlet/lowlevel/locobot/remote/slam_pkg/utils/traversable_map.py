@@ -0,0 +1,129 @@
+import numpy as np
+from scipy import ndimage
+from skimage.morphology import disk
+
+
+def union_bounds(a, b):
+    """union of two (y_min, y_max, x_min, x_max) boxes, either of which can be None"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+
+
+class TraversableMap(object):
+    def __init__(self, map_builder, robot_rad=25, col_thr=0.1):
+        """
+        Keeps the traversable area of a MapBuilder map up to date incrementally: obstacles
+        exploded by the robot radius, minus the collisions in unknown space.
+        Only the cells changed by the last point cloud or collision are recomputed;
+        as obstacles are never removed from the map, the dilation of the new obstacles
+        is added to the dilation of the old ones.
+
+        :param map_builder: the MapBuilder the point clouds are added to
+        :param robot_rad: radius of the agent in cm, used to explode the map
+        :param col_thr: collision map value above which unknown space is not traversable
+
+        :type map_builder: MapBuilder
+        :type robot_rad: int
+        :type col_thr: float
+        """
+        self.map_builder = map_builder
+        self.col_thr = col_thr
+        self.selem = disk(robot_rad / map_builder.resolution).astype(bool)
+        self.pad = self.selem.shape[0] // 2
+        self.reset()
+
+    def reset(self):
+        """
+        recomputes everything from the map builder's map, e.g. after reset_map
+        """
+        shape = self.map_builder.shape[:2]
+        self.obstacle = np.zeros(shape, dtype=bool)
+        self.dilated = np.zeros(shape, dtype=bool)
+        self.col_map = np.zeros(shape)
+        self.traversable = np.ones(shape, dtype=bool)
+        # box of the cells of traversable changed since the last pop_dirty
+        self.dirty = None
+        self.refresh((0, shape[0], 0, shape[1]))
+
+    def update(self, pcd, pose):
+        """
+        adds a point cloud to the map and updates the traversable area
+        :param pcd: point cloud in robot base frame, in meter
+        :param pose: pose of robot, in metric unit
+
+        :type pcd: np.ndarray [num_points, 3]
+        :type pose: [x_robot_co-ordinate, y_robot_co-ordinate, robot_orientation]
+        :return: traversable area, updated in place
+        :rtype: np.ndarray
+        """
+        self.map_builder.update_map(pcd, pose)
+        if self.map_builder.updated_bounds is not None:
+            # the map builder keeps the points outside of the map too
+            h, w = self.traversable.shape
+            y0, y1, x0, x1 = self.map_builder.updated_bounds
+            y0, y1, x0, x1 = max(y0, 0), min(y1, h), max(x0, 0), min(x1, w)
+            if y0 < y1 and x0 < x1:
+                self.refresh((y0, y1, x0, x1))
+        return self.traversable
+
+    def add_collision(self, patch, corner):
+        """
+        adds a collision patch to the collision map
+        :param patch: values to add to the collision map
+        :param corner: map cell [row, col] of the patch's top left corner
+
+        :type patch: np.ndarray
+        :type corner: tuple
+        """
+        h, w = self.col_map.shape
+        y0, x0 = corner
+        y1, x1 = y0 + patch.shape[0], x0 + patch.shape[1]
+        cy0, cy1, cx0, cx1 = max(y0, 0), min(y1, h), max(x0, 0), min(x1, w)
+        if cy0 >= cy1 or cx0 >= cx1:
+            return
+        self.col_map[cy0:cy1, cx0:cx1] += patch[cy0 - y0 : cy1 - y0, cx0 - x0 : cx1 - x0]
+        self.refresh((cy0, cy1, cx0, cx1))
+
+    def refresh(self, bounds):
+        """
+        recomputes the traversable area around the cells of the map in bounds
+        :param bounds: (y_min, y_max, x_min, x_max) of the changed cells, max exclusive
+        """
+        y0, y1, x0, x1 = bounds
+        h, w = self.obstacle.shape
+        # the map in the window padded by the radius, where new obstacles are dilated
+        p = self.pad
+        dy0, dy1, dx0, dx1 = max(y0 - p, 0), min(y1 + p, h), max(x0 - p, 0), min(x1 + p, w)
+        m = self.map_builder.get_region(dy0, dy1, dx0, dx1)
+        new = (m[y0 - dy0 : y1 - dy0, x0 - dx0 : x1 - dx0, 1] >= 1.0) & ~self.obstacle[
+            y0:y1, x0:x1
+        ]
+        if new.any():
+            self.obstacle[y0:y1, x0:x1] |= new
+            stamp = np.zeros((dy1 - dy0, dx1 - dx0), dtype=bool)
+            stamp[y0 - dy0 : y1 - dy0, x0 - dx0 : x1 - dx0] = new
+            self.dilated[dy0:dy1, dx0:dx1] |= ndimage.binary_dilation(stamp, structure=self.selem)
+            y0, y1, x0, x1 = dy0, dy1, dx0, dx1
+        m = m[y0 - dy0 : y1 - dy0, x0 - dx0 : x1 - dx0]
+        unknown_region = m.sum(axis=-1) < 1
+        col_map_unknown = np.logical_and(self.col_map[y0:y1, x0:x1] > self.col_thr, unknown_region)
+        traversable = np.logical_not(np.logical_or(self.dilated[y0:y1, x0:x1], col_map_unknown))
+        rows, cols = np.nonzero(traversable != self.traversable[y0:y1, x0:x1])
+        if len(rows) == 0:
+            return
+        self.traversable[y0:y1, x0:x1] = traversable
+        changed = (y0 + rows.min(), y0 + rows.max() + 1, x0 + cols.min(), x0 + cols.max() + 1)
+        self.dirty = union_bounds(self.dirty, changed)
+
+    def pop_dirty(self):
+        """
+        :return: box (y_min, y_max, x_min, x_max) of the cells of the traversable area
+            which changed since the last call, or None
+        :rtype: tuple
+        """
+        dirty = self.dirty
+        self.dirty = None
+        return dirty
@@ -0,0 +1,177 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+import logging
+import threading
+from timeit import Timer
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.spatial.transform import Rotation
+
+from droidlet.lowlevel.locobot.locobot_mover_utils import transform_pose
+from droidlet.lowlevel.locobot.deprojection import (
+    ROS_TO_HABITAT_FRAME,
+    get_deprojector,
+    camera_to_base,
+    pose_transform,
+    threshold_range,
+    voxel_indices,
+)
+
+INTRINSICS = np.array([[605.0, 0.0, 320.0], [0.0, 605.0, 240.0], [0.0, 0.0, 1.0]])
+
+
+def legacy_uv_one_in_cam(intrinsics, height, width):
+    """the pixel rays, as LoCoBotMover computed them"""
+    img_pixs = np.mgrid[0:height:1, 0:width:1]
+    img_pixs = img_pixs.reshape(2, -1)
+    img_pixs[[0, 1], :] = img_pixs[[1, 0], :]
+    uv_one = np.concatenate((img_pixs, np.ones((1, img_pixs.shape[1]))))
+    return np.dot(np.linalg.inv(intrinsics), uv_one)
+
+
+def legacy_rgb_depth_pts(uv_one_in_cam, depth, rot, trans, pose, backend):
+    """the point cloud of a frame, as LoCoBotMover.get_rgb_depth computed it"""
+    depth = depth.astype(np.float32).reshape(-1) / 1000.0
+    pts_in_cam = np.multiply(uv_one_in_cam, depth)
+    pts_in_cam = np.concatenate((pts_in_cam, np.ones((1, pts_in_cam.shape[1]))), axis=0)
+    pts = pts_in_cam[:3, :].T
+    pts = np.dot(pts, rot.T)
+    pts = pts + trans.reshape(-1)
+    if backend == "habitat":
+        pts = ROS_TO_HABITAT_FRAME.T @ pts.T
+        pts = pts.T
+    return transform_pose(pts, pose)
+
+
+def legacy_pcd_ic(intrinsics, depth_im, rgb_im, subsample_pixs, depth_threshold, factor):
+    """the point cloud of a frame in the camera frame, as pyrobot's DepthImgProcessor.get_pcd_ic
+    computed it for RemoteLocobot.get_current_pcd"""
+    height, width = depth_im.shape
+    img_pixs = np.mgrid[0:height:subsample_pixs, 0:width:subsample_pixs]
+    img_pixs = img_pixs.reshape(2, -1)
+    img_pixs[[0, 1], :] = img_pixs[[1, 0], :]
+    uv_one = np.concatenate((img_pixs, np.ones((1, img_pixs.shape[1]))))
+    uv_one_in_cam = np.dot(np.linalg.inv(intrinsics), uv_one)
+    depth = depth_im[::subsample_pixs, ::subsample_pixs].reshape(-1) / float(factor)
+    rgb = rgb_im[::subsample_pixs, ::subsample_pixs].reshape(-1, 3)
+    valid = depth > depth_threshold[0]
+    if len(depth_threshold) > 1:
+        valid = np.logical_and(valid, depth < depth_threshold[1])
+    return np.multiply(uv_one_in_cam[:, valid], depth[valid]).T, rgb[valid]
+
+
+def random_camera(rng):
+    depth = rng.randint(0, 5000, size=(480, 640)).astype(np.uint16)
+    rot = Rotation.from_euler("xyz", rng.uniform(-np.pi, np.pi, 3)).as_matrix()
+    trans = rng.uniform(-1, 1, (3, 1))
+    pose = rng.uniform(-3, 3, 3)
+    return depth, rot, trans, pose
+
+
+class DeprojectionTest(unittest.TestCase):
+    def test_parity(self):
+        rng = np.random.RandomState(0)
+        uv_one_in_cam = legacy_uv_one_in_cam(INTRINSICS, 480, 640)
+        deprojector = get_deprojector(INTRINSICS, 480, 640)
+        assert get_deprojector(INTRINSICS.tolist(), 480, 640) is deprojector
+        for backend in ["locobot", "habitat"]:
+            depth, rot, trans, pose = random_camera(rng)
+            expected = legacy_rgb_depth_pts(uv_one_in_cam, depth, rot, trans, pose, backend)
+            transform = pose_transform(pose) @ camera_to_base(rot, trans, backend)
+            pts = deprojector.deproject(depth, transform, scale=0.001)
+            assert pts.shape == expected.shape
+            assert_allclose(pts, expected, atol=1e-6)
+            # in the camera frame, and in a reused buffer
+            out = np.empty_like(pts)
+            pts_in_cam = deprojector.deproject(depth, scale=0.001, out=out)
+            assert pts_in_cam is out
+            assert_allclose(pts_in_cam, (uv_one_in_cam * depth.reshape(-1) / 1000.0).T, atol=1e-6)
+        with self.assertRaises(ValueError):
+            deprojector.deproject(np.zeros((240, 320)))
+
+    def test_stride_and_filters(self):
+        rng = np.random.RandomState(1)
+        depth, rot, trans, pose = random_camera(rng)
+        full = get_deprojector(INTRINSICS, 480, 640).deproject(depth, camera_to_base(rot, trans))
+        strided = get_deprojector(INTRINSICS, 480, 640, stride=4, dtype=np.float32)
+        pts = strided.deproject(depth, camera_to_base(rot, trans))
+        assert pts.dtype == np.float32 and len(pts) == len(strided) == 120 * 160
+        expected = full.reshape(480, 640, 3)[::4, ::4].reshape(-1, 3)
+        assert_allclose(pts, expected, rtol=1e-5, atol=1e-2)
+        valid = strided.mask(depth, min_depth=100)
+        assert (valid == (depth[::4, ::4] > 100).reshape(-1)).all()
+
+        pts = np.array([[0.01, 0.01, 0.0], [0.02, 0.04, 0.0], [0.3, 0.0, 0.0], [np.nan, 0, 0]])
+        assert voxel_indices(pts, 0.05).tolist() == [0, 2]
+        keep = voxel_indices(full, 0.05)
+        voxels = np.floor(full / 0.05).astype(np.int64)
+        assert len(np.unique(voxels, axis=0)) == len(keep)
+
+    def test_depth_thresholds(self):
+        """the points kept by RemoteLocobot.get_current_pcd are the DepthImgProcessor ones"""
+        rng = np.random.RandomState(3)
+        depth_mm, _, _, _ = random_camera(rng)
+        depth_mm[:40] = 0
+        rgb = rng.randint(0, 255, size=(480, 640, 3)).astype(np.uint8)
+        depth = depth_mm / 1000.0
+        assert threshold_range(None) == (0.0, np.inf)
+        for subsample_pixs, depth_threshold in [(1, (0, 1.5)), (2, (0.5, 3.0)), (4, (1.0,))]:
+            deprojector = get_deprojector(INTRINSICS, 480, 640, stride=subsample_pixs)
+            valid = deprojector.mask(depth, *threshold_range(depth_threshold))
+            pts = deprojector.deproject(depth)[valid]
+            colors = rgb[::subsample_pixs, ::subsample_pixs].reshape(-1, 3)[valid]
+            expected_pts, expected_colors = legacy_pcd_ic(
+                INTRINSICS, depth_mm, rgb, subsample_pixs, depth_threshold, 1000
+            )
+            assert_allclose(pts, expected_pts, atol=1e-9)
+            assert (colors == expected_colors).all()
+            assert len(pts) < len(deprojector)
+
+    def test_threads(self):
+        """the threads of the Pyro server deproject frames with the same Deprojector"""
+        rng = np.random.RandomState(4)
+        deprojector = get_deprojector(INTRINSICS, 480, 640, stride=2)
+        depths = [random_camera(rng)[0] for _ in range(4)]
+        expected = [deprojector.deproject(depth, scale=0.001) for depth in depths]
+        errors = []
+
+        def run(i):
+            for _ in range(20):
+                pts = deprojector.deproject(depths[i], scale=0.001)
+                if not np.array_equal(pts, expected[i]):
+                    errors.append(i)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(depths))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_time(self):
+        rng = np.random.RandomState(2)
+        depth, rot, trans, pose = random_camera(rng)
+        uv_one_in_cam = legacy_uv_one_in_cam(INTRINSICS, 480, 640)
+        deprojector = get_deprojector(INTRINSICS, 480, 640)
+        out = np.empty((len(deprojector), 3))
+        n = 20
+        legacy = Timer(
+            lambda: legacy_rgb_depth_pts(uv_one_in_cam, depth, rot, trans, pose, "habitat")
+        ).timeit(number=n)
+
+        def deproject(out=None):
+            transform = pose_transform(pose) @ camera_to_base(rot, trans, "habitat")
+            deprojector.deproject(depth, transform, scale=0.001, out=out)
+
+        fused = Timer(deproject).timeit(number=n)
+        reused = Timer(lambda: deproject(out)).timeit(number=n)
+        logging.info(
+            "480x640 point cloud: {:.2f} ms before, {:.2f} ms fused, {:.2f} ms in a reused "
+            "buffer".format(1000 * legacy / n, 1000 * fused / n, 1000 * reused / n)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import os
+import sys
+import unittest
+
+import numpy as np
+import pytest
+
+pytest.importorskip("skfmm")
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../remote"))
+from slam_pkg.utils.fmm_planner import FMMPlanner
+
+
+def random_traversable(rng, size=80, num_obstacles=25):
+    traversable = np.ones((size, size), dtype=bool)
+    for _ in range(num_obstacles):
+        y, x = rng.randint(0, size, 2)
+        h, w = rng.randint(1, 8, 2)
+        traversable[y : y + h, x : x + w] = False
+    return traversable
+
+
+def from_scratch(traversable, goal, state):
+    planner = FMMPlanner(traversable.copy(), step_size=5)
+    planner.set_goal(goal, state)
+    return planner
+
+
+class FMMPlannerTest(unittest.TestCase):
+    def assert_same_around(self, planner, state):
+        """the short term goal and the distances around the robot are the ones computed from
+        scratch on the whole current map"""
+        stg = planner.get_short_term_goal(state)
+        scratch = from_scratch(planner.traversable, planner.goal, state)
+        self.assertEqual(stg, scratch.get_short_term_goal(state))
+        s = planner.step_size
+        y0, x0 = max(state[0] - s, 0), max(state[1] - s, 0)
+        box = np.s_[y0 : state[0] + s + 1, x0 : state[1] + s + 1]
+        unreachable = planner.fmm_dist[box] >= planner.unreachable
+        np.testing.assert_array_equal(unreachable, scratch.fmm_dist[box] >= scratch.unreachable)
+        np.testing.assert_allclose(
+            planner.fmm_dist[box][~unreachable], scratch.fmm_dist[box][~unreachable]
+        )
+
+    def test_update_parity(self):
+        rng = np.random.RandomState(0)
+        for _ in range(5):
+            traversable = random_traversable(rng)
+            goal, state = (70, 70), [10, 10]
+            traversable[goal[1], goal[0]] = traversable[state[0], state[1]] = True
+            planner = FMMPlanner(traversable, step_size=5)
+            planner.set_goal(goal, state)
+            recomputed = 0
+            for _ in range(40):
+                # obstacles appear and disappear, as the map and the collisions are updated
+                y, x = rng.randint(0, 75, 2)
+                traversable[y : y + 5, x : x + 5] = rng.rand() < 0.5
+                traversable[state[0], state[1]] = True
+                planner.update((y, y + 5, x, x + 5))
+                recomputed += planner.is_stale(
+                    max(state[0] - 5, 0), state[0] + 6, max(state[1] - 5, 0), state[1] + 6
+                )
+                self.assert_same_around(planner, state)
+                state = [int(v) for v in planner.get_short_term_goal(state)]
+            # changes away from the robot do not recompute the distances
+            self.assertLess(recomputed, 40)
+
+    def test_unreachable_goal(self):
+        """a change far from the robot which connects it to the goal recomputes the distances"""
+        traversable = np.ones((60, 60), dtype=bool)
+        traversable[:, 30] = False
+        goal, state = (50, 10), [10, 10]
+        planner = FMMPlanner(traversable, step_size=5)
+        planner.set_goal(goal, state)
+        self.assertGreaterEqual(planner.fmm_dist[10, 10], planner.fmm_dist.max())
+        traversable[50:55, 30] = True
+        planner.update((50, 55, 30, 31))
+        self.assert_same_around(planner, state)
+        # the whole area is not reported as explored
+        self.assertLess(planner.fmm_dist[10, 10], planner.fmm_dist.max())
+
+    def test_window_fallback(self):
+        """the distances are computed on the whole map when the robot can not reach the goal
+        inside the window"""
+        traversable = np.ones((60, 60), dtype=bool)
+        traversable[5:, 30] = False
+        goal, state = (50, 50), [50, 10]
+        planner = FMMPlanner(traversable, step_size=5, window=3)
+        planner.set_goal(goal, state)
+        self.assertEqual(planner.bounds, (0, 60, 0, 60))
+        self.assert_same_around(planner, state)
+
+
+if __name__ == "__main__":
+    unittest.main()
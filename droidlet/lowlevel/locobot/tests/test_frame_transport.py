@@ -0,0 +1,207 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+import logging
+import threading
+from timeit import Timer
+import numpy as np
+import Pyro4
+
+from droidlet.lowlevel.locobot.frame_transport import (
+    RING_SLOTS,
+    FrameRing,
+    FrameClient,
+    FrameTransportError,
+)
+from droidlet.lowlevel.locobot.locobot_mover import LoCoBotMover
+
+Pyro4.config.SERIALIZERS_ACCEPTED.add("pickle")
+
+
+def random_frame(h, w, rng):
+    rgb = rng.randint(0, 256, size=(h, w, 3)).astype(np.uint8)
+    depth = rng.randint(0, 2 ** 16, size=(h, w)).astype(np.uint16)
+    return rgb, depth
+
+
+@Pyro4.expose
+class FakeRemote:
+    """get_pcd_data of RemoteLocobot, cycling through a few random frames"""
+
+    def __init__(self, h, w):
+        rng = np.random.RandomState(0)
+        self.cycle = [random_frame(h, w, rng) for _ in range(3)]
+        self.count = 0
+        self.last = None
+
+    def get_pcd_data(self):
+        self.last = self.cycle[self.count % len(self.cycle)]
+        self.count += 1
+        return self.last[0], self.last[1], np.eye(3), np.zeros((3, 1))
+
+    def close(self):
+        pass
+
+
+@Pyro4.expose
+class FakeFrameRemote(FakeRemote):
+    """the frame methods of RemoteLocobot
+
+    Args:
+        other_host: the ring is announced under a name which is not on this host
+        overwrite: the frames are overwritten before the client reads them
+    """
+
+    def __init__(self, h, w, other_host=False, overwrite=False):
+        super().__init__(h, w)
+        self.frames = FrameRing([((h, w, 3), "uint8"), ((h, w), "uint16")])
+        self.other_host = other_host
+        self.overwrite = overwrite
+
+    def get_pcd_frame(self):
+        rgb, depth, rot, trans = self.get_pcd_data()
+        seq, timestamp = self.frames.write([rgb, depth])
+        if self.overwrite:
+            for _ in range(RING_SLOTS):
+                self.frames.write([rgb, depth])
+        meta = self.frames.metadata()
+        meta.update(
+            {"seq": seq, "timestamp": timestamp, "rot": rot.tolist(), "trans": trans.tolist()}
+        )
+        if self.other_host:
+            meta["shm_name"] = "droidlet_frames_missing"
+        return meta
+
+    def close(self):
+        self.frames.close()
+
+
+def pyro_proxy(obj):
+    """serves obj with a Pyro daemon in a thread, returns the proxy and the daemon"""
+    daemon = Pyro4.Daemon(host="127.0.0.1")
+    uri = daemon.register(obj)
+    threading.Thread(target=daemon.requestLoop, daemon=True).start()
+    proxy = Pyro4.Proxy(uri)
+    proxy._pyroSerializer = "pickle"
+    return proxy, daemon
+
+
+class FrameRingTest(unittest.TestCase):
+    def test_ring(self):
+        rng = np.random.RandomState(0)
+        ring = FrameRing([((48, 64, 3), "uint8"), ((48, 64), "uint16")], slots=3)
+        reader = FrameRing(ring.spec, name=ring.name, slots=3)
+        with self.assertRaises(FrameTransportError):
+            reader.read()
+        frames = {}
+        for i in range(5):
+            frame = random_frame(48, 64, rng)
+            seq, timestamp = ring.write(frame)
+            frames[seq] = frame
+        assert reader.latest() == 5
+        for seq in [3, 4, 5]:
+            read_seq, _, (rgb, depth) = reader.read(seq)
+            assert read_seq == seq
+            assert (rgb == frames[seq][0]).all() and (depth == frames[seq][1]).all()
+        # overwritten frames are detected
+        with self.assertRaises(FrameTransportError):
+            reader.read(2)
+        # views change when the slot is written again
+        _, _, (rgb, _) = reader.read(5, copy=False)
+        ring.write(random_frame(48, 64, rng))
+        ring.write(random_frame(48, 64, rng))
+        ring.write(random_frame(48, 64, rng))
+        assert not (rgb == frames[5][0]).all()
+        del rgb
+        with self.assertRaises(FrameTransportError):
+            FrameRing(ring.spec, name="droidlet_frames_missing")
+        reader.close()
+        ring.close()
+
+
+class FrameClientTest(unittest.TestCase):
+    def test_client(self):
+        remote = FakeFrameRemote(48, 64)
+        client = FrameClient()
+        meta = remote.get_pcd_frame()
+        rgb, depth = client.fetch(meta)
+        assert rgb.dtype == np.uint8 and depth.dtype == np.uint16
+        assert (rgb == remote.last[0]).all() and (depth == remote.last[1]).all()
+        for _ in range(RING_SLOTS):
+            remote.get_pcd_frame()
+        with self.assertRaises(FrameTransportError):
+            client.fetch(meta)
+        # not on the same host
+        meta["shm_name"] = "droidlet_frames_missing"
+        assert not client.attach(meta)
+        with self.assertRaises(FrameTransportError):
+            client.fetch(meta)
+        client.close()
+        remote.close()
+
+    def mover(self, remote):
+        proxy, daemon = pyro_proxy(remote)
+        mover = LoCoBotMover.__new__(LoCoBotMover)
+        mover.bot = proxy
+        mover.frame_client = mover.init_frame_client()
+        return mover, proxy, daemon
+
+    def test_mover(self):
+        remotes = [
+            (FakeRemote(48, 64), False),
+            (FakeFrameRemote(48, 64), True),
+            (FakeFrameRemote(48, 64, other_host=True), False),
+            (FakeFrameRemote(48, 64, overwrite=True), True),
+        ]
+        for remote, shared_memory in remotes:
+            mover, proxy, daemon = self.mover(remote)
+            assert (mover.frame_client is not None) == shared_memory
+            for _ in range(2):
+                rgb, depth, rot, trans = mover.get_pcd_data()
+                assert (rgb == remote.last[0]).all() and (depth == remote.last[1]).all()
+            # the frames overwritten before they are read are fetched through Pyro, without
+            # turning off the shared memory
+            assert (mover.frame_client is not None) == shared_memory
+            if mover.frame_client is not None:
+                mover.frame_client.close()
+            proxy._pyroRelease()
+            daemon.shutdown()
+            remote.close()
+
+    def test_mover_errors(self):
+        """errors other than the frames not being available are not hidden by the fallback"""
+        remote = FakeFrameRemote(48, 64)
+        mover, proxy, daemon = self.mover(remote)
+
+        def fetch(meta):
+            raise ValueError("bug")
+
+        mover.frame_client.fetch = fetch
+        with self.assertRaises(ValueError):
+            mover.get_pcd_data()
+        proxy._pyroRelease()
+        daemon.shutdown()
+        remote.close()
+
+    def test_time(self):
+        n = 30
+        for h, w in [(512, 512), (480, 640)]:
+            remote = FakeFrameRemote(h, w)
+            proxy, daemon = pyro_proxy(remote)
+            client = FrameClient()
+            pyro = Timer(lambda: proxy.get_pcd_data()).timeit(number=n)
+            shm = Timer(lambda: client.fetch(proxy.get_pcd_frame())).timeit(number=n)
+            logging.info(
+                "{}x{} rgb-d frames/s: {:.1f} through pyro, {:.1f} shared memory".format(
+                    h, w, n / pyro, n / shm
+                )
+            )
+            client.close()
+            proxy._pyroRelease()
+            daemon.shutdown()
+            remote.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import os
+import sys
+import unittest
+import logging
+from timeit import Timer
+import numpy as np
+from scipy import ndimage
+from skimage.morphology import disk
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "../remote"))
+from slam_pkg.utils.map_builder import MapBuilder
+from slam_pkg.utils.depth_util import transform_pose, bin_points
+from slam_pkg.utils.traversable_map import TraversableMap
+from slam_pkg.utils.recording import synthetic_recording
+
+
+def full_traversable(map_builder, col_map, robot_rad):
+    """the traversable area, as computed from scratch by Slam.update_map before"""
+    obstacle = map_builder.map[:, :, 1] >= 1.0
+    selem = disk(robot_rad / map_builder.resolution)
+    traversable = ndimage.binary_dilation(obstacle, structure=selem) != True
+    unknown_region = map_builder.map.sum(axis=-1) < 1
+    col_map_unknown = np.logical_and(col_map > 0.1, unknown_region)
+    return np.logical_and(traversable, np.logical_not(col_map_unknown))
+
+
+def dense_map(recording, map_size_cm, resolution=5, z_bins=(5, 70)):
+    """the map as accumulated by the dense MapBuilder before, points outside of it are dropped"""
+    map_size = map_size_cm // resolution
+    m = np.zeros((map_size, map_size, len(z_bins) + 1), dtype=np.float32)
+    for pcd, pose in recording:
+        pcd = transform_pose(pcd, pose) * 100
+        pcd = transform_pose(pcd, (map_size_cm / 2.0, map_size_cm / 2.0, np.pi / 2.0))
+        m = m + bin_points(pcd, map_size, list(z_bins), resolution)
+    return m
+
+
+class MapBuilderTest(unittest.TestCase):
+    def test_parity(self):
+        recording = synthetic_recording(num_steps=15)
+        # a map smaller than the room, with points on all sides of it
+        map_builder = MapBuilder(map_size_cm=400, tile_size=16)
+        for pcd, pose in recording:
+            map_builder.update_map(pcd, pose)
+        assert (map_builder.get_map() == dense_map(recording, 400)).all()
+        # the points outside are kept: the map of a larger square has the same cells
+        big = dense_map(recording, 1000)
+        assert (map_builder.get_region(-60, 140, -60, 140) == big).all()
+        rows, cols = map_builder.get_obstacle_cells()
+        assert sorted(zip(rows + 60, cols + 60)) == sorted(zip(*np.nonzero(big[:, :, 1] >= 1.0)))
+
+    def test_map(self):
+        recording = synthetic_recording(num_steps=4)
+        map_builder = MapBuilder(map_size_cm=1000)
+        map_builder.update_map(*recording[0])
+        # the dense map is only rebuilt after an update
+        assert map_builder.map is map_builder.map
+        before = map_builder.map.copy()
+        map_builder.update_map(*recording[1])
+        assert (map_builder.map == map_builder.get_map()).all()
+        assert (map_builder.map != before).any()
+        map_builder.reset_map(1000)
+        assert not map_builder.map.any()
+
+    def test_outliers(self):
+        pcd, pose = synthetic_recording(num_steps=4)[0]
+        map_builder = MapBuilder(map_size_cm=1000)
+        expected = map_builder.update_map(pcd, pose)
+        bounds = map_builder.updated_bounds
+        # a depth outlier 10km away does not change the map nor the region of the update
+        map_builder.reset_map(1000)
+        outliers = np.array([[1e4, 0.0, 0.3], [0.0, -1e4, 0.3], [np.nan, 0.0, 0.3]])
+        updated = map_builder.update_map(np.concatenate([pcd, outliers]), pose)
+        assert map_builder.updated_bounds == bounds
+        assert (updated == expected).all()
+
+    def test_memory(self):
+        recording = synthetic_recording(num_steps=20)
+        times = []
+        for map_size in [1000, 100000]:
+            map_builder = MapBuilder(map_size_cm=map_size)
+            times.append(
+                Timer(lambda: [map_builder.update_map(*r) for r in recording]).timeit(number=1)
+            )
+            # the tiles only cover the 8m room
+            assert len(map_builder.tiles) <= 36
+        logging.info(
+            "{} point clouds in 10m and 1km maps: {} s, {} s".format(len(recording), *times)
+        )
+
+
+class TraversableMapTest(unittest.TestCase):
+    def test_parity(self):
+        recording = synthetic_recording(num_steps=30)
+        map_builder = MapBuilder(map_size_cm=1000)
+        traversable_map = TraversableMap(map_builder, robot_rad=25)
+        rng = np.random.RandomState(0)
+        for i, (pcd, pose) in enumerate(recording):
+            before = traversable_map.traversable.copy()
+            traversable = traversable_map.update(pcd, pose)
+            if i % 5 == 0:
+                patch = rng.rand(12, 9)
+                traversable_map.add_collision(patch, tuple(rng.randint(-5, 200, size=2)))
+            expected = full_traversable(map_builder, traversable_map.col_map, 25)
+            assert (traversable == expected).all()
+            # the changed cells are in the dirty box
+            changed = before != traversable
+            dirty = traversable_map.pop_dirty()
+            if dirty is None:
+                assert not changed.any()
+            else:
+                y0, y1, x0, x1 = dirty
+                changed[y0:y1, x0:x1] = False
+                assert not changed.any()
+        assert traversable_map.pop_dirty() is None
+
+    def test_time(self):
+        recording = synthetic_recording(num_steps=20)
+        for map_size in [2000, 8000]:
+            map_builder = MapBuilder(map_size_cm=map_size)
+            col_map = np.zeros(map_builder.map.shape[:2])
+            full = Timer(
+                lambda: [
+                    (map_builder.update_map(*r), full_traversable(map_builder, col_map, 25))
+                    for r in recording
+                ]
+            ).timeit(number=1)
+            traversable_map = TraversableMap(MapBuilder(map_size_cm=map_size), robot_rad=25)
+            incremental = Timer(
+                lambda: [traversable_map.update(*r) for r in recording]
+            ).timeit(number=1)
+            logging.info(
+                "{} cm map, {} point clouds: {} s full dilation, {} s incremental".format(
+                    map_size, len(recording), full, incremental
+                )
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,7 +3,7 @@ Copyright (c) Facebook, Inc. and its affiliates.
 """
 import os
 import random
-from typing import Optional, List
+from typing import Optional, List, Dict, Sequence
 from droidlet.memory.sql_memory import AgentMemory
 from droidlet.base_util import XYZ, Block, npy_to_blocks_list
 from droidlet.memory.memory_nodes import (  # noqa
@@ -31,6 +31,8 @@ from .mc_memory_nodes import (  # noqa
 from droidlet.perception.craftassist.heuristic_perception import check_inside
 
 PERCEPTION_RANGE = 64
+# max number of voxels looked up in one query (3 sql variables each)
+XYZ_CHUNK = 300
 
 # TODO: ship these schemas via setup.py and fix these directory references
 SCHEMAS = [
@@ -92,6 +94,7 @@ class MCAgentMemory(AgentMemory):
         )
         self.dances = {}
         self.perception_range = preception_range
+        self.spatial_index.add_table("VoxelObjects")
 
     ###########################
     ### For Animate objects ###
@@ -200,7 +203,7 @@ class MCAgentMemory(AgentMemory):
         assert new_count
         self._update_voxel_mean(memid, new_count, (x, y, z))
         if old_memid and update:
-            if old_memid != memid:
+            if old_memid[0] != memid:
                 self.remove_voxel(x, y, z, ref_type)
                 cmd = "INSERT INTO VoxelObjects (uuid, bid, meta, updated, player_placed, agent_placed, ref_type, x, y, z) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
             else:
@@ -211,6 +214,89 @@ class MCAgentMemory(AgentMemory):
             cmd, memid, b, m, self.get_time(), player_placed, agent_placed, ref_type, x, y, z
         )
 
+    def upsert_blocks(
+        self,
+        blocks: Sequence[Block],
+        memid: str,
+        ref_type: str,
+        player_placed: bool = False,
+        agent_placed: bool = False,
+        update: bool = True,  # if update is set to False, forces a write
+    ):
+        """Bulk version of upsert_block: upserts a list of blocks of ref_type into the object memid
+        with one lookup of the occupied voxels, one insert and one update query,
+        and one recomputation of the voxel count and mean of each object changed,
+        all in a single transaction.
+        As in upsert_block, a voxel of the same ref_type belonging to another object is moved to memid,
+        and if update is False the blocks are inserted without checking for existing voxels"""
+        # if a location is given twice the last block wins, as in repeated upsert_block calls
+        blocks = {tuple(xyz): idm for xyz, idm in blocks}
+        t = self.get_time()
+        with self.transaction():
+            inserts = []
+            updates = []
+            moved = {}
+            if update:
+                old_memids = self.get_object_ids_by_xyzs(list(blocks.keys()), ref_type)
+            else:
+                old_memids = {}
+            for (x, y, z), (b, m) in blocks.items():
+                old = old_memids.get((x, y, z))
+                if old and old[0] == memid:
+                    updates.append((memid, b, m, t, player_placed, agent_placed, ref_type, x, y, z))
+                else:
+                    if old:
+                        moved[(x, y, z)] = old[0]
+                    inserts.append((memid, b, m, t, player_placed, agent_placed, ref_type, x, y, z))
+            if moved:
+                self._db_write_many(
+                    "DELETE FROM VoxelObjects WHERE x=? AND y=? AND z=? and ref_type=?",
+                    [(x, y, z, ref_type) for (x, y, z) in moved],
+                )
+            if updates:
+                self._db_write_many(
+                    "UPDATE VoxelObjects SET uuid=?, bid=?, meta=?, updated=?, player_placed=?, agent_placed=? WHERE ref_type=? AND x=? AND y=? AND z=?",
+                    updates,
+                )
+            if inserts:
+                self._db_write_many(
+                    "INSERT INTO VoxelObjects (uuid, bid, meta, updated, player_placed, agent_placed, ref_type, x, y, z) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    inserts,
+                )
+            # objects that lost all their voxels were deleted by the VoxelObjectsDelete trigger
+            # and the update is a no-op
+            for m in [memid] + list(set(moved.values()) - {memid}):
+                self.db_write(
+                    """UPDATE ReferenceObjects SET
+                    (voxel_count, x, y, z) = (SELECT COUNT(*), AVG(x), AVG(y), AVG(z) FROM VoxelObjects WHERE uuid=?)
+                    WHERE uuid=?""",
+                    m,
+                    m,
+                )
+
+    def get_object_ids_by_xyzs(self, xyzs: Sequence[XYZ], ref_type: str) -> Dict[XYZ, List[str]]:
+        """Bulk version of get_object_info_by_xyz
+
+        Returns:
+            dict of (x, y, z) -> list of memids of objects of ref_type with a voxel there,
+            for the locations in xyzs with at least one object
+        """
+        out = {}
+        for i in range(0, len(xyzs), XYZ_CHUNK):
+            chunk = xyzs[i : i + XYZ_CHUNK]
+            values = ",".join(["(?,?,?)"] * len(chunk))
+            r = self._db_read(
+                "WITH L(x, y, z) AS (VALUES {}) SELECT V.x, V.y, V.z, V.uuid FROM VoxelObjects AS V "
+                "INNER JOIN L ON V.x=L.x AND V.y=L.y AND V.z=L.z WHERE V.ref_type=?".format(values),
+                *[int(c) for xyz in chunk for c in xyz],
+                ref_type
+            )
+            for x, y, z, memid in r:
+                memids = out.setdefault((x, y, z), [])
+                if memid not in memids:
+                    memids.append(memid)
+        return out
+
     def check_inside(self, mems):
         """ mems is a sequence of two ReferenceObjectNodes.
         this just wraps the heuristic perception check_inside method
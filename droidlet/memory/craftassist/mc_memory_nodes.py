@@ -79,9 +79,9 @@ class VoxelObjectNode(ReferenceObjectNode):
 
     def snapshot(self, agent_memory):
         archive_memid = self.new(agent_memory, snapshot=True)
-        for loc in self.locs:
-            cmd = "INSERT INTO ArchivedVoxelObjects (uuid, x, y, z, bid, meta, agent_placed, player_placed, updated, ref_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-            values = (
+        cmd = "INSERT INTO ArchivedVoxelObjects (uuid, x, y, z, bid, meta, agent_placed, player_placed, updated, ref_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        values = [
+            (
                 archive_memid,
                 loc[0],
                 loc[1],
@@ -93,7 +93,9 @@ class VoxelObjectNode(ReferenceObjectNode):
                 self.update_times[loc],
                 self.memtype,
             )
-            agent_memory.db_write(cmd, *values)
+            for loc in self.locs
+        ]
+        agent_memory._db_write_many(cmd, values)
 
         archive_memid = self.new(agent_memory, snapshot=True)
         cmd = "INSERT INTO ArchivedReferenceObjects (uuid, eid, x, y, z, yaw, pitch, name, type_name, ref_type, player_placed, agent_placed, created, updated, voxel_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
@@ -149,17 +151,16 @@ class BlockObjectNode(VoxelObjectNode):
             >>> create(memory, blocks)
         """
         # check if block object already exists in memory
+        old_memids = memory.get_object_ids_by_xyzs([xyz for xyz, _ in blocks], "BlockObjects")
         for xyz, _ in blocks:
-            old_memids = memory.get_block_object_ids_by_xyz(xyz)
-            if old_memids:
-                return old_memids[0]
+            if old_memids.get(tuple(xyz)):
+                return old_memids[tuple(xyz)][0]
         memid = cls.new(memory)
         # TODO check/assert this isn't there...
         cmd = "INSERT INTO ReferenceObjects (uuid, x, y, z, ref_type, voxel_count) VALUES ( ?, ?, ?, ?, ?, ?)"
-        # TODO this is going to cause a bug, need better way to initialize and track mean loc
         memory.db_write(cmd, memid, 0, 0, 0, "BlockObjects", 0)
-        for block in blocks:
-            memory.upsert_block(block, memid, "BlockObjects")
+        # sets the voxel count and mean loc
+        memory.upsert_blocks(blocks, memid, "BlockObjects")
         memory.tag(memid, "_block_object")
         memory.tag(memid, "VOXEL_OBJECT")
         memory.tag(memid, "_physical_object")
@@ -224,14 +225,9 @@ class InstSegNode(VoxelObjectNode):
         # TODO option to not overwrite
         # check if instance segmentation object already exists in memory
         inst_memids = {}
-        for xyz in locs:
-            m = memory._db_read(
-                'SELECT uuid from VoxelObjects WHERE ref_type="inst_seg" AND x=? AND y=? AND z=?',
-                *xyz
-            )
-            if len(m) > 0:
-                for memid in m:
-                    inst_memids[memid[0]] = True
+        for memids in memory.get_object_ids_by_xyzs(locs, "inst_seg").values():
+            for memid in memids:
+                inst_memids[memid] = True
         # FIXME just remember the locs in the first pass
         for m in inst_memids.keys():
             olocs = memory._db_read("SELECT x, y, z from VoxelObjects WHERE uuid=?", m)
@@ -244,9 +240,7 @@ class InstSegNode(VoxelObjectNode):
         # TODO check/assert this isn't there...
         cmd = "INSERT INTO ReferenceObjects (uuid, x, y, z, ref_type) VALUES ( ?, ?, ?, ?, ?)"
         memory.db_write(cmd, memid, loc[0], loc[1], loc[2], "inst_seg")
-        for loc in locs:
-            cmd = "INSERT INTO VoxelObjects (uuid, x, y, z, ref_type) VALUES ( ?, ?, ?, ?, ?)"
-            memory.db_write(cmd, memid, loc[0], loc[1], loc[2], "inst_seg")
+        memory.upsert_blocks([(l, (None, None)) for l in locs], memid, "inst_seg", update=False)
         memory.tag(memid, "VOXEL_OBJECT")
         memory.tag(memid, "_inst_seg")
         memory.tag(memid, "_destructible")
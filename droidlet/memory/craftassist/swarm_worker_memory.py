@@ -1,7 +1,8 @@
 import pdb, sys
+from contextlib import nullcontext
 from multiprocessing import Queue
 from droidlet.shared_data_structs import Time
-from typing import Optional, List, Tuple, Sequence, Union
+from typing import Optional, List, Tuple, Sequence, Union, Dict
 from droidlet.base_util import XYZ, Block, npy_to_blocks_list
 from droidlet.interpreter.task import *
 from droidlet.interpreter.craftassist.tasks import *
@@ -60,6 +61,8 @@ class SwarmWorkerMemory():
         self.receive_dict = {}
         self.init_time_interface(agent_time)
         self._safe_pickle_saved_attrs = {}
+        # tasks are pickled into the master memory, which steps them
+        self.live_tasks = None
         mem_id_len = len(uuid.uuid4().hex)
         self.self_memid = "0" * (mem_id_len // 2) + uuid.uuid4().hex[: mem_id_len - mem_id_len // 2]
         self.db_write(
@@ -146,6 +149,14 @@ class SwarmWorkerMemory():
 
     def db_write(self, query: str, *args) -> int:
         return self._db_command("db_write", query, *args)
+
+    def _db_write_many(self, query: str, seq_of_args) -> int:
+        return self._db_command("_db_write_many", query, list(seq_of_args))
+
+    def transaction(self):
+        # writes are forwarded one by one to the master memory, which commits each
+        # of them; there is nothing to batch on the worker side
+        return nullcontext(self)
     
     def _db_read(self, query: str, *args) -> List[Tuple]:
         return self._db_command("_db_read", query, *args)
@@ -159,6 +170,9 @@ class SwarmWorkerMemory():
     def forget(self, memid):
         return self._db_command("forget", memid)
 
+    def merge_triples(self, subj_memids: List[str], into_memid: str):
+        return self._db_command("merge_triples", list(subj_memids), into_memid)
+
     def add_triple(self,
         subj: str = None,  # this is a memid if given
         obj: str = None,  # this is a memid if given
@@ -216,6 +230,19 @@ class SwarmWorkerMemory():
         update: bool = True,  # if update is set to False, forces a write
     ):
         return self._db_command("upsert_block", block, memid, ref_type, player_placed, agent_placed, update)
+
+    def upsert_blocks(self,
+        blocks: Sequence[Block],
+        memid: str,
+        ref_type: str,
+        player_placed: bool = False,
+        agent_placed: bool = False,
+        update: bool = True,  # if update is set to False, forces a write
+    ):
+        return self._db_command("upsert_blocks", blocks, memid, ref_type, player_placed, agent_placed, update)
+
+    def get_object_ids_by_xyzs(self, xyzs: Sequence[XYZ], ref_type: str) -> Dict[XYZ, List[str]]:
+        return self._db_command("get_object_ids_by_xyzs", xyzs, ref_type)
     
     def _update_voxel_count(self, memid, dn):
         return self._db_command("_update_voxel_count", memid, dn)
@@ -2,10 +2,16 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 import unittest
+import logging
+import queue
+import random
+import threading
+from timeit import Timer
 from collections import namedtuple
 from droidlet.memory.craftassist.mc_memory import MCAgentMemory
 from droidlet.memory.craftassist.mc_memory_nodes import BlockObjectNode, \
     MobNode, SchematicNode, InstSegNode, ItemStackNode, DanceNode
+from droidlet.memory.craftassist.swarm_worker_memory import SwarmWorkerMemory
 from droidlet.memory.memory_nodes import PlayerNode
 from droidlet.base_util import Pos, Look, Player
 
@@ -66,6 +72,17 @@ class BasicTest(unittest.TestCase):
         assert self.memory.get_instseg_object_ids_by_xyz((2, 0, 34))[0][0] == inst_seg_memid
         assert self.memory.get_instseg_object_ids_by_xyz((3, 0, 34))[0][0] == inst_seg_memid
 
+    def test_merge_triples(self):
+        self.memory = MCAgentMemory()
+        a = InstSegNode.create(self.memory, [(1, 0, 34)], ["shiny"])
+        b = InstSegNode.create(self.memory, [(2, 0, 34)], ["bright"])
+        # the nodes are cached with their tags
+        assert "bright" not in self.memory.get_mem_by_id(a).tags
+        assert "bright" in self.memory.get_mem_by_id(b).tags
+        self.memory.merge_triples([a, b], a)
+        assert {"shiny", "bright"} <= set(self.memory.get_mem_by_id(a).tags)
+        assert "bright" not in self.memory.get_mem_by_id(b).tags
+
     def test_schematic_apis(self):
         self.memory = MCAgentMemory()
         schematic_memid = SchematicNode.create(self.memory, (((2, 0, 1), (1, 0)), ((2, 0, 2), (1, 0)), ((2, 0, 3), (2, 0))))
@@ -110,5 +127,232 @@ class BasicTest(unittest.TestCase):
         assert len(self.memory.get_triples(obj_text="dance_with_numbers")) == 1
 
 
+class TransactionTimeTest(unittest.TestCase):
+    """Per-tick cost of creating block objects, as the heuristic perception does,
+    with and without batching the writes into one transaction"""
+
+    def perception_tick(self, memory, tick):
+        for i in range(10):
+            blocks = [((x, tick, 3 * i), (1, 0)) for x in range(20)]
+            BlockObjectNode.create(memory, blocks)
+
+    def test_time(self):
+        memory = MCAgentMemory()
+        t = Timer(lambda: self.perception_tick(memory, 0))
+        unbatched = t.timeit(number=1)
+
+        memory = MCAgentMemory()
+
+        def batched_tick():
+            with memory.transaction():
+                self.perception_tick(memory, 0)
+
+        batched = Timer(batched_tick).timeit(number=1)
+        logging.info(
+            "BlockObject creation per tick: {} s unbatched, {} s batched".format(
+                unbatched, batched
+            )
+        )
+        assert len(memory._db_read("SELECT uuid FROM ReferenceObjects WHERE ref_type=?", "BlockObjects")) == 10
+        assert len(memory._db_read("SELECT * FROM Updates")) == 0
+
+
+class SpatialIndexTest(unittest.TestCase):
+    def brute_force_within(self, memory, bbox):
+        xmin, xmax, ymin, ymax, zmin, zmax = bbox
+        memids = set()
+        for table in ["ReferenceObjects", "VoxelObjects"]:
+            cmd = "SELECT uuid FROM {} WHERE x>=? AND x<=? AND y>=? AND y<=? AND z>=? AND z<=?"
+            r = memory._db_read(cmd.format(table), xmin, xmax, ymin, ymax, zmin, zmax)
+            memids.update(m[0] for m in r)
+        return memids
+
+    def brute_force_nearest(self, memory, pos, k):
+        dists = {}
+        for table in ["ReferenceObjects", "VoxelObjects"]:
+            for memid, x, y, z in memory._db_read("SELECT uuid, x, y, z FROM {}".format(table)):
+                if x is None:
+                    continue
+                d = ((x - pos[0]) ** 2 + (y - pos[1]) ** 2 + (z - pos[2]) ** 2) ** 0.5
+                dists[memid] = min(d, dists.get(memid, float("inf")))
+        return sorted(dists.values())[:k]
+
+    def test_spatial_index(self):
+        memory = MCAgentMemory()
+        random.seed(0)
+        for i in range(30):
+            x, y, z = [random.randint(-30, 30) for _ in range(3)]
+            BlockObjectNode.create(memory, [((x + j, y, z), (1, 0)) for j in range(3)])
+        mob_memid = MobNode.create(memory, Mob(10, 65, Pos(1, 2, 3), Look(0, 0)))
+        bboxes = [(-5, 5, -5, 5, -5, 5), (0, 30, -30, 0, -10, 10), (-100, 100, -100, 100, -100, 100)]
+        for bbox in bboxes:
+            assert set(memory.objects_within(bbox)) == self.brute_force_within(memory, bbox)
+        assert mob_memid in memory.objects_within((0, 2, 1, 3, 2, 4))
+        for pos in [(0, 0, 0), (30, 30, 30), (-15, 2, 8)]:
+            memids = memory.k_nearest(pos, 5)
+            dists = [min(self.brute_force_nearest_one(memory, pos, m)) for m in memids]
+            assert dists == self.brute_force_nearest(memory, pos, 5)
+
+        # the index follows updates and deletes
+        memory.set_mob_position(Mob(10, 65, Pos(50, 50, 50), Look(0, 0)))
+        assert mob_memid not in memory.objects_within((0, 2, 1, 3, 2, 4))
+        assert memory.k_nearest((50, 50, 50), 1) == [mob_memid]
+        block_memid = memory.objects_within((-100, 100, -100, 100, -100, 100), ref_type="BlockObjects")[0]
+        memory.forget(block_memid)
+        assert block_memid not in memory.objects_within((-100, 100, -100, 100, -100, 100))
+
+    def brute_force_nearest_one(self, memory, pos, memid):
+        locs = memory._db_read("SELECT x, y, z FROM VoxelObjects WHERE uuid=?", memid)
+        locs += memory._db_read("SELECT x, y, z FROM ReferenceObjects WHERE uuid=? AND x IS NOT NULL", memid)
+        return [((x - pos[0]) ** 2 + (y - pos[1]) ** 2 + (z - pos[2]) ** 2) ** 0.5 for x, y, z in locs]
+
+    def test_time(self):
+        memory = MCAgentMemory()
+        random.seed(0)
+        with memory.transaction():
+            for i in range(1000):
+                x, y, z = [random.randint(-500, 500) for _ in range(3)]
+                blocks = [((x + j, y + l, z), (1, 0)) for j in range(10) for l in range(10)]
+                memid = BlockObjectNode.new(memory)
+                cmd = "INSERT INTO ReferenceObjects (uuid, x, y, z, ref_type, voxel_count) VALUES (?, ?, ?, ?, ?, ?)"
+                memory.db_write(cmd, memid, x, y, z, "BlockObjects", len(blocks))
+                cmd = "INSERT INTO VoxelObjects (uuid, bid, meta, updated, player_placed, agent_placed, ref_type, x, y, z) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                memory._db_write_many(
+                    cmd, [(memid, b, m, 0, False, False, "BlockObjects", *xyz) for xyz, (b, m) in blocks]
+                )
+        bbox = (-20, 20, -20, 20, -20, 20)
+        indexed = Timer(lambda: memory.objects_within(bbox)).timeit(number=10)
+        btree = Timer(lambda: self.brute_force_within(memory, bbox)).timeit(number=10)
+        nearest = Timer(lambda: memory.k_nearest((0, 0, 0), 5)).timeit(number=10)
+        logging.info(
+            "10^5 voxels, 10 box searches: {} s R*Tree, {} s B-tree; 10 5-nearest searches: {} s".format(
+                indexed, btree, nearest
+            )
+        )
+        assert set(memory.objects_within(bbox)) == self.brute_force_within(memory, bbox)
+
+
+class UpsertBlocksTest(unittest.TestCase):
+    """upsert_blocks should leave the same voxels as upserting the blocks one at a time"""
+
+    def voxels(self, memory, memids):
+        """the voxels in memory, with the memids of the objects replaced by their index in memids"""
+        r = memory._db_read("SELECT uuid, x, y, z, bid, meta, ref_type FROM VoxelObjects")
+        return {(memids.index(v[0]),) + v[1:] for v in r}
+
+    def test_parity(self):
+        random.seed(0)
+        memories = [MCAgentMemory(), MCAgentMemory()]
+        memids = [[], []]
+        for memory, m in zip(memories, memids):
+            m.append(BlockObjectNode.create(memory, [((0, 0, 0), (1, 0)), ((1, 0, 0), (1, 0))]))
+            m.append(BlockObjectNode.create(memory, [((5, 5, 5), (4, 0)), ((6, 5, 5), (4, 0))]))
+            m.append(BlockObjectNode.create(memory, [((9, 9, 9), (4, 0))]))
+        blocks = [
+            ((random.randint(-2, 2), 0, random.randint(-2, 2)), (random.randint(1, 3), 0))
+            for i in range(30)
+        ]
+        # updates voxels of the object, adds new ones and moves voxels of the other objects,
+        # deleting the last one when all its voxels are moved
+        blocks += [((5, 5, 5), (7, 0)), ((9, 9, 9), (7, 0)), ((1, 0, 0), (8, 0))]
+        for block in blocks:
+            memories[0].upsert_block(block, memids[0][0], "BlockObjects")
+        memories[1].upsert_blocks(blocks, memids[1][0], "BlockObjects")
+        assert self.voxels(memories[0], memids[0]) == self.voxels(memories[1], memids[1])
+
+        memory, (memid, other, deleted) = memories[1], memids[1]
+        locs = {v[1:4] for v in memory._db_read("SELECT * FROM VoxelObjects WHERE uuid=?", memid)}
+        assert set(memory.get_mem_by_id(memid).blocks.keys()) == locs
+        count, x, y, z = memory._db_read_one(
+            "SELECT voxel_count, x, y, z FROM ReferenceObjects WHERE uuid=?", memid
+        )
+        assert count == len(locs)
+        assert abs(x - sum(l[0] for l in locs) / len(locs)) < 1e-6
+        assert abs(z - sum(l[2] for l in locs) / len(locs)) < 1e-6
+        assert memory._db_read_one(
+            "SELECT voxel_count, x FROM ReferenceObjects WHERE uuid=?", other
+        ) == (1, 6)
+        assert memory._db_read_one("SELECT * FROM Memories WHERE uuid=?", deleted) is None
+
+    def test_create(self):
+        memory = MCAgentMemory()
+        blocks = [((x, 0, z), (1, 0)) for x in range(4) for z in range(4)]
+        memid = BlockObjectNode.create(memory, blocks)
+        assert BlockObjectNode.create(memory, [((9, 9, 9), (1, 0))] + blocks[5:6]) == memid
+        assert memory._db_read_one(
+            "SELECT voxel_count, x, y, z FROM ReferenceObjects WHERE uuid=?", memid
+        ) == (16, 1.5, 0, 1.5)
+        snapshot = memory.get_mem_by_id(memid).snapshot(memory)
+        archived = memory._db_read("SELECT x, y, z, bid, meta FROM ArchivedVoxelObjects")
+        assert sorted(archived) == sorted(xyz + idm for xyz, idm in blocks)
+        assert memory._db_read_one(
+            "SELECT voxel_count FROM ArchivedReferenceObjects WHERE uuid=?", snapshot
+        ) == (16,)
+        locs = [(1, 0, 34), (1, 0, 35), (2, 0, 34)]
+        inst_seg_memid = InstSegNode.create(memory, locs)
+        assert set(memory.get_mem_by_id(inst_seg_memid).locs) == set(locs)
+        # an instance segmentation object covered by a new one is replaced
+        new_memid = InstSegNode.create(memory, locs + [(3, 0, 34)])
+        assert memory.get_object_ids_by_xyzs(locs, "inst_seg") == {l: [new_memid] for l in locs}
+
+    def test_time(self):
+        blocks = [((x, y, z), (1, 0)) for x in range(10) for y in range(10) for z in range(10)]
+
+        def upsert_one_at_a_time():
+            memory = MCAgentMemory()
+            memid = BlockObjectNode.create(memory, blocks[:1])
+            with memory.transaction():
+                for block in blocks:
+                    memory.upsert_block(block, memid, "BlockObjects")
+
+        def upsert_bulk():
+            memory = MCAgentMemory()
+            memid = BlockObjectNode.create(memory, blocks[:1])
+            memory.upsert_blocks(blocks, memid, "BlockObjects")
+
+        one_at_a_time = Timer(upsert_one_at_a_time).timeit(number=1)
+        bulk = Timer(upsert_bulk).timeit(number=1)
+        logging.info(
+            "upserting 1000 blocks: {} s one at a time, {} s bulk".format(one_at_a_time, bulk)
+        )
+
+
+
+class SwarmWorkerSnapshotTest(unittest.TestCase):
+    """snapshots of voxel objects through the memory of a swarm worker, whose queries are
+    answered by the master memory like in CraftAssistSwarmMaster.handle_memory_query"""
+
+    def serve(self):
+        while True:
+            query = self.send_queue.get()
+            if query is None:
+                return
+            query_id, name, args = query[0], query[1], query[2:]
+            self.receive_queue.put((query_id, getattr(self.memory, name)(*args)))
+
+    def setUp(self):
+        self.memory = MCAgentMemory()
+        self.send_queue, self.receive_queue = queue.Queue(), queue.Queue()
+        self.master = threading.Thread(target=self.serve, daemon=True)
+        self.master.start()
+        self.worker_memory = SwarmWorkerMemory(
+            self.send_queue, self.receive_queue, "swarm_worker_1"
+        )
+
+    def tearDown(self):
+        self.send_queue.put(None)
+        self.master.join()
+
+    def test_snapshot(self):
+        blocks = [((x, 0, z), (1, 0)) for x in range(3) for z in range(3)]
+        memid = BlockObjectNode.create(self.memory, blocks)
+        archive_memid = BlockObjectNode(self.worker_memory, memid).snapshot(self.worker_memory)
+        locs = self.memory._db_read("SELECT x, y, z FROM ArchivedVoxelObjects")
+        assert sorted(locs) == sorted(xyz for xyz, _ in blocks)
+        assert self.memory.get_triples(subj=memid, pred_text="_has_archive") == [
+            (memid, "_has_archive", archive_memid)
+        ]
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -2,7 +2,7 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 import numpy as np
-from .memory_filters import get_property_value
+from .memory_filters import get_property_values
 
 
 # attribute has function signature list(mems) --> list(value)
@@ -17,7 +17,7 @@ class Attribute:
 class TableColumn(Attribute):
     """
     for each input memory, the call returns a column value or a triple obj_text via
-    get_property_value
+    get_property_values
 
     Args:
          memory (droidlet memory):  the memory that will be queried
@@ -33,10 +33,9 @@ class TableColumn(Attribute):
         self.get_all = get_all
 
     def __call__(self, mems):
-        return [
-            get_property_value(self.memory, mem, self.attribute, get_all=self.get_all)
-            for mem in mems
-        ]
+        return get_property_values(
+            self.memory, mems, self.attribute, get_all=self.get_all
+        ).tolist()
 
     def __repr__(self):
         return "Attribute: " + self.attribute
@@ -2,8 +2,10 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 from typing import List
+import numpy as np
 import torch
-from droidlet.memory.filters_conversions import get_inequality_symbol, sqly_to_new_filters
+from droidlet.memory.filters_conversions import sqly_to_new_filters
+from droidlet.memory.where_planner import check_well_formed_triple, parse_comparator
 
 ####################################################################################
 ### This file is split between the basic memory searcher, and memory filters objects
@@ -14,6 +16,8 @@ from droidlet.memory.filters_conversions import get_inequality_symbol, sqly_to_n
 
 
 SELFID = "0" * 32
+# max number of memids bound in a single "IN (...)" clause
+SQL_IN_CHUNK = 500
 
 
 def maybe_and(sql, a):
@@ -30,19 +34,6 @@ def maybe_or(sql, a):
         return sql
 
 
-def check_well_formed_triple(clause):
-    # TODO search by pred?
-    assert any(
-        [
-            "subj" in clause or "subj_text" in clause,
-            "pred_text" in clause,
-            "obj" in clause or "obj_text" in clause,
-        ]
-    )
-    assert not ("subj" in clause and "subj_text" in clause)
-    assert not ("obj" in clause and "obj_text" in clause)
-
-
 def get_property_value(agent_memory, mem, prop, get_all=False):
     """
     Tries to get property value from a memory.
@@ -63,15 +54,13 @@ def get_property_value(agent_memory, mem, prop, get_all=False):
         mem = agent_memory.get_mem_by_id(mem)
 
     # is it in the main memory table?
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info(Memories)")]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns("Memories"):
         cmd = "SELECT " + prop + " FROM Memories WHERE uuid=?"
         r = agent_memory._db_read(cmd, mem.memid)
         return r[0][0]
     # is it in the mem.TABLE?
     T = mem.TABLE
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info({})".format(T))]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns(T):
         cmd = "SELECT " + prop + " FROM " + T + " WHERE uuid=?"
         r = agent_memory._db_read(cmd, mem.memid)
         return r[0][0]
@@ -86,6 +75,73 @@ def get_property_value(agent_memory, mem, prop, get_all=False):
     return None
 
 
+def _read_by_memids(agent_memory, cmd, memids, *args):
+    """runs cmd, which should end with "IN ", with a (?,...,?) for
+    each memid appended, in chunks of at most SQL_IN_CHUNK memids"""
+    rows = []
+    for i in range(0, len(memids), SQL_IN_CHUNK):
+        chunk = memids[i : i + SQL_IN_CHUNK]
+        qmarks = "(" + ",".join(["?"] * len(chunk)) + ")"
+        rows.extend(agent_memory._db_read(cmd + qmarks, *args, *chunk))
+    return rows
+
+
+def get_property_values(agent_memory, mems, prop, get_all=False):
+    """
+    Bulk version of get_property_value: gets a property value for each of a list of memories,
+    with one query per table instead of several queries per memory.
+
+    Args:
+        agent_memory: an AgentMemory object
+        mems: a list of MemoryNode objects or memids (str)
+        prop: a string with the name of the property
+        get_all: if True, the value for each memory is the list of all its triples' obj_text
+            (when the property is a triple)
+
+    returns a numpy array with the value for each memory, None if the memory has no such property.
+    the array has a numeric dtype if all the values are numbers, and dtype object otherwise.
+    uses the same order of precedence as get_property_value
+    """
+    memids = [m if type(m) is str else m.memid for m in mems]
+    values = {}
+    # is it in the main memory table?
+    if prop in agent_memory.get_table_columns("Memories"):
+        cmd = "SELECT uuid, " + prop + " FROM Memories WHERE uuid IN "
+        values.update(_read_by_memids(agent_memory, cmd, memids))
+    else:
+        # is it in the tables corresponding to the nodes?
+        node_types = _read_by_memids(
+            agent_memory, "SELECT uuid, node_type FROM Memories WHERE uuid IN ", memids
+        )
+        by_table = {}
+        for memid, node_type in node_types:
+            T = getattr(agent_memory.nodes.get(node_type), "TABLE", None)
+            if T is not None and prop in agent_memory.get_table_columns(T):
+                by_table.setdefault(T, []).append(memid)
+        for T, table_memids in by_table.items():
+            cmd = "SELECT uuid, " + prop + " FROM " + T + " WHERE uuid IN "
+            values.update(_read_by_memids(agent_memory, cmd, table_memids))
+        # is it a triple?
+        triple_memids = list(set(memids) - set(values.keys()))
+        cmd = (
+            "SELECT subj, obj_text FROM Triples INNER JOIN Memories as M ON Triples.subj=M.uuid "
+            "WHERE M.is_snapshot=0 AND pred_text=? AND subj IN "
+        )
+        for memid, obj_text in _read_by_memids(agent_memory, cmd, triple_memids, prop):
+            if get_all:
+                values.setdefault(memid, []).append(obj_text)
+            elif memid not in values:
+                values[memid] = obj_text
+
+    out = [values.get(memid) for memid in memids]
+    if not get_all and all(type(v) in [int, float] for v in out):
+        return np.array(out)
+    # don't let numpy convert mixed values to strings, or lists of values into a 2d array
+    out_array = np.empty(len(out), dtype=object)
+    out_array[:] = out
+    return out_array
+
+
 def search_by_property(agent_memory, prop, value, comparison_symbol, memtype):
     """
     Tries to find memories with a property value
@@ -130,15 +186,13 @@ def search_by_property(agent_memory, prop, value, comparison_symbol, memtype):
         v = value
 
     # is it in the main memory table?
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info(Memories)")]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns("Memories"):
         cmd = "SELECT uuid FROM Memories " + where
         return [m[0] for m in agent_memory._db_read(cmd, *v)]
 
     # is it in the node table?
     T = agent_memory.nodes[memtype].TABLE
-    cols = [c[1] for c in agent_memory._db_read("PRAGMA table_info({})".format(T))]
-    if prop in cols:
+    if prop in agent_memory.get_table_columns(T):
         cmd = "SELECT uuid FROM " + T + " " + where
         return [m[0] for m in agent_memory._db_read(cmd, *v)]
 
@@ -162,19 +216,19 @@ def search_by_property(agent_memory, prop, value, comparison_symbol, memtype):
     return []
 
 
-def try_float(value, where_clause):
-    try:
-        return float(value)
-    except:
-        raise Exception("tried to get float from {} in {}".format(value, where_clause))
-
-
 def argval_subsample_idx(values, n, polarity="MAX"):
-    """ values is a list, n an int, polarity is MAX or MIN"""
+    """ values is a list or numpy array, n an int, polarity is MAX or MIN"""
     assert n > 0
-    descending = {"MAX": True, "MIN": False}[polarity]
-    _, idxs = torch.sort(torch.Tensor(values), descending=descending)
-    return idxs.tolist()[:n]
+    values = np.asarray(values, dtype=np.float64)
+    if polarity == "MAX":
+        values = -values
+    elif polarity != "MIN":
+        raise KeyError(polarity)
+    if n >= len(values):
+        return np.argsort(values, kind="stable").tolist()
+    # only the top n need sorting
+    idxs = np.argpartition(values, n - 1)[:n]
+    return idxs[np.argsort(values[idxs], kind="stable")].tolist()
 
 
 def random_subsample_idx(num_mems, n, same="DISALLOWED"):
@@ -237,9 +291,10 @@ class MemorySearcher:
     # TODO eventually allow any attribute- if its not a "simple" attribute,
     #  pass in as attribute object (callable with proper signature)
 
-    def __init__(self, query=None, ignore_self=False):
+    def __init__(self, query=None, ignore_self=False, compile_where=True):
         self.query = query
         self.ignore_self = ignore_self
+        self.compile_where = compile_where
 
     def maybe_convert_query(self, query):
         if type(query) is str:
@@ -248,19 +303,30 @@ class MemorySearcher:
             return query
 
     def handle_where(self, agent_memory, where_clause, memtype):
-        """ 
-        returns a list of memids whose memories satisfy the where clause
+        """
+        returns a list of memids whose memories satisfy the where clause.
+        unless compile_where is False, the where clause is compiled into
+        a single SQL statement by the agent_memory's WherePlanner
+        """
+        if self.compile_where:
+            return agent_memory.where_planner.run(where_clause, memtype)
+        return self.handle_where_uncompiled(agent_memory, where_clause, memtype)
+
+    def handle_where_uncompiled(self, agent_memory, where_clause, memtype):
+        """
+        returns a list of memids whose memories satisfy the where clause,
+        searching each leaf separately and combining the results in python
         """
         # do this brutally for now, if we need can make more efficient
         if where_clause.get("AND"):
             memid_lists = []
             for c in where_clause["AND"]:
-                memid_lists.append(self.handle_where(agent_memory, c, memtype))
+                memid_lists.append(self.handle_where_uncompiled(agent_memory, c, memtype))
             return list(set.intersection(*[set(m) for m in memid_lists]))
         if where_clause.get("OR"):
             memid_lists = []
             for c in where_clause["OR"]:
-                memid_lists.append(self.handle_where(agent_memory, c, memtype))
+                memid_lists.append(self.handle_where_uncompiled(agent_memory, c, memtype))
             return list(set.union(*[set(m) for m in memid_lists]))
         if where_clause.get("NOT"):
             # FIXME memtype might be a union of node types
@@ -271,35 +337,13 @@ class MemorySearcher:
                 "SELECT uuid FROM Memories WHERE " + node_type_clause, *memtypes
             )
             all_memids = set([m[0] for m in all_memids])
-            memids = self.handle_where(agent_memory, where_clause["NOT"][0], memtype)
+            memids = self.handle_where_uncompiled(agent_memory, where_clause["NOT"][0], memtype)
             return list(all_memids - set(memids))
 
         # TODO: if input_left or input_right are subqueries...
         if where_clause.get("input_left"):
             # this is a leaf, actually search:
-            input_left = where_clause["input_left"]["value_extractor"]
-            input_right = where_clause["input_right"]["value_extractor"]
-            if type(input_left) is dict or type(input_right) is dict:
-                raise Exception(
-                    "currently search assumes comparator attributes are explicitly stored property of the memory: {}".format(
-                        where_clause
-                    )
-                )
-            ctype = where_clause.get("comparison_type", "EQUAL")
-            comparison_symbol = get_inequality_symbol(ctype)
-            # FIXME do close tolerance for modulus
-            if type(ctype) is dict and ctype.get("close_tolerance"):
-                comparison_symbol = "<>"
-                v = try_float(input_right, where_clause)
-                value = (v - ctype["close_tolerance"], v + ctype["close_tolerance"])
-            elif comparison_symbol[0] == "<" or comparison_symbol[0] == ">":
-                # going to convert back to str later, doing this for data sanitation/debugging
-                value = (try_float(input_right, where_clause),)
-            elif type(ctype) is dict and ctype.get("modulus"):
-                comparison_symbol = "%"
-                value = (ctype["modulus"], input_right)
-            else:
-                value = (input_right,)
+            input_left, comparison_symbol, value = parse_comparator(where_clause)
             return search_by_property(agent_memory, input_left, value, comparison_symbol, memtype)
 
         # if we made it here, this is a triple leaf, actually search...
@@ -363,7 +407,7 @@ class MemorySearcher:
                             attribute_name
                         )
                     )
-                vals = [get_property_value(agent_memory, m, attribute_name) for m in memids]
+                vals = get_property_values(agent_memory, memids, attribute_name)
                 idxs = argval_subsample_idx(
                     vals, ordinal, polarity=return_q["argval"].get("polarity", "MAX")
                 )
@@ -396,8 +440,9 @@ class MemorySearcher:
                             attribute_name_list
                         )
                     )
-                for m in memids:
-                    values_dict[m].append(get_property_value(agent_memory, m, aname))
+                vals = get_property_values(agent_memory, memids, aname).tolist()
+                for m, v in zip(memids, vals):
+                    values_dict[m].append(v)
             if len(attribute_name_list) == 1:
                 for m in values_dict:
                     values_dict[m] = values_dict[m][0]
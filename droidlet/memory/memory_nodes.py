@@ -787,22 +787,43 @@ class TaskNode(MemoryNode):
 
     def __init__(self, agent_memory, memid: str):
         super().__init__(agent_memory, memid)
-        (
-            pickled,
-            prio,
-            running,
-            run_count,
-            created,
-            finished,
-            action_name,
-        ) = self.agent_memory._db_read_one(
-            "SELECT pickled, prio, running, run_count, created, finished, action_name FROM Tasks WHERE uuid=?",
-            memid,
-        )
+        live_tasks = agent_memory.live_tasks
+        if live_tasks is not None and memid in live_tasks:
+            # the live Task object is up to date, don't read or unpickle the blob
+            pickled = None
+            (
+                prio,
+                running,
+                run_count,
+                created,
+                finished,
+                action_name,
+            ) = self.agent_memory._db_read_one(
+                "SELECT prio, running, run_count, created, finished, action_name FROM Tasks WHERE uuid=?",
+                memid,
+            )
+        else:
+            (
+                pickled,
+                prio,
+                running,
+                run_count,
+                created,
+                finished,
+                action_name,
+            ) = self.agent_memory._db_read_one(
+                "SELECT pickled, prio, running, run_count, created, finished, action_name FROM Tasks WHERE uuid=?",
+                memid,
+            )
         self.prio = prio
         self.run_count = run_count
         self.running = running
-        self.task = self.agent_memory.safe_unpickle(pickled)
+        if pickled is None:
+            self.task = live_tasks[memid]
+        else:
+            self.task = self.agent_memory.safe_unpickle(pickled)
+            if live_tasks is not None and finished < 0:
+                live_tasks[memid] = self.task
         self.created = created
         self.finished = finished
         # TODO changeme to just "name"
@@ -836,6 +857,8 @@ class TaskNode(MemoryNode):
             task.run_count,
             memory.get_time(),
         )
+        if memory.live_tasks is not None:
+            memory.live_tasks[memid] = task
         return memid
 
     def step(self, agent):
@@ -844,6 +867,17 @@ class TaskNode(MemoryNode):
 
     def update_task(self, task=None):
         task = task or self.task
+        live_tasks = self.memory.live_tasks
+        if live_tasks is not None and self.memid in live_tasks:
+            # only the scalar columns are written, the task is pickled
+            # by AgentMemory.checkpoint_tasks() or when it finishes
+            live_tasks[self.memid] = task
+            if task.run_count != self.run_count:
+                self.memory.db_write(
+                    "UPDATE Tasks SET run_count=? WHERE uuid=?", task.run_count, self.memid
+                )
+                self.run_count = task.run_count
+            return
         self.memory.db_write(
             "UPDATE Tasks SET run_count=?, pickled=? WHERE uuid=?",
             task.run_count,
@@ -902,6 +936,8 @@ class TaskNode(MemoryNode):
             if status.get(k) or force_db_update:
                 cmd = "UPDATE Tasks SET " + k + "=? WHERE uuid=?"
                 self.agent_memory.db_write(cmd, status_out[k], self.memid)
+        if self.task.finished and self.agent_memory.live_tasks is not None:
+            self.agent_memory.archive_task(self.memid)
         return status_out
 
     # FIXME! or torch me
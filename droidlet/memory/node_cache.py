@@ -0,0 +1,81 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+from collections import OrderedDict
+
+
+class MemoryNodeCache:
+    """An identity map from memid to MemoryNode objects, with bounded size
+    and least-recently-used eviction.  The AgentMemory is responsible for
+    invalidating entries when the underlying rows change; it does so using the
+    Updates table filled by the db TRIGGERs.
+
+    Args:
+        max_size (int): maximum number of nodes kept.  if 0, nothing is cached
+
+    Attributes:
+        hits (int): number of lookups that found a node
+        misses (int): number of lookups that did not find a node
+        evictions (int): number of nodes dropped to respect max_size
+        invalidations (int): number of nodes dropped because their memory changed
+
+    Examples::
+        >>> cache = MemoryNodeCache(max_size=2)
+        >>> cache.put(memid, node)
+        >>> cache.get(memid)
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._nodes = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, memid):
+        """Return the cached node for memid and mark it as recently used,
+        or None if there is no such node"""
+        node = self._nodes.get(memid)
+        if node is None:
+            self.misses += 1
+            return None
+        self._nodes.move_to_end(memid)
+        self.hits += 1
+        return node
+
+    def put(self, memid, node):
+        """Add a node to the cache, evicting the least recently used nodes if full"""
+        if self.max_size <= 0:
+            return
+        self._nodes[memid] = node
+        self._nodes.move_to_end(memid)
+        while len(self._nodes) > self.max_size:
+            self._nodes.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, memids):
+        """Drop the nodes for each memid in memids, if cached"""
+        for memid in memids:
+            if self._nodes.pop(memid, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        self._nodes.clear()
+
+    def get_stats(self):
+        """Return a dict with the cache counters and current size"""
+        return {
+            "size": len(self._nodes),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def __contains__(self, memid):
+        return memid in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
@@ -26,6 +26,8 @@ class LocoAgentMemory(AgentMemory):
         schema_paths=SCHEMAS,
         coordinate_transforms=None,
     ):
+        # created first, as the db writes of AgentMemory.__init__ call _invalidate
+        self.detected_objects = DetectedObjectCache(self)
         super(LocoAgentMemory, self).__init__(
             db_file=db_file,
             schema_paths=schema_paths,
@@ -36,6 +38,14 @@ class LocoAgentMemory(AgentMemory):
         self.banned_default_behaviors = []  # FIXME: move into triple store?
         self._safe_pickle_saved_attrs = {}
         self.dances = {}
+        self.spatial_index.add_table(
+            "DetectedObjectFeatures", ("minx", "maxx", "miny", "maxy", "minz", "maxz")
+        )
+
+    def _invalidate(self, updated, deleted):
+        super()._invalidate(updated, deleted)
+        self.detected_objects.mark_changed(updated)
+        self.detected_objects.mark_changed(deleted)
 
     def update(self, agent):
         pass
@@ -4,6 +4,28 @@ Copyright (c) Facebook, Inc. and its affiliates.
 from droidlet.base_util import XYZ, Pos
 from droidlet.memory.memory_nodes import ReferenceObjectNode, MemoryNode, NODELIST
 import pickle
+import numpy as np
+
+
+def feature_to_blob(feature):
+    """Return the raw float32 bytes and the dimension of a feature vector
+    (e.g. a torch tensor or a numpy array), or (None, None) if feature is None"""
+    if feature is None:
+        return None, None
+    if hasattr(feature, "detach"):
+        feature = feature.detach().cpu()
+    feature = np.asarray(feature, dtype=np.float32).reshape(-1)
+    return feature.tobytes(), len(feature)
+
+
+def blob_to_feature(blob, dim):
+    """Return the read-only float32 array stored by feature_to_blob.
+    Features stored before the featureDim column (dim is None) were pickled."""
+    if blob is None:
+        return None
+    if dim is None:
+        return pickle.loads(blob)
+    return np.frombuffer(blob, dtype=np.float32, count=dim)
 
 
 class DetectedObjectNode(ReferenceObjectNode):
@@ -46,11 +68,13 @@ class DetectedObjectNode(ReferenceObjectNode):
             detected_obj.get_xyz()["z"],
             cls.NODE_TYPE,
         )
+        feature_blob, feature_dim = feature_to_blob(detected_obj.feature_repr)
         memory.db_write(
-            "INSERT INTO DetectedObjectFeatures(uuid, featureBlob, minx, miny, minz, maxx, maxy, maxz) \
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            "INSERT INTO DetectedObjectFeatures(uuid, featureBlob, featureDim, \
+            minx, miny, minz, maxx, maxy, maxz) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
             memid,
-            pickle.dumps(detected_obj.feature_repr),
+            feature_blob,
+            feature_dim,
             bounds[0],
             bounds[1],
             bounds[2],
@@ -90,9 +114,11 @@ class DetectedObjectNode(ReferenceObjectNode):
             detected_obj.get_xyz()["z"],
             memid,
         )
+        feature_blob, feature_dim = feature_to_blob(detected_obj.feature_repr)
         memory.db_write(
-            "UPDATE DetectedObjectFeatures SET featureBlob=? where uuid=?",
-            pickle.dumps(detected_obj.feature_repr),
+            "UPDATE DetectedObjectFeatures SET featureBlob=?, featureDim=? where uuid=?",
+            feature_blob,
+            feature_dim,
             memid,
         )
         return memid
@@ -105,16 +131,39 @@ class DetectedObjectNode(ReferenceObjectNode):
 
     @classmethod
     def get_all(cls, memory) -> list:
-        objs = []
-        detected_objs = memory._db_read(
-            "SELECT uuid, eid, x, y, z FROM ReferenceObjects WHERE ref_type=?", cls.NODE_TYPE
-        )
-        for node in detected_objs:
-            objs.append(cls.from_node(memory, node))
-        return objs
+        """Return a dict (see from_node) for each detected object.  With a LocoAgentMemory,
+        the dicts come from its DetectedObjectCache, where only the objects changed since
+        the last call are read again; their feature_repr arrays are read-only."""
+        cache = getattr(memory, "detected_objects", None)
+        if cache is not None and memory._transaction_depth == 0:
+            return cache.get_all()
+        return [cls.from_node(memory, node) for node in cls.read_nodes(memory)]
+
+    @classmethod
+    def read_nodes(cls, memory, memids=None) -> list:
+        """Return the (uuid, eid, x, y, z, featureBlob, featureDim, minx, miny, minz, maxx,
+        maxy, maxz) rows of the detected objects, or of the ones in memids"""
+        query = "SELECT r.uuid, r.eid, r.x, r.y, r.z, f.featureBlob, f.featureDim, \
+            f.minx, f.miny, f.minz, f.maxx, f.maxy, f.maxz \
+            FROM ReferenceObjects AS r JOIN DetectedObjectFeatures AS f ON r.uuid=f.uuid \
+            WHERE r.ref_type=?"
+        if memids is None:
+            return memory._db_read(query, cls.NODE_TYPE)
+        memids = list(memids)
+        rows = []
+        # sqlite limits the number of variables of a query
+        for i in range(0, len(memids), 500):
+            chunk = memids[i : i + 500]
+            rows += memory._db_read(
+                query + " AND r.uuid IN ({})".format(", ".join(["?"] * len(chunk))),
+                cls.NODE_TYPE,
+                *chunk,
+            )
+        return rows
 
     @classmethod
-    def from_node(cls, memory, node) -> list:
+    def from_node(cls, memory, node) -> dict:
+        """node is a row of read_nodes, or a (uuid, eid, x, y, z) row of ReferenceObjects"""
         def get_value(memid, pred_text):
             triple = memory.get_triples(
                 subj=memid, pred_text=pred_text, return_obj_text="if_exists"
@@ -129,11 +178,14 @@ class DetectedObjectNode(ReferenceObjectNode):
         properties = get_value(node[0], "has_properties")
 
         # Get DetectedObjectFeatures
-        feature_blob, minx, miny, minz, maxx, maxy, maxz = memory._db_read(
-            "SELECT featureBlob, minx, miny, minz, maxx, maxy, maxz \
-                FROM DetectedObjectFeatures WHERE uuid=?", node[0]
-        )[0]
-        feature_repr = pickle.loads(feature_blob)
+        if len(node) > 5:
+            feature_blob, feature_dim, minx, miny, minz, maxx, maxy, maxz = node[5:]
+        else:
+            feature_blob, feature_dim, minx, miny, minz, maxx, maxy, maxz = memory._db_read(
+                "SELECT featureBlob, featureDim, minx, miny, minz, maxx, maxy, maxz \
+                    FROM DetectedObjectFeatures WHERE uuid=?", node[0]
+            )[0]
+        feature_repr = blob_to_feature(feature_blob, feature_dim)
 
         return {
             "eid": node[1],
@@ -166,6 +218,117 @@ class DetectedObjectNode(ReferenceObjectNode):
         return Pos(x, y, z)
 
 
+class DetectedObjectCache:
+    """The dicts of DetectedObjectNode.get_all, and the matrix of the features, positions and
+    bounds of all the detected objects, kept up to date from the Updates table: the
+    DetectedObjInsert, DetectedObjUpdate and RefObjUpdate TRIGGERs mark the changed objects,
+    which are read again on the next get_all or get_matrix, so that the cost of a call is in
+    the number of changes rather than in the number of objects.  The tags (label, color,
+    properties) of an object are read when it is created or updated, and when its triples
+    are changed with add_triple or untag.  The ObjectDeduplicator of the perception reads the
+    previous objects with get_matrix.
+
+    Args:
+        memory (AgentMemory): the memory of the detected objects; it calls mark_changed
+            from its _invalidate
+
+    Examples::
+        >>> cache = DetectedObjectCache(memory)
+        >>> objects = cache.get_all()
+        >>> memids, eids, features, xyz, bounds = cache.get_matrix()
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.clear()
+
+    def clear(self):
+        """forget everything, the next call reads all the detected objects"""
+        # memid -> dict of DetectedObjectNode.from_node, in insertion order
+        self.objects = {}
+        # memids to read again, None for all
+        self.changed = None
+        # row -> memid, memid -> row, of the objects with a feature
+        self._memids = []
+        self._rows = {}
+        self._eids = np.zeros(16, dtype=np.int64)
+        self._features = None
+        self._xyz = np.zeros((16, 3))
+        self._bounds = np.zeros((16, 6))
+
+    def mark_changed(self, memids):
+        if self.changed is not None:
+            self.changed.update(memids)
+
+    def get_all(self):
+        """Return a (shallow) copy of the dict of each detected object"""
+        self._refresh()
+        return [dict(obj) for obj in self.objects.values()]
+
+    def get_matrix(self):
+        """Return the memids and (views of) the eids, features, xyz and bounds of the detected
+        objects with a feature, as arrays with one row per object"""
+        self._refresh()
+        n = len(self._memids)
+        features = self._features if self._features is not None else np.zeros((0, 0), np.float32)
+        return list(self._memids), self._eids[:n], features[:n], self._xyz[:n], self._bounds[:n]
+
+    def _refresh(self):
+        if self.changed is None:
+            nodes = DetectedObjectNode.read_nodes(self.memory)
+            self.clear()
+        elif self.changed:
+            nodes = DetectedObjectNode.read_nodes(self.memory, self.changed)
+            # deleted objects are not read again
+            for memid in self.changed - {node[0] for node in nodes}:
+                self.objects.pop(memid, None)
+                self._remove_row(memid)
+        else:
+            return
+        self.changed = set()
+        for node in nodes:
+            obj = DetectedObjectNode.from_node(self.memory, node)
+            self.objects[node[0]] = obj
+            self._set_row(node[0], obj)
+
+    def _set_row(self, memid, obj):
+        feature = obj["feature_repr"]
+        if feature is not None:
+            feature = np.asarray(feature, dtype=np.float32).reshape(-1)
+            if self._features is None:
+                self._features = np.zeros((len(self._eids), len(feature)), dtype=np.float32)
+        if feature is None or len(feature) != self._features.shape[1]:
+            self._remove_row(memid)
+            return
+        row = self._rows.get(memid)
+        if row is None:
+            row = len(self._memids)
+            if row == len(self._eids):
+                self._eids = np.concatenate([self._eids, np.zeros_like(self._eids)])
+                self._features = np.concatenate([self._features, np.zeros_like(self._features)])
+                self._xyz = np.concatenate([self._xyz, np.zeros_like(self._xyz)])
+                self._bounds = np.concatenate([self._bounds, np.zeros_like(self._bounds)])
+            self._memids.append(memid)
+            self._rows[memid] = row
+        self._eids[row] = obj["eid"]
+        self._features[row] = feature
+        self._xyz[row] = obj["xyz"]
+        self._bounds[row] = [np.nan if b is None else b for b in obj["bounds"]]
+
+    def _remove_row(self, memid):
+        row = self._rows.pop(memid, None)
+        if row is None:
+            return
+        last = len(self._memids) - 1
+        if row != last:
+            # move the last row into the removed one
+            self._memids[row] = self._memids[last]
+            self._rows[self._memids[row]] = row
+            for a in (self._eids, self._features, self._xyz, self._bounds):
+                a[row] = a[last]
+        self._memids.pop()
+
+
 class HumanPoseNode(ReferenceObjectNode):
     """Encapsulates all methods for dealing with human poses - creating / updating /
     retrieving them etc.
@@ -6,6 +6,7 @@ PRAGMA foreign_keys = ON;
 CREATE TABLE DetectedObjectFeatures(
     uuid            NCHAR(36)   NOT NULL,
     featureBlob     BLOB,
+    featureDim      INTEGER,
     minx        FLOAT,
     miny        FLOAT,
     minz        FLOAT,
@@ -19,6 +20,11 @@ CREATE TRIGGER DetectedObjUpdate AFTER UPDATE ON DetectedObjectFeatures
     BEGIN INSERT INTO Updates(uuid, update_type) VALUES (OLD.uuid, 'update');
 END;
 
+-- so that the cache of the detected objects (DetectedObjectCache) sees the new ones
+CREATE TRIGGER DetectedObjInsert AFTER INSERT ON DetectedObjectFeatures
+    BEGIN INSERT INTO Updates(uuid, update_type) VALUES (NEW.uuid, 'update');
+END;
+
 CREATE TABLE HumanPoseFeatures(
     uuid            NCHAR(36)   NOT NULL,
     keypointsBlob     BLOB,
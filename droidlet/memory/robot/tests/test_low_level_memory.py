@@ -2,8 +2,13 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 import unittest
+import logging
+import pickle
+from timeit import Timer
+import numpy as np
 from droidlet.memory.robot.loco_memory import LocoAgentMemory
 from droidlet.memory.robot.loco_memory_nodes import DetectedObjectNode
+from droidlet.memory.memory_nodes import PlayerNode
 from droidlet.base_util import Pos, Look, Player
 
 
@@ -54,6 +59,22 @@ class BasicTest(unittest.TestCase):
             assert len(self.memory.get_detected_objects_tagged(t)) == 1
             assert self.memory.get_detected_objects_tagged(t).pop() == detected_object_mem_id
 
+    def test_spatial_index(self):
+        self.memory = LocoAgentMemory()
+        near = DetectedObjectNode.create(
+            self.memory, DO(1, "chair", None, "red", [1, 0, 1], [0, 0, 0, 2, 1, 2])
+        )
+        far = DetectedObjectNode.create(
+            self.memory, DO(2, "table", None, "red", [10, 0, 10], [9, 0, 9, 11, 1, 11])
+        )
+        player = PlayerNode.create(self.memory, Player(10, "abc", Pos(5, 0, 5), Look(0, 0)))
+        # the box of a detected object is searched, not only its center
+        assert set(self.memory.objects_within((1.5, 3, 0, 1, 1.5, 3))) == {near}
+        assert set(self.memory.objects_within((4, 12, -1, 1, 4, 12))) == {far, player}
+        assert self.memory.k_nearest((8.5, 0, 8.5), 2) == [far, player]
+        assert self.memory.k_nearest((0, 0, 0), 10, ref_type="DetectedObject")[0] == near
+        assert len(self.memory.k_nearest((0, 0, 0), 10, ref_type="DetectedObject")) == 2
+
     def test_dance_api(self):
         self.memory = LocoAgentMemory()
 
@@ -64,6 +85,112 @@ class BasicTest(unittest.TestCase):
         assert len(self.memory.get_triples(obj_text="dance_with_numbers")) == 1
 
 
+class DetectedObjectCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.memory = LocoAgentMemory()
+        self.rng = np.random.RandomState(0)
+
+    def add(self, eid, update=False):
+        lo = self.rng.rand(3)
+        bounds = list(lo) + list(lo + 1)
+        d = DO(eid, "chair", ["wooden"], "red", list(self.rng.rand(3)), bounds)
+        d.feature_repr = self.rng.rand(512).astype(np.float32)
+        if update:
+            DetectedObjectNode.update(self.memory, d)
+        else:
+            DetectedObjectNode.create(self.memory, d)
+        return d
+
+    def memid(self, eid):
+        return self.memory._db_read_one("SELECT uuid FROM ReferenceObjects WHERE eid=?", eid)[0]
+
+    def uncached(self):
+        nodes = DetectedObjectNode.read_nodes(self.memory)
+        return {n[1]: DetectedObjectNode.from_node(self.memory, n) for n in nodes}
+
+    def assert_same(self, objects, expected):
+        assert len(objects) == len(expected)
+        for obj in objects:
+            e = expected[obj["eid"]]
+            for k in ["xyz", "label", "color", "properties", "bounds"]:
+                assert obj[k] == e[k], k
+            assert (obj["feature_repr"] == e["feature_repr"]).all()
+
+    def test_cache(self):
+        objs = [self.add(eid) for eid in range(1, 21)]
+        objects = DetectedObjectNode.get_all(self.memory)
+        self.assert_same(objects, self.uncached())
+        # float32 blobs
+        blob, dim = self.memory._db_read_one(
+            "SELECT featureBlob, featureDim FROM DetectedObjectFeatures LIMIT 1"
+        )
+        assert dim == 512 and len(blob) == 4 * 512
+        assert (objects[0]["feature_repr"] == objs[0].feature_repr).all()
+
+        # only the changes are read again
+        self.add(3, update=True)
+        self.add(21)
+        assert self.memory.detected_objects.changed == {self.memid(3), self.memid(21)}
+        self.assert_same(DetectedObjectNode.get_all(self.memory), self.uncached())
+        memids, eids, features, xyz, bounds = self.memory.detected_objects.get_matrix()
+        assert sorted(eids.tolist()) == list(range(1, 22))
+        for memid, eid, feature in zip(memids, eids, features):
+            assert (feature == self.uncached()[eid]["feature_repr"]).all()
+
+        # deleted objects are dropped
+        self.memory.forget(self.memid(5))
+        objects = DetectedObjectNode.get_all(self.memory)
+        assert 5 not in [o["eid"] for o in objects]
+        self.assert_same(objects, self.uncached())
+        assert len(self.memory.detected_objects.get_matrix()[0]) == 20
+
+    def test_tags(self):
+        """the triples added or removed after the object was created are read again"""
+        d = DO(1, None, None, None, [0, 0, 0], [0, 0, 0, 1, 1, 1])
+        d.feature_repr = self.rng.rand(512).astype(np.float32)
+        DetectedObjectNode.create(self.memory, d)
+        assert DetectedObjectNode.get_all(self.memory)[0]["label"] is None
+        memid = self.memid(1)
+        self.memory.add_triple(subj=memid, pred_text="has_name", obj_text="chair")
+        self.memory.add_triple(subj=memid, pred_text="has_colour", obj_text="blue")
+        objects = DetectedObjectNode.get_all(self.memory)
+        assert (objects[0]["label"], objects[0]["color"]) == ("chair", "blue")
+        self.assert_same(objects, self.uncached())
+        self.memory.tag(memid, "shiny")
+        DetectedObjectNode.get_all(self.memory)
+        self.memory.untag(memid, "shiny")
+        assert memid in self.memory.detected_objects.changed
+
+    def test_pickled_features(self):
+        d = self.add(1)
+        # features saved before the featureDim column
+        self.memory.db_write(
+            "UPDATE DetectedObjectFeatures SET featureBlob=?, featureDim=NULL",
+            pickle.dumps(d.feature_repr),
+        )
+        assert (DetectedObjectNode.get_all(self.memory)[0]["feature_repr"] == d.feature_repr).all()
+
+    def test_time(self):
+        for n in [100, 1000]:
+            self.memory = LocoAgentMemory()
+            for eid in range(1, n + 1):
+                self.add(eid)
+            DetectedObjectNode.get_all(self.memory)
+
+            def tick():
+                # a perception tick updates a few objects and reads them all
+                for eid in range(1, 4):
+                    self.add(eid, update=True)
+                DetectedObjectNode.get_all(self.memory)
+
+            cached = Timer(tick).timeit(number=5) / 5
+            uncached = Timer(self.uncached).timeit(number=1)
+            logging.info(
+                "get_all of {} detected objects: {:.4f}s per tick, {:.4f}s uncached".format(
+                    n, cached, uncached
+                )
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
-
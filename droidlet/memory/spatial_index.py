@@ -0,0 +1,164 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import logging
+
+# columns of a table storing points
+POINT_COLUMNS = ("x", "x", "y", "y", "z", "z")
+# half side of the first box searched by nearest(); doubled until enough objects are found
+NEAREST_START_RADIUS = 8.0
+
+
+def rtree_available(db):
+    try:
+        (r,) = db.execute("SELECT sqlite_compileoption_used('ENABLE_RTREE')").fetchone()
+        return bool(r)
+    except Exception:
+        return False
+
+
+class SpatialIndex:
+    """
+    Range and nearest neighbour searches on tables with a location or a box, e.g.
+    ReferenceObjects (x, y, z), VoxelObjects (x, y, z) or DetectedObjectFeatures
+    (minx, ..., maxz).  For each indexed table T an SQLite R*Tree TRTree is created,
+    and kept in sync with T by TRIGGERs keyed on T's rowid; so any write to T
+    (including ON DELETE CASCADEs) updates the index.
+    If the SQLite library was not built with R*Tree support, the searches
+    fall back to the B-tree indices on T.
+
+    Boxes are (xmin, xmax, ymin, ymax, zmin, zmax), as returned by ReferenceObjectNode.get_bounds
+
+    Args:
+        agent_memory: the AgentMemory owning the tables
+
+    Examples::
+        >>> index = SpatialIndex(agent_memory)
+        >>> index.add_table("ReferenceObjects", POINT_COLUMNS)
+        >>> index.within("ReferenceObjects", (0, 10, 0, 10, 0, 10))
+        >>> index.nearest("ReferenceObjects", (0, 0, 0), 3)
+    """
+
+    def __init__(self, agent_memory):
+        self.memory = agent_memory
+        self.use_rtree = rtree_available(agent_memory.db)
+        if not self.use_rtree:
+            logging.info("sqlite has no R*Tree support, spatial searches use B-tree indices")
+        # table name -> (xmin, xmax, ymin, ymax, zmin, zmax) column names
+        self.tables = {}
+
+    def add_table(self, table, columns=POINT_COLUMNS):
+        """index the box with the given (xmin, xmax, ymin, ymax, zmin, zmax) columns of table.
+        for a table of points, each min and max column is the same"""
+        self.tables[table] = columns
+        if not self.use_rtree:
+            return
+        rt = table + "RTree"
+        new = ", ".join("NEW." + c for c in columns)
+        not_null = " AND ".join("{}" + c + " IS NOT NULL" for c in sorted(set(columns)))
+        n = len(set(columns))
+        self.memory._db_script(
+            """
+            CREATE VIRTUAL TABLE {rt} USING rtree(id, xmin, xmax, ymin, ymax, zmin, zmax);
+            INSERT INTO {rt} SELECT rowid, {cols} FROM {t} WHERE {old_not_null};
+            CREATE TRIGGER {rt}Insert AFTER INSERT ON {t} WHEN {not_null}
+                BEGIN INSERT INTO {rt} VALUES (NEW.rowid, {new});
+            END;
+            CREATE TRIGGER {rt}Update AFTER UPDATE OF {ucols} ON {t}
+                BEGIN DELETE FROM {rt} WHERE id=OLD.rowid;
+                INSERT INTO {rt} SELECT NEW.rowid, {new} WHERE {not_null};
+            END;
+            CREATE TRIGGER {rt}Delete AFTER DELETE ON {t}
+                BEGIN DELETE FROM {rt} WHERE id=OLD.rowid;
+            END;
+            """.format(
+                rt=rt,
+                t=table,
+                cols=", ".join(columns),
+                new=new,
+                not_null=not_null.format(*["NEW."] * n),
+                old_not_null=not_null.format(*[""] * n),
+                ucols=", ".join(sorted(set(columns))),
+            )
+        )
+
+    def _overlap_clause(self, table, alias="T"):
+        xmin, xmax, ymin, ymax, zmin, zmax = ["{}.{}".format(alias, c) for c in self.tables[table]]
+        return "{}>=? AND {}<=? AND {}>=? AND {}<=? AND {}>=? AND {}<=?".format(
+            xmax, xmin, ymax, ymin, zmax, zmin
+        )
+
+    def _select(self, table, select, bbox, where=None, args=(), select_args=(), tail=""):
+        # the R*Tree stores 32 bit floats rounded outwards, so the box is
+        # checked again against the table
+        conditions = [self._overlap_clause(table)]
+        all_args = list(select_args)
+        if self.use_rtree:
+            sql = "SELECT {} FROM {}RTree AS R INNER JOIN {} AS T ON T.rowid=R.id WHERE ".format(
+                select, table, table
+            )
+            conditions.insert(
+                0,
+                "R.xmax>=? AND R.xmin<=? AND R.ymax>=? AND R.ymin<=? AND R.zmax>=? AND R.zmin<=?",
+            )
+            all_args.extend(bbox)
+        else:
+            sql = "SELECT {} FROM {} AS T WHERE ".format(select, table)
+        all_args.extend(bbox)
+        if where:
+            conditions.append(where)
+            all_args.extend(args)
+        return self.memory._db_read(sql + " AND ".join(conditions) + tail, *all_args)
+
+    def within(self, table, bbox, where=None, args=()):
+        """
+        returns the uuids of the rows of table whose box intersects bbox.
+        where is an optional SQL condition on the table (aliased T), with arguments args,
+        e.g. where="T.ref_type=?", args=("BlockObjects",)
+        """
+        return [r[0] for r in self._select(table, "DISTINCT T.uuid", bbox, where, args)]
+
+    def nearest(self, table, pos, k, where=None, args=()):
+        """
+        returns a list of the uuids of the k rows of table closest to pos, nearest first,
+        and a list of the corresponding distances.  the distance of a row is the euclidean
+        distance from pos to its box, and the distance of a uuid is the distance of its closest row.
+        where and args are as in within()
+        """
+        if k <= 0:
+            return [], []
+        x, y, z = pos
+        xmin, xmax, ymin, ymax, zmin, zmax = ["T." + c for c in self.tables[table]]
+        # squared distance from pos to the box of the row
+        d2 = " + ".join(
+            "MAX({m} - ?, 0, ? - {M}) * MAX({m} - ?, 0, ? - {M})".format(m=m, M=M)
+            for m, M in [(xmin, xmax), (ymin, ymax), (zmin, zmax)]
+        )
+        select = "T.uuid, MIN({}) AS d2".format(d2)
+        select_args = (x, x, x, x, y, y, y, y, z, z, z, z)
+        tail = " GROUP BY T.uuid ORDER BY d2 LIMIT {}".format(int(k))
+        r = NEAREST_START_RADIUS
+        while True:
+            bbox = (x - r, x + r, y - r, y + r, z - r, z + r)
+            close = self._select(table, select, bbox, where, args, select_args, tail)
+            if len(close) == k:
+                # anything at distance <= r is inside the box, so if the kth
+                # distance is <= r these are the k nearest.  otherwise search
+                # again in the box of half side the kth distance
+                kth = close[-1][1] ** 0.5
+                if kth <= r:
+                    return [uuid for uuid, d2 in close], [d2 ** 0.5 for uuid, d2 in close]
+                r = kth
+                continue
+            # are there any rows outside the box?
+            outside = "SELECT 1 FROM {} AS T WHERE {} IS NOT NULL AND NOT ({})".format(
+                table, xmin, self._overlap_clause(table)
+            )
+            outside_args = list(bbox)
+            if where:
+                outside += " AND " + where
+                outside_args.extend(args)
+            if not self.memory._db_read_one(outside + " LIMIT 1", *outside_args):
+                # there are less than k rows in total
+                return [uuid for uuid, d2 in close], [d2 ** 0.5 for uuid, d2 in close]
+            r = 2 * r
@@ -11,11 +11,15 @@ import pickle
 import sqlite3
 import uuid
 import datetime
+from contextlib import contextmanager
 from itertools import zip_longest
 from typing import cast, Optional, List, Tuple, Sequence, Union
 from droidlet.base_util import XYZ
 from droidlet.shared_data_structs import Time
 from droidlet.memory.memory_filters import MemorySearcher
+from droidlet.memory.node_cache import MemoryNodeCache
+from droidlet.memory.where_planner import WherePlanner
+from droidlet.memory.spatial_index import SpatialIndex
 from .dialogue_stack import DialogueStack
 from droidlet.event import dispatch
 from droidlet.memory.memory_util import parse_sql, format_query
@@ -50,6 +54,9 @@ NONPICKLE_ATTRS = [
 
 SCHEMAS = [os.path.join(os.path.dirname(__file__), "base_memory_schema.sql")]
 
+# max number of MemoryNodes kept in the get_mem_by_id identity map
+NODE_CACHE_SIZE = 1024
+
 # TODO when a memory is removed, its last state should be snapshotted to prevent tag weirdness
 
 
@@ -65,6 +72,7 @@ class AgentMemory:
         agent_time (Time object): object with a .get_time(), get_world_hour, and add_tick()
                                    methods
         on_delete_callback (callable): callable to be run when a memory is deleted from Memories table
+        node_cache_size (int): max number of MemoryNodes kept by get_mem_by_id, 0 to disable
 
     Attributes:
         _db_log_file (FileHandler): File handler for writing database logs
@@ -75,7 +83,11 @@ class AgentMemory:
         nodes (dict): Mapping of node name to table name
         self_memid (str): MemoryID for the AgentMemory
         searcher (MemorySearcher): A class to process searches through memory
+        where_planner (WherePlanner): compiles and memoizes the SQL for search where clauses
+        spatial_index (SpatialIndex): R*Tree index on the locations of ReferenceObjects (and voxels etc.)
         time (int): The time of the agent
+        node_cache (MemoryNodeCache): identity map of MemoryNodes returned by get_mem_by_id
+        live_tasks (dict): memid -> Task for unfinished tasks, if tasks are kept live
     """
 
     def __init__(
@@ -87,6 +99,7 @@ class AgentMemory:
         nodelist=NODELIST,
         agent_time=None,
         on_delete_callback=None,
+        node_cache_size=NODE_CACHE_SIZE,
     ):
         if db_log_path:
             self._db_log_file = gzip.open(db_log_path + ".gz", "w")
@@ -97,6 +110,12 @@ class AgentMemory:
         self.dialogue_stack = DialogueStack()
         self.task_db = {}
         self._safe_pickle_saved_attrs = {}
+        # nesting depth of transaction() blocks, and the writes deferred in them
+        self._transaction_depth = 0
+        self._transaction_writes = []
+        self.node_cache = MemoryNodeCache(max_size=node_cache_size)
+        # memid -> Task for tasks kept live in python, None unless set_live_tasks() was called
+        self.live_tasks = None
 
         self.on_delete_callback = on_delete_callback
 
@@ -112,6 +131,11 @@ class AgentMemory:
         self.all_tables = [
             c[0] for c in self._db_read("SELECT name FROM sqlite_master WHERE type='table';")
         ]
+        # table name -> list of column names, filled by get_table_columns
+        self._table_columns = {}
+        self.spatial_index = SpatialIndex(self)
+        if "ReferenceObjects" in self.all_tables:
+            self.spatial_index.add_table("ReferenceObjects")
         self.nodes = {}
         for node in nodelist:
             self.nodes[node.NODE_TYPE] = node
@@ -138,6 +162,7 @@ class AgentMemory:
         self.tag(self.self_memid, "SELF")
 
         self.searcher = MemorySearcher()
+        self.where_planner = WherePlanner(self)
 
     def __del__(self):
         """Close the database file"""
@@ -277,7 +302,8 @@ class AgentMemory:
 
     def get_mem_by_id(self, memid: str, node_type: str = None) -> "MemoryNode":
         """Given the memid and an optional node_type,
-        return the memory node
+        return the memory node.  Nodes are kept in self.node_cache until
+        their memory is updated or deleted, so repeated calls return the same object
 
         Args:
             memid (string): Memory ID
@@ -291,13 +317,90 @@ class AgentMemory:
             >>> node_type = 'Chat'
             >>> get_mem_by_id(memid, node_type)
         """
+        # the cache is invalidated when the Updates table is processed,
+        # which is deferred inside a transaction, so bypass it there
+        use_cache = self._transaction_depth == 0
+        if use_cache:
+            node = self.node_cache.get(memid)
+            if node is not None and (node_type is None or node.NODE_TYPE == node_type):
+                return node
+
         if node_type is None:
             node_type = self.get_node_from_memid(memid)
 
         if node_type is None:
             return MemoryNode(self, memid)
 
-        return self.nodes.get(node_type, MemoryNode)(self, memid)
+        node = self.nodes.get(node_type, MemoryNode)(self, memid)
+        if use_cache:
+            self.node_cache.put(memid, node)
+        return node
+
+    def get_table_columns(self, table: str) -> List[str]:
+        """Return the column names of a table.  The schema does not change
+        after the memory is created, so the columns are read once and cached
+
+        Args:
+            table (string): Name of table
+
+        Examples::
+            >>> get_table_columns("ReferenceObjects")
+        """
+        cols = self._table_columns.get(table)
+        if cols is None:
+            cols = [c[1] for c in self._db_read("PRAGMA table_info({})".format(table))]
+            self._table_columns[table] = cols
+        return cols
+
+    ########################
+    ###  Spatial search  ###
+    ########################
+
+    def _spatial_filter(self, table, ref_type):
+        if ref_type is None:
+            return None, ()
+        if "ref_type" in self.get_table_columns(table):
+            return "T.ref_type=?", (ref_type,)
+        return "T.uuid IN (SELECT uuid FROM ReferenceObjects WHERE ref_type=?)", (ref_type,)
+
+    def objects_within(self, bbox, ref_type=None) -> List[str]:
+        """Find the memids of the objects with a location (or a voxel, or a bounding box
+        in any of the tables in self.spatial_index) inside a box
+
+        Args:
+            bbox (tuple): (xmin, xmax, ymin, ymax, zmin, zmax)
+            ref_type (string): if not None, only return objects with this ref_type
+
+        Examples::
+            >>> objects_within((0, 10, 0, 5, -10, 10), ref_type="BlockObjects")
+        """
+        memids = []
+        for table in self.spatial_index.tables:
+            where, args = self._spatial_filter(table, ref_type)
+            memids.extend(self.spatial_index.within(table, bbox, where=where, args=args))
+        return list(dict.fromkeys(memids))
+
+    def k_nearest(self, pos, k: int, ref_type=None) -> List[str]:
+        """Find the memids of the k objects closest to pos, nearest first.
+        The distance to an object is the distance to its location, or its
+        nearest voxel or bounding box in any of the tables in self.spatial_index
+
+        Args:
+            pos (tuple): (x, y, z)
+            k (int): number of objects to return
+            ref_type (string): if not None, only return objects with this ref_type
+
+        Examples::
+            >>> k_nearest((0, 63, 0), 3)
+        """
+        dists = {}
+        for table in self.spatial_index.tables:
+            where, args = self._spatial_filter(table, ref_type)
+            memids, ds = self.spatial_index.nearest(table, pos, k, where=where, args=args)
+            for memid, d in zip(memids, ds):
+                if d < dists.get(memid, float("inf")):
+                    dists[memid] = d
+        return [memid for d, memid in sorted((d, memid) for memid, d in dists.items())[:k]]
 
     # FIXME! make table optional
     def check_memid_exists(self, memid: str, table: str) -> bool:
@@ -399,6 +502,10 @@ et        """
             >>> add_triple(subj=subj, pred_text=pred_text, obj_text=obj_text)
 
         """
+        # nodes may hold their tags (e.g. InstSegNode), and inserting a triple
+        # does not fire a TRIGGER
+        if subj:
+            self._invalidate([subj], [])
         return TripleNode.create(
             self,
             subj=subj,
@@ -446,8 +553,27 @@ et        """
             tag_text,
         )
         if triple_memids:
+            self._invalidate([subj_memid], [])
             self.forget(triple_memids[0][0])
 
+    def merge_triples(self, subj_memids: List[str], into_memid: str):
+        """Make into_memid the subject of all the triples of the subj_memids, e.g. to
+        keep the tags of memories merged into into_memid
+
+        Args:
+            subj_memids (list[string]): memids of the subjects of the triples
+            into_memid (string): memid of the new subject
+
+        Examples::
+            >>> subj_memids = ['10517cc584844659907ccfa6161e9d32']
+            >>> merge_triples(subj_memids, 'f3a9c2e1b8d74a5c9e0f1b2c3d4e5f6a')
+        """
+        where = " OR ".join(["subj=?"] * len(subj_memids))
+        self.db_write("UPDATE Triples SET subj=? WHERE " + where, into_memid, *subj_memids)
+        # the TRIGGER only drops the triples themselves from the node cache, not the
+        # nodes holding their tags
+        self._invalidate(list(subj_memids) + [into_memid], [])
+
     # does not search archived mems for now
     # assumes tag is tag text
     def get_memids_by_tag(self, tag: str) -> List[str]:
@@ -805,8 +931,52 @@ et        """
             >>> memid = '10517cc584844659907ccfa6161e9d32'
             >>> task_stack_update_task(task, memid)
         """
+        if self.live_tasks is not None and memid in self.live_tasks:
+            self.live_tasks[memid] = task
+            return
         self.db_write("UPDATE Tasks SET pickled=? WHERE uuid=?", self.safe_pickle(task), memid)
 
+    def set_live_tasks(self, live: bool = True):
+        """Turn on or off keeping unfinished Task objects live in self.live_tasks.
+        When on, stepping a task only writes its scalar status columns
+        (prio, running, paused, finished, run_count) to the Tasks table;
+        the pickled column is only written by checkpoint_tasks() and when the
+        task finishes (see archive_task()).  Turning it off checkpoints all live tasks.
+
+        Args:
+            live (bool): whether to keep tasks live
+
+        Examples ::
+            >>> set_live_tasks(True)
+        """
+        if live and self.live_tasks is None:
+            self.live_tasks = {}
+        elif not live and self.live_tasks is not None:
+            self.checkpoint_tasks()
+            self.live_tasks = None
+
+    def checkpoint_tasks(self):
+        """Pickle every live task into the Tasks table"""
+        if not self.live_tasks:
+            return
+        self._db_write_many(
+            "UPDATE Tasks SET pickled=? WHERE uuid=?",
+            [(self.safe_pickle(task), memid) for memid, task in self.live_tasks.items()],
+        )
+
+    def archive_task(self, memid: str):
+        """Pickle a live task into the Tasks table and stop keeping it live.
+        Used when a task finishes, so that finished tasks (e.g. for undo) are read from the db
+
+        Args:
+            memid (string): Memory ID of the task
+        """
+        if self.live_tasks is None:
+            return
+        task = self.live_tasks.pop(memid, None)
+        if task is not None:
+            self.db_write("UPDATE Tasks SET pickled=? WHERE uuid=?", self.safe_pickle(task), memid)
+
     # TORCH this
     def task_stack_peek(self) -> Optional["TaskNode"]:
         """Return the top of task stack
@@ -846,6 +1016,8 @@ et        """
         if mem is None:
             raise ValueError("Called task_stack_pop with empty stack")
         self.db_write("UPDATE Tasks SET finished=? WHERE uuid=?", self.get_time(), mem.memid)
+        # the popped task is finished, it is read from the db from now on
+        self.archive_task(mem.memid)
         return mem
 
     def task_stack_pause(self) -> bool:
@@ -863,7 +1035,13 @@ et        """
             int: Number of rows affected
         """
         # FIXME use forget; fix this when tasks become MemoryNodes
+        memids = [r[0] for r in self._db_read("SELECT uuid FROM Tasks WHERE finished < 0")]
         self.db_write("DELETE FROM Tasks WHERE finished < 0")
+        # there is no trigger on deletes from Tasks, drop the cleared tasks here
+        if self.live_tasks is not None:
+            for memid in memids:
+                self.live_tasks.pop(memid, None)
+        self._invalidate([], memids)
 
     def task_stack_resume(self) -> bool:
         """Resume stopped tasks. Return True if there was something to resume.
@@ -1011,7 +1189,9 @@ et        """
         """Return the number of rows affected.  As a side effect,
            sets the updated_time entry for each affected memory,
            and applies self.on_delete_callback to the list of deleted memids
-           if there are any and on_delete_callback is not None
+           if there are any and on_delete_callback is not None.
+           Inside a transaction() block the side effects are deferred
+           until the outermost block exits.
 
         Args:
             query (string): The query to be run against the database
@@ -1026,17 +1206,13 @@ et        """
         """
         start_time = datetime.datetime.now()
         r = self._db_write(query, *args)
+        if self._transaction_depth > 0:
+            self._transaction_writes.append((query, r))
+            return r
         # some of this can be implemented with TRIGGERS and a python sqlite fn
         # but its a bit of a pain bc we want the agent's time in the update
         # not system time
-        updated_memids = self._db_read("SELECT * FROM Updates")
-        updated = [mem[0] for mem in updated_memids if mem[1] == "update"]
-        deleted = [mem[0] for mem in updated_memids if mem[1] == "delete"]
-        for u in set(updated):
-            self.set_memory_updated_time(u)
-        if self.on_delete_callback is not None and deleted:
-            self.on_delete_callback(deleted)
-        self._db_write("DELETE FROM Updates")
+        self._process_updates()
         # format the data to send to dashboard timeline
         query_table, query_operation = parse_sql(query[:query.find("(") - 1])
         query_dict = format_query(query, *args)
@@ -1056,12 +1232,91 @@ et        """
         dispatch.send("memory", data=hook_data)
         return r
 
+    def _process_updates(self):
+        """Read the Updates table filled by the db TRIGGERs, drop the changed
+        memories from the node cache, set the updated_time of every updated memory,
+        run on_delete_callback on the deleted ones, and clear the table.
+        """
+        updated_memids = self._db_read("SELECT * FROM Updates")
+        if not updated_memids:
+            return
+        updated = {mem[0] for mem in updated_memids if mem[1] == "update"}
+        deleted = [mem[0] for mem in updated_memids if mem[1] == "delete"]
+        self._invalidate(updated, deleted)
+        if self.live_tasks:
+            for memid in deleted:
+                self.live_tasks.pop(memid, None)
+        if updated:
+            self._db_write_many(
+                "UPDATE Memories SET updated_time=? WHERE uuid=?",
+                [(self.get_time(), u) for u in updated],
+            )
+        if self.on_delete_callback is not None and deleted:
+            self.on_delete_callback(deleted)
+        self._db_write("DELETE FROM Updates")
+
+    def _invalidate(self, updated, deleted):
+        """Drop the updated and deleted memories from the caches of memory nodes.
+        Subclasses with more caches extend this."""
+        self.node_cache.invalidate(updated)
+        self.node_cache.invalidate(deleted)
+
+    @contextmanager
+    def transaction(self):
+        """Batch all db_write calls in the block into one sqlite transaction.
+        The commit, the Updates table processing and the dashboard "memory"
+        hook are deferred until the outermost block exits, and are then applied
+        once for the whole batch.  Blocks can be nested.  Reads inside the block
+        see the uncommitted writes, but updated_time is only set on exit.
+        Writes made before an exception are still committed, as they would have
+        been outside of a transaction.
+
+        Examples ::
+            >>> with memory.transaction():
+            >>>     for block in blocks:
+            >>>         memory.upsert_block(block, memid, "BlockObjects")
+        """
+        self._transaction_depth += 1
+        start_time = datetime.datetime.now()
+        try:
+            yield self
+        finally:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self._end_transaction(start_time)
+
+    def _end_transaction(self, start_time):
+        writes, self._transaction_writes = self._transaction_writes, []
+        self._process_updates()
+        self.db.commit()
+        if not writes:
+            return
+        tables = []
+        for query, _ in writes:
+            query_table, _ = parse_sql(query[:query.find("(") - 1])
+            if query_table not in tables:
+                tables.append(query_table)
+        end_time = datetime.datetime.now()
+        hook_data = {
+            "name" : "memory",
+            "start_time" : start_time,
+            "end_time" : end_time,
+            "elapsed_time" : (end_time - start_time).total_seconds(),
+            "agent_time" : self.get_time(),
+            "table_name" : ",".join(tables),
+            "operation" : "TRANSACTION ",
+            "arguments" : {"num_writes": len(writes)},
+            "result" : sum(r for _, r in writes),
+        }
+        dispatch.send("memory", data=hook_data)
+
     def _db_write(self, query: str, *args) -> int:
         args = tuple(a.item() if isinstance(a, np.number) else a for a in args)
         try:
             c = self.db.cursor()
             c.execute(query, args)
-            self.db.commit()
+            if self._transaction_depth == 0:
+                self.db.commit()
             c.close()
             self._write_to_db_log(query, *args)
             return c.rowcount
@@ -1069,6 +1324,30 @@ et        """
             logging.error("Bad write: {} : {}".format(query, args))
             raise
 
+    def _db_write_many(self, query: str, seq_of_args) -> int:
+        """Run the same write query for every tuple of args in seq_of_args
+        with a single executemany.  No updated_time or dashboard side effects.
+
+        Returns:
+            int: Number of rows affected
+        """
+        seq_of_args = [
+            tuple(a.item() if isinstance(a, np.number) else a for a in args)
+            for args in seq_of_args
+        ]
+        try:
+            c = self.db.cursor()
+            c.executemany(query, seq_of_args)
+            if self._transaction_depth == 0:
+                self.db.commit()
+            c.close()
+            for args in seq_of_args:
+                self._write_to_db_log(query, *args)
+            return c.rowcount
+        except:
+            logging.error("Bad write: {} : {} rows".format(query, len(seq_of_args)))
+            raise
+
     def _db_script(self, script: str):
         """Execute a script against the database
 
@@ -1133,6 +1412,7 @@ et        """
             sql_file (string): File to write database dump to
             dict_memory_file (string): File to dump task database to
         """
+        self.checkpoint_tasks()
         sql_file.write("\n".join(self.db.iterdump()))
         if dict_memory_file is not None:
             import io
@@ -8,10 +8,34 @@ from droidlet.memory.memory_nodes import (
     LocationNode,
     ChatNode,
     NamedAbstractionNode,
+    TaskNode,
 )
 from droidlet.memory.sql_memory import AgentMemory
 from droidlet.base_util import Pos, Look, Player
-from droidlet.memory.memory_filters import MemorySearcher
+from droidlet.memory.memory_filters import (
+    MemorySearcher,
+    get_property_value,
+    get_property_values,
+)
+from droidlet.interpreter.task import Task
+
+
+class CountTask(Task):
+    def __init__(self, agent, task_data={}):
+        super().__init__(agent, task_data=task_data)
+        self.steps = 0
+
+    @Task.step_wrapper
+    def step(self):
+        self.steps += 1
+        self.run_count += 1
+        if self.steps == 3:
+            self.finished = True
+
+
+class FakeTaskAgent:
+    def __init__(self, memory):
+        self.memory = memory
 
 
 class IncrementTime:
@@ -200,6 +224,39 @@ class BasicTest(unittest.TestCase):
         assert abs(vals[0][0] + 2.0) < 0.01
         assert abs(vals[0][1]) < 0.01
 
+    def test_get_property_values(self):
+        self.memory = AgentMemory()
+        memids = []
+        for i in range(5):
+            memid = PlayerNode.create(self.memory, Player(i, str(i), Pos(i, 0, -i), Look(0, 0)))
+            self.memory.tag(memid, "tag" + str(i % 2))
+            self.memory.tag(memid, "tag" + str(i))
+            memids.append(memid)
+        memids.append(LocationNode.create(self.memory, (7, 0, 0)))
+        for prop in ["x", "z", "created", "has_tag", "name", "nothing"]:
+            vals = get_property_values(self.memory, memids, prop)
+            assert len(vals) == len(memids)
+            for memid, v in zip(memids, vals):
+                assert v == get_property_value(self.memory, memid, prop)
+        vals = get_property_values(self.memory, memids, "has_tag", get_all=True)
+        assert "tag1" in vals[1]
+        assert sorted(vals[1]) == sorted(
+            get_property_value(self.memory, memids[1], "has_tag", get_all=True)
+        )
+        assert vals[5] is None
+        assert get_property_values(self.memory, memids, "x").dtype.kind == "f"
+
+        query = {
+            "memory_type": "ReferenceObject",
+            "where_clause": {"pred_text": "has_tag", "obj_text": "tag0"},
+            "selector": {
+                "return_quantity": {"argval": {"quantity": {"attribute": "z"}, "polarity": "MIN"}},
+                "ordinal": 2,
+            },
+        }
+        selected, _ = MemorySearcher().search(self.memory, query=query)
+        assert selected == [memids[4], memids[2]]
+
     def test_chat_apis_memory(self):
         self.memory = AgentMemory()
         # Test add_chat
@@ -284,6 +341,104 @@ class BasicTest(unittest.TestCase):
         triples = self.memory.get_triples(subj=jane_memid, pred_text="sister_of")
         assert len(triples) == 0
 
+    def test_transaction(self):
+        deleted = []
+        self.memory = AgentMemory(agent_time=self.time, on_delete_callback=deleted.extend)
+        joe_memid = PlayerNode.create(self.memory, Player(10, "joe", Pos(1, 0, 1), Look(0, 0)))
+        jane_memid = PlayerNode.create(self.memory, Player(11, "jane", Pos(-1, 0, 1), Look(0, 0)))
+        self.time.add_tick()
+        cmd = "SELECT updated_time FROM Memories WHERE uuid=?"
+        with self.memory.transaction():
+            with self.memory.transaction():
+                self.memory.db_write("UPDATE ReferenceObjects SET x=? WHERE uuid=?", 2, joe_memid)
+            self.memory.forget(jane_memid)
+            # writes are visible inside the block, side effects are deferred
+            assert self.memory._db_read_one("SELECT x FROM ReferenceObjects WHERE uuid=?", joe_memid)[0] == 2
+            assert self.memory._db_read(cmd, joe_memid)[0][0] == 0
+            assert len(deleted) == 0
+        assert self.memory._db_read(cmd, joe_memid)[0][0] == 1
+        assert jane_memid in deleted
+        assert len(self.memory._db_read("SELECT * FROM Updates")) == 0
+        assert not self.memory.db.in_transaction
+
+    def test_node_cache(self):
+        self.memory = AgentMemory(agent_time=self.time, node_cache_size=2)
+        joe_memid = PlayerNode.create(self.memory, Player(10, "joe", Pos(1, 0, 1), Look(0, 0)))
+        jane_memid = PlayerNode.create(self.memory, Player(11, "jane", Pos(-1, 0, 1), Look(0, 0)))
+        joe = self.memory.get_mem_by_id(joe_memid)
+        assert self.memory.get_mem_by_id(joe_memid) is joe
+        assert self.memory.node_cache.hits == 1
+
+        # updates through the RefObjUpdate trigger invalidate the node
+        self.memory.db_write("UPDATE ReferenceObjects SET x=? WHERE uuid=?", 2, joe_memid)
+        new_joe = self.memory.get_mem_by_id(joe_memid)
+        assert new_joe is not joe
+        assert new_joe.pos == (2.0, 0.0, 1.0)
+
+        # LRU eviction
+        self.memory.get_mem_by_id(jane_memid)
+        loc_memid = LocationNode.create(self.memory, (0, 0, 0))
+        self.memory.get_mem_by_id(loc_memid)
+        assert joe_memid not in self.memory.node_cache
+        assert jane_memid in self.memory.node_cache
+        assert self.memory.node_cache.evictions == 1
+
+        # deletes through the MemoryRemoved trigger invalidate the node
+        self.memory.forget(jane_memid)
+        assert jane_memid not in self.memory.node_cache
+        stats = self.memory.node_cache.get_stats()
+        assert stats["size"] == 1
+        assert stats["misses"] == 4
+
+    def test_live_tasks(self):
+        self.memory = AgentMemory(agent_time=self.time)
+        self.memory.set_live_tasks(True)
+        agent = FakeTaskAgent(self.memory)
+        task = CountTask(agent)
+        assert self.memory.live_tasks[task.memid] is task
+        TaskNode(self.memory, task.memid).get_update_status({"prio": 1})
+        pickled_cmd = "SELECT pickled FROM Tasks WHERE uuid=?"
+        pickled = self.memory._db_read_one(pickled_cmd, task.memid)[0]
+        task_node = self.memory.basic_search("SELECT MEMORY FROM Task WHERE prio>=1")[1][0]
+        assert task_node.task is task
+        task_node.task.step()
+        task_node.task.step()
+        # stepping writes run_count but not the pickle
+        assert self.memory._db_read_one(pickled_cmd, task.memid)[0] == pickled
+        assert self.memory._db_read_one("SELECT run_count FROM Tasks WHERE uuid=?", task.memid)[0] == 2
+        self.memory.checkpoint_tasks()
+        assert self.memory._db_read_one(pickled_cmd, task.memid)[0] != pickled
+        # finishing archives the task
+        task_node.task.step()
+        task_node.task.step()
+        assert task.memid not in self.memory.live_tasks
+        finished_task = TaskNode(self.memory, task.memid).task
+        assert finished_task is not task and finished_task.steps == 3
+        self.memory.set_live_tasks(False)
+        assert self.memory.live_tasks is None
+
+    def test_live_tasks_pop_and_clear(self):
+        self.memory = AgentMemory(agent_time=self.time)
+        self.memory.set_live_tasks(True)
+        agent = FakeTaskAgent(self.memory)
+        tasks = []
+        for _ in range(3):
+            self.time.add_tick()
+            tasks.append(CountTask(agent))
+            TaskNode(self.memory, tasks[-1].memid).get_update_status({"prio": 1})
+        # the head of the stack is the last created task; popping it archives it
+        tasks[-1].step()
+        popped = self.memory.task_stack_pop()
+        assert popped.memid == tasks[-1].memid
+        assert popped.memid not in self.memory.live_tasks
+        assert TaskNode(self.memory, popped.memid).task.steps == 1
+        # clearing drops the unfinished tasks, which are not reachable anymore
+        self.memory.task_stack_clear()
+        assert self.memory.live_tasks == {}
+        for task in tasks[:-1]:
+            assert self.memory._db_read_one("SELECT * FROM Tasks WHERE uuid=?", task.memid) is None
+        assert self.memory.task_stack_peek() is None
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,146 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import logging
+import random
+import unittest
+from timeit import Timer
+from droidlet.memory.memory_nodes import PlayerNode, LocationNode
+from droidlet.memory.sql_memory import AgentMemory
+from droidlet.memory.memory_filters import MemorySearcher
+from droidlet.base_util import Pos, Look, Player
+from droidlet.interpreter.tests import all_test_commands
+
+
+def get_where_clauses(d, out):
+    if type(d) is dict:
+        if type(d.get("where_clause")) is dict:
+            out.append(d["where_clause"])
+        for v in d.values():
+            get_where_clauses(v, out)
+    elif type(d) is list:
+        for v in d:
+            get_where_clauses(v, out)
+    return out
+
+
+def get_command_where_clauses():
+    out = []
+    for k in dir(all_test_commands):
+        if k.isupper():
+            get_where_clauses(getattr(all_test_commands, k), out)
+    return out
+
+
+def comparator(prop, value, ctype="EQUAL"):
+    return {
+        "input_left": {"value_extractor": prop},
+        "input_right": {"value_extractor": value},
+        "comparison_type": ctype,
+    }
+
+
+EXTRA_WHERE_CLAUSES = [
+    {"pred_text": "has_tag", "obj_text": "fluffy"},
+    {"OR": [{"pred_text": "has_name", "obj_text": "cube"}, {"pred_text": "has_colour", "obj_text": "red"}]},
+    {"NOT": [{"pred_text": "has_name", "obj_text": "cube"}]},
+    {
+        "AND": [
+            {"NOT": [{"pred_text": "has_colour", "obj_text": "blue"}]},
+            {"OR": [comparator("x", 3, "GREATER_THAN"), comparator("has_name", "house")]},
+        ]
+    },
+    {"AND": [comparator("x", 5, "LESS_THAN_EQUAL"), comparator("node_type", "Player")]},
+    {"AND": [comparator("has_size", "small"), {"NOT": [comparator("z", 0, "GREATER_THAN")]}]},
+]
+
+
+class WherePlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.memory = AgentMemory()
+        random.seed(0)
+        triples = [
+            ("has_name", ["cube", "house", "sphere", "hole", "cow", "tree"]),
+            ("has_colour", ["red", "blue", "gold"]),
+            ("has_size", ["small", "1 x 1 x 1"]),
+            ("has_tag", ["fluffy", "dance", "CURRENTLY_RUNNING"]),
+        ]
+        for i in range(200):
+            pos = (random.randint(-10, 10), 0, random.randint(-10, 10))
+            if i % 4 == 0:
+                memid = PlayerNode.create(
+                    self.memory, Player(i, "player" + str(i), Pos(*pos), Look(0, 0))
+                )
+            else:
+                memid = LocationNode.create(self.memory, pos)
+            for pred_text, objs in triples:
+                if random.random() < 0.5:
+                    self.memory.add_triple(subj=memid, pred_text=pred_text, obj_text=random.choice(objs))
+        self.where_clauses = get_command_where_clauses() + EXTRA_WHERE_CLAUSES
+
+    def test_parity(self):
+        compiled = MemorySearcher()
+        uncompiled = MemorySearcher(compile_where=False)
+        for where_clause in self.where_clauses:
+            for memtype in ["ReferenceObject", "Location"]:
+                a = compiled.handle_where(self.memory, where_clause, memtype)
+                b = uncompiled.handle_where(self.memory, where_clause, memtype)
+                assert sorted(a) == sorted(b), where_clause
+
+    def test_plan_memo(self):
+        planner = self.memory.where_planner
+        sql, args = planner.plan({"AND": [{"pred_text": "has_name", "obj_text": "cube"}]}, "Player")
+        other_sql, other_args = planner.plan(
+            {"AND": [{"pred_text": "has_name", "obj_text": "house"}]}, "Player"
+        )
+        assert other_sql is sql and args != other_args
+        assert planner.get_stats()["hits"] == 1
+        planner.plan({"OR": [{"pred_text": "has_name", "obj_text": "house"}]}, "Player")
+        assert planner.get_stats()["misses"] == 2
+
+    def test_tolerance_and_modulus(self):
+        searcher = MemorySearcher()
+        where = comparator("x", 2, {"close_tolerance": 1.5})
+        memids = searcher.handle_where(self.memory, where, "ReferenceObject")
+        expected = self.memory._db_read("SELECT uuid FROM ReferenceObjects WHERE x>0.5 AND x<3.5")
+        assert sorted(memids) == sorted([m[0] for m in expected])
+        where = comparator("x", 1, {"modulus": 2})
+        memids = searcher.handle_where(self.memory, where, "ReferenceObject")
+        expected = self.memory._db_read("SELECT uuid FROM ReferenceObjects WHERE x % 2 = 1")
+        assert len(memids) > 0
+        assert sorted(memids) == sorted([m[0] for m in expected])
+
+    def test_argval_query_count(self):
+        query = {
+            "memory_type": "ReferenceObject",
+            "selector": {
+                "return_quantity": {"argval": {"quantity": {"attribute": "x"}, "polarity": "MAX"}},
+                "ordinal": 1,
+            },
+            "output": {"attribute": "has_name"},
+        }
+        statements = []
+        self.memory.db.set_trace_callback(statements.append)
+        memids, vals = MemorySearcher().search(self.memory, query=query)
+        self.memory.db.set_trace_callback(None)
+        # one read per node type for the search, and a few per property instead of per memory
+        assert len(statements) < 20
+        max_x = self.memory._db_read_one("SELECT MAX(x) FROM ReferenceObjects")[0]
+        assert self.memory.get_mem_by_id(memids[0]).pos[0] == max_x
+
+    def test_time(self):
+        def run(searcher):
+            for where_clause in self.where_clauses:
+                searcher.handle_where(self.memory, where_clause, "ReferenceObject")
+
+        uncompiled = Timer(lambda: run(MemorySearcher(compile_where=False))).timeit(number=10)
+        compiled = Timer(lambda: run(MemorySearcher())).timeit(number=10)
+        logging.info(
+            "{} where clauses x 10: {} s uncompiled, {} s compiled".format(
+                len(self.where_clauses), uncompiled, compiled
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,246 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+from droidlet.memory.filters_conversions import get_inequality_symbol
+
+# keys of a triple leaf of a where clause, in the order they are bound
+TRIPLE_KEYS = ["subj", "subj_text", "pred_text", "obj", "obj_text"]
+MAX_PLANS = 1024
+
+
+def sql_literal(s):
+    return "'" + str(s).replace("'", "''") + "'"
+
+
+def check_well_formed_triple(clause):
+    # TODO search by pred?
+    assert any(
+        [
+            "subj" in clause or "subj_text" in clause,
+            "pred_text" in clause,
+            "obj" in clause or "obj_text" in clause,
+        ]
+    )
+    assert not ("subj" in clause and "subj_text" in clause)
+    assert not ("obj" in clause and "obj_text" in clause)
+
+
+def try_float(value, where_clause):
+    try:
+        return float(value)
+    except:
+        raise Exception("tried to get float from {} in {}".format(value, where_clause))
+
+
+def parse_comparator(where_clause):
+    """
+    converts a comparator leaf of a where clause (a dict with "input_left" and "input_right")
+    into a tuple (prop, comparison_symbol, value)
+    where comparison_symbol is one of "=", "!=", "=#=", "<", "<=", ">", ">=", "%", "<>"
+    and value is a tuple of (modulus, remainder) if comparison_symbol is "%",
+    (low, high) if comparison_symbol is "<>", and a singleton tuple otherwise
+    """
+    input_left = where_clause["input_left"]["value_extractor"]
+    input_right = where_clause["input_right"]["value_extractor"]
+    if type(input_left) is dict or type(input_right) is dict:
+        raise Exception(
+            "currently search assumes comparator attributes are explicitly stored property of the memory: {}".format(
+                where_clause
+            )
+        )
+    ctype = where_clause.get("comparison_type", "EQUAL")
+    comparison_symbol = get_inequality_symbol(ctype)
+    # FIXME do close tolerance for modulus
+    if type(ctype) is dict and ctype.get("close_tolerance"):
+        comparison_symbol = "<>"
+        v = try_float(input_right, where_clause)
+        value = (v - ctype["close_tolerance"], v + ctype["close_tolerance"])
+    elif comparison_symbol[0] == "<" or comparison_symbol[0] == ">":
+        # going to convert back to str later, doing this for data sanitation/debugging
+        value = (try_float(input_right, where_clause),)
+    elif type(ctype) is dict and ctype.get("modulus"):
+        comparison_symbol = "%"
+        value = (ctype["modulus"], input_right)
+    else:
+        value = (input_right,)
+    return input_left, comparison_symbol, value
+
+
+class WherePlanner:
+    """
+    Compiles the where clause of a MemorySearcher query into a single SQL statement.
+    AND, OR and NOT become INTERSECT, UNION and EXCEPT of the leaf SELECTs; leaves
+    on a column of the Memories table or of the memtype's table are SELECTs on that
+    table, and triple leaves are SELECTs on the Triples table JOINed with Memories
+    to filter the subject by node type.
+
+    The SQL only depends on the "shape" of the where clause (its structure, property names
+    and comparison types, but not the values compared against), so compiled statements
+    are memoized by (memtype, shape), and the values are bound as parameters.
+
+    Args:
+        agent_memory: the AgentMemory searched.  it is used to look up the table columns
+            and the node types of the memtypes
+        max_plans (int): the memo is cleared if it has more than max_plans statements
+
+    Attributes:
+        plans (dict): (memtype, shape) -> SQL statement
+        hits (int): number of where clauses whose statement was memoized
+        misses (int): number of where clauses compiled
+
+    Examples::
+        >>> planner = WherePlanner(agent_memory)
+        >>> where = {"AND": [{"pred_text": "has_name", "obj_text": "cube"}]}
+        >>> sql, args = planner.plan(where, "ReferenceObject")
+        >>> memids = planner.run(where, "ReferenceObject")
+    """
+
+    def __init__(self, agent_memory, max_plans=MAX_PLANS):
+        self.memory = agent_memory
+        self.max_plans = max_plans
+        self.plans = {}
+        self.hits = 0
+        self.misses = 0
+
+    def run(self, where_clause, memtype):
+        """returns a list of memids whose memories satisfy the where clause"""
+        sql, args = self.plan(where_clause, memtype)
+        return [r[0] for r in self.memory._db_read(sql, *args)]
+
+    def plan(self, where_clause, memtype):
+        """returns the SQL statement and the list of arguments to bind for a where clause"""
+        args = []
+        shape = self.get_shape(where_clause, args)
+        key = (memtype, shape)
+        sql = self.plans.get(key)
+        if sql is None:
+            self.misses += 1
+            sql = self.compile(shape, memtype)
+            if len(self.plans) >= self.max_plans:
+                self.plans.clear()
+            self.plans[key] = sql
+        else:
+            self.hits += 1
+        return sql, args
+
+    def get_shape(self, where_clause, args):
+        """
+        returns a hashable description of the where clause that determines its SQL statement,
+        and appends the values to bind to args, in the order they appear in the statement.
+        any subqueries in triple leaves are run here.
+        """
+        for conjunction in ["AND", "OR"]:
+            if where_clause.get(conjunction):
+                return (
+                    conjunction,
+                    tuple(self.get_shape(c, args) for c in where_clause[conjunction]),
+                )
+        if where_clause.get("NOT"):
+            return ("NOT", self.get_shape(where_clause["NOT"][0], args))
+
+        # TODO: if input_left or input_right are subqueries...
+        if where_clause.get("input_left"):
+            prop, comparison_symbol, value = parse_comparator(where_clause)
+            if comparison_symbol == "%":
+                args.append(value[1])
+                return ("PROPERTY", prop, "%", str(value[0]))
+            args.extend(value)
+            return ("PROPERTY", prop, comparison_symbol)
+
+        # if we made it here, this is a triple leaf
+        try:
+            check_well_formed_triple(where_clause)
+            assert all(k in TRIPLE_KEYS for k in where_clause)
+        except:
+            raise Exception("poorly formed triple dict{}".format(where_clause))
+        # run any subqueries:
+        for k, v in where_clause.items():
+            if callable(v):
+                # this should be a searcher, run it
+                try:
+                    mems, vals = v()
+                except:
+                    raise Exception("error in subquery {}".format(where_clause))
+                # FIXME, throw an error? the subquery could not
+                # get a value, so the leaf matches nothing:
+                if len(vals) == 0:
+                    return ("NOTHING",)
+                # FIXME?  handle this better (don't choose the first?)
+                # should we force subqueries to have proper selectors?
+                where_clause[k] = vals[0]
+        keys = tuple(k for k in TRIPLE_KEYS if where_clause.get(k) is not None)
+        args.extend(where_clause[k] for k in keys)
+        return ("TRIPLE", keys)
+
+    def compile(self, shape, memtype):
+        """returns the SQL statement for a where clause shape.  the statement has a
+        single column of memids"""
+        op = shape[0]
+        if op in ["AND", "OR", "NOT"]:
+            if op == "NOT":
+                node_types = ",".join(sql_literal(n) for n in self.memory.node_children[memtype])
+                children = [
+                    "SELECT uuid FROM Memories WHERE node_type IN ({})".format(node_types),
+                    self.compile(shape[1], memtype),
+                ]
+            else:
+                children = [self.compile(c, memtype) for c in shape[1]]
+            if len(children) == 1:
+                return "SELECT DISTINCT uuid FROM ({})".format(children[0])
+            compound = {"AND": " INTERSECT ", "OR": " UNION ", "NOT": " EXCEPT "}[op]
+            return compound.join("SELECT uuid FROM ({})".format(c) for c in children)
+        if op == "NOTHING":
+            return "SELECT uuid FROM Memories WHERE 0"
+        if op == "PROPERTY":
+            return self.compile_property(shape, memtype)
+        # triple leaf
+        where = ["M.is_snapshot=0"]
+        where.extend("Triples." + k + "=?" for k in shape[1])
+        return self.triple_select(where, memtype)
+
+    def compile_property(self, shape, memtype):
+        prop, comparison_symbol = shape[1], shape[2]
+        if comparison_symbol == "%":
+            condition = prop + " % " + shape[3] + " =?"
+        elif comparison_symbol == "<>":
+            condition = prop + ">? AND " + prop + "<?"
+        elif comparison_symbol == "=#=":
+            condition = prop + "=?"
+        else:
+            condition = prop + comparison_symbol + "?"
+
+        # is it in the main memory table?
+        if prop in self.memory.get_table_columns("Memories"):
+            return "SELECT uuid FROM Memories WHERE " + condition
+        # is it in the node table?
+        T = self.memory.nodes[memtype].TABLE
+        if prop in self.memory.get_table_columns(T):
+            return "SELECT uuid FROM " + T + " WHERE " + condition
+        # is it a triple?
+        # FIXME! it is assumed for now that the value is the obj_text, not the obj; need to
+        # to introduce special comparison_symbol for the obj memid case
+        if comparison_symbol == "=":
+            obj_key = "obj_text"
+        elif comparison_symbol == "=#=":
+            obj_key = "obj"
+        else:
+            raise Exception("Triple values need to have '=' or '=#=' as comparison symbol for now")
+        where = [
+            "M.is_snapshot=0",
+            "Triples.pred_text=" + sql_literal(prop),
+            "Triples." + obj_key + "=?",
+        ]
+        return self.triple_select(where, memtype)
+
+    def triple_select(self, where, memtype):
+        node_types = ",".join(sql_literal(n) for n in self.memory.node_children[memtype])
+        where.append("M.node_type IN ({})".format(node_types))
+        return (
+            "SELECT Triples.subj AS uuid FROM Triples INNER JOIN Memories as M "
+            + "ON Triples.subj=M.uuid WHERE "
+            + " AND ".join(where)
+        )
+
+    def get_stats(self):
+        """Return a dict with the memo counters and current size"""
+        return {"size": len(self.plans), "hits": self.hits, "misses": self.misses}
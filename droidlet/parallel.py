@@ -1,6 +1,8 @@
 import traceback
 import queue
-from typing import Callable, List
+import time
+from collections import OrderedDict, namedtuple
+from typing import Callable, Dict, List, Tuple
 import cloudpickle
 # you're wondering wtf? why is numpy needed in this file?
 # it's a workaround for https://github.com/pytorch/pytorch/issues/37377
@@ -45,8 +47,6 @@ def _runner(_init_fn, init_args, _process_fn, shutdown_event, input_queue, outpu
         try:
             process_args = input_queue.get(block=True, timeout=0.1)
             process_args_aug = (initial_state, *process_args)
-            print(process_args)
-            print(process_args_aug)
             process_return = process_fn(*process_args_aug)
             output_queue.put(process_return)
         except queue.Empty:
@@ -100,6 +100,248 @@ class BackgroundTask:
 
 
 
+def _stage_runner(
+    name, _init_fn, init_args, _process_fn, shutdown_event, input_queue, output_queue
+):
+    # imported here, not to slow down the start of the other processes
+    from droidlet.lowlevel.locobot.frame_transport import FrameRing, FrameTransportError
+
+    init_fn = cloudpickle.loads(_init_fn)
+    process_fn = cloudpickle.loads(_process_fn)
+    initial_state = init_fn(*init_args)
+    ring = None
+
+    while not shutdown_event.is_set():
+        try:
+            frame = input_queue.get(block=True, timeout=0.1)
+        except queue.Empty:
+            continue
+        # latest frame wins: skip the frames put while the last one was processed
+        dropped = 0
+        while True:
+            try:
+                frame = input_queue.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                break
+        start = time.time()
+        try:
+            if ring is None or ring.name != frame["shm_name"]:
+                if ring is not None:
+                    ring.close()
+                    ring = None
+                # the stages share the resource tracker of the process which created the ring
+                ring = FrameRing(
+                    frame["spec"], name=frame["shm_name"], slots=frame["slots"], unregister=False
+                )
+            arrays = ring.read(frame["seq"])[2]
+        except FrameTransportError:
+            # overwritten by newer frames, or in a ring replaced (and unlinked) by put since
+            output_queue.put((name, frame["frame_id"], None, 0.0, dropped + 1, False))
+            continue
+        process_return = process_fn(initial_state, *arrays, *frame["args"])
+        latency = time.time() - start
+        output_queue.put((name, frame["frame_id"], process_return, latency, dropped, True))
+
+
+FusedFrame = namedtuple("FusedFrame", ["frame_id", "payload", "results"])
+
+
+class Pipeline:
+    """Runs several stages (e.g. models) on a stream of frames, each stage in its own process,
+    so that a slow stage does not delay the others.  The arrays of a frame are passed through
+    a shared memory FrameRing, and only their metadata through the queues.  Each stage only
+    processes the latest frame put while it was busy (latest frame wins); the older ones are
+    dropped.  The results of the stages are fused by frame: get returns a frame when all the
+    stages have processed it or a later one, or max_wait seconds after its first result; a
+    result arriving after its frame was returned is returned alone, in a new FusedFrame.
+
+    Args:
+        stages: stage name -> (init_fn, init_args, process_fn), as for BackgroundTask; the
+            stage calls process_fn(init_fn(*init_args), *arrays, *args) on each frame put with
+            put(arrays, *args)
+        max_wait: seconds a frame with the results of some stages waits for the other ones
+        keep: number of recent frames whose payload is kept for their results
+
+    Examples::
+        >>> pipeline = Pipeline({"detector": (init_fn, (weights_dir,), detect)})
+        >>> pipeline.start()
+        >>> pipeline.put([rgb, depth], xyz, payload=rgb_depth)
+        >>> for frame in pipeline.get():
+        >>>     detections = frame.results.get("detector")
+    """
+
+    def __init__(
+        self,
+        stages: Dict[str, Tuple[Callable, List, Callable]],
+        max_wait: float = 0.5,
+        keep: int = 16,
+    ):
+        self._stages = stages
+        self.max_wait = max_wait
+        self.keep = keep
+        self._send_queues = {name: multiprocessing.Queue() for name in stages}
+        self._recv_queue = multiprocessing.Queue()
+        self._shutdown_event = multiprocessing.Event()
+        self._processes = {}
+        self._ring = None
+        self._frame_id = 0
+        # frame_id -> payload of the recent frames
+        self._payloads = OrderedDict()
+        # frame_id -> [first result time, {stage: result}] of the frames not returned yet
+        self._pending = OrderedDict()
+        # last frame processed (or skipped) by each stage
+        self._stage_frame = {name: 0 for name in stages}
+        self._stats = {
+            name: {"frames": 0, "dropped": 0, "busy": 0.0, "latency": 0.0} for name in stages
+        }
+        self._start_time = None
+
+    def start(self):
+        for name, (init_fn, init_args, process_fn) in self._stages.items():
+            process = Process(
+                target=_stage_runner,
+                args=(
+                    name,
+                    cloudpickle.dumps(init_fn),
+                    init_args,
+                    cloudpickle.dumps(process_fn),
+                    self._shutdown_event,
+                    self._send_queues[name],
+                    self._recv_queue,
+                ),
+            )
+            process.daemon = True
+            process.start()
+            self._processes[name] = process
+        self._start_time = time.time()
+
+    def _raise(self):
+        if not self._processes:
+            raise RuntimeError(
+                "Pipeline has not yet been started. Did you forget to call .start()?"
+            )
+        for process in self._processes.values():
+            if process.exception:
+                error, _traceback = process.exception
+                raise ChildProcessError(_traceback)
+
+    def stop(self):
+        self._raise()
+        self._shutdown_event.set()
+        if self._ring is not None:
+            self._ring.close()
+            self._ring = None
+
+    def put(self, arrays, *args, payload=None):
+        """writes the arrays of a frame in shared memory and sends the frame to every stage,
+        with args (pickled); payload is returned with the results of the frame
+
+        Returns:
+            the frame_id of the frame
+        """
+        from droidlet.lowlevel.locobot.frame_transport import FrameRing
+
+        self._raise()
+        spec = [(tuple(numpy.shape(a)), numpy.asarray(a).dtype.str) for a in arrays]
+        if self._ring is None or self._ring.spec != spec:
+            if self._ring is not None:
+                self._ring.close()
+            self._ring = FrameRing(spec)
+        seq, _ = self._ring.write(arrays)
+        self._frame_id += 1
+        self._payloads[self._frame_id] = payload
+        self._pending[self._frame_id] = [None, {}]
+        while len(self._payloads) > self.keep:
+            old_id, _ = self._payloads.popitem(last=False)
+            self._pending.pop(old_id, None)
+        frame = self._ring.metadata()
+        frame.update({"seq": seq, "frame_id": self._frame_id, "args": args})
+        for send_queue in self._send_queues.values():
+            send_queue.put(frame)
+        return self._frame_id
+
+    def _receive(self, message):
+        name, frame_id, result, latency, dropped, processed = message
+        stats = self._stats[name]
+        stats["dropped"] += dropped
+        self._stage_frame[name] = max(self._stage_frame[name], frame_id)
+        if not processed:
+            return []
+        stats["frames"] += 1
+        stats["busy"] += latency
+        stats["latency"] = latency
+        if frame_id in self._pending:
+            pending = self._pending[frame_id]
+            pending[0] = pending[0] or time.time()
+            pending[1][name] = result
+        elif frame_id in self._payloads:
+            # the frame was already returned without the result of this stage
+            return [FusedFrame(frame_id, self._payloads[frame_id], {name: result})]
+        return []
+
+    def _ready(self):
+        now = time.time()
+        ready = []
+        for frame_id, (first_result, results) in list(self._pending.items()):
+            done = all(f >= frame_id for f in self._stage_frame.values())
+            if done or (first_result is not None and now - first_result >= self.max_wait):
+                del self._pending[frame_id]
+                # a frame skipped by all the stages has no results
+                if results:
+                    ready.append(FusedFrame(frame_id, self._payloads[frame_id], results))
+        return ready
+
+    def get(self, block=False, timeout=None, frame_id=None):
+        """returns the list of the FusedFrames ready, in the order of their frame_id
+
+        Args:
+            block: wait until a frame is ready, or until frame frame_id is if it is not None
+            timeout: maximum seconds to wait, None for no limit
+            frame_id: see block
+        """
+        self._raise()
+        deadline = None if timeout is None else time.time() + timeout
+        frames = []
+        while True:
+            while True:
+                try:
+                    frames += self._receive(self._recv_queue.get_nowait())
+                except queue.Empty:
+                    break
+            frames += self._ready()
+            if not block:
+                break
+            if frame_id is None and frames:
+                break
+            if frame_id is not None and frame_id not in self._pending:
+                break
+            wait = 0.05 if deadline is None else min(0.05, deadline - time.time())
+            if wait <= 0:
+                break
+            self._raise()
+            try:
+                frames += self._receive(self._recv_queue.get(block=True, timeout=wait))
+            except queue.Empty:
+                pass
+        return sorted(frames, key=lambda f: f.frame_id)
+
+    def stats(self):
+        """per stage: number of frames processed and dropped, frames processed per second
+        since start, mean and last latency in seconds"""
+        elapsed = max(time.time() - (self._start_time or time.time()), 1e-6)
+        return {
+            name: {
+                "frames": s["frames"],
+                "dropped": s["dropped"],
+                "fps": s["frames"] / elapsed,
+                "mean_latency": s["busy"] / max(s["frames"], 1),
+                "latency": s["latency"],
+            }
+            for name, s in self._stats.items()
+        }
+
+
 # https://stackoverflow.com/a/31614591
 # CC BY-SA 4.0
 class PropagatingThread(Thread):
@@ -5,6 +5,7 @@ Copyright (c) Facebook, Inc. and its affiliates.
 import heapq
 import math
 import numpy as np
+from scipy import ndimage
 from scipy.ndimage.filters import median_filter
 from scipy.optimize import linprog
 from copy import deepcopy
@@ -22,11 +23,20 @@ from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import (
     COLOR_BID_MAP,
 )
 from droidlet.base_util import to_block_pos
-from droidlet.perception.craftassist.search import depth_first_search
+from droidlet.perception.craftassist.labeling import (
+    label_blocks,
+    components_from_labels,
+    flood_fill,
+    get_structure,
+)
 from droidlet.memory.craftassist.mc_memory_nodes import InstSegNode, BlockObjectNode
 
 GROUND_BLOCKS = [1, 2, 3, 7, 8, 9, 12, 79, 80]
 MAX_RADIUS = 20
+# side of the cubes the cached BlockWindow is split into to track changes
+CHUNK_SIZE = 8
+# number of blocks read at once down each column when looking for the ground around holes
+HOLE_COLUMN_DEPTH = 16
 COLOUR_LIST = list(COLOR_BID_MAP.keys())
 
 # Taken from : stackoverflow.com/questions/16750618/
@@ -52,6 +62,12 @@ def all_nearby_objects(get_blocks, pos, max_radius=MAX_RADIUS):
     mask, off, blocks = all_close_interesting_blocks(get_blocks, pos, max_radius)
     components = connected_components(mask)
     logging.debug("all_nearby_objects found {} objects near {}".format(len(components), pos))
+    return components_to_blocks(components, off, blocks)
+
+
+def components_to_blocks(components, off, blocks):
+    """Convert connected components of yzx indices into a yzxb array with offset off
+    into lists of ((x, y, z), (id, meta))"""
     xyzbms = [
         [((c[2] + off[2], c[0] + off[0], c[1] + off[1]), tuple(blocks[c])) for c in component_yzxs]
         for component_yzxs in components
@@ -93,15 +109,7 @@ def accessible_interesting_blocks(blocks, pos):
     passable = np.isin(blocks, PASSABLE_BLOCKS)
     interesting = np.isin(blocks, BORING_BLOCKS, invert=True)
     passable_or_interesting = passable | interesting
-    X = np.zeros_like(passable)
-
-    def _fn(p):
-        if passable_or_interesting[p]:
-            X[p] = True
-            return True
-        return False
-
-    depth_first_search(blocks.shape[:3], pos, _fn)
+    X = flood_fill(passable_or_interesting, pos, connectivity=6)
     return X & interesting
 
 
@@ -122,61 +130,17 @@ def find_closest_component(mask, relpos):
     return components[np.argmin(dists)]
 
 
-def connected_components(X, unique_idm=False):
+def connected_components(X, unique_idm=False, connectivity=26):
     """Find all connected nonzero components in a array X.
     X is either rank 3 (volume) or rank 4 (volume-idm)
     If unique_idm == True, different block types are different
-    components
+    components.  connectivity is 6 (faces) or 26 (faces, edges and corners)
 
-    Returns a list of lists of indices of connected components
+    Returns a list of lists of indices of connected components,
+    ordered by their first index in raster order
     """
-    visited = np.zeros((X.shape[0], X.shape[1], X.shape[2]), dtype="bool")
-    components = []
-    current_component = set()
-    diag_adj = build_safe_diag_adjacent([0, X.shape[0], 0, X.shape[1], 0, X.shape[2]])
-
-    if len(X.shape) == 3:
-        X = np.expand_dims(X, axis=3)
-
-    def is_air(X, i, j, k):
-        return X[i, j, k, 0] == 0
-
-    if not unique_idm:
-
-        def _build_fn(X, current_component, idm):
-            def _fn(p):
-                if X[p[0], p[1], p[2], 0]:
-                    current_component.add(p)
-                    return True
-
-            return _fn
-
-    else:
-
-        def _build_fn(X, current_component, idm):
-            def _fn(p):
-                if tuple(X[p]) == idm:
-                    current_component.add(p)
-                    return True
-
-            return _fn
-
-    for i in range(visited.shape[0]):
-        for j in range(visited.shape[1]):
-            for k in range(visited.shape[2]):
-                if visited[i, j, k]:
-                    continue
-                visited[i, j, k] = True
-                if is_air(X, i, j, k):
-                    continue
-                # found a new component
-                pos = (i, j, k)
-                _fn = _build_fn(X, current_component, tuple(X[i, j, k, :]))
-                visited |= depth_first_search(X.shape[:3], pos, _fn, diag_adj)
-                components.append(list(current_component))
-                current_component.clear()
-
-    return components
+    labels, n = label_blocks(X, connectivity=connectivity, unique_idm=unique_idm)
+    return components_from_labels(labels, n)
 
 
 def check_between(entities, fat_scale=0.2):
@@ -354,17 +318,19 @@ def ground_height(agent, pos, radius, yfilt=5, xzfilt=5):
 
 
 def get_nearby_airtouching_blocks(
-    agent, location, block_data, color_data, block_property_data, radius=15
+    agent, location, block_data, color_data, block_property_data, radius=15, get_blocks=None
 ):
     """Get all blocks in 'radius' of 'location'
     that are touching air on either side.
+    get_blocks defaults to agent.get_blocks
     Returns:
         A list of blocktypes
     """
+    get_blocks = get_blocks or agent.get_blocks
     gh = ground_height(agent, location, 0)[0, 0]
     x, y, z = location
     ymin = int(max(y - radius, gh))
-    yzxb = agent.get_blocks(x - radius, x + radius, ymin, y + radius, z - radius, z + radius)
+    yzxb = get_blocks(x - radius, x + radius, ymin, y + radius, z - radius, z + radius)
     xyzb = yzxb.transpose([2, 0, 1, 3]).copy()
     components = connected_components(xyzb, unique_idm=True)
     blocktypes = []
@@ -404,93 +370,115 @@ def get_nearby_airtouching_blocks(
     return blocktypes
 
 
-def get_all_nearby_holes(agent, location, block_data, radius=15, store_inst_seg=True):
-    """Returns:
-    a list of holes. Each hole is an InstSegNode"""
+def get_top_blocks(get_blocks, mx, mz, size, max_height, exclude=()):
+    """Find the highest non-air block at or below max_height of each column
+    in the size x size square with corner (mx, mz), ignoring mobs and the
+    positions in exclude (e.g. the agent)
+
+    Returns:
+        an int array of heights indexed by [x - mx, z - mz], and an array
+        of the (id, meta) of the blocks indexed the same way
+    """
+    heights = np.zeros((size, size), dtype="int64")
+    idms = np.zeros((size, size, 2), dtype="int64")
+    found = np.zeros((size, size), dtype="bool")
+    top = max_height
+    while not found.all():
+        bottom = top - HOLE_COLUMN_DEPTH + 1
+        B = get_blocks(mx, mx + size - 1, bottom, top, mz, mz + size - 1)
+        # mobile blocks (agent, speaker, mobs)
+        solid = (B[:, :, :, 0] != 0) & (B[:, :, :, 0] != 383)
+        for x, y, z in exclude:
+            if 0 <= x - mx < size and bottom <= y <= top and 0 <= z - mz < size:
+                solid[y - bottom, z - mz, x - mx] = False
+        # indexed x, z
+        has_solid = solid.any(axis=0).T
+        highest = HOLE_COLUMN_DEPTH - 1 - np.argmax(solid[::-1], axis=0).T
+        new = has_solid & ~found
+        heights[new] = bottom + highest[new]
+        xs, zs = np.nonzero(new)
+        idms[xs, zs] = B[highest[xs, zs], zs, xs]
+        found |= new
+        top = bottom - 1
+    return heights, idms
+
+
+def find_holes(get_blocks, location, radius=15, exclude=()):
+    """Find the holes in the ground around location.  A hole is a connected region of
+    columns with their top at the same height, all lower than the columns around the
+    region.  The hole is filled by one level and searched again, until it is level with
+    its surroundings or above location.  Columns are as in get_top_blocks.
+
+    Returns:
+        a list of holes (list of (x, y, z), (id, meta)) where the positions
+        are the levels of the hole, and (id, meta) is a block around it
+    """
     sx, sy, sz = location
     max_height = sy + 5
     map_size = radius * 2 + 1
-    height_map = [[sz] * map_size for i in range(map_size)]
-    hid_map = [[-1] * map_size for i in range(map_size)]
-    idm_map = [[(0, 0)] * map_size for i in range(map_size)]
-    visited = set([])
-    global current_connected_comp, current_idm
-    current_connected_comp = []
-    current_idm = (2, 0)
-
-    # helper functions
-    def get_block_info(x, z):  # fudge factor 5
-        height = max_height
-        while True:
-            B = agent.get_blocks(x, x, height, height, z, z)
-            if (
-                (B[0, 0, 0, 0] != 0)
-                and (x != sx or z != sz or height != sy)
-                and (x != agent.pos[0] or z != agent.pos[2] or height != agent.pos[1])
-                and (B[0, 0, 0, 0] != 383)
-            ):  # if it's not a mobile block (agent, speaker, mobs)
-                return height, tuple(B[0, 0, 0])
-            height -= 1
-
-    gx = [0, 0, -1, 1]
-    gz = [1, -1, 0, 0]
-
-    def dfs(x, y, z):
-        """Traverse current connected component and return minimum
-        height of all surrounding blocks"""
-        build_height = 100000
-        if (x, y, z) in visited:
-            return build_height
-        global current_connected_comp, current_idm
-        current_connected_comp.append((x - radius + sx, y, z - radius + sz))  # absolute positions
-        visited.add((x, y, z))
-        for d in range(4):
-            nx = x + gx[d]
-            nz = z + gz[d]
-            if nx >= 0 and nz >= 0 and nx < map_size and nz < map_size:
-                if height_map[x][z] == height_map[nx][nz]:
-                    build_height = min(build_height, dfs(nx, y, nz))
-                else:
-                    build_height = min(build_height, height_map[nx][nz])
-                    current_idm = idm_map[nx][nz]
-            else:
-                # bad ... hole is not within defined radius
-                return -100000
-        return build_height
-
-    # find all holes
-    blocks_queue = []
-    for i in range(map_size):
-        for j in range(map_size):
-            height_map[i][j], idm_map[i][j] = get_block_info(i - radius + sx, j - radius + sz)
-            heapq.heappush(blocks_queue, (height_map[i][j] + 1, (i, height_map[i][j] + 1, j)))
+    height_map, idm_map = get_top_blocks(
+        get_blocks, sx - radius, sz - radius, map_size, max_height, exclude
+    )
+    hid_map = np.full((map_size, map_size), -1)
+    four_connected = get_structure(2, 4)
+    visited = set()
+    blocks_queue = [
+        (height_map[i, j] + 1, (i, height_map[i, j] + 1, j))
+        for i in range(map_size)
+        for j in range(map_size)
+    ]
+    heapq.heapify(blocks_queue)
     holes = []
     while len(blocks_queue) > 0:
-        hxyz = heapq.heappop(blocks_queue)
-        h, (x, y, z) = hxyz  # NB: relative positions
+        h, (x, y, z) = heapq.heappop(blocks_queue)  # NB: relative positions
         if (x, y, z) in visited or y > max_height:
             continue
-        assert h == height_map[x][z] + 1, " h=%d heightmap=%d, x,z=%d,%d" % (
+        assert h == height_map[x, z] + 1, " h=%d heightmap=%d, x,z=%d,%d" % (
             h,
-            height_map[x][z],
+            height_map[x, z],
             x,
             z,
         )  # sanity check
-        current_connected_comp = []
-        current_idm = (2, 0)
-        build_height = dfs(x, y, z)
-        if build_height >= h:
-            holes.append((current_connected_comp.copy(), current_idm))
-            cur_hid = len(holes) - 1
-            for n, xyz in enumerate(current_connected_comp):
-                x, y, z = xyz
-                rx, ry, rz = x - sx + radius, y + 1, z - sz + radius
-                heapq.heappush(blocks_queue, (ry, (rx, ry, rz)))
-                height_map[rx][rz] += 1
-                if hid_map[rx][rz] != -1:
-                    holes[cur_hid][0].extend(holes[hid_map[rx][rz]][0])
-                    holes[hid_map[rx][rz]] = ([], (0, 0))
-                hid_map[rx][rz] = cur_hid
+        region = flood_fill(height_map == height_map[x, z], (x, z), connectivity=4)
+        xs, zs = np.nonzero(region)
+        visited.update((i, y, j) for i, j in zip(xs.tolist(), zs.tolist()))
+        # a region reaching the edge of the map is not known to be enclosed
+        if region[0].any() or region[-1].any() or region[:, 0].any() or region[:, -1].any():
+            continue
+        around = ndimage.binary_dilation(region, structure=four_connected) & ~region
+        around_heights = height_map[around]
+        if around_heights.min() < h:
+            continue
+        # the fill type is a block of the lowest column around the hole
+        ax, az = [v[np.argmin(around_heights)] for v in np.nonzero(around)]
+        holes.append(
+            (
+                [(i - radius + sx, y, j - radius + sz) for i, j in zip(xs.tolist(), zs.tolist())],
+                tuple(idm_map[ax, az].tolist()),
+            )
+        )
+        cur_hid = len(holes) - 1
+        # fill the hole by one level, merging the holes below into this one
+        for old_hid in set(hid_map[region].tolist()) - {-1}:
+            holes[cur_hid][0].extend(holes[old_hid][0])
+            holes[old_hid] = ([], (0, 0))
+        hid_map[region] = cur_hid
+        height_map[region] += 1
+        for i, j in zip(xs.tolist(), zs.tolist()):
+            heapq.heappush(blocks_queue, (y + 1, (i, y + 1, j)))
+    return holes
+
+
+def get_all_nearby_holes(
+    agent, location, block_data, radius=15, store_inst_seg=True, get_blocks=None
+):
+    """get_blocks defaults to agent.get_blocks
+    Returns:
+    a list of holes. Each hole is an InstSegNode"""
+    get_blocks = get_blocks or agent.get_blocks
+    location = tuple(int(v) for v in location)
+    exclude = [location, tuple(int(v) for v in agent.pos)]
+    holes = find_holes(get_blocks, location, radius, exclude)
 
     # A bug in the algorithm above produces holes that include non-air blocks.
     # Just patch the problem here, since this function will eventually be
@@ -530,6 +518,137 @@ def maybe_get_type_name(idm, block_data):
     return type_name
 
 
+class BlockWindow:
+    """A cached cube of blocks of side 2 * radius + 1 around a center, in the yzxb
+    layout of agent.get_blocks.  When the center moves only the slabs newly covered
+    by the window are fetched, and changed blocks are written into the cache as they
+    are reported, so the world is only read once.  The window is split into chunks of
+    side chunk_size, and the chunks changed since the last call to pop_dirty()
+    are tracked.
+
+    Args:
+        get_blocks: a function (xa, xb, ya, yb, za, zb) -> yzxb array, e.g. agent.get_blocks
+        radius (int): half side of the window
+        chunk_size (int): side of the chunks
+
+    Examples::
+        >>> window = BlockWindow(agent.get_blocks, 20)
+        >>> window.move_to(agent.pos)
+        >>> window.on_block_changed((1, 63, 2), (1, 0))
+        >>> dirty = window.pop_dirty()
+        >>> yzxb = window.get_blocks(-5, 5, 60, 65, -5, 5)
+    """
+
+    def __init__(self, get_blocks, radius=MAX_RADIUS, chunk_size=CHUNK_SIZE):
+        self.fetch = get_blocks
+        self.radius = radius
+        self.chunk_size = chunk_size
+        self.center = None
+        self.blocks = None
+        # (cx, cy, cz) indices of the changed chunks, e.g. (0, 7, -1) for x in [0, 8)...
+        self.dirty = set()
+
+    def bounds(self, center=None):
+        """returns the inclusive (mx, Mx, my, My, mz, Mz) of the window around center,
+        by default the current center"""
+        x, y, z = self.center if center is None else center
+        r = self.radius
+        return x - r, x + r, y - r, y + r, z - r, z + r
+
+    def contains(self, xa, xb, ya, yb, za, zb):
+        if self.center is None:
+            return False
+        mx, Mx, my, My, mz, Mz = self.bounds()
+        return mx <= xa and xb <= Mx and my <= ya and yb <= My and mz <= za and zb <= Mz
+
+    def move_to(self, center):
+        """recenter the window, fetching the blocks not covered by the old window"""
+        center = tuple(int(c) for c in center)
+        if center == self.center:
+            return
+        new_bounds = self.bounds(center)
+        side = 2 * self.radius + 1
+        old_center, old_blocks = self.center, self.blocks
+        self.center = center
+        shift = [0, 0, 0] if old_center is None else np.subtract(center, old_center)
+        if old_center is None or any(abs(d) >= side for d in shift):
+            self.blocks = self.fetch(*new_bounds)
+            self.mark_dirty(*new_bounds)
+            return
+        self.blocks = np.zeros((side, side, side) + old_blocks.shape[3:], dtype=old_blocks.dtype)
+        # copy the overlap. the arrays are indexed y, z, x
+        dx, dy, dz = shift
+        new_slices = []
+        old_slices = []
+        for d in (dy, dz, dx):
+            new_slices.append(slice(max(0, -d), side - max(0, d)))
+            old_slices.append(slice(max(0, d), side - max(0, -d)))
+        self.blocks[tuple(new_slices)] = old_blocks[tuple(old_slices)]
+        # fetch the slabs that were not in the old window: first all of x outside the
+        # old window, then y outside it within the overlap in x, then z
+        lo = list(new_bounds[0::2])
+        hi = list(new_bounds[1::2])
+        for axis, d in enumerate(shift):
+            if d == 0:
+                continue
+            slab_lo, slab_hi = list(lo), list(hi)
+            if d > 0:
+                slab_lo[axis] = hi[axis] - d + 1
+                hi[axis] = slab_lo[axis] - 1
+            else:
+                slab_hi[axis] = lo[axis] - d - 1
+                lo[axis] = slab_hi[axis] + 1
+            box = (slab_lo[0], slab_hi[0], slab_lo[1], slab_hi[1], slab_lo[2], slab_hi[2])
+            self._set(box, self.fetch(*box))
+            self.mark_dirty(*box)
+
+    def _set(self, box, yzxb):
+        mx, _, my, _, mz, _ = self.bounds()
+        xa, xb, ya, yb, za, zb = box
+        self.blocks[ya - my : yb - my + 1, za - mz : zb - mz + 1, xa - mx : xb - mx + 1] = yzxb
+
+    def on_block_changed(self, xyz, idm):
+        """write a changed block into the window.  blocks outside are ignored, they
+        are fetched when the window moves over them"""
+        x, y, z = xyz
+        if not self.contains(x, x, y, y, z, z):
+            return
+        self._set((x, x, y, y, z, z), idm)
+        self.mark_dirty(x, x, y, y, z, z)
+
+    def get_blocks(self, xa, xb, ya, yb, za, zb):
+        """same as agent.get_blocks, reading from the window if the box is inside it"""
+        if not self.contains(xa, xb, ya, yb, za, zb):
+            return self.fetch(xa, xb, ya, yb, za, zb)
+        mx, _, my, _, mz, _ = self.bounds()
+        return self.blocks[
+            ya - my : yb - my + 1, za - mz : zb - mz + 1, xa - mx : xb - mx + 1
+        ].copy()
+
+    def chunks(self, xa, xb, ya, yb, za, zb):
+        """returns the indices of the chunks intersecting the box"""
+        c = self.chunk_size
+        return {
+            (i, j, k)
+            for i in range(int(xa) // c, int(xb) // c + 1)
+            for j in range(int(ya) // c, int(yb) // c + 1)
+            for k in range(int(za) // c, int(zb) // c + 1)
+        }
+
+    def mark_dirty(self, xa, xb, ya, yb, za, zb):
+        self.dirty |= self.chunks(xa, xb, ya, yb, za, zb)
+
+    def pop_dirty(self):
+        """returns the set of chunks changed since the last call, and clears it"""
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
+    def is_dirty(self, xyz, dirty):
+        """is the block at xyz in one of the chunks in dirty"""
+        return tuple(int(v) // self.chunk_size for v in xyz) in dirty
+
+
 class PerceptionWrapper:
     """Perceive the world at a given frequency and update agent
     memory.
@@ -545,18 +664,34 @@ class PerceptionWrapper:
     |     a block placement, it would be dealt with via maybe_add_block_to_memory
     |     in low_level_perception.py)
 
+    In incremental mode the blocks around the agent are kept in a BlockWindow, updated
+    with the changed blocks passed to on_block_changed and by fetching the newly visible
+    blocks when the agent moves.  The heuristics only run when a chunk near the agent
+    changed, and only the objects touching a changed chunk or newly reachable
+    are written to memory; when the world is static a perception pass does nothing.
+
     Args:
         agent (LocoMCAgent): reference to the minecraft Agent
         perceive_freq (int): if not forced, how many Agent steps between perception
+        incremental (bool): run the heuristics incrementally.  the agent should call
+            on_block_changed on each changed block
     """
 
-    def __init__(self, agent, low_level_data, perceive_freq=20):
+    def __init__(self, agent, low_level_data, perceive_freq=20, incremental=False):
         self.perceive_freq = perceive_freq
         self.agent = agent
         self.radius = 15
         self.block_data = low_level_data["block_data"]
         self.color_data = low_level_data["color_data"]
         self.block_property_data = low_level_data["block_property_data"]
+        self.incremental = incremental
+        self.window = BlockWindow(agent.get_blocks, MAX_RADIUS) if incremental else None
+        # the accessible-interesting mask of the last incremental pass, and its offset
+        self.last_mask = None
+
+    def on_block_changed(self, xyz, idm):
+        if self.window is not None:
+            self.window.on_block_changed(xyz, idm)
 
     def perceive(self, force=False):
         """Called by the core event loop for the agent to run all perceptual
@@ -571,50 +706,90 @@ class PerceptionWrapper:
         if self.agent.count % self.perceive_freq != 0 and not force:
             return
         if force or not self.agent.memory.task_stack_peek():
-            # perceive blocks in marked areas
-            for pos, radius in self.agent.areas_to_perceive:
-                for obj in all_nearby_objects(self.agent.get_blocks, pos, radius):
-                    memid = BlockObjectNode.create(self.agent.memory, obj)
-                    color_tags = []
-                    for idm in obj:
-                        type_name = maybe_get_type_name(idm, self.block_data)
-                        color_tags.extend(self.color_data["name_to_colors"].get(type_name, []))
-                    for color_tag in list(set(color_tags)):
-                        self.agent.memory.add_triple(
-                            subj=memid, pred_text="has_colour", obj_text=color_tag
-                        )
-
-                get_all_nearby_holes(self.agent, pos, self.block_data, radius)
-                get_nearby_airtouching_blocks(
-                    self.agent,
-                    pos,
-                    self.block_data,
-                    self.color_data,
-                    self.block_property_data,
-                    radius,
-                )
-            # perceive blocks near the agent
-            for objs in all_nearby_objects(self.agent.get_blocks, self.agent.pos):
-                memid = BlockObjectNode.create(self.agent.memory, objs)
-                color_tags = []
-                for obj in objs:
-                    idm = obj[1]
-                    type_name = maybe_get_type_name(idm, self.block_data)
-                    color_tags.extend(self.color_data["name_to_colors"].get(type_name, []))
-                for color_tag in list(set(color_tags)):
-                    self.agent.memory.add_triple(
-                        subj=memid, pred_text="has_colour", obj_text=color_tag
-                    )
-
-            get_all_nearby_holes(self.agent, self.agent.pos, self.block_data, radius=self.radius)
-            get_nearby_airtouching_blocks(
-                self.agent,
-                self.agent.pos,
-                self.block_data,
-                self.color_data,
-                self.block_property_data,
-                radius=self.radius,
-            )
+            # batch all the writes of this perception pass into one transaction
+            with self.agent.memory.transaction():
+                if self.incremental:
+                    self.perceive_incremental()
+                    return
+                # perceive blocks in marked areas
+                for pos, radius in self.agent.areas_to_perceive:
+                    for obj in all_nearby_objects(self.agent.get_blocks, pos, radius):
+                        self.add_object_to_memory(obj)
+                    self.perceive_holes_and_airtouching(pos, radius)
+                # perceive blocks near the agent
+                for obj in all_nearby_objects(self.agent.get_blocks, self.agent.pos):
+                    self.add_object_to_memory(obj)
+                self.perceive_holes_and_airtouching(self.agent.pos, self.radius)
+
+    def perceive_incremental(self):
+        window = self.window
+        window.move_to(self.agent.pos)
+        dirty = window.pop_dirty()
+        # marked areas come from changed blocks, which are already in the window
+        for pos, radius in self.agent.areas_to_perceive:
+            for obj in all_nearby_objects(window.get_blocks, pos, radius):
+                self.add_object_to_memory(obj)
+            self.perceive_holes_and_airtouching(pos, radius, window.get_blocks)
+        if not dirty:
+            return
+
+        pos = np.round(self.agent.pos).astype("int32")
+        mask, off, blocks = all_close_interesting_blocks(window.get_blocks, pos, MAX_RADIUS)
+        newly_accessible = mask & ~self.shift_last_mask(mask.shape, off)
+        self.last_mask = (mask, off)
+        components = connected_components(mask)
+        for obj, component in zip(components_to_blocks(components, off, blocks), components):
+            # objects away from the changes were written to memory by an earlier pass
+            if any(newly_accessible[c] for c in component) or any(
+                window.is_dirty(xyz, dirty) for xyz, _ in obj
+            ):
+                self.add_object_to_memory(obj)
+
+        x, y, z = self.agent.pos
+        r = self.radius
+        if window.chunks(x - r, x + r, y - r, y + r, z - r, z + r) & dirty:
+            self.perceive_holes_and_airtouching(self.agent.pos, r, window.get_blocks)
+
+    def shift_last_mask(self, shape, off):
+        """returns the mask of the last incremental pass in the frame of a mask
+        with the given shape and offset"""
+        shifted = np.zeros(shape, dtype="bool")
+        if self.last_mask is None:
+            return shifted
+        last, last_off = self.last_mask
+        new_slices = []
+        old_slices = []
+        for i in range(3):
+            d = off[i] - last_off[i]
+            lo = max(0, -d)
+            hi = min(shape[i], last.shape[i] - d)
+            if hi <= lo:
+                return shifted
+            new_slices.append(slice(lo, hi))
+            old_slices.append(slice(lo + d, hi + d))
+        shifted[tuple(new_slices)] = last[tuple(old_slices)]
+        return shifted
+
+    def add_object_to_memory(self, obj):
+        memid = BlockObjectNode.create(self.agent.memory, obj)
+        color_tags = []
+        for _, idm in obj:
+            type_name = maybe_get_type_name(idm, self.block_data)
+            color_tags.extend(self.color_data["name_to_colors"].get(type_name, []))
+        for color_tag in list(set(color_tags)):
+            self.agent.memory.add_triple(subj=memid, pred_text="has_colour", obj_text=color_tag)
+
+    def perceive_holes_and_airtouching(self, pos, radius, get_blocks=None):
+        get_all_nearby_holes(self.agent, pos, self.block_data, radius, get_blocks=get_blocks)
+        get_nearby_airtouching_blocks(
+            self.agent,
+            pos,
+            self.block_data,
+            self.color_data,
+            self.block_property_data,
+            radius,
+            get_blocks=get_blocks,
+        )
 
 
 def build_safe_diag_adjacent(bounds):
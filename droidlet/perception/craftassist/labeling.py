@@ -0,0 +1,92 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+
+Connected component labeling of block arrays with scipy.ndimage, used by
+heuristic_perception instead of walking the voxels with depth_first_search.
+"""
+import numpy as np
+from scipy import ndimage
+
+# (rank of the array, connectivity) -> maximum number of coordinates that can differ
+# between two neighbours, as in scipy.ndimage.generate_binary_structure
+CONNECTIVITY_RANK = {(2, 4): 1, (2, 8): 2, (3, 6): 1, (3, 18): 2, (3, 26): 3}
+
+
+def get_structure(ndim, connectivity):
+    """returns the scipy.ndimage structuring element for connectivity 4 or 8 in 2d,
+    and 6, 18 or 26 in 3d"""
+    rank = CONNECTIVITY_RANK.get((ndim, connectivity))
+    if rank is None:
+        raise ValueError("bad connectivity {} for a rank {} array".format(connectivity, ndim))
+    return ndimage.generate_binary_structure(ndim, rank)
+
+
+def label_blocks(X, connectivity=26, unique_idm=False):
+    """Label the connected nonzero components of a block array X.
+    X is either rank 3 (volume) or rank 4 (volume-idm).
+    If unique_idm == True, neighbouring blocks with a different (id, meta)
+    are in different components
+
+    Returns:
+        labels: an int array with X's first three dimensions, 0 for air and
+            1, ..., n for the components, numbered in raster order of their first block
+        n: the number of components
+    """
+    if X.ndim == 3:
+        X = np.expand_dims(X, axis=3)
+    structure = get_structure(3, connectivity)
+    nonzero = X[:, :, :, 0] != 0
+    if not unique_idm:
+        return ndimage.label(nonzero, structure=structure)
+    # label each (id, meta) separately and merge the labels
+    keys = np.zeros(X.shape[:3], dtype="int64")
+    for i in range(X.shape[3]):
+        keys = keys * 65536 + X[:, :, :, i].astype("int64")
+    labels = np.zeros(X.shape[:3], dtype="int64")
+    n = 0
+    for key in np.unique(keys[nonzero]):
+        key_labels, key_n = ndimage.label(keys == key, structure=structure)
+        labels[key_labels > 0] = key_labels[key_labels > 0] + n
+        n += key_n
+    return renumber_raster_order(labels, n), n
+
+
+def renumber_raster_order(labels, n):
+    """renumber the nonzero labels so they are increasing in raster order of their first index"""
+    flat = labels.ravel()
+    nonzero = np.flatnonzero(flat)
+    _, first = np.unique(flat[nonzero], return_index=True)
+    order = np.argsort(first)
+    new_label = np.zeros(n + 1, dtype=labels.dtype)
+    new_label[order + 1] = np.arange(1, n + 1)
+    return new_label[labels]
+
+
+def components_from_labels(labels, n):
+    """Returns a list with a list of the index tuples of each component, in label order"""
+    if n == 0:
+        return []
+    flat = labels.ravel()
+    idx = np.flatnonzero(flat)
+    # group the indices by label, keeping the raster order in each group
+    idx = idx[np.argsort(flat[idx], kind="stable")]
+    counts = np.bincount(flat[idx], minlength=n + 1)[1:]
+    coords = np.stack(np.unravel_index(idx, labels.shape), axis=1).tolist()
+    components = []
+    start = 0
+    for c in counts:
+        components.append([tuple(p) for p in coords[start : start + c]])
+        start += c
+    return components
+
+
+def flood_fill(mask, pos, connectivity=6):
+    """Returns a boolean array, True at the positions of mask connected to pos.
+    mask can be 2d (connectivity 4 or 8) or 3d (connectivity 6, 18 or 26).
+    if mask is False at pos, nothing is filled"""
+    pos = tuple(pos)
+    filled = np.zeros(mask.shape, dtype="bool")
+    if not mask[pos]:
+        return filled
+    labels, _ = ndimage.label(mask, structure=get_structure(mask.ndim, connectivity))
+    return labels == labels[pos]
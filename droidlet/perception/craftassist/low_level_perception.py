@@ -35,6 +35,10 @@ class LowLevelMCPerception:
     Args:
         agent (LocoMCAgent): reference to the minecraft Agent
         perceive_freq (int): if not forced, how many Agent steps between perception
+
+    Attributes:
+        block_change_listeners (list): functions (xyz, idm) called on each changed block,
+            e.g. the on_block_changed of an incremental heuristic PerceptionWrapper
     """
 
     def __init__(self, agent, perceive_freq=5):
@@ -42,6 +46,7 @@ class LowLevelMCPerception:
         self.memory = agent.memory
         self.pending_agent_placed_blocks = set()
         self.perceive_freq = perceive_freq
+        self.block_change_listeners = []
 
     def perceive(self, force=False):
         """
@@ -83,8 +88,9 @@ class LowLevelMCPerception:
         self.update_other_players(self.agent.get_other_players())
 
         # use safe_get_changed_blocks to deal with pointing
-        for (xyz, idm) in self.agent.safe_get_changed_blocks():
-            self.on_block_changed(xyz, idm)
+        with self.memory.transaction():
+            for (xyz, idm) in self.agent.safe_get_changed_blocks():
+                self.on_block_changed(xyz, idm)
 
     def update_self_memory(self):
         """Update agent's current position and attributes in memory"""
@@ -148,6 +154,23 @@ class LowLevelMCPerception:
         self.maybe_remove_inst_seg(xyz)
         self.maybe_remove_block_from_memory(xyz, idm)
         self.maybe_add_block_to_memory(xyz, idm)
+        for listener in self.block_change_listeners:
+            listener(xyz, idm)
+
+    def drain_changed_blocks(self):
+        """Get the blocks changed since they were last read, and pass them to the
+        block_change_listeners.  Tasks which update the memory themselves after changing
+        the world (e.g. Build) drain the changes with this instead of
+        agent.get_changed_blocks, so that the listeners still see the agent's own changes.
+
+        Returns:
+            list of (xyz, idm) of the changed blocks
+        """
+        blocks = self.agent.get_changed_blocks()
+        for xyz, idm in blocks:
+            for listener in self.block_change_listeners:
+                listener(xyz, idm)
+        return blocks
 
     def clear_air_surrounded_negatives(self):
         pass
@@ -215,10 +238,7 @@ class LowLevelMCPerception:
             self.memory.set_memory_attended_time(chosen_memid)
 
             # merge tags
-            where = " OR ".join(["subj=?"] * len(adjacent_memids))
-            self.memory.db_write(
-                "UPDATE Triples SET subj=? WHERE " + where, chosen_memid, *adjacent_memids
-            )
+            self.memory.merge_triples(adjacent_memids, chosen_memid)
 
             # merge multiple block objects (will delete old ones)
             where = " OR ".join(["uuid=?"] * len(adjacent_memids))
@@ -2,10 +2,10 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 
-import heapq
 import logging
 import numpy as np
 import time
+from collections import OrderedDict
 
 from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import PASSABLE_BLOCKS
 from droidlet.lowlevel.minecraft.mc_util import adjacent, manhat_dist
@@ -44,8 +44,18 @@ def depth_first_search(blocks_shape, pos, fn, adj_fn=adjacent):
     return visited
 
 
+# margin around the start and the target of the box searched by astar
+ASTAR_MARGIN = 10
+# side of the cubes of blocks cached by PathFinder
+PATH_CHUNK_SIZE = 16
+# side of the cells of the coarse grid of the hierarchical search
+COARSE_CELL_SIZE = 8
+
+
 def astar(agent, target, approx=0, pos="agent"):
     """Find a path from the agent's pos to the target.
+    If the agent has a PathFinder in agent.path_finder, it is used, so
+    the blocks it has cached are not read again.
 
     Args:
     - agent: the Agent object
@@ -53,28 +63,177 @@ def astar(agent, target, approx=0, pos="agent"):
     - approx: proximity to target before search is complete (0 = exact)
     - pos: (optional) checks path from specified tuple
 
-    Returns: a list of (x, y, z) positions from start to target
+    Returns: a list of (x, y, z) positions from target to start
     """
-    t_start = time.time()
     if type(pos) is str and pos == "agent":
         pos = agent.pos
-    logging.debug("A* from {} -> {} ± {}".format(pos, target, approx))
+    path_finder = getattr(agent, "path_finder", None) or PathFinder(agent.get_blocks, max_chunks=0)
+    return path_finder.find_path(pos, target, approx)
+
 
-    corners = np.array([pos, target]).astype("int32")
-    mx, my, mz = corners.min(axis=0) - 10
-    Mx, My, Mz = corners.max(axis=0) + 10
-    my, My = max(my, 0), min(My, 255)
-    blocks = agent.get_blocks(mx, Mx, my, My, mz, Mz)
-    obstacles = np.isin(blocks[:, :, :, 0], PASSABLE_BLOCKS, invert=True)
-    obstacles = obstacles[:-1, :, :] | obstacles[1:, :, :]  # check head and feet
-    start, goal = (corners - [mx, my, mz])[:, [1, 2, 0]]
-    path = _astar(obstacles, start, goal, approx)
-    if path is not None:
-        path = [(p[2] + mx, p[0] + my, p[1] + mz) for p in reversed(path)]
+class PathFinder:
+    """A* path finding for agents two blocks high, on a grid of the blocks that can be
+    walked through.  The grid is read from the world in cubes of chunk_size blocks which
+    are cached, and kept up to date by on_block_changed; so repeated searches in the same
+    area do not read the world again.
+
+    Long paths can optionally be found hierarchically: first on a coarse grid of cells of
+    COARSE_CELL_SIZE blocks, then on the blocks of the cells along the coarse path.  The
+    path found this way may not be the shortest.
+
+    Args:
+        get_blocks: a function (xa, xb, ya, yb, za, zb) -> yzxb array, e.g. agent.get_blocks
+        max_chunks (int): maximum number of chunks cached.  if 0, nothing is cached
+        chunk_size (int): side of the cached chunks
+        hierarchical_min_dist (int): search hierarchically when the manhattan distance
+            between start and target is at least this.  if None, never
+
+    Examples::
+        >>> path_finder = PathFinder(agent.get_blocks)
+        >>> path = path_finder.find_path((0, 63, 0), (10, 63, 5))
+        >>> path_finder.on_block_changed((3, 63, 2), (1, 0))
+        >>> paths = path_finder.find_paths([((0, 63, 0), (10, 63, 5), 0), ((4, 63, 4), (0, 63, 0), 1)])
+    """
 
-    t_elapsed = time.time() - t_start
-    logging.debug("A* returned {}-len path in {}".format(len(path) if path else "None", t_elapsed))
-    return path
+    def __init__(
+        self, get_blocks, max_chunks=8192, chunk_size=PATH_CHUNK_SIZE, hierarchical_min_dist=None
+    ):
+        self.get_blocks = get_blocks
+        self.max_chunks = max_chunks
+        self.chunk_size = chunk_size
+        self.hierarchical_min_dist = hierarchical_min_dist
+        # (cx, cy, cz) -> yzx bool array, True where the block is not passable
+        self.chunks = OrderedDict()
+
+    def on_block_changed(self, xyz, idm):
+        x, y, z = xyz
+        c = self.chunk_size
+        chunk = self.chunks.get((x // c, y // c, z // c))
+        if chunk is not None:
+            chunk[y % c, z % c, x % c] = idm[0] not in PASSABLE_BLOCKS
+
+    def clear(self):
+        self.chunks.clear()
+
+    def get_blocked(self, mx, Mx, my, My, mz, Mz):
+        """returns a yzx bool array of the box, True where the block is not passable"""
+        if self.max_chunks <= 0:
+            blocks = self.get_blocks(mx, Mx, my, My, mz, Mz)
+            return np.isin(blocks[:, :, :, 0], PASSABLE_BLOCKS, invert=True)
+        c = self.chunk_size
+        keys = [
+            (i, j, k)
+            for i in range(mx // c, Mx // c + 1)
+            for j in range(my // c, My // c + 1)
+            for k in range(mz // c, Mz // c + 1)
+        ]
+        missing = [key for key in keys if key not in self.chunks]
+        if missing:
+            # read all the missing chunks at once
+            lo = np.min(missing, axis=0) * c
+            hi = (np.max(missing, axis=0) + 1) * c - 1
+            blocks = self.get_blocks(lo[0], hi[0], lo[1], hi[1], lo[2], hi[2])
+            blocked = np.isin(blocks[:, :, :, 0], PASSABLE_BLOCKS, invert=True)
+            for i, j, k in missing:
+                y, z, x = j * c - lo[1], k * c - lo[2], i * c - lo[0]
+                self.chunks[(i, j, k)] = blocked[y : y + c, z : z + c, x : x + c].copy()
+        out = np.empty((My - my + 1, Mz - mz + 1, Mx - mx + 1), dtype="bool")
+        for key in keys:
+            self.chunks.move_to_end(key)
+            i, j, k = key
+            # the intersection of the chunk and the box
+            x0, y0, z0 = max(i * c, mx), max(j * c, my), max(k * c, mz)
+            x1, y1, z1 = min(i * c + c - 1, Mx), min(j * c + c - 1, My), min(k * c + c - 1, Mz)
+            out[y0 - my : y1 - my + 1, z0 - mz : z1 - mz + 1, x0 - mx : x1 - mx + 1] = self.chunks[
+                key
+            ][y0 - j * c : y1 - j * c + 1, z0 - k * c : z1 - k * c + 1, x0 - i * c : x1 - i * c + 1]
+        while len(self.chunks) > max(self.max_chunks, len(keys)):
+            self.chunks.popitem(last=False)
+        return out
+
+    def find_path(self, pos, target, approx=0, hierarchical=None):
+        """Find a path from pos to the target.
+
+        Args:
+        - pos, target: absolute (x, y, z)
+        - approx: proximity to target before search is complete (0 = exact)
+        - hierarchical: search on the coarse grid first.  if None, only if
+            the target is at least hierarchical_min_dist away
+
+        Returns: a list of (x, y, z) positions from target to pos (so the next step
+            is popped from the end), or None if there is no path
+        """
+        t_start = time.time()
+        logging.debug("A* from {} -> {} ± {}".format(pos, target, approx))
+        corners = np.array([pos, target]).astype("int32")
+        mx, my, mz = corners.min(axis=0) - ASTAR_MARGIN
+        Mx, My, Mz = corners.max(axis=0) + ASTAR_MARGIN
+        my, My = max(my, 0), min(My, 255)
+        obstacles = self.get_blocked(mx, Mx, my, My, mz, Mz)
+        obstacles = obstacles[:-1, :, :] | obstacles[1:, :, :]  # check head and feet
+        start, goal = (corners - [mx, my, mz])[:, [1, 2, 0]]
+        if hierarchical is None:
+            hierarchical = (
+                self.hierarchical_min_dist is not None
+                and manhat_dist(start, goal) >= self.hierarchical_min_dist
+            )
+        path = None
+        if hierarchical:
+            path = _hierarchical_astar(obstacles, start, goal, approx)
+        if path is None:
+            path = _astar(obstacles, start, goal, approx)
+        if path is not None:
+            path = [(p[2] + mx, p[0] + my, p[1] + mz) for p in reversed(path)]
+
+        t_elapsed = time.time() - t_start
+        logging.debug(
+            "A* returned {}-len path in {}".format(len(path) if path else "None", t_elapsed)
+        )
+        return path
+
+    def find_paths(self, requests):
+        """Find paths for several agents.  requests is a list of (pos, target, approx);
+        the requests share the cached blocks, and identical requests are only searched once.
+
+        Returns: a list with the path for each request, as in find_path
+        """
+        paths = {}
+        out = []
+        for pos, target, approx in requests:
+            key = (tuple(int(v) for v in pos), tuple(int(v) for v in target), approx)
+            if key not in paths:
+                paths[key] = self.find_path(pos, target, approx)
+            path = paths[key]
+            out.append(None if path is None else list(path))
+        return out
+
+
+def _hierarchical_astar(X, start, goal, approx=0, cell_size=COARSE_CELL_SIZE):
+    """Find a path through X from start to goal through the cells of a coarse
+    grid on a path between the cells of start and goal.  A coarse cell can be walked
+    through if any of its blocks can.
+
+    Returns: a list of relative positions, from start to goal, or None if
+    there is no path through the cells found
+    """
+    c = cell_size
+    shape = np.array(X.shape)
+    coarse_shape = -(-shape // c)
+    padded = np.ones(coarse_shape * c, dtype="bool")
+    padded[: shape[0], : shape[1], : shape[2]] = X
+    coarse = padded.reshape(
+        coarse_shape[0], c, coarse_shape[1], c, coarse_shape[2], c
+    ).all(axis=(1, 3, 5))
+    coarse_path = _astar(coarse, np.array(start) // c, np.array(goal) // c, approx // c)
+    if coarse_path is None:
+        return None
+    # the cells on the coarse path and their neighbours
+    corridor = np.zeros(coarse_shape, dtype="bool")
+    for p in coarse_path:
+        corridor[tuple(slice(max(v - 1, 0), v + 2) for v in p)] = True
+    corridor = corridor.repeat(c, axis=0).repeat(c, axis=1).repeat(c, axis=2)
+    corridor = corridor[: shape[0], : shape[1], : shape[2]]
+    return _astar(X | ~corridor, start, goal, approx)
 
 
 def _astar(X, start, goal, approx=0):
@@ -87,79 +246,131 @@ def _astar(X, start, goal, approx=0):
 
     Returns: a list of relative positions, from start to goal
     """
-    start = tuple(start)
-    goal = tuple(goal)
+    start = tuple(int(v) for v in start)
+    goal = tuple(int(v) for v in goal)
+    # positions are flat indices into X, which sort the same as the index tuples
+    d0, d1, d2 = X.shape
+    s0 = d1 * d2
+    blocked = X.ravel()
+    g0, g1, g2 = goal
+    start_i = start[0] * s0 + start[1] * d2 + start[2]
 
     visited = set()
     came_from = {}
-    q = PriorityQueue()
-    q.push(start, manhat_dist(start, goal))
-    G = np.full_like(X, np.iinfo(np.uint32).max, "uint32")
-    G[start] = 0
+    G = {start_i: 0}
+    q = IndexedHeap()
+    q.push(start_i, manhat_dist(start, goal))
 
     while len(q) > 0:
-        _, p = q.pop()
+        _, i = q.pop()
+        p0, r = divmod(i, s0)
+        p1, p2 = divmod(r, d2)
 
-        if manhat_dist(p, goal) <= approx:
+        if abs(p0 - g0) + abs(p1 - g1) + abs(p2 - g2) <= approx:
             path = []
-            while p in came_from:
-                path.append(p)
-                p = came_from[p]
-            return [start] + list(reversed(path))
-
-        visited.add(p)
-        for a in adjacent(p):
-            if (
-                a in visited
-                or a[0] < 0
-                or a[0] >= X.shape[0]
-                or a[1] < 0
-                or a[1] >= X.shape[1]
-                or a[2] < 0
-                or a[2] >= X.shape[2]
-                or X[a]
-            ):
+            while i in came_from:
+                path.append(i)
+                i = came_from[i]
+            return [start] + [
+                (j // s0, (j % s0) // d2, j % d2) for j in reversed(path)
+            ]
+
+        visited.add(i)
+        g = G[i] + 1
+        for ok, j, a0, a1, a2 in (
+            (p0 + 1 < d0, i + s0, p0 + 1, p1, p2),
+            (p0 > 0, i - s0, p0 - 1, p1, p2),
+            (p1 + 1 < d1, i + d2, p0, p1 + 1, p2),
+            (p1 > 0, i - d2, p0, p1 - 1, p2),
+            (p2 + 1 < d2, i + 1, p0, p1, p2 + 1),
+            (p2 > 0, i - 1, p0, p1, p2 - 1),
+        ):
+            if not ok or j in visited or blocked[j]:
                 continue
-
-            g = G[p] + 1
-            if g >= G[a]:
+            if g >= G.get(j, g + 1):
                 continue
-            came_from[a] = p
-            G[a] = g
-            f = g + manhat_dist(a, goal)
-            if q.contains(a):
-                q.replace(a, f)
+            came_from[j] = i
+            G[j] = g
+            f = g + abs(a0 - g0) + abs(a1 - g1) + abs(a2 - g2)
+            if q.contains(j):
+                q.replace(j, f)
             else:
-                q.push(a, f)
+                q.push(j, f)
 
     return None
 
 
-class PriorityQueue:
+class IndexedHeap:
+    """A binary min-heap of (priority, item) pairs, with an index from the items to their
+    position in the heap, so contains is O(1) and replace (changing the priority of an item)
+    is O(log n).  Items must be hashable, and ties are broken by comparing the items."""
+
     def __init__(self):
         self.q = []
-        self.set = set()
+        self.index = {}
 
     def push(self, x, prio):
-        heapq.heappush(self.q, (prio, x))
-        self.set.add(x)
+        self.q.append((prio, x))
+        self.index[x] = len(self.q) - 1
+        self._sift_up(len(self.q) - 1)
 
     def pop(self):
-        prio, x = heapq.heappop(self.q)
-        self.set.remove(x)
-        return prio, x
+        q = self.q
+        top = q[0]
+        last = q.pop()
+        del self.index[top[1]]
+        if q:
+            q[0] = last
+            self.index[last[1]] = 0
+            self._sift_down(0)
+        return top
 
     def contains(self, x):
-        return x in self.set
+        return x in self.index
 
     def replace(self, x, newp):
-        for i in range(len(self.q)):
-            oldp, y = self.q[i]
-            if x == y:
-                self.q[i] = (newp, x)
-                heapq.heapify(self.q)  # TODO: probably slow
-                return
-        raise ValueError("Not found: {}".format(x))
+        i = self.index.get(x)
+        if i is None:
+            raise ValueError("Not found: {}".format(x))
+        old = self.q[i]
+        self.q[i] = (newp, x)
+        if (newp, x) < old:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def _sift_up(self, i):
+        q, index = self.q, self.index
+        item = q[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if item < q[parent]:
+                q[i] = q[parent]
+                index[q[i][1]] = i
+                i = parent
+            else:
+                break
+        q[i] = item
+        index[item[1]] = i
+
+    def _sift_down(self, i):
+        q, index = self.q, self.index
+        n = len(q)
+        item = q[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and q[child + 1] < q[child]:
+                child += 1
+            if q[child] < item:
+                q[i] = q[child]
+                index[q[i][1]] = i
+                i = child
+            else:
+                break
+        q[i] = item
+        index[item[1]] = i
 
     def __len__(self):
         return len(self.q)
@@ -176,4 +387,4 @@ if __name__ == "__main__":
     ]
     start = (3, 4, 0)
     goal = (3, 1, 0)
-    print(astar(X, start, goal))
+    print(_astar(X, start, goal))
@@ -0,0 +1,141 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import unittest
+import logging
+import random
+from timeit import Timer
+import numpy as np
+from droidlet.lowlevel.minecraft import craftassist_specs
+from droidlet.memory.craftassist.mc_memory import MCAgentMemory
+from droidlet.perception.craftassist.heuristic_perception import BlockWindow, PerceptionWrapper
+from agents.craftassist.tests.world import World, Opt, flat_ground_generator
+
+
+def make_world():
+    spec = {
+        "players": [],
+        "mobs": [],
+        "item_stacks": [],
+        "ground_generator": flat_ground_generator,
+        "agent": {"pos": (0, 63, 0)},
+        "coord_shift": (-32, 40, -32),
+    }
+    world_opts = Opt()
+    world_opts.sl = 64
+    return World(world_opts, spec)
+
+
+class PerceptionAgent:
+    """the parts of the agent used by the heuristic perception, counting the world reads"""
+
+    def __init__(self, world, pos=(0, 63, 0)):
+        self.world = world
+        self.memory = MCAgentMemory()
+        self.pos = np.array(pos)
+        self.count = 0
+        self.areas_to_perceive = []
+        self.reads = 0
+
+    def get_blocks(self, xa, xb, ya, yb, za, zb):
+        self.reads += 1
+        return self.world.get_blocks(xa, xb, ya, yb, za, zb)
+
+
+def block_objects(memory):
+    r = memory._db_read("SELECT x, y, z, bid FROM VoxelObjects WHERE ref_type='BlockObjects'")
+    return set(r)
+
+
+class BlockWindowTest(unittest.TestCase):
+    def test_window(self):
+        random.seed(0)
+        world = make_world()
+        agent = PerceptionAgent(world)
+        window = BlockWindow(agent.get_blocks, radius=6, chunk_size=4)
+        pos = np.array((0, 63, 0))
+        for i in range(30):
+            pos = pos + [random.randint(-3, 3) for _ in range(3)]
+            window.move_to(pos)
+            for j in range(5):
+                xyz = tuple(pos + [random.randint(-8, 8) for _ in range(3)])
+                idm = (random.choice([0, 1, 2, 5]), 0)
+                world.place_block((xyz, idm))
+                window.on_block_changed(xyz, idm)
+                if window.contains(*[c for c in xyz for _ in range(2)]):
+                    assert window.is_dirty(xyz, window.dirty)
+            window.pop_dirty()
+            reads = agent.reads
+            blocks = window.get_blocks(*window.bounds())
+            assert agent.reads == reads
+            assert (blocks == world.get_blocks(*window.bounds())).all()
+        window.move_to(pos + (100, 0, 0))
+        assert (window.get_blocks(*window.bounds()) == world.get_blocks(*window.bounds())).all()
+
+
+class IncrementalPerceptionTest(unittest.TestCase):
+    def setUp(self):
+        self.low_level_data = {
+            "block_data": craftassist_specs.get_block_data(),
+            "color_data": craftassist_specs.get_colour_data(),
+            "block_property_data": craftassist_specs.get_block_property_data(),
+        }
+        self.world = make_world()
+        for x in range(3, 6):
+            for y in range(63, 65):
+                self.world.place_block(((x, y, 4), (5, 0)))
+        self.world.place_block(((-4, 63, -6), (35, 14)))
+
+    def perceive(self, agent, incremental):
+        perception = PerceptionWrapper(agent, self.low_level_data, incremental=incremental)
+        perception.perceive(force=True)
+        return perception
+
+    def test_parity(self):
+        full = PerceptionAgent(self.world)
+        self.perceive(full, incremental=False)
+        agent = PerceptionAgent(self.world)
+        perception = self.perceive(agent, incremental=True)
+        assert block_objects(agent.memory) == block_objects(full.memory)
+        assert len(block_objects(agent.memory)) == 7
+
+        # nothing changed, nothing is read or written
+        agent.reads = 0
+        statements = []
+        agent.memory.db.set_trace_callback(statements.append)
+        perception.perceive(force=True)
+        agent.memory.db.set_trace_callback(None)
+        assert agent.reads == 0
+        assert not [s for s in statements if not s.startswith("SELECT")]
+
+        # a changed block is written into the window and perceived
+        block = ((-5, 63, 7), (57, 0))
+        self.world.place_block(block)
+        perception.on_block_changed(*block)
+        perception.perceive(force=True)
+        assert (-5, 63, 7, 57) in block_objects(agent.memory)
+
+        # moving reads only the newly visible slab of the window
+        self.world.place_block(((25, 63, 0), (57, 0)))
+        agent.pos = agent.pos + (6, 0, 0)
+        agent.reads = 0
+        perception.window.move_to(agent.pos)
+        assert agent.reads == 1
+        perception.perceive(force=True)
+        assert (25, 63, 0, 57) in block_objects(agent.memory)
+
+    def test_time(self):
+        agent = PerceptionAgent(self.world)
+        perception = self.perceive(agent, incremental=True)
+        full = PerceptionWrapper(agent, self.low_level_data)
+        full_time = Timer(lambda: full.perceive(force=True)).timeit(number=1)
+        static_time = Timer(lambda: perception.perceive(force=True)).timeit(number=1)
+        logging.info(
+            "heuristic perception of a static world: {} s full, {} s incremental".format(
+                full_time, static_time
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,239 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import heapq
+import unittest
+import logging
+import random
+from timeit import Timer
+import numpy as np
+from droidlet.lowlevel.minecraft.mc_util import adjacent
+from droidlet.lowlevel.minecraft.craftassist_cuberite_utils.block_data import (
+    BORING_BLOCKS,
+    PASSABLE_BLOCKS,
+)
+from droidlet.perception.craftassist.search import depth_first_search
+from droidlet.perception.craftassist.heuristic_perception import (
+    connected_components,
+    accessible_interesting_blocks,
+    find_holes,
+    build_safe_diag_adjacent,
+)
+from droidlet.perception.craftassist.tests.test_heuristic_perception import make_world
+
+
+# the depth first search implementations replaced by the labeling, as references
+
+
+def safe_adjacent(shape):
+    # depth_first_search only catches the IndexErrors past the end of the array,
+    # so with mc_util.adjacent a search reaching index 0 wraps around to the last index
+    def a(p):
+        return [q for q in adjacent(p) if all(0 <= q[i] < shape[i] for i in range(3))]
+
+    return a
+
+
+def dfs_connected_components(X, unique_idm=False, adj_fn=None):
+    visited = np.zeros((X.shape[0], X.shape[1], X.shape[2]), dtype="bool")
+    components = []
+    current_component = set()
+    if adj_fn is None:
+        adj_fn = build_safe_diag_adjacent([0, X.shape[0], 0, X.shape[1], 0, X.shape[2]])
+    if len(X.shape) == 3:
+        X = np.expand_dims(X, axis=3)
+
+    def _build_fn(idm):
+        def _fn(p):
+            if (not unique_idm and X[p[0], p[1], p[2], 0]) or tuple(X[p]) == idm:
+                current_component.add(p)
+                return True
+
+        return _fn
+
+    for i in range(visited.shape[0]):
+        for j in range(visited.shape[1]):
+            for k in range(visited.shape[2]):
+                if visited[i, j, k]:
+                    continue
+                visited[i, j, k] = True
+                if X[i, j, k, 0] == 0:
+                    continue
+                _fn = _build_fn(tuple(X[i, j, k, :]))
+                visited |= depth_first_search(X.shape[:3], (i, j, k), _fn, adj_fn)
+                components.append(list(current_component))
+                current_component.clear()
+    return components
+
+
+def dfs_accessible_interesting_blocks(blocks, pos):
+    passable = np.isin(blocks, PASSABLE_BLOCKS)
+    interesting = np.isin(blocks, BORING_BLOCKS, invert=True)
+    passable_or_interesting = passable | interesting
+    X = np.zeros_like(passable)
+
+    def _fn(p):
+        if passable_or_interesting[p]:
+            X[p] = True
+            return True
+        return False
+
+    depth_first_search(blocks.shape[:3], pos, _fn, safe_adjacent(blocks.shape))
+    return X & interesting
+
+
+def dfs_find_holes(get_blocks, location, radius, exclude):
+    sx, sy, sz = location
+    max_height = sy + 5
+    map_size = radius * 2 + 1
+    height_map = [[sz] * map_size for i in range(map_size)]
+    hid_map = [[-1] * map_size for i in range(map_size)]
+    idm_map = [[(0, 0)] * map_size for i in range(map_size)]
+    visited = set([])
+    comp = []
+
+    def get_block_info(x, z):
+        height = max_height
+        while True:
+            B = get_blocks(x, x, height, height, z, z)
+            if (B[0, 0, 0, 0] != 0) and (x, height, z) not in exclude and B[0, 0, 0, 0] != 383:
+                return height, tuple(B[0, 0, 0])
+            height -= 1
+
+    def dfs(x, y, z):
+        build_height = 100000
+        if (x, y, z) in visited:
+            return build_height
+        comp.append((x - radius + sx, y, z - radius + sz))
+        visited.add((x, y, z))
+        for nx, nz in [(x, z + 1), (x, z - 1), (x - 1, z), (x + 1, z)]:
+            if nx >= 0 and nz >= 0 and nx < map_size and nz < map_size:
+                if height_map[x][z] == height_map[nx][nz]:
+                    build_height = min(build_height, dfs(nx, y, nz))
+                else:
+                    build_height = min(build_height, height_map[nx][nz])
+            else:
+                return -100000
+        return build_height
+
+    blocks_queue = []
+    for i in range(map_size):
+        for j in range(map_size):
+            height_map[i][j], idm_map[i][j] = get_block_info(i - radius + sx, j - radius + sz)
+            heapq.heappush(blocks_queue, (height_map[i][j] + 1, (i, height_map[i][j] + 1, j)))
+    holes = []
+    while len(blocks_queue) > 0:
+        h, (x, y, z) = heapq.heappop(blocks_queue)
+        if (x, y, z) in visited or y > max_height:
+            continue
+        comp.clear()
+        build_height = dfs(x, y, z)
+        if build_height >= h:
+            holes.append(comp.copy())
+            cur_hid = len(holes) - 1
+            for x, y, z in comp:
+                rx, ry, rz = x - sx + radius, y + 1, z - sz + radius
+                heapq.heappush(blocks_queue, (ry, (rx, ry, rz)))
+                height_map[rx][rz] += 1
+                if hid_map[rx][rz] != -1:
+                    holes[cur_hid].extend(holes[hid_map[rx][rz]])
+                    holes[hid_map[rx][rz]] = []
+                hid_map[rx][rz] = cur_hid
+    return holes
+
+
+def random_blocks(shape, density, idms):
+    X = np.zeros(shape + (2,), dtype="uint8")
+    filled = np.random.rand(*shape) < density
+    choices = np.array(idms, dtype="uint8")
+    X[filled] = choices[np.random.randint(len(idms), size=filled.sum())]
+    return X
+
+
+def as_sets(components):
+    return sorted(sorted(tuple(int(i) for i in p) for p in c) for c in components)
+
+
+class LabelingTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        random.seed(0)
+
+    def test_connected_components(self):
+        for density in [0.05, 0.2, 0.4]:
+            X = random_blocks((12, 10, 11), density, [(1, 0), (2, 0), (35, 3)])
+            old = dfs_connected_components(X)
+            new = connected_components(X)
+            assert as_sets(old) == as_sets(new)
+            # same order: by first index in raster order
+            assert [min(c) for c in old] == [c[0] for c in new]
+            six = dfs_connected_components(X, adj_fn=safe_adjacent(X.shape))
+            assert as_sets(six) == as_sets(connected_components(X, connectivity=6))
+            three_d = X[:, :, :, 0]
+            assert as_sets(connected_components(three_d)) == as_sets(new)
+
+    def test_unique_idm(self):
+        # the depth first search marks the neighbours of a component with another
+        # idm as visited, so compare with the components of each idm separately
+        X = random_blocks((10, 10, 10), 0.3, [(1, 0), (2, 0), (2, 1)])
+        new = connected_components(X, unique_idm=True)
+        expected = []
+        for idm in [(1, 0), (2, 0), (2, 1)]:
+            is_idm = (X[:, :, :, 0] == idm[0]) & (X[:, :, :, 1] == idm[1])
+            expected.extend(dfs_connected_components(is_idm))
+        assert as_sets(new) == as_sets(expected)
+        for c in new:
+            assert len({tuple(X[p]) for p in c}) == 1
+        assert [c[0] for c in new] == sorted(c[0] for c in new)
+
+    def test_accessible_interesting_blocks(self):
+        for density in [0.2, 0.5, 0.7]:
+            X = random_blocks((15, 15, 15), density, [(1, 0), (3, 0), (46, 0), (31, 0)])
+            blocks = X[:, :, :, 0]
+            pos = (7, 7, 7)
+            old = dfs_accessible_interesting_blocks(blocks, pos)
+            assert (old == accessible_interesting_blocks(blocks, pos)).all()
+
+    def test_holes(self):
+        world = make_world()
+        # a 3x3 pit two deep, a 1x2 pit, and a pit with a step
+        for x in range(-3, 0):
+            for z in range(2, 5):
+                for y in [61, 62]:
+                    world.place_block(((x, y, z), (0, 0)))
+        for z in range(-5, -3):
+            world.place_block(((4, 62, z), (0, 0)))
+        for x in range(5, 9):
+            world.place_block(((x, 62, 5), (0, 0)))
+        world.place_block(((6, 61, 5), (0, 0)))
+        location, exclude = (0, 63, 0), [(0, 63, 0)]
+        old = dfs_find_holes(world.get_blocks, location, 10, exclude)
+        new = find_holes(world.get_blocks, location, 10, exclude)
+        old = [h for h in old if h]
+        new = [xyzs for xyzs, idm in new if xyzs]
+        assert as_sets(old) == as_sets(new)
+        assert len(new) == 3
+
+    def test_time(self):
+        X = random_blocks((31, 31, 31), 0.15, [(1, 0), (2, 0), (35, 3)])
+        dfs = Timer(lambda: dfs_connected_components(X)).timeit(number=1)
+        labeling = Timer(lambda: connected_components(X)).timeit(number=1)
+        dfs_unique = Timer(lambda: dfs_connected_components(X, unique_idm=True)).timeit(number=1)
+        unique = Timer(lambda: connected_components(X, unique_idm=True)).timeit(number=1)
+        world = make_world()
+        holes_dfs = Timer(
+            lambda: dfs_find_holes(world.get_blocks, (0, 63, 0), 15, [(0, 63, 0)])
+        ).timeit(number=1)
+        holes = Timer(lambda: find_holes(world.get_blocks, (0, 63, 0), 15, [(0, 63, 0)])).timeit(
+            number=1
+        )
+        logging.info(
+            "31^3 connected components: {} s dfs, {} s labeling; unique idm: {} s dfs, {} s labeling; "
+            "holes: {} s dfs, {} s labeling".format(
+                dfs, labeling, dfs_unique, unique, holes_dfs, holes
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
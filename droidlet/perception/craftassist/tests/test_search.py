@@ -0,0 +1,181 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import heapq
+import unittest
+import logging
+import random
+from timeit import Timer
+import numpy as np
+from droidlet.lowlevel.minecraft.mc_util import adjacent, manhat_dist
+from droidlet.perception.craftassist.search import IndexedHeap, PathFinder, _astar, astar
+
+
+def heapq_astar(X, start, goal, approx=0):
+    """the A* with a heapq priority queue that IndexedHeap replaced, as a reference"""
+    start = tuple(start)
+    goal = tuple(goal)
+    visited = set()
+    came_from = {}
+    q = [(manhat_dist(start, goal), start)]
+    G = np.full_like(X, np.iinfo(np.uint32).max, "uint32")
+    G[start] = 0
+    while len(q) > 0:
+        _, p = heapq.heappop(q)
+        if manhat_dist(p, goal) <= approx:
+            path = []
+            while p in came_from:
+                path.append(p)
+                p = came_from[p]
+            return [start] + list(reversed(path))
+        visited.add(p)
+        for a in adjacent(p):
+            if a in visited or min(a) < 0 or any(a[i] >= X.shape[i] for i in range(3)) or X[a]:
+                continue
+            g = G[p] + 1
+            if g >= G[a]:
+                continue
+            came_from[a] = p
+            G[a] = g
+            f = g + manhat_dist(a, goal)
+            for i in range(len(q)):
+                if q[i][1] == a:
+                    q[i] = (f, a)
+                    heapq.heapify(q)
+                    break
+            else:
+                heapq.heappush(q, (f, a))
+    return None
+
+
+def pillar_world(xa, xb, ya, yb, za, zb):
+    """get_blocks of an infinite world: stone below y=63, and pillars
+    three blocks high on about one column in six"""
+    y, z, x = np.meshgrid(
+        np.arange(ya, yb + 1), np.arange(za, zb + 1), np.arange(xa, xb + 1), indexing="ij"
+    )
+    pillar = ((x * 73856093) ^ (z * 19349663)) % 6 == 0
+    stone = (y < 63) | (pillar & (y < 66))
+    blocks = np.zeros(y.shape + (2,), dtype="uint8")
+    blocks[:, :, :, 0] = stone
+    return blocks
+
+
+def is_valid_path(path, get_blocks, start, target, approx):
+    # paths are reversed, so the agent can pop the steps
+    assert tuple(path[-1]) == tuple(start)
+    assert manhat_dist(path[0], target) <= approx
+    for p, q in zip(path, path[1:]):
+        assert manhat_dist(p, q) == 1
+    for x, y, z in path:
+        assert not get_blocks(x, x, y, y + 1, z, z)[:, :, :, 0].any()
+    return True
+
+
+class IndexedHeapTest(unittest.TestCase):
+    def test_order(self):
+        random.seed(0)
+        heap = IndexedHeap()
+        prios = {}
+        for i in range(500):
+            x = random.randint(0, 200)
+            p = random.randint(0, 50)
+            if heap.contains(x):
+                heap.replace(x, p)
+            else:
+                heap.push(x, p)
+            prios[x] = p
+        out = [heap.pop() for _ in range(len(heap))]
+        assert out == sorted((p, x) for x, p in prios.items())
+
+
+class AstarTest(unittest.TestCase):
+    def test_parity(self):
+        np.random.seed(0)
+        for density in [0.1, 0.3, 0.45]:
+            X = np.random.rand(12, 14, 16) < density
+            for _ in range(5):
+                start, goal = [tuple(np.random.randint(0, 12, size=3)) for _ in range(2)]
+                X[start] = X[goal] = False
+                for approx in [0, 2]:
+                    assert _astar(X, start, goal, approx) == heapq_astar(X, start, goal, approx)
+
+    def test_path_finder(self):
+        reads = []
+
+        def get_blocks(*box):
+            reads.append(box)
+            return pillar_world(*box)
+
+        path_finder = PathFinder(get_blocks)
+        start, target = (1, 63, 2), (30, 63, -20)
+        path = path_finder.find_path(start, target)
+        assert is_valid_path(path, pillar_world, start, target, 0)
+        old = PathFinder(pillar_world, max_chunks=0).find_path(start, target)
+        assert path == old
+        # the blocks are cached
+        n = len(reads)
+        assert path_finder.find_path(start, (20, 63, -15), 1) is not None
+        assert len(reads) == n
+
+        # block changes are seen without reading the world
+        x, y, z = path[len(path) // 2]
+        path_finder.on_block_changed((x, y, z), (1, 0))
+        new_path = path_finder.find_path(start, target)
+        assert (x, y, z) not in new_path and len(reads) == n
+
+        paths = path_finder.find_paths([(start, target, 0), ((5, 63, 5), start, 1), (start, target, 0)])
+        assert paths[0] == new_path and paths[2] == new_path
+        assert is_valid_path(paths[1], pillar_world, (5, 63, 5), start, 1)
+
+    def test_hierarchical(self):
+        path_finder = PathFinder(pillar_world, hierarchical_min_dist=40)
+        start, target = (1, 63, 0), (80, 63, 45)
+        path = path_finder.find_path(start, target)
+        assert is_valid_path(path, pillar_world, start, target, 0)
+        shortest = path_finder.find_path(start, target, hierarchical=False)
+        assert len(shortest) <= len(path)
+
+    def test_astar(self):
+        class Agent:
+            pos = np.array((1, 63, 0))
+
+            def get_blocks(self, *box):
+                return pillar_world(*box)
+
+        agent = Agent()
+        path = astar(agent, (10, 63, 10))
+        assert is_valid_path(path, pillar_world, agent.pos, (10, 63, 10), 0)
+        agent.path_finder = PathFinder(agent.get_blocks)
+        assert astar(agent, (10, 63, 10)) == path
+
+    def test_time(self):
+        for dist in [10, 50, 100, 500]:
+            start, target = (1, 63, 0), (1 + dist // 2, 63, dist - dist // 2)
+            uncached = Timer(
+                lambda: PathFinder(pillar_world, max_chunks=0).find_path(start, target)
+            ).timeit(number=1)
+            path_finder = PathFinder(pillar_world)
+            path_finder.find_path(start, target)
+            cached = Timer(lambda: path_finder.find_path(start, target)).timeit(number=1)
+            hierarchical = Timer(
+                lambda: path_finder.find_path(start, target, hierarchical=True)
+            ).timeit(number=1)
+            msg = "A* over {} blocks: {} s, {} s with cached blocks, {} s hierarchical".format(
+                dist, uncached, cached, hierarchical
+            )
+            if dist <= 50:
+                # the previous search, with a linear time replace in its priority queue
+                corners = np.array([start, target])
+                mx, my, mz = corners.min(axis=0) - 10
+                Mx, My, Mz = corners.max(axis=0) + 10
+                blocks = pillar_world(mx, Mx, my, My, mz, Mz)[:, :, :, 0] > 0
+                X = blocks[:-1] | blocks[1:]
+                s, g = (corners - [mx, my, mz])[:, [1, 2, 0]]
+                old = Timer(lambda: heapq_astar(X, s, g)).timeit(number=1)
+                msg += ", {} s with the old priority queue".format(old)
+            logging.info(msg)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -10,45 +10,150 @@ from torchvision import transforms
 from .core import AbstractHandler
 from droidlet.interpreter.robot.objects import AttributeDict
 
+FEATURE_SIZE = 512
 
-class ObjectDeduplicator(AbstractHandler):
-    """Class for deduplicating a given set of objects from a given set of existing objects"""
 
-    def __init__(self):
+class ObjectDeduplicator(AbstractHandler):
+    """Class for deduplicating a given set of objects from a given set of existing objects
+
+    The features and positions of the previous objects are read as matrices with one row per
+    object, from the DetectedObjectCache of the memory (see DetectedObjectCache.get_matrix),
+    so that they are not copied in the deduplicator and always are the ones in memory.  Each
+    object of a frame is only compared to the previous objects within dist_thresh of it, all
+    at once.
+
+    Args:
+        device (str): device of the feature model, e.g. "cpu"; by default cuda if it is
+            available, otherwise cpu
+        score_thresh (float): cosine similarity above which two objects look the same
+        dist_thresh (float): distance below which two objects which look the same are the same
+    """
+
+    def __init__(self, device=None, score_thresh=0.95, dist_thresh=0.6):
         self.object_id_counter = 1
-        self.dedupe_model = models.resnet18(pretrained=True).cuda()
-        self.layer = self.dedupe_model._modules.get("avgpool")
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.dedupe_model = models.resnet18(pretrained=True)
+        # the features are the flattened output of the avgpool layer
+        self.dedupe_model.fc = torch.nn.Identity()
+        self.dedupe_model.to(self.device)
         self.dedupe_model.eval()
         self.transforms = [
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
             transforms.ToTensor(),
         ]
-        self._temp_buffer = torch.zeros(512).pin_memory()
+        self.score_thresh = score_thresh
+        self.dist_thresh = dist_thresh
 
-        def copy_data(m, i, o):
-            self._temp_buffer.copy_(torch.flatten(o).data)
+    def get_feature_reprs(self, imgs):
+        """returns the features of a list of images, computed in batches of images of
+        the same shape
 
-        self.layer.register_forward_hook(copy_data)
-
-    def get_feature_repr(self, img):
+        Returns:
+            a float tensor of shape (len(imgs), 512), on cpu
+        """
         normalize, to_tensor = self.transforms
-        t_img = normalize(to_tensor(img)).unsqueeze(0).cuda()
-
+        features = torch.zeros((len(imgs), FEATURE_SIZE))
+        by_shape = {}
+        for i, img in enumerate(imgs):
+            by_shape.setdefault(np.shape(img), []).append(i)
         with torch.no_grad():
-            self.dedupe_model(t_img)
-        return self._temp_buffer.clone()
+            for indices in by_shape.values():
+                batch = torch.stack([normalize(to_tensor(imgs[i])) for i in indices])
+                out = self.dedupe_model(batch.to(self.device))
+                features[indices] = torch.flatten(out, 1).float().cpu()
+        return features
+
+    def get_feature_repr(self, img):
+        return self.get_feature_reprs([img])[0]
 
     # Not accounting for moving objects
     def is_match(self, score, dist):
-        score_thresh = 0.95
-        dist_thresh = 0.6
-        if score > score_thresh and dist > dist_thresh:
+        if score > self.score_thresh and dist > self.dist_thresh:
             return False  # Similar object, different places.
-        elif score > score_thresh and dist < dist_thresh:
+        elif score > self.score_thresh and dist < self.dist_thresh:
             return True  # same object, same place
         else:
             return False
 
+    def previous_matrix(self, previous_objects):
+        """the eids, features and first two coordinates of the previous objects with a
+        feature, as arrays with one row per object
+
+        Args:
+            previous_objects: the DetectedObjectCache of the memory, or a list of the dicts of
+                DetectedObjectNode.get_all (or of WorldObjects)
+        """
+        if hasattr(previous_objects, "get_matrix"):
+            _, eids, features, xyz, _ = previous_objects.get_matrix()
+            if features.shape[1:] == (FEATURE_SIZE,):
+                return eids, features, xyz[:, :2]
+            previous_objects = []
+        eids, features, xys = [], [], []
+        for previous_object in previous_objects:
+            if isinstance(previous_object, dict):
+                previous_object = AttributeDict(previous_object)
+            if previous_object.eid is None or previous_object.feature_repr is None:
+                continue
+            feature = np.asarray(previous_object.feature_repr, dtype=np.float32).reshape(-1)
+            if len(feature) != FEATURE_SIZE:
+                continue
+            eids.append(previous_object.eid)
+            features.append(feature)
+            xys.append(previous_object.xyz[:2])
+        if not eids:
+            return np.zeros(0, np.int64), np.zeros((0, FEATURE_SIZE), np.float32), np.zeros((0, 2))
+        return np.array(eids), np.stack(features), np.array(xys, dtype=np.float64)
+
+    def match(self, features, xys, previous):
+        """finds the previous object matching each object, see is_match
+
+        Args:
+            features (torch.Tensor): (m, 512) features of the objects
+            xys (np.ndarray): (m, 2) first two coordinates of the objects
+            previous: the eids, features and first two coordinates of the previous objects,
+                see previous_matrix
+
+        Returns:
+            the eid of the best (most similar) match of each object, or None
+        """
+        eids, previous_features, previous_xys = previous
+        if len(eids) == 0 or len(features) == 0:
+            return [None] * len(features)
+        features = np.asarray(features, dtype=np.float32)
+        features = features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-8)
+        dists = np.linalg.norm(xys[:, None, :] - previous_xys[None, :, :], axis=2)
+        matches = []
+        for feature, dist in zip(features, dists):
+            candidates = np.flatnonzero(dist < self.dist_thresh)
+            candidate_features = previous_features[candidates]
+            norms = np.maximum(np.linalg.norm(candidate_features, axis=1), 1e-8)
+            score = candidate_features @ feature / norms
+            is_match = score > self.score_thresh
+            if not is_match.any():
+                matches.append(None)
+                continue
+            best = candidates[np.flatnonzero(is_match)[np.argmax(score[is_match])]]
+            matches.append(eids[best].item())
+        return matches
+
+    def _is_novel(self, current_objects, previous):
+        features = self.get_feature_reprs([o.get_masked_img() for o in current_objects])
+        xys = np.zeros((len(current_objects), 2))
+        for i, current_object in enumerate(current_objects):
+            current_object.feature_repr = features[i]
+            xys[i] = np.asarray(current_object.xyz[:2], dtype=np.float64)
+        novel = []
+        for current_object, eid in zip(current_objects, self.match(features, xys, previous)):
+            if eid is not None:
+                current_object.eid = eid
+            logging.info(
+                "world object {}, is_novel {}".format(current_object.label, eid is None)
+            )
+            novel.append(eid is None)
+        return novel
+
     def is_novel(self, current_object, previous_objects):
         """this is long-term tracking (not in-frame). it does some feature
         matching to figure out if we've seen this exact instance of object
@@ -59,40 +164,12 @@ class ObjectDeduplicator(AbstractHandler):
 
         Args:
             current_object (WorldObject): current object to compare
-            previous_objects (List[WorldObject]): all previous objects to compare to
+            previous_objects (List[WorldObject]): all previous objects to compare to, or the
+                DetectedObjectCache of the memory
 
 
         """
-        current_object.feature_repr = self.get_feature_repr(current_object.get_masked_img())
-        cos = torch.nn.CosineSimilarity(dim=1)
-        is_novel = True
-
-        # Future = use all object features to calculate novelty
-        for previous_object in previous_objects:
-            if isinstance(previous_object, dict):
-                previous_object = AttributeDict(previous_object)
-            if (
-                previous_object.feature_repr is not None
-                and current_object.feature_repr is not None
-            ):
-                score = cos(
-                    previous_object.feature_repr.unsqueeze(0),
-                    current_object.feature_repr.unsqueeze(0),
-                )
-                dist = np.linalg.norm(
-                    np.asarray(current_object.xyz[:2]) - np.asarray(previous_object.xyz[:2])
-                )
-                logging.debug(
-                    "Similarity {}.{} = {}, {}".format(
-                        current_object.label, previous_object.label, score.item(), dist
-                    )
-                )
-                # FIXME pick best match?
-                if self.is_match(score.item(), dist):
-                    is_novel = False
-                    current_object.eid = previous_object.eid
-        logging.info("world object {}, is_novel {}".format(current_object.label, is_novel))
-        return is_novel
+        return self._is_novel([current_object], self.previous_matrix(previous_objects))[0]
 
     def __call__(self, current_objects, previous_objects):
         """run the deduplication for the current objects detected.
@@ -102,14 +179,21 @@ class ObjectDeduplicator(AbstractHandler):
         Args:
             current_objects (list[WorldObject]): a list of all WorldObjects detected in the current frame
             previous_objects (list[WorldObject]): a list of all previous WorldObjects ever detected
+                (or the DetectedObjectCache of the memory)
         """
         logging.info("In ObjectDeduplicationHandler ... ")
-        if self.object_id_counter <= len(previous_objects): # Ensure unique eids
-            self.object_id_counter = len(previous_objects) + 1
+        previous = self.previous_matrix(previous_objects)
+        eids = previous[0]
+        num_previous = max(len(eids), int(eids.max()) if len(eids) else 0)
+        if self.object_id_counter <= num_previous: # Ensure unique eids
+            self.object_id_counter = num_previous + 1
         new_objects = []
         updated_objects = []
-        for current_object in current_objects:
-            if self.is_novel(current_object, previous_objects):
+        if not current_objects:
+            return new_objects, updated_objects
+        novel = self._is_novel(current_objects, previous)
+        for i, current_object in enumerate(current_objects):
+            if novel[i]:
                 current_object.eid = self.object_id_counter
                 self.object_id_counter = self.object_id_counter + 1
                 new_objects.append(current_object)
@@ -17,6 +17,7 @@ from scipy.spatial.transform import Rotation
 import glob
 import argparse
 from droidlet.lowlevel.locobot import transform_pose
+from droidlet.lowlevel.locobot.deprojection import get_deprojector, rigid_transform, pose_transform
 
 class LabelPropagate(AbstractHandler):
     def __call__(self,    
@@ -42,27 +43,16 @@ class LabelPropagate(AbstractHandler):
         intrinsic_mat = np.array([[256, 0, 256], [0, 256, 256], [0, 0, 1]])
         rot = np.array([[0.0, 0.0, 1.0], [-1.0, 0.0, 0.0], [0.0, -1.0, 0.0]])
         trans = np.array([0, 0, 0.6])
-        # precompute some values necessary to depth to point cloud
-        intrinsic_mat_inv = np.linalg.inv(intrinsic_mat)
+        # the pixel rays are cached across calls
         height, width, channels = src_img.shape
-        img_resolution = (height, width)
-        img_pixs = np.mgrid[0 : img_resolution[0] : 1, 0 : img_resolution[1] : 1]
-        img_pixs = img_pixs.reshape(2, -1)
-        img_pixs[[0, 1], :] = img_pixs[[1, 0], :]
-        uv_one = np.concatenate((img_pixs, np.ones((1, img_pixs.shape[1]))))
-        uv_one_in_cam = np.dot(intrinsic_mat_inv, uv_one)
+        deprojector = get_deprojector(intrinsic_mat, height, width)
+        cam_to_base = rigid_transform(rot, trans)
 
         ### calculate point cloud in different frmaes ###
-        # point cloud in camera frmae
-        depth = (src_depth.astype(np.float32) / 1000.0).reshape(-1)
-        pts_in_cam = np.multiply(uv_one_in_cam, depth)
-        pts_in_cam = np.concatenate((pts_in_cam, np.ones((1, pts_in_cam.shape[1]))), axis=0)
-        # point cloud in robot base frame
-        pts_in_base = pts_in_cam[:3, :].T
-        pts_in_base = np.dot(pts_in_base, rot.T)
-        pts_in_base = pts_in_base + trans.reshape(-1)
-        # point cloud in world frame (pyrobot)
-        pts_in_world = transform_pose(pts_in_base, src_pose)
+        # point cloud in world frame (pyrobot), in one transform from the camera frame
+        pts_in_world = deprojector.deproject(
+            src_depth, pose_transform(src_pose) @ cam_to_base, scale=0.001
+        )
 
         ### figure out unique label values in provided gt label which is greater than 0 ###
         unique_pix_value = np.unique(src_label.reshape(-1), axis=0)
@@ -80,18 +70,10 @@ class LabelPropagate(AbstractHandler):
         # param useful to search nearest point cloud in a region
         kernal_size = 3
 
-        # convert depth to point cloud in camera frame
-        cur_depth = (cur_depth.astype(np.float32) / 1000.0).reshape(-1)
-        cur_pts_in_cam = np.multiply(uv_one_in_cam, cur_depth)
-        cur_pts_in_cam = np.concatenate(
-            (cur_pts_in_cam, np.ones((1, cur_pts_in_cam.shape[1]))), axis=0
+        # convert depth to point cloud in world frame
+        cur_pts_in_world = deprojector.deproject(
+            cur_depth, pose_transform(base_pose) @ cam_to_base, scale=0.001
         )
-        # convert point cloud in camera frame to base frame
-        cur_pts_in_base = cur_pts_in_cam[:3, :].T
-        cur_pts_in_base = np.dot(cur_pts_in_base, rot.T)
-        cur_pts_in_base = cur_pts_in_base + trans.reshape(-1)
-        # convert point cloud from base frame to world frame
-        cur_pts_in_world = transform_pose(cur_pts_in_base, base_pose)
 
         ### generate label for new img ###
         # crete annotation files with all zeros
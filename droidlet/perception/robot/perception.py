@@ -2,26 +2,40 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 import time
+import logging
 
-from droidlet.parallel import BackgroundTask
+from droidlet.parallel import Pipeline
 from droidlet.perception.robot.handlers import (
     ObjectDetection,
     FaceRecognition,
     HumanPose,
-    ObjectTracking,
     DetectLaserPointer,
     ObjectDeduplicator,
 )
 from droidlet.interpreter.robot.objects import AttributeDict
+from droidlet.shared_data_structs import RGBDepth
 from droidlet.event import sio
-import queue
+
+# the stats of the slow perception models are logged every STATS_INTERVAL frames
+STATS_INTERVAL = 100
+
+
+def slow_perceive_run(model, rgb, depth, pts, xyz):
+    """runs a slow perception model on a frame, in its Pipeline stage"""
+    objects = model(RGBDepth(rgb, depth, pts)) or []
+    for obj in objects:
+        # not sent back with the results, the frame is attached again by Perception
+        obj.rgb_depth = None
+    return objects
 
 
 class Perception:
     """Home for all perceptual modules used by the LocobotAgent.
 
     It provides a multiprocessing mechanism to run the more compute intensive perceptual
-    models (for example our object detector) as a separate process.
+    models (for example our object detector) as separate processes, one per model, with a
+    Pipeline: each model processes the latest frame when it is done with the previous one,
+    and its results are returned as soon as they are ready, without waiting for slower models.
 
     Args:
         model_data_dir (string): path for all perception models (default: ~/locobot/agent/models/perception)
@@ -30,28 +44,19 @@ class Perception:
     def __init__(self, model_data_dir, default_keypoints_path=False):
         self.model_data_dir = model_data_dir
 
-        def slow_perceive_init(weights_dir):
-            return AttributeDict(
-                {
-                    "detector": ObjectDetection(weights_dir),
-                    "human_pose": HumanPose(weights_dir, default_keypoints_path),
-                    "face_recognizer": FaceRecognition(),
-                    "tracker": ObjectTracking(),
-                })
-
-        def slow_perceive_run(models, rgb_depth, xyz):
-            detections = models.detector(rgb_depth)
-            humans = models.human_pose(rgb_depth)
-            face_detections = models.face_recognizer(rgb_depth)
-            if face_detections:
-                detections += face_detections
-            return rgb_depth, detections, humans, xyz
-
-        self.vprocess = BackgroundTask(init_fn=slow_perceive_init,
-                                   init_args=(model_data_dir,),
-                                    process_fn=slow_perceive_run)
+        self.vprocess = Pipeline(
+            {
+                "detector": (ObjectDetection, (model_data_dir,), slow_perceive_run),
+                "human_pose": (
+                    HumanPose,
+                    (model_data_dir, default_keypoints_path),
+                    slow_perceive_run,
+                ),
+                "face_recognizer": (FaceRecognition, (), slow_perceive_run),
+            }
+        )
         self.vprocess.start()
-        self.slow_vision_ready = True
+        self.frame_count = 0
 
         self.vision = self.setup_vision_handlers()
         self.audio = None
@@ -83,29 +88,43 @@ class Perception:
         SlowPerception if they are ready.
 
         Args:
+            previous_objects: the DetectedObjectCache of the memory (or a list of the previous
+                objects) the detections are deduplicated against, None not to deduplicate
             force (boolean): set to True to force waiting on the SlowPerception models to finish, and execute
                 all perceptual models to execute sequentially (doing that is a good debugging tool)
                 (default: False)
         """
-        if self.slow_vision_ready:
-            self.vprocess.put(rgb_depth, xyz)
-            self.slow_vision_ready = False
-
-        try:
-            old_image, detections, humans, old_xyz = self.vprocess.get(block=force)
-            self.slow_vision_ready = True
-        except queue.Empty:
-            old_image, detections, humans, old_xyz = None, None, None, None
+        frame_id = self.vprocess.put(
+            [rgb_depth.rgb, rgb_depth.depth, rgb_depth.ptcloud], xyz, payload=rgb_depth
+        )
+        self.frame_count += 1
+        if self.frame_count % STATS_INTERVAL == 0:
+            logging.info("slow perception stats {}".format(self.vprocess.stats()))
+
+        frames = self.vprocess.get(block=force, frame_id=frame_id if force else None)
+        if not frames:
+            self.log(rgb_depth, None, None, None)
+            return None
+
+        # the latest results of each model, on the frame they were computed on
+        results = {}
+        for frame in frames:
+            for stage, objects in frame.results.items():
+                for obj in objects:
+                    obj.rgb_depth = frame.payload
+                results[stage] = objects
+        old_image = frames[-1].payload
+        detections = results.get("detector", []) + results.get("face_recognizer", [])
+        humans = results.get("human_pose", [])
 
         self.log(rgb_depth, detections, humans, old_image)
-        if detections is not None:
-            current_objects = detections + humans
-            if previous_objects is not None:
-                new_objects, updated_objects = self.vision.deduplicate(
-                    current_objects, previous_objects
-                )
-            return (new_objects, updated_objects)
-        return None
+        current_objects = detections + humans
+        new_objects, updated_objects = [], []
+        if previous_objects is not None:
+            new_objects, updated_objects = self.vision.deduplicate(
+                current_objects, previous_objects
+            )
+        return (new_objects, updated_objects)
 
     def log(self, rgb_depth, detections, humans, old_rgb_depth):
         """Log all relevant data from the perceptual models for the dashboard.
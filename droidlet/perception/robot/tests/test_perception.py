@@ -20,6 +20,7 @@ from droidlet.memory.robot.loco_memory_nodes import DetectedObjectNode, HumanPos
 from droidlet.lowlevel.locobot.locobot_mover import LoCoBotMover
 import cv2
 import torch
+import numpy as np
 from PIL import Image
 from droidlet.perception.robot.tests.utils import get_fake_rgbd, get_fake_detection, get_fake_humanpose
 
@@ -156,6 +157,84 @@ class MemoryStoringTest(unittest.TestCase):
         logging.info("Number of detections {}".format(len(detections)))
 
 
+class DeduplicatorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.deduplicator = ObjectDeduplicator(device=DEVICE)
+
+    def fake_memory(self, n):
+        """n previous objects, copies of 50 objects at random places"""
+        torch.manual_seed(0)
+        features = torch.randn(50, 512)
+        return [
+            {
+                "eid": i + 1,
+                "xyz": tuple((torch.rand(3) * 20).tolist()),
+                "feature_repr": features[i % 50] + 0.1 * torch.randn(512),
+            }
+            for i in range(n)
+        ]
+
+    def test_batched_features(self):
+        detections = [get_fake_detection("wand", [], [0, 0, 0]) for _ in range(3)]
+        imgs = [d.get_masked_img() for d in detections] + [get_fake_humanpose().get_masked_img()]
+        features = self.deduplicator.get_feature_reprs(imgs)
+        for img, feature in zip(imgs, features):
+            single = self.deduplicator.get_feature_reprs([img])[0]
+            self.assertTrue(torch.allclose(single, feature, atol=1e-4))
+
+    def test_match(self):
+        cos = torch.nn.CosineSimilarity(dim=0)
+        previous_objects = self.fake_memory(2000)
+        previous = self.deduplicator.previous_matrix(previous_objects)
+        for obj in previous_objects[:20]:
+            feature = obj["feature_repr"] + 0.05 * torch.randn(512)
+            xy = np.array(obj["xyz"][:2]) + 0.1
+            # the most similar of the previous objects the pairwise check matches
+            matches = [
+                (cos(feature, p["feature_repr"]).item(), p["eid"])
+                for p in previous_objects
+                if self.deduplicator.is_match(
+                    cos(feature, p["feature_repr"]).item(),
+                    np.linalg.norm(xy - np.array(p["xyz"][:2])),
+                )
+            ]
+            expected = max(matches)[1] if matches else None
+            match = self.deduplicator.match(feature.unsqueeze(0), xy.reshape(1, 2), previous)[0]
+            self.assertEqual(match, expected)
+
+    def test_memory(self):
+        """the previous objects are read from the DetectedObjectCache of the memory"""
+        memory = LocoAgentMemory()
+        detections = [get_fake_detection("wand", [], [3 * i, 0, 0]) for i in range(3)]
+        new_objects, _ = self.deduplicator(detections, memory.detected_objects)
+        self.assertEqual(len(new_objects), 3)
+        for obj in new_objects:
+            obj.save_to_memory(memory)
+        eids = [obj.eid for obj in new_objects]
+
+        detections = [get_fake_detection("wand", [], [3 * i, 0, 0]) for i in range(3)]
+        new_objects, updated_objects = self.deduplicator(detections, memory.detected_objects)
+        self.assertEqual(new_objects, [])
+        self.assertEqual([obj.eid for obj in updated_objects], eids)
+        # an object removed from the memory is not matched anymore
+        memid = memory._db_read_one("SELECT uuid FROM ReferenceObjects WHERE eid=?", eids[0])[0]
+        memory.forget(memid)
+        detections = [get_fake_detection("wand", [], [0, 0, 0])]
+        new_objects, _ = self.deduplicator(detections, memory.detected_objects)
+        self.assertEqual(len(new_objects), 1)
+        self.assertNotIn(new_objects[0].eid, eids)
+
+    def test_time(self):
+        detections = [get_fake_detection("wand", [], [0, 0, 0]) for _ in range(8)]
+        features = self.deduplicator.get_feature_reprs([d.get_masked_img() for d in detections])
+        xys = np.zeros((len(detections), 2))
+        for n in [100, 1000, 10000]:
+            # the matrix of the previous objects, as read from the DetectedObjectCache
+            previous = self.deduplicator.previous_matrix(self.fake_memory(n))
+            t = Timer(lambda: self.deduplicator.match(features, xys, previous)).timeit(number=1)
+            logging.info("Matching 8 objects against {}: {} s".format(n, t))
+
+
 class TestFaceRecognition(unittest.TestCase):
     def setUp(self) -> None:
         self.f_rec = FaceRecognition(FACES_IDS_DIR)
@@ -2,20 +2,31 @@ import os
 import json
 
 
+def ground_truth_files(ground_truth_data_dir):
+    """paths of the ground truth text files, in ground_truth_data_dir/datasets"""
+    gt_data_directory = ground_truth_data_dir + "datasets/"
+    paths = []
+    for (dirpath, dirnames, filenames) in os.walk(gt_data_directory):
+        for f_name in filenames:
+            paths.append(gt_data_directory + f_name)
+    return paths
+
+
+def read_ground_truth_file(path):
+    """yields the (command, logical form json) of each line of a ground truth file"""
+    with open(path) as f:
+        for line in f.readlines():
+            text, logical_form = line.strip().split("|")
+            yield text.strip('"'), logical_form
+
+
 def get_ground_truth(no_ground_truth, ground_truth_data_dir):
     # Load all ground truth commands and their parses
     ground_truth_actions = {}
     if not no_ground_truth:
         if os.path.isdir(ground_truth_data_dir):
-            gt_data_directory = ground_truth_data_dir + "datasets/"
-            for (dirpath, dirnames, filenames) in os.walk(gt_data_directory):
-                for f_name in filenames:
-                    file = gt_data_directory + f_name
-                    with open(file) as f:
-                        for line in f.readlines():
-                            text, logical_form = line.strip().split("|")
-                            clean_text = text.strip('"')
-                            ground_truth_actions[clean_text] = json.loads(logical_form)
+            for path in ground_truth_files(ground_truth_data_dir):
+                for clean_text, logical_form in read_ground_truth_file(path):
+                    ground_truth_actions[clean_text] = json.loads(logical_form)
 
     return ground_truth_actions
-
@@ -3,7 +3,7 @@ Copyright (c) Facebook, Inc. and its affiliates.
 """
 import logging
 import os
-from typing import Dict
+from typing import Dict, List
 from .nsp_transformer_model.query_model import TTADBertModel as Model
 
 
@@ -33,6 +33,7 @@ class DroidletSemanticParsingModel:
 
         if os.path.isdir(data_dir) and os.path.isdir(ttad_model_dir):
             self.model = Model(model_dir=ttad_model_dir, data_dir=data_dir)
+            self.model_version = self.model.model_version
         else:
             raise NotADirectoryError
 
@@ -65,3 +66,18 @@ class DroidletSemanticParsingModel:
         logging.info("Querying the semantic parsing model")
         logical_form = self.model.parse(chat=chat)
         return logical_form
+
+    def query_for_logical_forms(self, chats: List[str], return_scores: bool = False) -> List:
+        """Get the logical forms of several chat commands at once, with a single
+        batched query of the semantic parsing model.
+
+        Args:
+            chats (List[str]): Input chats provided by the users.
+            return_scores (bool): also return the confidence of each logical form.
+
+        Return:
+            List[Dict]: Logical forms, in the same order as the chats, or
+                (logical form, confidence) pairs with return_scores.
+        """
+        logging.info("Querying the semantic parsing model for {} chats".format(len(chats)))
+        return self.model.parse_batch(chats, return_scores=return_scores)
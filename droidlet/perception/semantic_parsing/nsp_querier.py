@@ -4,14 +4,17 @@ Copyright (c) Facebook, Inc. and its affiliates.
 import copy
 import logging
 import pkg_resources
+from concurrent.futures import Future
+from functools import partial
 from time import time
 from typing import Dict, Tuple
 from .utils import preprocess
-from .load_and_check_datasets import get_ground_truth
 from .nsp_model_wrapper import DroidletSemanticParsingModel
+from .parse_cache import GroundTruthIndex, ParseCache
+from .parser_service import ParserService
 from droidlet.event import sio
 from .utils.nsp_logger import NSPLogger
-from .utils.validate_json import JSONValidator
+from .utils.validate_json import get_json_validator
 
 
 class NSPQuerier(object):
@@ -20,6 +23,10 @@ class NSPQuerier(object):
          and converts it to logical form. It does so by first checking against
          ground truth text-logical form pairings and if not found, querying the
          neural semantic parsing model.
+
+         The model is queried by a ParserService, on its own thread: the chats parsed at the
+         same time (by the agent, the dashboard...) are batched together.  Its parses are
+         cached in a ParseCache, persisted in opts.nsp_cache_path.
          """
         self.opts = opts
         # instantiate logger and parsing model
@@ -36,8 +43,25 @@ class NSPQuerier(object):
         except NotADirectoryError:
             # No parsing model
             self.parsing_model = None
-        # Read the ground truth dataset file: ground_truth/datasets folder
-        self.ground_truth_actions = get_ground_truth(self.opts.no_ground_truth, self.opts.ground_truth_data_dir)
+        self.parser_service = None
+        self.parse_cache = None
+        if self.parsing_model:
+            self.parser_service = ParserService(
+                partial(self.parsing_model.query_for_logical_forms, return_scores=True)
+            )
+            self.parse_cache = ParseCache(
+                getattr(opts, "nsp_cache_path", "") or ":memory:",
+                getattr(opts, "nsp_cache_size", 10000),
+            )
+        # Index of the ground truth dataset files (ground_truth/datasets folder), only rebuilt
+        # when they change and opened on the first lookup
+        if self.opts.no_ground_truth:
+            self.ground_truth_actions = {}
+        else:
+            self.ground_truth_actions = GroundTruthIndex(
+                self.opts.ground_truth_data_dir,
+                getattr(opts, "ground_truth_index_path", "") or ":memory:",
+            )
 
         # Socket event listener
         # TODO(kavya): I might want to move this to SemanticParserWrapper
@@ -46,7 +70,7 @@ class NSPQuerier(object):
             """This is a socket event listener from dashboard and returns
             the logical form output"""
             logging.debug("inside query parser, querying for: %r" % (data))
-            action_dict = self.get_logical_form(s=data["chat"], parsing_model=self.parsing_model)
+            action_dict = self.get_logical_form(chat=data["chat"], parsing_model=self.parsing_model)
             logging.debug("got logical form: %r" % (action_dict))
             payload = {"action_dict": action_dict}
             sio.emit("renderActionDict", payload)
@@ -89,12 +113,24 @@ class NSPQuerier(object):
         Returns:
             Dict: logical form found either in ground truth or from model
         """
+        chat, logical_form = self.get_parse_async(chatstr)
+        return chat, logical_form.result()
+
+    def get_parse_async(self, chatstr: str) -> Tuple[str, Future]:
+        """Same as get_parse, but does not wait for the parsing model.
+
+        Args:
+            chatstr (str) : chat or command that needs to be parsed
+
+        Returns:
+            the preprocessed chat, and a Future of its logical form, which is already done
+            if the chat is in the ground truth
+        """
         # 1. Preprocess chat
         chat = self.preprocess_chat(chatstr)
 
         # 2. Get logical form from either ground truth or query the parsing model
-        logical_form = self.get_logical_form(chat=chat, parsing_model=self.parsing_model)
-        return chat, logical_form
+        return chat, self.get_logical_form_async(chat=chat, parsing_model=self.parsing_model)
 
     def validate_parse_tree(self, parse_tree: Dict, debug: bool = True) -> bool:
         """Validate the parse tree against current grammar.
@@ -106,11 +142,11 @@ class NSPQuerier(object):
         Returns:
             True if parse tree is valid, False if not.
         """
-        # RefResolver initialization requires a base schema and URI
+        # The schemas are loaded and compiled by the first call only
         schema_dir = "{}/".format(
             pkg_resources.resource_filename("droidlet.documents", "json_schema")
         )
-        json_validator = JSONValidator(schema_dir, span_type="all")
+        json_validator = get_json_validator(schema_dir, span_type="all")
         is_valid_json = json_validator.validate_instance(parse_tree, debug)
         return is_valid_json
 
@@ -143,22 +179,61 @@ class NSPQuerier(object):
                 }]
             }
         """
-        logical_form_source = "ground_truth"
-        # Check if chat is in ground_truth otherwise query parsing model
-        if chat in self.ground_truth_actions:
-            logical_form = copy.deepcopy(self.ground_truth_actions[chat])
+        return self.get_logical_form_async(chat, parsing_model).result()
+
+    def get_logical_form_async(self, chat: str, parsing_model) -> Future:
+        """Same as get_logical_form, but returns a Future of the logical form.  The agent's
+        parsing model is queried through the parser service, so that the chat is batched with
+        the other chats being parsed; the logical form is cached, logged and validated on the
+        service thread.  Another parsing_model is queried directly, and its parses are not
+        cached.  The future of a chat found in the ground truth or in the parse cache is
+        already done.
+        """
+        future = Future()
+        use_service = parsing_model is not None and parsing_model is self.parsing_model
+        # Check if chat is in ground_truth, then in the cache, otherwise query parsing model
+        ground_truth = self.ground_truth_actions.get(chat)
+        cached = None
+        if ground_truth is None and use_service:
+            cached = self.parse_cache.get(chat, parsing_model.model_version)
+        if ground_truth is not None:
+            logical_form = copy.deepcopy(ground_truth)
             logging.info('Found ground truth action for "{}"'.format(chat))
-            # log the current UTC time
-            time_now = time()
-        elif self.parsing_model:
+            future.set_result(self._log_and_validate(chat, logical_form, "ground_truth"))
+        elif cached is not None:
+            logical_form, confidence = cached
+            logging.info('Found cached parse for "{}", confidence {:.2f}'.format(chat, confidence))
+            future.set_result(self._log_and_validate(chat, logical_form, "parse_cache"))
+        elif use_service:
+            model_version = parsing_model.model_version
+
+            def finish(parse):
+                try:
+                    logical_form, confidence = parse.result()
+                    self.parse_cache.put(chat, logical_form, model_version, confidence)
+                    future.set_result(
+                        self._log_and_validate(chat, logical_form, "semantic_parser")
+                    )
+                except Exception as e:
+                    future.set_exception(e)
+
+            self.parser_service.submit(chat).add_done_callback(finish)
+        elif parsing_model:
             logical_form = parsing_model.query_for_logical_form(chat)
-            time_now = time()
-            logical_form_source = "semantic_parser"
+            future.set_result(self._log_and_validate(chat, logical_form, "semantic_parser"))
         else:
             logical_form = {"dialogue_type": "NOOP"}
             logging.info("Not found in ground truth, no parsing model initiated. Returning NOOP.")
-            time_now = time()
-            logical_form_source = "not_found_in_gt_no_model"
+            future.set_result(
+                self._log_and_validate(chat, logical_form, "not_found_in_gt_no_model")
+            )
+        return future
+
+    def _log_and_validate(self, chat: str, logical_form: Dict, logical_form_source: str) -> Dict:
+        """Logs the logical form of a chat, and returns it if it conforms to the grammar,
+        else NOOP"""
+        # log the current UTC time
+        time_now = time()
         # log the logical form and chat with source
         self.NSPLogger.log_dialogue_outputs(
             [chat, logical_form, logical_form_source, "craftassist", time_now]
@@ -173,4 +248,3 @@ class NSPQuerier(object):
             logging.error("Returning NOOP")
 
         return logical_form
-
@@ -6,10 +6,58 @@ import numpy as np
 import re
 from os.path import isfile, isdir
 from os.path import join as pjoin
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from .tokenization_utils import fixed_span_values
 from .utils_caip import make_full_tree, process_txt_data, tokenize_linearize
 
+SPEC_TOKENS = ["[PAD]", "unused", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "<S>", "</S>"]
+
+
+def make_tree_voc(tree_i2w):
+    """Output vocabulary of the decoder: special tokens, grammar nodes and fixed values"""
+    tree_voc = SPEC_TOKENS[:] + tree_i2w + list(fixed_span_values)
+    return tree_voc, dict([(w, i) for i, w in enumerate(tree_voc)])
+
+
+def encode_caip_example(p_text, p_tree, tokenizer, full_tree, tree_idxs, word_noise=0.0):
+    """Applies BPE to the input and linearizes the tree of an example
+
+    Returns:
+        the input token ids, the tree as a list of [node id, span start, span end, text span
+        start, text span end, fixed value] between <S> and </S>, and the tokenized input
+    """
+    text, tree = tokenize_linearize(p_text, p_tree, tokenizer, full_tree, word_noise)
+    text_idx_ls = [tokenizer._convert_token_to_id(w) for w in text.split()]
+    tree_idx_ls = [
+        [
+            tree_idxs[w],
+            bi,
+            ei,
+            text_span_start,
+            text_span_end,
+            (tree_idxs[fixed_span_val] if type(fixed_span_val) == str else fixed_span_val),
+        ]
+        for w, bi, ei, text_span_start, text_span_end, fixed_span_val in [
+            ("<S>", -1, -1, -1, -1, -1)
+        ]
+        + tree
+        + [("</S>", -1, -1, -1, -1, -1)]
+    ]
+    return text_idx_ls, tree_idx_ls, text
+
+
+def tree_to_text_ids(tree_idx_ls, tree_voc, tokenizer):
+    """Input token ids of the words of the nodes of a linearized tree, for back translation"""
+    stripped_tree_tokens = []
+    for node in tree_idx_ls[1:-1]:
+        tree_node = tree_voc[node[0]].lower()
+        tree_node_processed = re.sub("[^0-9a-zA-Z]+", " ", tree_node)
+        tree_tokens = tree_node_processed.split(" ")
+        stripped_tree_tokens += [x for x in tree_tokens if x != ""]
+
+    extended_tree = ["[CLS]"] + stripped_tree_tokens + ["[SEP]"]
+    return [tokenizer._convert_token_to_id(w) for w in extended_tree]
+
 
 class CAIPDataset(Dataset):
     """Torch Dataset for the CAIP format, applies BPE and linearizes trees on-the-fly
@@ -93,9 +141,7 @@ class CAIPDataset(Dataset):
         else:
             full_tree, tr_i2w = full_tree_voc
             self.full_tree = full_tree
-        spec_tokens = ["[PAD]", "unused", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "<S>", "</S>"]
-        self.tree_voc = spec_tokens[:] + tr_i2w + list(fixed_span_values)
-        self.tree_idxs = dict([(w, i) for i, w in enumerate(self.tree_voc)])
+        self.tree_voc, self.tree_idxs = make_tree_voc(tr_i2w)
 
         self.dataset_length = max([len(v) for v in self.data.values()])
         if args.examples_per_epoch > 0:
@@ -120,39 +166,11 @@ class CAIPDataset(Dataset):
             p_text, p_tree = t
         except ValueError as e:
             print(e)
-        text, tree = tokenize_linearize(
-            p_text, p_tree, self.tokenizer, self.full_tree, self.word_noise
+        text_idx_ls, tree_idx_ls, text = encode_caip_example(
+            p_text, p_tree, self.tokenizer, self.full_tree, self.tree_idxs, self.word_noise
         )
-        text_idx_ls = [self.tokenizer._convert_token_to_id(w) for w in text.split()]
-        tree_idx_ls = [
-            [
-                self.tree_idxs[w],
-                bi,
-                ei,
-                text_span_start,
-                text_span_end,
-                (
-                    self.tree_idxs[fixed_span_val]
-                    if type(fixed_span_val) == str
-                    else fixed_span_val
-                ),
-            ]
-            for w, bi, ei, text_span_start, text_span_end, fixed_span_val in [
-                ("<S>", -1, -1, -1, -1, -1)
-            ]
-            + tree
-            + [("</S>", -1, -1, -1, -1, -1)]
-        ]
         if self.tree_to_text:
-            stripped_tree_tokens = []
-            for w, bi, ei in tree:
-                tree_node = w.lower()
-                tree_node_processed = re.sub("[^0-9a-zA-Z]+", " ", tree_node)
-                tree_tokens = tree_node_processed.split(" ")
-                stripped_tree_tokens += [x for x in tree_tokens if x != ""]
-
-            extended_tree = ["[CLS]"] + stripped_tree_tokens + ["[SEP]"]
-            tree_idx_ls = [self.tokenizer._convert_token_to_id(w) for w in extended_tree]
+            tree_idx_ls = tree_to_text_ids(tree_idx_ls, self.tree_voc, self.tokenizer)
         return (text_idx_ls, tree_idx_ls, (text, p_text, p_tree))
 
     def add_hard_example(self, exple):
@@ -162,3 +180,174 @@ class CAIPDataset(Dataset):
         else:
             self.data["hard"][self.hard_buffer_counter % self.hard_buffer_size] = exple
         self.hard_buffer_counter += 1
+
+
+class PretokenizedCAIPData:
+    """The examples of a data type of a split written by pretokenize_caip, read from memory
+    mapped arrays: the input token ids and the linearized trees of all the examples, with the
+    offsets of each example, and the raw (input|tree) lines.  The arrays are opened on first
+    access, also after unpickling (eg. in DataLoader workers).
+
+    Args:
+        path: directory of the arrays, <pretokenized data dir>/<split>/<data type>
+    """
+
+    ARRAYS = ["text_ids", "text_offsets", "tree", "tree_offsets", "raw", "raw_offsets"]
+
+    def __init__(self, path):
+        self.path = path
+        self._arrays = None
+        self.num_examples = len(np.load(pjoin(path, "text_offsets.npy"), mmap_mode="r")) - 1
+
+    def __len__(self):
+        return self.num_examples
+
+    def __getstate__(self):
+        return {"path": self.path, "_arrays": None, "num_examples": self.num_examples}
+
+    @property
+    def arrays(self):
+        if self._arrays is None:
+            self._arrays = {
+                name: np.load(pjoin(self.path, name + ".npy"), mmap_mode="r")
+                for name in self.ARRAYS
+            }
+        return self._arrays
+
+    def __getitem__(self, idx):
+        """the input token ids, the linearized tree and the raw (input, tree) of an example"""
+        a = self.arrays
+        text_ids = a["text_ids"][a["text_offsets"][idx] : a["text_offsets"][idx + 1]]
+        tree = a["tree"][a["tree_offsets"][idx] : a["tree_offsets"][idx + 1]]
+        raw = a["raw"][a["raw_offsets"][idx] : a["raw_offsets"][idx + 1]].tobytes()
+        p_text, p_tree = raw.decode("utf-8").split("|")
+        return text_ids, tree, (p_text, p_tree)
+
+
+class CAIPStreamDataset(IterableDataset):
+    """Streams examples pretokenized by pretokenize_caip, instead of applying BPE and
+    linearizing the trees of the text files on-the-fly like CAIPDataset; yields the same
+    examples, in the format of CAIPDataset.__getitem__.
+
+    With sampling, the data type of each example is sampled with the dtype_samples
+    probabilities and the example uniformly in the data type, else the examples of dtype are
+    read in order.  In a DataLoader with several workers, each worker yields its share of the
+    examples of the epoch: with sampling, from its own random generator seeded by the seed, the
+    epoch (see set_epoch) and the worker id, else every num_workers-th example.  Hard examples
+    (the "hard" data type) are only sampled in the process calling add_hard_example, so with
+    num_workers=0.  With tree_to_text, the trees are converted to text like in CAIPDataset.
+
+    Args:
+        data_dir: directory written by pretokenize_caip
+        tokenizer: the tokenizer used by pretokenize_caip
+        dtype_samples: data type -> sampling probability
+        split: split of the dataset
+        dtype: data type read without sampling, or sampled instead of empty data types
+        sampling: whether to sample data types and examples
+        word_noise: probability of replacing an input token by [UNK]
+        examples_per_epoch: number of examples per epoch if > 0, else the size of the largest
+            data type
+        seed: seed of the random generators
+        tree_to_text: whether to yield the words of the tree nodes as the target, for back
+            translation
+    """
+
+    def __init__(
+        self,
+        data_dir,
+        tokenizer,
+        dtype_samples,
+        split="train",
+        dtype="templated",
+        sampling=True,
+        word_noise=0.0,
+        examples_per_epoch=-1,
+        seed=0,
+        tree_to_text=False,
+    ):
+        self.tokenizer = tokenizer
+        self.tree_to_text = tree_to_text
+        with open(pjoin(data_dir, "index.json")) as f:
+            self.index = json.load(f)
+        with open(pjoin(data_dir, self.index["tree_voc_file"])) as f:
+            self.full_tree, tr_i2w = json.load(f)
+        self.tree_voc, self.tree_idxs = make_tree_voc(tr_i2w)
+        self.dtypes = list(dtype_samples.keys())
+        self.sample_probas = np.array([dtype_samples[k] for k in self.dtypes], dtype=np.float64)
+        self.sample_probas /= self.sample_probas.sum()
+        self.data = {"hard": []}
+        for k in set(self.dtypes + [dtype]):
+            if k in self.index["splits"].get(split, {}):
+                self.data[k] = PretokenizedCAIPData(pjoin(data_dir, split, k))
+            elif k != "hard":
+                print("could not find pretokenized dataset {} {}".format(split, k))
+                self.data[k] = []
+        self.dtype = dtype
+        self.sampling = sampling
+        self.word_noise = word_noise
+        self.seed = seed
+        self.epoch = 0
+        self.hard_buffer_size = 1024
+        self.hard_buffer_counter = 0
+
+        self.dataset_length = max([len(v) for v in self.data.values()])
+        if examples_per_epoch > 0:
+            self.dataset_length = min(self.dataset_length, examples_per_epoch)
+        self.special_ids = np.array(
+            [tokenizer._convert_token_to_id(w) for w in ["[CLS]", "[SEP]"]]
+        )
+        self.unk_id = tokenizer._convert_token_to_id("[UNK]")
+
+    def __len__(self):
+        return self.dataset_length
+
+    def set_epoch(self, epoch):
+        """Sets the epoch, to sample different examples in each epoch with several workers"""
+        self.epoch = epoch
+
+    def add_hard_example(self, exple):
+        """Add a given example for resampling."""
+        if self.hard_buffer_counter < self.hard_buffer_size:
+            self.data["hard"] += [exple]
+        else:
+            self.data["hard"][self.hard_buffer_counter % self.hard_buffer_size] = exple
+        self.hard_buffer_counter += 1
+
+    def _example(self, dtype, idx, rng):
+        data = self.data[dtype]
+        if dtype == "hard":
+            p_text, p_tree = data[idx]
+            text_idx_ls, tree_idx_ls, text = encode_caip_example(
+                p_text, p_tree, self.tokenizer, self.full_tree, self.tree_idxs, self.word_noise
+            )
+        else:
+            text_ids, tree, (p_text, p_tree) = data[idx]
+            if self.word_noise > 0:
+                noise = rng.random(len(text_ids)) < self.word_noise
+                noise &= ~np.isin(text_ids, self.special_ids)
+                text_ids = np.where(noise, self.unk_id, text_ids)
+            text_idx_ls = text_ids.tolist()
+            text = " ".join(self.tokenizer.convert_ids_to_tokens(text_idx_ls))
+            tree_idx_ls, p_tree = tree.tolist(), json.loads(p_tree)
+        if self.tree_to_text:
+            tree_idx_ls = tree_to_text_ids(tree_idx_ls, self.tree_voc, self.tokenizer)
+        return text_idx_ls, tree_idx_ls, (text, p_text, p_tree)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = 0, 1
+        if worker_info is not None:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+        rng = np.random.default_rng([self.seed, self.epoch, worker_id])
+        if not self.sampling:
+            for i in range(worker_id, self.dataset_length, num_workers):
+                dtype = self.dtype
+                yield self._example(dtype, i % len(self.data[dtype]), rng)
+            return
+        num_examples = len(range(worker_id, self.dataset_length, num_workers))
+        dtype_ids = rng.choice(len(self.dtypes), size=num_examples, p=self.sample_probas)
+        for k in dtype_ids:
+            dtype = self.dtypes[k]
+            if len(self.data[dtype]) == 0:
+                dtype = self.dtype
+            yield self._example(dtype, rng.integers(len(self.data[dtype])), rng)
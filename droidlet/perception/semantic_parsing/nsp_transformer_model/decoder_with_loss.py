@@ -85,29 +85,38 @@ class DecoderWithLoss(nn.Module):
         self.fixed_span_loss = torch.nn.CrossEntropyLoss(ignore_index=-1, reduction="none")
         self.tree_to_text = args.tree_to_text
 
-    def step(self, y, y_mask, x_reps, x_mask):
+    def step(self, y, y_mask, x_reps, x_mask, past_key_values=None):
         """Without loss, used at prediction time.
 
-        TODO: add previously computed y_rep, currently y only has the node indices, not spans.
+        For incremental decoding, pass the past_key_values returned by the previous step:
+        y then only has the nodes which are not in the cache yet, and the scores are only
+        computed for these nodes.
 
         Args:
             y: targets
-            y_mask: mask for targets
+            y_mask: mask for targets, including the cached ones
             x_reps: encoder hidden states
             x_mask: input mask
+            past_key_values: keys and values of the previous nodes in each layer, or None
 
         Returns:
-            Dictionary containing scores from each output head
+            Dictionary containing scores from each output head, and the past_key_values
+            of all the nodes so far
 
         """
-        y_rep = self.bert(
+        bert_out = self.bert(
             labels=y,
             input_ids=y,
             attention_mask=y_mask,
             encoder_hidden_states=x_reps,
             encoder_attention_mask=x_mask,
-        )[0]
-        y_mask_target = y_mask
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=False,
+        )
+        # (sequence output, pooled output, past_key_values)
+        y_rep = bert_out[0]
+        y_mask_target = y_mask[:, -y.shape[1] :]
         lm_scores = self.lm_head(y_rep)
         y_span_pre_b = y_rep
         for hw in self.span_b_proj:
@@ -153,6 +162,7 @@ class DecoderWithLoss(nn.Module):
             "text_span_start_scores": torch.log_softmax(text_span_start_scores, dim=-1).detach(),
             "text_span_end_scores": torch.log_softmax(text_span_end_scores, dim=-1).detach(),
             "fixed_value_scores": torch.log_softmax(fixed_value_scores, dim=-1).detach(),
+            "past_key_values": bert_out[2],
         }
         return res
 
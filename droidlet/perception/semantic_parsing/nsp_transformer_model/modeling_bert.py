@@ -532,6 +532,9 @@ class BertEncoder(nn.Module):
         all_cross_attentions = () if output_attentions and self.config.add_cross_attention else None
 
         next_decoder_cache = () if use_cache else None
+        # the caches of the expert layers follow the ones of the layers
+        expert_past_key_values = past_key_values[len(self.layer) :] if past_key_values is not None else None
+        next_expert_cache = () if use_cache else None
         # NOTE: this is where the for loop iterating over layers is
         # Let's say layer 5 is where we branch off
         # condition on the hidden
@@ -548,6 +551,9 @@ class BertEncoder(nn.Module):
                 hidden_size = hidden_states.shape[-1]
                 sum_of_experts = torch.zeros(labels.size() + (hidden_size,)).to(labels.device)
                 for j, expert_layer_j in enumerate(self.expert_layers):
+                    expert_past_key_value = (
+                        expert_past_key_values[j] if expert_past_key_values is not None else None
+                    )
                     # For token j
                     # B x V x H
                     layer_outputs_j = self.expert_layers[j](
@@ -556,9 +562,12 @@ class BertEncoder(nn.Module):
                         layer_head_mask,
                         encoder_hidden_states,
                         encoder_attention_mask,
-                        past_key_value,
+                        expert_past_key_value,
                         output_attentions,
-                    )[0]
+                    )
+                    if use_cache:
+                        next_expert_cache += (layer_outputs_j[-1],)
+                    layer_outputs_j = layer_outputs_j[0]
                     # Mask the outputs for tokens that are assigned to this layer
                     # B x V
                     mask_token_j = torch.where(labels % 20 == j, 1, 0)
@@ -620,6 +629,8 @@ class BertEncoder(nn.Module):
 
         if output_hidden_states:
             all_hidden_states = all_hidden_states + (hidden_states,)
+        if use_cache:
+            next_decoder_cache += next_expert_cache
 
         if not return_dict:
             return tuple(
@@ -924,6 +935,8 @@ class BertModel(BertPreTrainedModel):
             - 0 for tokens that are **masked**.
         past_key_values (:obj:`tuple(tuple(torch.FloatTensor))` of length :obj:`config.n_layers` with each tuple having 4 tensors of shape :obj:`(batch_size, num_heads, sequence_length - 1, embed_size_per_head)`):
             Contains precomputed key and value hidden states of the attention blocks. Can be used to speed up decoding.
+            When the model has expert layers (at least 12 layers), their key and value states follow the ones of
+            the layers.
 
             If :obj:`past_key_values` are used, the user can optionally input only the last :obj:`decoder_input_ids`
             (those that don't have their past key value states given to this model) of shape :obj:`(batch_size, 1)`
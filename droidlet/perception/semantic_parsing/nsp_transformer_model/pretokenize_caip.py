@@ -0,0 +1,158 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+
+Writes a CAIP dataset (the <split>/<data type>.txt files of a data directory) with the inputs
+tokenized and the trees linearized, in memory mapped arrays streamed by CAIPStreamDataset:
+
+    <output_dir>/index.json: tokenizer, grammar file and number of examples of each file
+    <output_dir>/tree_voc.json: the grammar and tree vocabulary (full_tree, tree_i2w)
+    <output_dir>/<split>/<data type>/*.npy: the examples of <split>/<data type>.txt
+
+eg. python -m droidlet.perception.semantic_parsing.nsp_transformer_model.pretokenize_caip \
+    --data_dir agents/craftassist/datasets/annotated_data/ --output_dir pretokenized_data/
+"""
+import argparse
+import json
+import logging
+import os
+from array import array
+from os.path import isfile
+from os.path import join as pjoin
+
+import numpy as np
+
+from .caip_dataset import encode_caip_example, make_tree_voc
+from .utils_caip import make_full_tree, process_txt_data
+
+
+def pretokenize_file(fname, output_dir, tokenizer, full_tree, tree_idxs):
+    """Writes the examples of a text file in output_dir, and returns their number"""
+    text_ids, text_offsets = array("i"), array("q", [0])
+    tree, tree_offsets = array("i"), array("q", [0])
+    raw, raw_offsets = bytearray(), array("q", [0])
+    with open(fname) as f:
+        for line in f:
+            p_text, p_tree = line.split("|")
+            text_idx_ls, tree_idx_ls, _ = encode_caip_example(
+                p_text, json.loads(p_tree), tokenizer, full_tree, tree_idxs
+            )
+            text_ids.extend(text_idx_ls)
+            text_offsets.append(len(text_ids))
+            for node in tree_idx_ls:
+                tree.extend(node)
+            tree_offsets.append(len(tree) // 6)
+            raw += "|".join([p_text, p_tree.strip()]).encode("utf-8")
+            raw_offsets.append(len(raw))
+    os.makedirs(output_dir, exist_ok=True)
+    arrays = {
+        "text_ids": np.frombuffer(text_ids, dtype=np.int32),
+        "text_offsets": np.frombuffer(text_offsets, dtype=np.int64),
+        "tree": np.frombuffer(tree, dtype=np.int32).reshape(-1, 6),
+        "tree_offsets": np.frombuffer(tree_offsets, dtype=np.int64),
+        "raw": np.frombuffer(bytes(raw), dtype=np.uint8),
+        "raw_offsets": np.frombuffer(raw_offsets, dtype=np.int64),
+    }
+    for name, values in arrays.items():
+        np.save(pjoin(output_dir, name + ".npy"), values)
+    return len(text_offsets) - 1
+
+
+def pretokenize_dataset(
+    data_dir, output_dir, tokenizer, full_tree_voc, dtypes, splits=("train", "valid", "test")
+):
+    """Pretokenizes the <split>/<data type>.txt files of data_dir which exist, and writes the
+    index of output_dir
+
+    Args:
+        data_dir: directory of the text files
+        output_dir: directory of the pretokenized dataset
+        tokenizer: pre-trained tokenizer for input
+        full_tree_voc: grammar and tree vocabulary used to linearize the trees
+        dtypes: data types
+        splits: splits of the dataset
+
+    Returns:
+        the index
+    """
+    full_tree, tree_i2w = full_tree_voc
+    _, tree_idxs = make_tree_voc(tree_i2w)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(pjoin(output_dir, "tree_voc.json"), "w") as f:
+        json.dump(full_tree_voc, f)
+    index = {
+        "tokenizer": getattr(tokenizer, "name_or_path", type(tokenizer).__name__),
+        "vocab_size": len(tokenizer),
+        "tree_voc_file": "tree_voc.json",
+        "splits": {},
+    }
+    for split in splits:
+        for dtype in dtypes:
+            fname = pjoin(data_dir, split, dtype + ".txt")
+            if not isfile(fname):
+                continue
+            logging.info("pretokenizing {}".format(fname))
+            num_examples = pretokenize_file(
+                fname, pjoin(output_dir, split, dtype), tokenizer, full_tree, tree_idxs
+            )
+            index["splits"].setdefault(split, {})[dtype] = num_examples
+    with open(pjoin(output_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def main():
+    from transformers import AutoTokenizer
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_dir",
+        default="agents/craftassist/datasets/annotated_data/",
+        type=str,
+        help="train/valid/test data",
+    )
+    parser.add_argument(
+        "--output_dir", required=True, type=str, help="Where we save the pretokenized data"
+    )
+    parser.add_argument(
+        "--tree_voc_file",
+        default="agents/craftassist/models/semantic_parser/ttad_bert_updated/caip_test_model_tree.json",
+        type=str,
+        help="Pre-computed grammar and output vocabulary, made from the data if it does not exist",
+    )
+    parser.add_argument(
+        "--pretrained_encoder_name",
+        default="distilbert-base-uncased",
+        type=str,
+        help="Pretrained text encoder, whose tokenizer is applied",
+    )
+    parser.add_argument(
+        "--dtypes",
+        default="templated,templated_filters,annotated",
+        type=str,
+        help="Comma separated data types to pretokenize",
+    )
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.INFO)
+    dtypes = args.dtypes.split(",")
+    splits = ["train", "valid", "test"]
+    if isfile(args.tree_voc_file):
+        logging.info("====== Loading Grammar ======")
+        with open(args.tree_voc_file) as fd:
+            full_tree_voc = json.load(fd)
+    else:
+        logging.info("====== Making Grammar ======")
+        full_tree_voc = make_full_tree(
+            [
+                (process_txt_data(pjoin(args.data_dir, spl, dt + ".txt")), 1.0)
+                for spl in splits
+                for dt in dtypes
+                if isfile(pjoin(args.data_dir, spl, dt + ".txt"))
+            ]
+        )
+    tokenizer = AutoTokenizer.from_pretrained(args.pretrained_encoder_name)
+    index = pretokenize_dataset(args.data_dir, args.output_dir, tokenizer, full_tree_voc, dtypes)
+    logging.info("pretokenized: {}".format(index["splits"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,8 @@ class TTADBertModel(object):
         dataset (CAIPDataset): CAIP (CraftAssist Instruction Parsing) Dataset. Note that
             this is empty during inference.
         encoder_decoder (EncoderDecoderWithLoss): Transformer model class. See
+        model_version (str): Identifies the checkpoint (name, size and modification time), eg.
+            to invalidate the parses cached with another model.
 
     Args:
         model_dir (str): Path to directory containing all files necessary to
@@ -47,6 +49,10 @@ class TTADBertModel(object):
         if torch.cuda.is_available():
             self.encoder_decoder.cuda()
         self.encoder_decoder.eval()
+        checkpoint = os.stat(os.path.join(model_dir, model_name + ".pth"))
+        self.model_version = "{}-{}-{}".format(
+            model_name, checkpoint.st_size, int(checkpoint.st_mtime)
+        )
 
     def parse(self, chat, noop_thres=0.95, beam_size=5, well_formed_pen=1e2):
         """Given an incoming chat, query the parser and return a logical form.
@@ -59,11 +65,34 @@ class TTADBertModel(object):
             dict: Logical form.
 
         """
-        btr = beam_search(
-            chat, self.encoder_decoder, self.tokenizer, self.dataset, beam_size, well_formed_pen
-        )
-        if btr[0][0].get("dialogue_type", "NONE") == "NOOP" and math.exp(btr[0][1]) < noop_thres:
-            tree = btr[1][0]
-        else:
-            tree = btr[0][0]
-        return tree
+        return self.parse_batch([chat], noop_thres, beam_size, well_formed_pen)[0]
+
+    def parse_batch(
+        self, chats, noop_thres=0.95, beam_size=5, well_formed_pen=1e2, return_scores=False
+    ):
+        """Given a list of preprocessed chats, query the parser and return their logical forms,
+        with one encoder pass and a batched beam search, see :any:`batch_beam_search`
+
+        Args:
+            chats (list[str]): Preprocessed chat commands, see parse
+            return_scores (bool): also return the confidence of each logical form, the
+                probability of its beam
+
+        Returns:
+            list[dict]: Logical forms, in the same order as the chats, or list of
+            (logical form, confidence) with return_scores.
+
+        """
+        trees = []
+        for btr in batch_beam_search(
+            chats, self.encoder_decoder, self.tokenizer, self.dataset, beam_size, well_formed_pen
+        ):
+            if (
+                btr[0][0].get("dialogue_type", "NONE") == "NOOP"
+                and math.exp(btr[0][1]) < noop_thres
+            ):
+                tree, score = btr[1][:2]
+            else:
+                tree, score = btr[0][:2]
+            trees.append((tree, math.exp(score)) if return_scores else tree)
+        return trees
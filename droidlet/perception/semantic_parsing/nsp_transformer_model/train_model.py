@@ -14,7 +14,7 @@ from os.path import isfile
 from os.path import join as pjoin
 from tqdm import tqdm
 
-from torch.utils.data import DataLoader, RandomSampler, SequentialSampler
+from torch.utils.data import DataLoader, IterableDataset, RandomSampler, SequentialSampler
 from transformers import AutoModel, AutoTokenizer, BertConfig
 
 from .utils_parsing import *
@@ -45,8 +45,8 @@ class ModelTrainer:
             Tuple of (Loss, Accuracy)
 
         """
-        # make data sampler
-        train_sampler = RandomSampler(dataset)
+        # make data sampler, streamed datasets sample their examples
+        train_sampler = None if isinstance(dataset, IterableDataset) else RandomSampler(dataset)
         logging.info("Initializing train data sampler: {}".format(train_sampler))
         model_collate_fn = functools.partial(
             caip_collate, tokenizer=tokenizer, tree_to_text=self.args.tree_to_text
@@ -56,6 +56,7 @@ class ModelTrainer:
             sampler=train_sampler,
             batch_size=self.args.batch_size,
             collate_fn=model_collate_fn,
+            num_workers=self.args.num_data_workers,
         )
         epoch_iterator = tqdm(train_dataloader, desc="Iteration", disable=True)
         # make optimizer
@@ -78,6 +79,8 @@ class ModelTrainer:
         # training loop
         for e in range(self.args.num_epochs):
             logging.info("Epoch: {}".format(e))
+            if hasattr(dataset, "set_epoch"):
+                dataset.set_epoch(e)
             loc_steps = 0
             loc_loss = 0.0
             loc_int_acc = 0.0
@@ -333,6 +336,19 @@ def main():
         type=str,
         help="Where we save the model",
     )
+    parser.add_argument(
+        "--pretokenized_data_dir",
+        default="",
+        type=str,
+        help="train data written by pretokenize_caip, streamed instead of the text files of "
+        "data_dir (the grammar of the pretokenized data is used)",
+    )
+    parser.add_argument(
+        "--num_data_workers",
+        default=0,
+        type=int,
+        help="Number of DataLoader worker processes, hard examples are disabled if > 0",
+    )
     parser.add_argument("--model_name", default="caip_parser", type=str, help="Model name")
     parser.add_argument(
         "--tree_voc_file",
@@ -469,7 +485,13 @@ def main():
     logging.info("****** Args ******")
     logging.info(vars(args))
     logging.info("model identifier: {}".format(model_identifier))
-    if isfile(args.tree_voc_file):
+    if args.pretokenized_data_dir:
+        logging.info("====== Loading Grammar of the pretokenized data ======")
+        with open(pjoin(args.pretokenized_data_dir, "index.json")) as fd:
+            tree_voc_file = pjoin(args.pretokenized_data_dir, json.load(fd)["tree_voc_file"])
+        with open(tree_voc_file) as fd:
+            full_tree, tree_i2w = json.load(fd)
+    elif isfile(args.tree_voc_file):
         logging.info("====== Loading Grammar ======")
         with open(args.tree_voc_file) as fd:
             full_tree, tree_i2w = json.load(fd)
@@ -494,14 +516,31 @@ def main():
         json.dump((full_tree, tree_i2w), open(args.tree_voc_file, "w"))
     tokenizer = AutoTokenizer.from_pretrained(args.pretrained_encoder_name)
     logging.info("====== Loading Dataset ======")
-    train_dataset = CAIPDataset(
-        tokenizer,
-        args,
-        prefix="train",
-        sampling=True,
-        word_noise=args.word_dropout,
-        full_tree_voc=(full_tree, tree_i2w),
-    )
+    if args.hard and args.num_data_workers > 0:
+        # the DataLoader workers sample from their own copies of the dataset, which do not
+        # see the hard examples added by the training loop
+        logging.warning("hard examples need --num_data_workers 0, not adding hard examples")
+        args.hard = 0
+    if args.pretokenized_data_dir:
+        train_dataset = CAIPStreamDataset(
+            args.pretokenized_data_dir,
+            tokenizer,
+            dict(json.loads(args.dtype_samples)),
+            split="train",
+            sampling=True,
+            word_noise=args.word_dropout,
+            examples_per_epoch=args.examples_per_epoch,
+            tree_to_text=args.tree_to_text,
+        )
+    else:
+        train_dataset = CAIPDataset(
+            tokenizer,
+            args,
+            prefix="train",
+            sampling=True,
+            word_noise=args.word_dropout,
+            full_tree_voc=(full_tree, tree_i2w),
+        )
     logging.info("====== Setting up Model ======")
 
     # make model
@@ -6,7 +6,22 @@ from .utils_caip import select_spans, seq_to_tree, tokenize_mapidx, caip_collate
 from .tokenization_utils import fixed_span_values_voc
 
 
-def beam_search(txt, model, tokenizer, dataset, beam_size=5, well_formed_pen=1e2):
+def reorder_past_key_values(past_key_values, beam_ids):
+    """Reorders the cached keys and values of the decoder layers along the beams.
+
+    Only the self-attention keys and values depend on the beam: the cross-attention ones
+    are computed from the same encoder hidden states for all beams.
+    """
+    return tuple(
+        (layer_past[0][beam_ids], layer_past[1][beam_ids]) + tuple(layer_past[2:])
+        for layer_past in past_key_values
+    )
+
+
+@torch.no_grad()
+def beam_search(
+    txt, model, tokenizer, dataset, beam_size=5, well_formed_pen=1e2, use_cache=True
+):
     """Beam search decoding.
 
     Note: Only uses node prediction scores, not the span scores.
@@ -17,177 +32,212 @@ def beam_search(txt, model, tokenizer, dataset, beam_size=5, well_formed_pen=1e2
         tokenizer: pretrained tokenizer
         beam_size (int): Number of branches to keep in beam search
         well_formed_pen (float): penalization for poorly formed trees
+        use_cache (bool): decode incrementally, with the keys and values of the previous
+            nodes cached in each decoder layer, instead of running the decoder over the
+            whole sequence at each step
 
     Returns:
         logical form (dict)
 
+    """
+    return batch_beam_search(
+        [txt], model, tokenizer, dataset, beam_size, well_formed_pen, use_cache
+    )[0]
+
+
+@torch.no_grad()
+def batch_beam_search(
+    txts, model, tokenizer, dataset, beam_size=5, well_formed_pen=1e2, use_cache=True
+):
+    """Beam search decoding of several chats at once: the chats are encoded in a single
+    padded batch, and the beams of all the chats are decoded together, in a batch of
+    len(txts) * beam_size sequences. Each chat gets the same result as with beam_search.
+
+    Args:
+        txts (list[str]): chat inputs
+        model: model class with pretrained model
+        tokenizer: pretrained tokenizer
+        beam_size (int): Number of branches to keep in beam search
+        well_formed_pen (float): penalization for poorly formed trees
+        use_cache (bool): decode incrementally, see beam_search
+
+    Returns:
+        for each chat, the list of (logical form, score, sequence) of its beams, best first
+
     """
     model_device = model.decoder.lm_head.predictions.decoder.weight.device
+    n_txts = len(txts)
     # prepare batch
-    text, idx_maps = tokenize_mapidx(txt, tokenizer)
-    idx_rev_map = [(0, 0)] * len(text.split())
-    for line_id, idx_map in enumerate(idx_maps):
-        for pre_id, (a, b) in enumerate(idx_map):
-            idx_rev_map[a] = (line_id, pre_id)
-            idx_rev_map[b] = (line_id, pre_id)
-    idx_rev_map[-1] = idx_rev_map[-2]
-    tree = [("<S>", -1, -1, -1, -1, -1)]
-    text_idx_ls = [dataset.tokenizer._convert_token_to_id(w) for w in text.split()]
-    tree_idx_ls = [
-        [dataset.tree_idxs[w], bi, ei, text_span_bi, text_span_ei, fixed_val]
-        for w, bi, ei, text_span_bi, text_span_ei, fixed_val in tree
-    ]
-    pre_batch = [(text_idx_ls, tree_idx_ls, (text, txt, {}))]
+    pre_batch = []
+    idx_rev_maps = []
+    for txt in txts:
+        text, idx_maps = tokenize_mapidx(txt, tokenizer)
+        idx_rev_map = [(0, 0)] * len(text.split())
+        for line_id, idx_map in enumerate(idx_maps):
+            for pre_id, (a, b) in enumerate(idx_map):
+                idx_rev_map[a] = (line_id, pre_id)
+                idx_rev_map[b] = (line_id, pre_id)
+        idx_rev_map[-1] = idx_rev_map[-2]
+        idx_rev_maps.append(idx_rev_map)
+        tree = [("<S>", -1, -1, -1, -1, -1)]
+        text_idx_ls = [dataset.tokenizer._convert_token_to_id(w) for w in text.split()]
+        tree_idx_ls = [
+            [dataset.tree_idxs[w], bi, ei, text_span_bi, text_span_ei, fixed_val]
+            for w, bi, ei, text_span_bi, text_span_ei, fixed_val in tree
+        ]
+        pre_batch.append((text_idx_ls, tree_idx_ls, (text, txt, {})))
     batch = caip_collate(pre_batch, tokenizer)
     batch = [t.to(model_device) for t in batch[:4]]
     x, x_mask, y, y_mask = batch
     x_reps = model.encoder(input_ids=x, attention_mask=x_mask)[0].detach()
-    x_mask = x_mask.expand(beam_size, -1)
-    x_reps = x_reps.expand(beam_size, -1, -1)
+    # the beams of the i-th chat are the rows i * beam_size to (i + 1) * beam_size - 1
+    x_mask = x_mask.repeat_interleave(beam_size, dim=0)
+    x_reps = x_reps.repeat_interleave(beam_size, dim=0)
+    x_len = x_reps.shape[1]
     # start decoding
-    y = torch.LongTensor([[dataset.tree_idxs["<S>"]] for _ in range(beam_size)]).to(
-        model_device
-    )  # B x 1
-    beam_scores = torch.Tensor([-1e9 for _ in range(beam_size)]).to(model_device)  # B
-    beam_scores[0] = 0
-    beam_seqs = [[("<S>", -1, -1, -1, -1, -1)] for _ in range(beam_size)]
-    finished = [False for _ in range(beam_size)]
+    y = y[:, :, 0].repeat_interleave(beam_size, dim=0)  # NB x 1
+    y_mask = y_mask.repeat_interleave(beam_size, dim=0)  # NB x 1
+    beam_scores = torch.full((n_txts, beam_size), -1e9, device=model_device)  # N x B
+    beam_scores[:, 0] = 0
+    beam_seqs = [[("<S>", -1, -1, -1, -1, -1)] for _ in range(n_txts * beam_size)]
+    finished = torch.zeros(n_txts * beam_size, dtype=torch.bool, device=model_device)  # NB
+    # offsets of the beams of each chat in the batch
+    beam_offsets = torch.arange(n_txts, device=model_device)[:, None] * beam_size  # N x 1
+    eos_id = dataset.tree_idxs["</S>"]
     fixed_value_vocab_size = len(fixed_span_values_voc)
     pad_scores = torch.Tensor([-1e9] * (len(dataset.tree_voc) - fixed_value_vocab_size)).to(
         model_device
     )
     pad_scores[dataset.tree_idxs["[PAD]"]] = 0
-    for i in range(100):
-        outputs = model.decoder.step(y, y_mask, x_reps, x_mask)
+    # spans are invalid if beginning > end, or if they start or end in the padding of a
+    # shorter chat: very small scores, the same for all steps
+    invalid_span_scores = torch.ones(x_len, x_len, device=model_device).tril(diagonal=-1) * -1e9
+    x_pad_scores = (1 - x_mask.type_as(x_reps)) * -1e9  # NB x T
+    invalid_span_scores = (
+        invalid_span_scores[None, :, :] + x_pad_scores[:, :, None] + x_pad_scores[:, None, :]
+    )  # NB x T x T
+    past_key_values = None
+    for _ in range(100):
+        if use_cache:
+            # only run the decoder on the last node, the previous ones are cached
+            outputs = model.decoder.step(y[:, -1:], y_mask, x_reps, x_mask, past_key_values)
+        else:
+            outputs = model.decoder.step(y, y_mask, x_reps, x_mask)
         # next word, grab the final token
-        lm_scores = outputs["lm_scores"][:, -1, :]  # B x V
-        for i, fshed in enumerate(finished):
-            if fshed:
-                # set predictions to padding tokens
-                lm_scores[i] = pad_scores
-        beam_lm_scores = lm_scores + beam_scores[:, None]  # B x V
-        beam_lm_lin = beam_lm_scores.view(-1)
-        # get the highest probability tokens
-        s_scores, s_ids = beam_lm_lin.sort(dim=-1, descending=True)
-        s_beam_ids = s_ids // beam_lm_scores.shape[-1]
-        s_word_ids = s_ids % beam_lm_scores.shape[-1]
-        # re-order and add next token
-        beam_scores = s_scores[:beam_size]
-        n_beam_ids = s_beam_ids[:beam_size]
-        n_word_ids = s_word_ids[:beam_size]
-        # convert tokens to words
-        n_words = [dataset.tree_voc[nw_id.item()] for nw_id in n_word_ids]
+        lm_scores = outputs["lm_scores"][:, -1, :]  # NB x V
+        # set predictions of finished beams to padding tokens
+        lm_scores = torch.where(finished[:, None], pad_scores[None, :], lm_scores)
+        voc_size = lm_scores.shape[-1]
+        beam_lm_scores = lm_scores + beam_scores.view(-1)[:, None]  # NB x V
+        # get the highest probability tokens of each chat, and re-order
+        beam_scores, s_ids = beam_lm_scores.view(n_txts, -1).topk(beam_size, dim=-1)  # N x B
+        n_beam_ids = (s_ids // voc_size + beam_offsets).view(-1)
+        n_word_ids = (s_ids % voc_size).view(-1)
+        # add next token
         y = torch.cat([y[n_beam_ids], n_word_ids[:, None]], dim=1)
         # find out which of the beams are finished
-        pre_finished = [finished[b_id.item()] for b_id in n_beam_ids]
-        new_finished = [w_id.item() == dataset.tree_idxs["</S>"] for w_id in n_word_ids]
-        finished = [p or n for p, n in zip(pre_finished, new_finished)]
-        n_mask = 1 - torch.Tensor(finished).type_as(y_mask)
+        finished = finished[n_beam_ids] | (n_word_ids == eos_id)
+        n_mask = (~finished).type_as(y_mask)
         y_mask = torch.cat([y_mask[n_beam_ids], n_mask[:, None]], dim=1)
+        if use_cache:
+            past_key_values = reorder_past_key_values(outputs["past_key_values"], n_beam_ids)
         # predicted span
-        span_b_scores = outputs["span_b_scores"][:, -1, :][n_beam_ids]  # B x T
-        span_e_scores = outputs["span_e_scores"][:, -1, :][n_beam_ids]  # B x T
+        span_b_scores = outputs["span_b_scores"][:, -1, :][n_beam_ids]  # NB x T
+        span_e_scores = outputs["span_e_scores"][:, -1, :][n_beam_ids]  # NB x T
         span_be_scores = span_b_scores[:, :, None] + span_e_scores[:, None, :]
-        # scores are invalid if beginning > end
-        # Create triangular matrix with negative infinity for invalid combos
-        invalid_scores = torch.tril(torch.ones(span_be_scores.shape), diagonal=-1) * -1e9
-        # Make invalid scores very small
-        span_be_scores += invalid_scores.type_as(span_be_scores)
-        # Create linearized view
-        span_be_lin = span_be_scores.view(span_be_scores.shape[0], -1)
-        # Sort linearized scores by descending order
-        _, s_sbe_ids = span_be_lin.sort(dim=-1, descending=True)
-        # Grab token IDs for top scores
-        s_sb_ids = s_sbe_ids[:, 0] // span_b_scores.shape[-1]
-        s_se_ids = s_sbe_ids[:, 0] % span_b_scores.shape[-1]
-        beam_b_ids = [bb_id.item() for bb_id in s_sb_ids]
-        beam_e_ids = [be_id.item() for be_id in s_se_ids]
+        span_be_scores = span_be_scores + invalid_span_scores
+        # Grab token IDs for top scores of linearized view
+        s_sbe_ids = span_be_scores.view(n_txts * beam_size, -1).argmax(dim=-1)
+        s_sb_ids = s_sbe_ids // x_len
+        s_se_ids = s_sbe_ids % x_len
 
         # predict text spans
-        text_span_start_scores = outputs["text_span_start_scores"][:, -1, :][n_beam_ids]  # B x T
-        text_span_end_scores = outputs["text_span_end_scores"][:, -1, :][n_beam_ids]  # B x T
+        text_span_start_scores = outputs["text_span_start_scores"][:, -1, :][n_beam_ids]
+        text_span_end_scores = outputs["text_span_end_scores"][:, -1, :][n_beam_ids]
         text_span_scores = text_span_start_scores[:, :, None] + text_span_end_scores[:, None, :]
-        invalid_text_span_scores = (
-            torch.tril(torch.ones(text_span_scores.shape), diagonal=-1) * -1e9
-        )
-        text_span_scores += invalid_text_span_scores.type_as(text_span_scores)
-        text_span_lin_scores = text_span_scores.view(text_span_scores.shape[0], -1)
-        _, text_span_ids = text_span_lin_scores.sort(dim=-1, descending=True)
-        text_span_start_ids = text_span_ids[:, 0] // text_span_start_scores.shape[-1]
-        text_span_end_ids = text_span_ids[:, 0] % text_span_start_scores.shape[-1]
-        text_span_beam_start_ids = [bb_id.item() for bb_id in text_span_start_ids]
-        text_span_beam_end_ids = [be_id.item() for be_id in text_span_end_ids]
+        text_span_scores = text_span_scores + invalid_span_scores
+        text_span_ids = text_span_scores.view(n_txts * beam_size, -1).argmax(dim=-1)
+        text_span_start_ids = text_span_ids // x_len
+        text_span_end_ids = text_span_ids % x_len
 
         # predict fixed values
-        fixed_value_scores = outputs["fixed_value_scores"][:, -1, :][n_beam_ids]  # B x T
-        fixed_value_lin_scores = fixed_value_scores.view(-1)
-        # get the highest probability tokens
-        fixed_value_ranked_scores, fixed_value_ids = fixed_value_lin_scores.sort(
-            dim=-1, descending=True
-        )
-        fixed_value_beam_ids = fixed_value_ids // fixed_value_scores.shape[-1]
+        fixed_value_scores = outputs["fixed_value_scores"][:, -1, :][n_beam_ids]  # NB x F
+        # get the highest probability tokens of each chat
+        _, fixed_value_ids = fixed_value_scores.view(n_txts, -1).topk(beam_size, dim=-1)
         # map back to which word in sequence, since
-        fixed_value_word_ids = fixed_value_ids % fixed_value_scores.shape[-1]
-        # re-order and add next token
-        fixed_value_beam_scores = fixed_value_ranked_scores[:beam_size]
-        fixed_value_beam_ids = fixed_value_beam_ids[:beam_size]
-        fixed_value_word_ids = fixed_value_word_ids[:beam_size]
-        # convert tokens to words
-        fixed_value_words = [fixed_span_values_voc[nw_id.item()] for nw_id in fixed_value_word_ids]
+        fixed_value_word_ids = (fixed_value_ids % fixed_value_scores.shape[-1]).view(-1)
 
+        # copy the predictions of the step to cpu at once
+        step_preds = torch.stack(
+            [
+                n_beam_ids,
+                n_word_ids,
+                s_sb_ids,
+                s_se_ids,
+                text_span_start_ids,
+                text_span_end_ids,
+                fixed_value_word_ids,
+                finished.long(),
+            ],
+            dim=1,
+        ).tolist()
         # update beam_seq
         beam_seqs = [
-            beam_seqs[n_beam_ids[i].item()]
+            beam_seqs[b_id]
             + [
                 (
-                    n_words[i],
-                    beam_b_ids[i],
-                    beam_e_ids[i],
-                    text_span_beam_start_ids[i],
-                    text_span_beam_end_ids[i],
-                    fixed_value_words[i],
+                    dataset.tree_voc[w_id],
+                    b,
+                    e,
+                    text_span_b,
+                    text_span_e,
+                    fixed_span_values_voc[fixed_value_id],
                 )
             ]
-            for i in range(beam_size)
+            for b_id, w_id, b, e, text_span_b, text_span_e, fixed_value_id, _ in step_preds
         ]
         # penalize poorly formed trees
-        for i, seq in enumerate(beam_seqs):
-            if seq[-1][0] == "</S>":
-                _, well_formed = select_spans(seq)
-                if not well_formed:
-                    beam_scores[i] -= well_formed_pen
+        ill_formed = [
+            i
+            for i, seq in enumerate(beam_seqs)
+            if seq[-1][0] == "</S>" and not select_spans(seq)[1]
+        ]
+        if ill_formed:
+            beam_scores.view(-1)[ill_formed] -= well_formed_pen
         # check whether all beams have reached EOS
-        if all(finished):
+        if all(preds[-1] for preds in step_preds):
             break
-    # only keep span predictions for span nodes, then map back to tree
-    beam_seqs = [
-        [
-            (w, b, e, -1, -1, -1)
-            if w.startswith("BE:")
-            else (w, -1, -1, text_span_start, text_span_end, fixed_val)
-            for w, b, e, text_span_start, text_span_end, fixed_val in res
-            if w != "[PAD]"
+    beam_scores = beam_scores.tolist()
+    results = []
+    for i, idx_rev_map in enumerate(idx_rev_maps):
+        # only keep span predictions for span nodes, then map back to tree
+        chat_seqs = [
+            [
+                (w, b, e, -1, -1, -1)
+                if w.startswith("BE:")
+                else (w, -1, -1, text_span_start, text_span_end, fixed_val)
+                for w, b, e, text_span_start, text_span_end, fixed_val in res
+                if w != "[PAD]"
+            ]
+            for res in beam_seqs[i * beam_size : (i + 1) * beam_size]
+        ]
+        chat_seqs = [
+            [
+                (w, -1, -1, text_span_start, text_span_end, -1)
+                if w.startswith("TBE:")
+                else (w, b, e, -1, -1, fixed_val)
+                for w, b, e, text_span_start, text_span_end, fixed_val in res
+            ]
+            for res in chat_seqs
         ]
-        for res in beam_seqs
-    ]
-    beam_seqs = [
-        [
-            (w, -1, -1, text_span_start, text_span_end, -1)
-            if w.startswith("TBE:")
-            else (w, b, e, -1, -1, fixed_val)
-            for w, b, e, text_span_start, text_span_end, fixed_val in res
-            if w != "[PAD]"
+        # delinearize predicted sequences into tree
+        beam_trees = [
+            seq_to_tree(dataset.full_tree, res[1:-1], idx_rev_map)[0] for res in chat_seqs
         ]
-        for res in beam_seqs
-    ]
-    # delinearize predicted sequences into tree
-    beam_trees = [seq_to_tree(dataset.full_tree, res[1:-1], idx_rev_map)[0] for res in beam_seqs]
-    pre_res = [
-        (tree, score.item(), seq) for tree, score, seq in zip(beam_trees, beam_scores, beam_seqs)
-    ]
-    # sort one last time to have well-formed trees on top
-    res = sorted(pre_res, key=lambda x: x[1], reverse=True)
-    return res
+        pre_res = list(zip(beam_trees, beam_scores[i], chat_seqs))
+        # sort one last time to have well-formed trees on top
+        results.append(sorted(pre_res, key=lambda x: x[1], reverse=True))
+    return results
 
 
 def compute_accuracy(outputs, y):
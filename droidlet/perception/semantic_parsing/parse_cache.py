@@ -0,0 +1,210 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from .load_and_check_datasets import ground_truth_files, read_ground_truth_file
+
+
+def normalize_chat(chat: str) -> str:
+    """Key of a preprocessed chat in the caches: lower case, with single spaces between words.
+    The words are not changed otherwise, so that the text spans of the logical form (word
+    indices) stay valid for all the chats with the same key.
+    """
+    return " ".join(chat.lower().split())
+
+
+def make_parent_dir(path: str):
+    """creates the directory of the SQLite file path, if it is not an in memory database"""
+    if path != ":memory:" and os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+
+class ParseCache:
+    """Caches the logical forms output by the parsing model, with the version of the model and
+    the confidence of the parse, in a SQLite database.  The cache is persisted across agent
+    restarts when path is a file; only the max_entries most recently used parses are kept.
+
+    Args:
+        path: path of the SQLite file, or ":memory:" for a cache which is not persisted
+        max_entries: maximum number of parses in the cache, the least recently used ones are
+            evicted
+
+    Examples::
+        >>> cache = ParseCache("cache/nsp_parse_cache.db")
+        >>> cache.put("build a cube", logical_form, model_version, confidence=0.98)
+        >>> logical_form, confidence = cache.get("Build a  cube", model_version)
+    """
+
+    def __init__(self, path: str = ":memory:", max_entries: int = 10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # the cache is read by the agent and written by the parser service thread
+        self._lock = threading.Lock()
+        make_parent_dir(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS parses (
+            chat TEXT PRIMARY KEY,
+            logical_form TEXT,
+            model_version TEXT,
+            confidence REAL,
+            last_used REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS parses_last_used ON parses(last_used)")
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM parses").fetchone()[0]
+
+    def get(self, chat: str, model_version: str) -> Optional[Tuple[Dict, float]]:
+        """Returns the cached (logical form, confidence) of the chat, if it was parsed by the
+        same version of the model, else None"""
+        key = normalize_chat(chat)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT logical_form, confidence FROM parses WHERE chat=? AND model_version=?",
+                (key, model_version),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE parses SET last_used=? WHERE chat=?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0]), row[1]
+
+    def put(self, chat: str, logical_form: Dict, model_version: str, confidence: float = 1.0):
+        """Caches the logical form of a chat, replacing the previous one, and evicts the least
+        recently used parses above max_entries"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parses VALUES (?, ?, ?, ?, ?)",
+                (
+                    normalize_chat(chat),
+                    json.dumps(logical_form),
+                    model_version,
+                    confidence,
+                    time.time(),
+                ),
+            )
+            self._conn.execute(
+                """DELETE FROM parses WHERE chat IN (
+                SELECT chat FROM parses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM parses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class GroundTruthIndex:
+    """The ground truth parses of the text files of ground_truth_data_dir/datasets, indexed by
+    normalized chat in a SQLite file.  The index is only (re)built from the text files when
+    they changed since it was built; otherwise it is opened on the first lookup, and the
+    parses are read from it when looked up.
+
+    Args:
+        ground_truth_data_dir: directory of the ground truth data
+        index_path: path of the index, or ":memory:" to build it on each run.  it should not
+            be in the data directories, which are checksummed by tools/data_scripts
+    """
+
+    def __init__(self, ground_truth_data_dir: str, index_path: str = ":memory:"):
+        self.ground_truth_data_dir = ground_truth_data_dir
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _signature(self) -> str:
+        """names, sizes and modification times of the text files"""
+        files = []
+        for path in ground_truth_files(self.ground_truth_data_dir):
+            stat = os.stat(path)
+            files.append([path, stat.st_size, stat.st_mtime])
+        return json.dumps(files)
+
+    def _connect(self):
+        if self._conn is not None:
+            return self._conn
+        if not os.path.isdir(self.ground_truth_data_dir):
+            self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self._build(self._conn, "[]")
+            return self._conn
+        signature = self._signature()
+        try:
+            make_parent_dir(self.index_path)
+            conn = sqlite3.connect(self.index_path, check_same_thread=False)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key='signature'").fetchone()
+            except sqlite3.OperationalError:
+                row = None
+            if row is None or row[0] != signature:
+                logging.info("Building the ground truth index {}".format(self.index_path))
+                self._build(conn, signature)
+        except (sqlite3.Error, OSError) as e:
+            # e.g. read-only directory
+            logging.warning("Cannot write {} ({}), indexing in memory".format(self.index_path, e))
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            self._build(conn, signature)
+        self._conn = conn
+        return conn
+
+    def _build(self, conn, signature: str):
+        conn.execute("DROP TABLE IF EXISTS ground_truth")
+        conn.execute("DROP TABLE IF EXISTS meta")
+        conn.execute("CREATE TABLE ground_truth (chat TEXT PRIMARY KEY, logical_form TEXT)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        for path in ground_truth_files(self.ground_truth_data_dir):
+            conn.executemany(
+                "INSERT OR REPLACE INTO ground_truth VALUES (?, ?)",
+                (
+                    (normalize_chat(text), logical_form)
+                    for text, logical_form in read_ground_truth_file(path)
+                ),
+            )
+        conn.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+        conn.commit()
+
+    def get(self, chat: str) -> Optional[Dict]:
+        """Returns the ground truth logical form of the chat, or None"""
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT logical_form FROM ground_truth WHERE chat=?", (normalize_chat(chat),)
+                )
+                .fetchone()
+            )
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, chat: str) -> bool:
+        return self.get(chat) is not None
+
+    def __getitem__(self, chat: str) -> Dict:
+        logical_form = self.get(chat)
+        if logical_form is None:
+            raise KeyError(chat)
+        return logical_form
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM ground_truth").fetchone()[0]
@@ -0,0 +1,144 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+
+
+class ParserService:
+    """Parses chats on a worker thread, in micro-batches: the chats submitted by all the callers
+    (the agent loop, the dashboard, offline evaluation) are queued, and the worker parses the
+    chats waiting in the queue together, with a single call of parse_batch_fn (e.g. one encoder
+    pass and a batched beam search).  A batch is started as soon as max_batch_size chats are
+    queued, or max_wait seconds after its first chat.
+
+    Args:
+        parse_batch_fn: list of chats -> list of logical forms, in the same order
+        max_batch_size: maximum number of chats parsed together
+        max_wait: seconds the first chat of a batch waits for other chats
+
+    Examples::
+        >>> service = ParserService(parsing_model.query_for_logical_forms)
+        >>> future = service.submit("build a red cube")
+        >>> logical_form = future.result()
+    """
+
+    def __init__(
+        self,
+        parse_batch_fn: Callable[[List[str]], List[Dict]],
+        max_batch_size: int = 8,
+        max_wait: float = 0.01,
+    ):
+        self.parse_batch_fn = parse_batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # (chat, future, submit time), or None to stop the worker
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "batches": 0,
+            "errors": 0,
+            "busy": 0.0,
+            "latency": 0.0,
+            "total_latency": 0.0,
+            "total_queue_wait": 0.0,
+        }
+        self._start_time = time.time()
+        self._worker = threading.Thread(target=self._run, name="ParserService", daemon=True)
+        self._worker.start()
+
+    def submit(self, chat: str) -> Future:
+        """Queues a chat, and returns a Future of its logical form"""
+        if not self._worker.is_alive():
+            raise RuntimeError("the parser service is stopped")
+        future = Future()
+        self._queue.put((chat, future, time.time()))
+        return future
+
+    def parse(self, chats: List[str]) -> List[Dict]:
+        """Parses chats, batched with the chats of the other callers, and waits for the
+        logical forms"""
+        return [future.result() for future in [self.submit(chat) for chat in chats]]
+
+    def stop(self):
+        """Stops the worker after the chats already queued are parsed"""
+        if self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
+
+    def _next_batch(self):
+        """Blocks until a chat is queued, then gathers the chats queued within max_wait"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                break
+            if request is None:
+                # parse the batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            # skip the chats whose future was cancelled while queued
+            batch = [r for r in batch if r[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = time.time()
+            try:
+                logical_forms = self.parse_batch_fn([chat for chat, _, _ in batch])
+                assert len(logical_forms) == len(batch)
+            except Exception as e:
+                logging.error("Parsing failed for chats {}".format([r[0] for r in batch]))
+                logical_forms = None
+                error = e
+            end = time.time()
+            with self._lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["errors"] += len(batch) if logical_forms is None else 0
+                self._stats["busy"] += end - start
+                for _, _, submit_time in batch:
+                    self._stats["total_queue_wait"] += start - submit_time
+                    self._stats["total_latency"] += end - submit_time
+                self._stats["latency"] = end - batch[0][2]
+            for i, (_, future, _) in enumerate(batch):
+                if logical_forms is None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(logical_forms[i])
+
+    def stats(self):
+        """number of chats parsed, batches and failed chats, mean batch size, chats parsed per
+        second since start and per second of parsing, mean time spent queued, mean and last
+        latency (from submit to result) in seconds"""
+        with self._lock:
+            s = dict(self._stats)
+        elapsed = max(time.time() - self._start_time, 1e-6)
+        requests = max(s["requests"], 1)
+        return {
+            "requests": s["requests"],
+            "batches": s["batches"],
+            "errors": s["errors"],
+            "mean_batch_size": s["requests"] / max(s["batches"], 1),
+            "throughput": s["requests"] / elapsed,
+            "busy_throughput": s["requests"] / max(s["busy"], 1e-6),
+            "mean_queue_wait": s["total_queue_wait"] / requests,
+            "mean_latency": s["total_latency"] / requests,
+            "latency": s["latency"],
+        }
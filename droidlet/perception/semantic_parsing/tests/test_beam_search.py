@@ -0,0 +1,167 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import os
+import logging
+import tempfile
+import unittest
+from argparse import Namespace
+from timeit import Timer
+
+import torch
+from transformers import BertConfig, BertModel, BertTokenizer
+
+from ..load_and_check_datasets import get_ground_truth
+from ..nsp_transformer_model.caip_dataset import CAIPDataset
+from ..nsp_transformer_model.decoder_with_loss import DecoderWithLoss
+from ..nsp_transformer_model.encoder_decoder import EncoderDecoderWithLoss
+from ..nsp_transformer_model.utils_caip import make_full_tree
+from ..nsp_transformer_model.utils_parsing import beam_search
+
+GROUND_TRUTH_DATA_DIR = os.path.join(
+    os.path.dirname(__file__), "../../../../agents/craftassist/datasets/ground_truth/"
+)
+
+# used when the ground truth dataset is not there
+COMMANDS = [
+    "hello",
+    "turn right",
+    "come here",
+    "move to the chair",
+    "build a red cube there",
+    "destroy that house",
+    "dig a hole next to the tree",
+    "go to the left of the table and dance",
+]
+
+TREES = [
+    {"dialogue_type": "NOOP"},
+    {
+        "dialogue_type": "HUMAN_GIVE_COMMAND",
+        "action_sequence": [
+            {
+                "action_type": "MOVE",
+                "location": {"reference_object": {"text_span": [0, [2, 3]]}},
+            }
+        ],
+    },
+    {
+        "dialogue_type": "HUMAN_GIVE_COMMAND",
+        "action_sequence": [
+            {
+                "action_type": "BUILD",
+                "schematic": {"has_name": [0, [3, 3]], "has_colour": [0, [2, 2]]},
+            }
+        ],
+    },
+    {
+        "dialogue_type": "HUMAN_GIVE_COMMAND",
+        "action_sequence": [
+            {
+                "action_type": "DANCE",
+                "dance_type": {"body_turn": {"relative_yaw": {"fixed_value": "-90"}}},
+            }
+        ],
+    },
+]
+
+
+def tiny_parser(tmp_dir, num_layers=12, hidden_size=64):
+    """a randomly initialized encoder-decoder, with the same number of decoder layers as the
+    parsing model (so with the expert layers) but smaller ones"""
+    words = sorted({w for c in COMMANDS for w in c.split()})
+    vocab_file = os.path.join(tmp_dir, "vocab.txt")
+    with open(vocab_file, "w") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+    tokenizer = BertTokenizer(vocab_file)
+    full_tree, tree_i2w = make_full_tree([([("", tree) for tree in TREES], 1)])
+    args = Namespace(
+        data_dir=tmp_dir,
+        tree_to_text=False,
+        dtype_samples={"templated": 1.0},
+        examples_per_epoch=0,
+        num_highway=2,
+        node_label_smoothing=0.0,
+        lambda_span_loss=0.5,
+        train_encoder=False,
+    )
+    dataset = CAIPDataset(tokenizer, args, prefix="", full_tree_voc=(full_tree, tree_i2w))
+    kwargs = dict(
+        hidden_size=hidden_size,
+        num_attention_heads=4,
+        intermediate_size=4 * hidden_size,
+        max_position_embeddings=128,
+    )
+    encoder = BertModel(BertConfig(vocab_size=len(tokenizer), num_hidden_layers=2, **kwargs))
+    decoder_config = BertConfig(
+        vocab_size=len(tree_i2w) + 8,
+        num_hidden_layers=num_layers,
+        is_decoder=True,
+        add_cross_attention=True,
+        **kwargs
+    )
+    decoder = DecoderWithLoss(decoder_config, args, tokenizer)
+    model = EncoderDecoderWithLoss(encoder, decoder, args)
+    model.eval()
+    return model, tokenizer, dataset
+
+
+class TestBeamSearch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.model, cls.tokenizer, cls.dataset = tiny_parser(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def parse(self, chat, **kwargs):
+        return beam_search(chat, self.model, self.tokenizer, self.dataset, **kwargs)
+
+    def test_incremental_decoding(self):
+        for chat in COMMANDS:
+            cached = self.parse(chat)
+            full = self.parse(chat, use_cache=False)
+            self.assertEqual(len(cached), 5)
+            for (tree, score, seq), (full_tree, full_score, full_seq) in zip(cached, full):
+                self.assertEqual(seq, full_seq)
+                self.assertEqual(tree, full_tree)
+                self.assertAlmostEqual(score, full_score, places=2)
+
+    def test_step_cache(self):
+        """the scores of the last node are the same with and without the cache"""
+        decoder = self.model.decoder
+        x_reps = torch.rand(2, 6, 64)
+        x_mask = torch.ones(2, 6, dtype=torch.long)
+        y = torch.randint(8, decoder.lm_head.predictions.decoder.out_features, (2, 4))
+        y_mask = torch.ones(2, 4, dtype=torch.long)
+        y_mask[1, 3] = 0
+        with torch.no_grad():
+            full = decoder.step(y, y_mask, x_reps, x_mask)
+            past = decoder.step(y[:, :3], y_mask[:, :3], x_reps, x_mask)["past_key_values"]
+            last = decoder.step(y[:, 3:], y_mask, x_reps, x_mask, past)
+        # 12 layers and 10 expert layers
+        self.assertEqual(len(past), 22)
+        self.assertEqual(last["lm_scores"].shape[1], 1)
+        for k, v in last.items():
+            if k != "past_key_values":
+                self.assertTrue(torch.allclose(v[:, -1], full[k][:, -1], atol=1e-4), k)
+
+    def test_time(self):
+        commands = list(get_ground_truth(False, GROUND_TRUTH_DATA_DIR)) or COMMANDS
+        n = min(len(commands), 20)
+        with torch.no_grad():
+            full = Timer(lambda: [self.parse(c, use_cache=False) for c in commands[:n]])
+            cached = Timer(lambda: [self.parse(c) for c in commands[:n]])
+            full_time = full.timeit(number=1)
+            cached_time = cached.timeit(number=1)
+        logging.info(
+            "beam search latency on cpu over {} commands: {:.1f} ms without cache, "
+            "{:.1f} ms with cache".format(n, 1000 * full_time / n, 1000 * cached_time / n)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import json
+import logging
+import os
+import tempfile
+import unittest
+from timeit import Timer
+
+from jsonschema import ValidationError, validate
+
+from droidlet.perception.semantic_parsing.utils.validate_json import (
+    JSONValidator,
+    get_json_validator,
+)
+
+SCHEMA_DIR = os.path.join(os.path.dirname(__file__), "../../../documents/json_schema/")
+
+MOVE = {
+    "dialogue_type": "HUMAN_GIVE_COMMAND",
+    "action_sequence": [
+        {"action_type": "MOVE", "location": {"reference_object": {"text_span": [0, [2, 3]]}}}
+    ],
+}
+INVALID = [
+    {"dialogue_type": "HUMAN_GIVE_COMMAND", "action_sequence": [{"action_type": "FLY"}]},
+    {"dialogue_type": "NOT_A_DIALOGUE_TYPE"},
+    {"action_sequence": []},
+]
+PARSE_TREES = [MOVE, {"dialogue_type": "NOOP"}] + INVALID
+
+
+class JSONValidatorTest(unittest.TestCase):
+    def setUp(self):
+        self.validator = get_json_validator(SCHEMA_DIR, "all")
+
+    def test_cached(self):
+        self.assertIs(get_json_validator(SCHEMA_DIR, "all"), self.validator)
+        self.assertIsNot(get_json_validator(SCHEMA_DIR, "array"), self.validator)
+
+    def test_validate_instance(self):
+        """same results and errors as jsonschema.validate"""
+        for parse_tree in PARSE_TREES:
+            try:
+                validate(parse_tree, self.validator.base_schema, resolver=self.validator.resolver)
+                error = None
+            except ValidationError as e:
+                error = e
+            self.assertEqual(self.validator.validate_instance(parse_tree, debug=False), not error)
+            self.assertEqual(str(self.validator.best_error(parse_tree)), str(error))
+
+    def test_validate_many(self):
+        parse_trees = PARSE_TREES * 100
+        expected = [self.validator.is_valid(parse_tree) for parse_tree in parse_trees]
+        self.assertEqual(expected[: len(PARSE_TREES)], [True, True, False, False, False])
+        self.assertEqual(self.validator.validate_many(parse_trees), expected)
+        self.assertEqual(self.validator.validate_many(parse_trees, processes=2), expected)
+
+    def test_validate_data(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+            for i in range(200):
+                f.write("move to the chair {}|{}\n".format(i, json.dumps(MOVE)))
+            f.flush()
+            self.assertTrue(self.validator.validate_data(f.name, test_mode=True, processes=2))
+            f.write("fly|{}\n".format(json.dumps(INVALID[0])))
+            f.flush()
+            self.assertFalse(self.validator.validate_data(f.name, test_mode=True, processes=2))
+
+    def test_time(self):
+        parse_trees = [MOVE] * 200
+        schema, resolver = self.validator.base_schema, self.validator.resolver
+        uncached = Timer(
+            lambda: [
+                JSONValidator(SCHEMA_DIR, "all").validate_instance(parse_tree, debug=False)
+                for parse_tree in parse_trees
+            ]
+        )
+        validate_fn = Timer(
+            lambda: [validate(parse_tree, schema, resolver=resolver) for parse_tree in parse_trees]
+        )
+        cached = Timer(lambda: self.validator.validate_many(parse_trees))
+        logging.info(
+            "validation of {} logical forms: {:.1f} ms with a new validator each, {:.1f} ms with "
+            "jsonschema.validate, {:.1f} ms with the compiled validator".format(
+                len(parse_trees),
+                1000 * uncached.timeit(number=1),
+                1000 * validate_fn.timeit(number=1),
+                1000 * cached.timeit(number=1),
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import json
+import logging
+import os
+import tempfile
+import unittest
+from timeit import Timer
+
+from ..load_and_check_datasets import get_ground_truth
+from ..parse_cache import GroundTruthIndex, ParseCache, normalize_chat
+
+MOVE = {
+    "dialogue_type": "HUMAN_GIVE_COMMAND",
+    "action_sequence": [
+        {"action_type": "MOVE", "location": {"reference_object": {"text_span": [0, [2, 3]]}}}
+    ],
+}
+
+
+def write_ground_truth(data_dir, name, parses):
+    os.makedirs(os.path.join(data_dir, "datasets"), exist_ok=True)
+    with open(os.path.join(data_dir, "datasets", name), "w") as f:
+        for chat, logical_form in parses.items():
+            f.write('"{}"|{}\n'.format(chat, json.dumps(logical_form)))
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # the directory of the cache is created with it
+        self.path = os.path.join(self.tmp_dir.name, "cache", "nsp_parse_cache.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_normalize(self):
+        self.assertEqual(normalize_chat("  Move to the  CHAIR "), "move to the chair")
+
+    def test_get_put(self):
+        cache = ParseCache(self.path)
+        self.assertIsNone(cache.get("move to the chair", "v1"))
+        cache.put("move to the chair", MOVE, "v1", confidence=0.9)
+        self.assertEqual(cache.get("Move to the  chair", "v1"), (MOVE, 0.9))
+        # parses of another version of the model are not used
+        self.assertIsNone(cache.get("move to the chair", "v2"))
+        cache.put("move to the chair", {"dialogue_type": "NOOP"}, "v2", confidence=0.5)
+        self.assertEqual(cache.get("move to the chair", "v2"), ({"dialogue_type": "NOOP"}, 0.5))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+
+    def test_persistence(self):
+        cache = ParseCache(self.path)
+        cache.put("move to the chair", MOVE, "v1")
+        cache.close()
+        self.assertEqual(ParseCache(self.path).get("move to the chair", "v1"), (MOVE, 1.0))
+
+    def test_lru(self):
+        cache = ParseCache(self.path, max_entries=2)
+        cache.put("a", MOVE, "v1")
+        cache.put("b", MOVE, "v1")
+        # a is now more recent than b
+        cache.get("a", "v1")
+        cache.put("c", MOVE, "v1")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b", "v1"))
+        self.assertIsNotNone(cache.get("a", "v1"))
+        self.assertIsNotNone(cache.get("c", "v1"))
+
+
+class TestGroundTruthIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_dir = self.tmp_dir.name + "/"
+        self.index_path = os.path.join(self.tmp_dir.name, "cache", "ground_truth_index.db")
+        self.parses = {"move to the chair": MOVE, "hello": {"dialogue_type": "NOOP"}}
+        write_ground_truth(self.data_dir, "commands.txt", self.parses)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_lookup(self):
+        index = GroundTruthIndex(self.data_dir, self.index_path)
+        # the index is built on the first lookup
+        self.assertFalse(os.path.exists(index.index_path))
+        self.assertEqual(index["Move to the chair"], MOVE)
+        self.assertTrue(os.path.exists(index.index_path))
+        self.assertIn("hello", index)
+        self.assertNotIn("goodbye", index)
+        self.assertIsNone(index.get("goodbye"))
+        self.assertEqual(len(index), 2)
+        self.assertEqual(get_ground_truth(False, self.data_dir), self.parses)
+
+    def test_rebuild(self):
+        GroundTruthIndex(self.data_dir, self.index_path).get("hello")
+        goodbye = {"goodbye": {"dialogue_type": "NOOP"}}
+        write_ground_truth(self.data_dir, "more_commands.txt", goodbye)
+        self.assertIn("goodbye", GroundTruthIndex(self.data_dir, self.index_path))
+
+    def test_missing_dir(self):
+        index = GroundTruthIndex(os.path.join(self.data_dir, "missing/"), self.index_path)
+        self.assertNotIn("hello", index)
+
+    def test_in_memory(self):
+        """by default nothing is written in the data directory, which is checksummed"""
+        files = os.listdir(os.path.join(self.data_dir, "datasets"))
+        index = GroundTruthIndex(self.data_dir)
+        self.assertEqual(index["hello"], {"dialogue_type": "NOOP"})
+        self.assertEqual(os.listdir(self.tmp_dir.name), ["datasets"])
+        self.assertEqual(os.listdir(os.path.join(self.data_dir, "datasets")), files)
+
+    def test_time(self):
+        parses = {"command number {}".format(i): MOVE for i in range(20000)}
+        write_ground_truth(self.data_dir, "commands.txt", parses)
+        GroundTruthIndex(self.data_dir, self.index_path).get("hello")
+        load = Timer(lambda: get_ground_truth(False, self.data_dir))
+        index = Timer(
+            lambda: GroundTruthIndex(self.data_dir, self.index_path).get("command number 7")
+        )
+        logging.info(
+            "startup with {} ground truth commands: {:.1f} ms to load the text files, "
+            "{:.1f} ms to open the index and look a command up".format(
+                len(parses), 1000 * load.timeit(number=1), 1000 * index.timeit(number=1)
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import logging
+import tempfile
+import threading
+import unittest
+from timeit import Timer
+
+import torch
+
+from ..nsp_transformer_model.utils_parsing import batch_beam_search, beam_search
+from ..parser_service import ParserService
+from .test_beam_search import COMMANDS, tiny_parser
+
+
+class TestParserService(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.model, cls.tokenizer, cls.dataset = tiny_parser(cls.tmp_dir.name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def parse_batch(self, chats):
+        results = batch_beam_search(chats, self.model, self.tokenizer, self.dataset)
+        return [btr[0][0] for btr in results]
+
+    def test_batch_beam_search(self):
+        """each chat of a batch (with padding) gets the same beams as when parsed alone"""
+        batched = batch_beam_search(COMMANDS, self.model, self.tokenizer, self.dataset)
+        self.assertEqual(len(batched), len(COMMANDS))
+        for chat, beams in zip(COMMANDS, batched):
+            alone = beam_search(chat, self.model, self.tokenizer, self.dataset)
+            self.assertEqual(len(beams), 5)
+            for (tree, score, seq), (alone_tree, alone_score, alone_seq) in zip(beams, alone):
+                self.assertEqual(seq, alone_seq)
+                self.assertEqual(tree, alone_tree)
+                self.assertAlmostEqual(score, alone_score, places=2)
+
+    def test_concurrent_callers(self):
+        """chats submitted from several threads are batched, and each caller gets its parse"""
+        service = ParserService(self.parse_batch, max_batch_size=4, max_wait=0.5)
+        expected = self.parse_batch(COMMANDS)
+        results = {}
+
+        def caller(i):
+            results[i] = service.submit(COMMANDS[i]).result()
+
+        threads = [threading.Thread(target=caller, args=(i,)) for i in range(len(COMMANDS))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        service.stop()
+        self.assertEqual([results[i] for i in range(len(COMMANDS))], expected)
+        stats = service.stats()
+        self.assertEqual(stats["requests"], len(COMMANDS))
+        self.assertLess(stats["batches"], len(COMMANDS))
+        self.assertGreater(stats["mean_batch_size"], 1)
+
+    def test_errors(self):
+        """a failed batch sets the exception of its futures, and the service keeps running"""
+
+        def parse_batch(chats):
+            if "fail" in chats:
+                raise ValueError("cannot parse")
+            return [{"dialogue_type": "NOOP"} for _ in chats]
+
+        service = ParserService(parse_batch, max_wait=0.0)
+        with self.assertRaises(ValueError):
+            service.submit("fail").result()
+        self.assertEqual(service.parse(["hello"]), [{"dialogue_type": "NOOP"}])
+        service.stop()
+        self.assertEqual(service.stats()["errors"], 1)
+        with self.assertRaises(RuntimeError):
+            service.submit("hello")
+
+    def test_time(self):
+        chats = COMMANDS * 4
+        service = ParserService(self.parse_batch, max_batch_size=8)
+        sequential = Timer(lambda: [self.parse_batch([c]) for c in chats])
+        batched = Timer(lambda: service.parse(chats))
+        sequential_time = sequential.timeit(number=1)
+        batched_time = batched.timeit(number=1)
+        service.stop()
+        stats = service.stats()
+        logging.info(
+            "parsing {} chats on cpu: {:.1f} chats/s one by one, {:.1f} chats/s with the "
+            "parser service (mean batch size {:.1f}, mean latency {:.1f} ms)".format(
+                len(chats),
+                len(chats) / sequential_time,
+                len(chats) / batched_time,
+                stats["mean_batch_size"],
+                1000 * stats["mean_latency"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
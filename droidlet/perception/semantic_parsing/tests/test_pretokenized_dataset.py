@@ -0,0 +1,180 @@
+"""
+Copyright (c) Facebook, Inc. and its affiliates.
+"""
+import functools
+import json
+import logging
+import os
+import tempfile
+import unittest
+from argparse import Namespace
+from timeit import Timer
+
+from torch.utils.data import DataLoader
+from transformers import BertTokenizer
+
+from ..nsp_transformer_model.caip_dataset import CAIPDataset, CAIPStreamDataset
+from ..nsp_transformer_model.pretokenize_caip import pretokenize_dataset
+from ..nsp_transformer_model.utils_caip import caip_collate, make_full_tree
+
+TEMPLATED = [
+    (
+        "move to the chair",
+        {
+            "dialogue_type": "HUMAN_GIVE_COMMAND",
+            "action_sequence": [
+                {
+                    "action_type": "MOVE",
+                    "location": {"reference_object": {"text_span": [0, [3, 3]]}},
+                }
+            ],
+        },
+    ),
+    (
+        "build a red cube there",
+        {
+            "dialogue_type": "HUMAN_GIVE_COMMAND",
+            "action_sequence": [
+                {
+                    "action_type": "BUILD",
+                    "schematic": {"has_name": [0, [3, 3]], "has_colour": [0, [2, 2]]},
+                }
+            ],
+        },
+    ),
+    (
+        "turn right",
+        {
+            "dialogue_type": "HUMAN_GIVE_COMMAND",
+            "action_sequence": [
+                {
+                    "action_type": "DANCE",
+                    "dance_type": {"body_turn": {"relative_yaw": {"fixed_value": "-90"}}},
+                }
+            ],
+        },
+    ),
+]
+ANNOTATED = [("hello", {"dialogue_type": "NOOP"})]
+
+
+def write_data(path, examples, repeat):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        for i in range(repeat):
+            for text, tree in examples:
+                f.write("{} {}|{}\n".format(text, i, json.dumps(tree)))
+
+
+class TestPretokenizedDataset(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.data_dir = os.path.join(cls.tmp_dir.name, "data")
+        cls.output_dir = os.path.join(cls.tmp_dir.name, "pretokenized")
+        words = sorted({w for text, _ in TEMPLATED + ANNOTATED for w in text.split()})
+        vocab_file = os.path.join(cls.tmp_dir.name, "vocab.txt")
+        with open(vocab_file, "w") as f:
+            f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + words))
+        cls.tokenizer = BertTokenizer(vocab_file)
+        write_data(os.path.join(cls.data_dir, "train", "templated.txt"), TEMPLATED, 300)
+        write_data(os.path.join(cls.data_dir, "train", "annotated.txt"), ANNOTATED, 100)
+        cls.full_tree_voc = make_full_tree([(TEMPLATED + ANNOTATED, 1)])
+        cls.dtype_samples = {"templated": 0.8, "annotated": 0.2}
+        cls.index = pretokenize_dataset(
+            cls.data_dir,
+            cls.output_dir,
+            cls.tokenizer,
+            cls.full_tree_voc,
+            ["templated", "annotated", "rephrases"],
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def caip_dataset(self, tree_to_text=False, **kwargs):
+        args = Namespace(
+            data_dir=self.data_dir,
+            tree_to_text=tree_to_text,
+            dtype_samples=self.dtype_samples,
+            examples_per_epoch=-1,
+        )
+        return CAIPDataset(self.tokenizer, args, full_tree_voc=self.full_tree_voc, **kwargs)
+
+    def stream_dataset(self, **kwargs):
+        return CAIPStreamDataset(self.output_dir, self.tokenizer, self.dtype_samples, **kwargs)
+
+    def test_index(self):
+        self.assertEqual(self.index["splits"], {"train": {"templated": 900, "annotated": 100}})
+
+    def test_same_examples(self):
+        """the examples are the same as the ones tokenized on-the-fly by CAIPDataset"""
+        for dtype in ["templated", "annotated"]:
+            expected = self.caip_dataset(dtype=dtype)
+            stream = self.stream_dataset(dtype=dtype, sampling=False)
+            self.assertEqual(stream.tree_voc, expected.tree_voc)
+            self.assertEqual(len(stream), len(expected))
+            for i, example in enumerate(stream):
+                self.assertEqual(example, expected[i])
+
+    def test_tree_to_text(self):
+        """the trees are converted to text like by CAIPDataset, for back translation"""
+        expected = self.caip_dataset(dtype="templated", tree_to_text=True)
+        stream = self.stream_dataset(dtype="templated", sampling=False, tree_to_text=True)
+        for i, example in enumerate(stream):
+            self.assertEqual(example, expected[i])
+        stream.add_hard_example(expected[0][-1][1:])
+        hard = stream._example("hard", 0, None)
+        self.assertEqual(hard[1], expected[0][1])
+
+    def test_sampling(self):
+        self.assertEqual(len(list(self.stream_dataset(examples_per_epoch=100))), 100)
+        stream = self.stream_dataset()
+        examples = list(stream)
+        self.assertEqual(len(examples), 900)
+        annotated = sum(p_text.startswith("hello") for _, _, (_, p_text, _) in examples)
+        self.assertAlmostEqual(annotated / len(examples), 0.2, delta=0.05)
+        # the same examples for the same epoch, different ones for another epoch
+        self.assertEqual(list(stream), examples)
+        stream.set_epoch(1)
+        self.assertNotEqual(list(stream), examples)
+
+    def test_word_noise(self):
+        stream = self.stream_dataset(dtype="templated", sampling=False, word_noise=0.5)
+        unk_id = self.tokenizer._convert_token_to_id("[UNK]")
+        for text_idx_ls, _, (text, _, _) in stream:
+            self.assertEqual(text_idx_ls[0], self.tokenizer.cls_token_id)
+            self.assertEqual(text_idx_ls[-1], self.tokenizer.sep_token_id)
+            self.assertEqual(text.split().count("[UNK]"), text_idx_ls.count(unk_id))
+
+    def test_workers(self):
+        """with several workers, each example of the epoch is read by one of them"""
+        stream = self.stream_dataset(dtype="templated", sampling=False)
+        collate_fn = functools.partial(caip_collate, tokenizer=self.tokenizer)
+        loader = DataLoader(stream, batch_size=16, collate_fn=collate_fn, num_workers=2)
+        texts = [p_text for batch in loader for p_text, _ in batch[-1]]
+        self.assertEqual(sorted(texts), sorted(p_text for _, _, (_, p_text, _) in stream))
+        self.assertEqual(len(set(texts)), len(stream))
+
+    def test_time(self):
+        start_text = Timer(lambda: self.caip_dataset(sampling=True))
+        start_stream = Timer(lambda: self.stream_dataset())
+        dataset = self.caip_dataset(sampling=True)
+        stream = self.stream_dataset()
+        epoch_text = Timer(lambda: [dataset[i] for i in range(len(dataset))])
+        epoch_stream = Timer(lambda: list(stream))
+        logging.info(
+            "{} examples: startup {:.1f} ms from the text files, {:.1f} ms pretokenized; "
+            "epoch {:.1f} ms tokenizing on-the-fly, {:.1f} ms pretokenized".format(
+                len(dataset),
+                1000 * start_text.timeit(number=1),
+                1000 * start_stream.timeit(number=1),
+                1000 * epoch_text.timeit(number=1),
+                1000 * epoch_stream.timeit(number=1),
+            )
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@
 Copyright (c) Facebook, Inc. and its affiliates.
 """
 import csv
+import threading
 
 
 class NSPLogger:
@@ -13,6 +14,8 @@ class NSPLogger:
             headers (list): List of string headers to be used in data store.
         """
         self.log_filepath = filepath
+        # rows are logged by the agent, the parser service and the dashboard threads
+        self._lock = threading.Lock()
         self.init_file_headers(filepath, headers)
 
     def init_file_headers(self, filepath, headers):
@@ -33,6 +36,6 @@ class NSPLogger:
             filepath (str): Where to log data.
             data (list): List of values to write to file.
         """
-        with open(self.log_filepath, "a") as fd:
+        with self._lock, open(self.log_filepath, "a") as fd:
             csv_writer = csv.writer(fd, delimiter="|")
             csv_writer.writerow(data)
@@ -1,9 +1,32 @@
-from jsonschema import validate, exceptions, RefResolver, Draft7Validator
+from jsonschema import exceptions, validators, RefResolver, Draft7Validator
 import json
 from pprint import pprint
 import argparse
 import glob
+import multiprocessing
 import re
+import threading
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_json_validator(schema_dir, span_type):
+    """Returns the JSONValidator of the schemas of schema_dir, loaded and compiled once per
+    process."""
+    return JSONValidator(schema_dir, span_type)
+
+
+# validator of the processes of JSONValidator.validate_many
+_worker_validator = None
+
+
+def _init_worker(schema_dir, span_type):
+    global _worker_validator
+    _worker_validator = get_json_validator(schema_dir, span_type)
+
+
+def _is_valid(parse_tree):
+    return _worker_validator.is_valid(parse_tree)
 
 
 class JSONValidator:
@@ -52,8 +75,46 @@ class JSONValidator:
                 resolver.store[schema_name + ".schema.json"] = json_schema
         self.base_schema = base_schema
         self.resolver = resolver
+        self.schema_dir = schema_dir
+        self.span_type = span_type
+        # Check the schema once, and reuse the validator for all instances (jsonschema.validate
+        # checks the schema and creates a validator at each call)
+        validator_class = validators.validator_for(base_schema)
+        validator_class.check_schema(base_schema)
+        self.validator = validator_class(base_schema, resolver=resolver)
+        # the resolver keeps a stack of the scopes of the references being resolved
+        self._lock = threading.Lock()
+
+    def is_valid(self, parse_tree):
+        """Whether a parse tree conforms to the grammar"""
+        with self._lock:
+            return self.validator.is_valid(parse_tree)
 
-    def validate_data(self, data_path, test_mode=False):
+    def best_error(self, parse_tree):
+        """The most relevant validation error of a parse tree, as raised by jsonschema.validate,
+        or None if it is valid"""
+        with self._lock:
+            return exceptions.best_match(self.validator.iter_errors(parse_tree))
+
+    def validate_many(self, parse_trees, processes=1, chunksize=64):
+        """
+        Validates a list of parse trees, with several processes if processes > 1.
+
+        Args:
+            parse_trees (list) -- dictionaries we want to validate
+            processes (int) -- number of processes, None for the number of cpus
+
+        Returns:
+            list of bools, True for the logical forms which pass the schema validation.
+        """
+        if processes == 1 or len(parse_trees) <= chunksize:
+            return [self.is_valid(parse_tree) for parse_tree in parse_trees]
+        with multiprocessing.Pool(
+            processes, initializer=_init_worker, initargs=(self.schema_dir, self.span_type)
+        ) as pool:
+            return pool.map(_is_valid, parse_trees, chunksize=chunksize)
+
+    def validate_data(self, data_path, test_mode=False, processes=1):
         """
         Validates JSON style parse trees from a dataset, where each row has the format
         [command] | [parse_tree]
@@ -61,22 +122,22 @@ class JSONValidator:
         Args:
         data_path (str) -- Path to plaintext file, eg. annotated.txt
         test_mode (bool) -- Whether we are running data validation as a unit test.
+        processes (int) -- Number of processes validating the rows, None for the number of cpus.
+            By default the rows are validated in this process
         """
         with open(data_path) as fd:
-            dataset = fd.readlines()
-            for line in dataset:
-                command, action_dict = line.split("|")
-                parse_tree = json.loads(action_dict)
-                try:
-                    validate(instance=parse_tree, schema=self.base_schema, resolver=self.resolver)
-                except exceptions.ValidationError as e:
-                    print(command)
-                    pprint(parse_tree)
-                    print(e)
-                    print("\n")
-                    # If we're running data validation as a unit test, return False immediately on validation error.
-                    if test_mode:
-                        return False
+            dataset = [line.split("|") for line in fd.readlines()]
+        parse_trees = [json.loads(action_dict) for _, action_dict in dataset]
+        is_valid = self.validate_many(parse_trees, processes=processes)
+        for (command, _), parse_tree, valid in zip(dataset, parse_trees, is_valid):
+            if not valid:
+                print(command)
+                pprint(parse_tree)
+                print(self.best_error(parse_tree))
+                print("\n")
+                # If we're running data validation as a unit test, return False on an error.
+                if test_mode:
+                    return False
         # Return True if we're running data validation as a unit test.
         if test_mode:
             return True
@@ -92,15 +153,13 @@ class JSONValidator:
         Returns:
             True if logical form passes the schema validation, else returns False.
         """
-        try:
-            validate(instance=parse_tree, schema=self.base_schema, resolver=self.resolver)
-        except exceptions.ValidationError as e:
-            # Option to print debug information
-            if debug:
-                print("Error validating:\n{}\n".format(parse_tree))
-                print(e)
-            return False
-        return True
+        if self.is_valid(parse_tree):
+            return True
+        # Option to print debug information
+        if debug:
+            print("Error validating:\n{}\n".format(parse_tree))
+            print(self.best_error(parse_tree))
+        return False
 
 
 if __name__ == "__main__":
@@ -124,8 +183,14 @@ if __name__ == "__main__":
         choices=["string", "array", "all"],
         help="What span types to allow",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of processes validating the dataset, 0 for the number of cpus",
+    )
     args = parser.parse_args()
     json_validator = JSONValidator(args.schema_dir, args.span_type)
 
     # Validate dataset against schema using resolver to resolve cross references
-    json_validator.validate_data(args.data_path)
+    json_validator.validate_data(args.data_path, processes=args.processes or None)
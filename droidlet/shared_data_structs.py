@@ -117,3 +117,6 @@ class MockOpt:
         self.no_default_behavior = False
         self.log_timeline = False
         self.enable_timeline = False
+        self.live_task_scheduler = False
+        self.incremental_perception = False
+        self.cached_pathfinding = False
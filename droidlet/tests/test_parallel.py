@@ -1,4 +1,7 @@
-from droidlet.parallel import BackgroundTask
+import logging
+import time
+import numpy as np
+from droidlet.parallel import BackgroundTask, Pipeline
 
 
 class Foo:
@@ -24,6 +27,20 @@ class Foo:
         print("getting item:", self.b.get(timeout=2))
 
 
+def model_init(latency):
+    return latency
+
+
+def model(latency, img, offset):
+    # a model taking latency seconds per frame
+    time.sleep(latency)
+    return float(img.sum()) + offset
+
+
+def frame(i):
+    return [np.full((48, 64, 3), i % 256, dtype=np.uint8)]
+
+
 import unittest
 
 class TestBackgroundtask(unittest.TestCase):
@@ -31,6 +48,83 @@ class TestBackgroundtask(unittest.TestCase):
             foo = Foo()
             foo.forward()
 
+
+class TestPipeline(unittest.TestCase):
+    def test_fusion(self):
+        pipeline = Pipeline(
+            {"fast": (model_init, (0.0,), model), "slow": (model_init, (0.05,), model)},
+            max_wait=10,
+        )
+        pipeline.start()
+        for i in range(1, 4):
+            frame_id = pipeline.put(frame(i), 0.5, payload=i)
+            frames = pipeline.get(block=True, timeout=10, frame_id=frame_id)
+            assert [f.frame_id for f in frames] == [frame_id]
+            assert frames[0].payload == i
+            expected = 48 * 64 * 3 * i + 0.5
+            assert frames[0].results == {"fast": expected, "slow": expected}
+        assert pipeline.get() == []
+        pipeline.stop()
+
+    def test_frame_dropping(self):
+        pipeline = Pipeline(
+            {"fast": (model_init, (0.0,), model), "slow": (model_init, (0.2,), model)},
+            max_wait=0.05,
+        )
+        pipeline.start()
+        frames = []
+        # the first frame waits for the processes to start
+        frame_id = pipeline.put(frame(0), 0.0, payload=0)
+        frames += pipeline.get(block=True, timeout=30, frame_id=frame_id)
+        start = time.time()
+        for i in range(1, 31):
+            last = pipeline.put(frame(i), 0.0, payload=i)
+            time.sleep(0.02)
+            frames += pipeline.get()
+        frames += pipeline.get(block=True, timeout=10, frame_id=last)
+        # the slow result of the last frame comes after the frame was returned
+        deadline = time.time() + 10
+        while not any(f.frame_id == last and "slow" in f.results for f in frames):
+            assert time.time() < deadline
+            frames += pipeline.get(block=True, timeout=1)
+        elapsed = time.time() - start
+        stats = pipeline.stats()
+        pipeline.stop()
+        fast = [f.frame_id for f in frames if "fast" in f.results]
+        slow = [f.frame_id for f in frames if "slow" in f.results]
+        # the fast model did not wait for the slow one, which dropped the stale frames
+        assert len(fast) > 2 * len(slow)
+        assert stats["slow"]["dropped"] > 0
+        assert last in slow
+        for f in frames:
+            for result in f.results.values():
+                assert result == 48 * 64 * 3 * (f.payload % 256)
+        logging.info(
+            "pipeline, 30 frames in {:.2f}s: fast {:.1f} frames/s, slow {:.1f} frames/s, "
+            "{} dropped".format(elapsed, len(fast) / elapsed, len(slow) / elapsed,
+                                stats["slow"]["dropped"])
+        )
+
+    def test_replaced_ring(self):
+        """a stage drops a frame of a ring replaced and unlinked by put, and goes on"""
+        pipeline = Pipeline({"fast": (model_init, (0.0,), model)}, max_wait=10)
+        pipeline.start()
+        frame_id = pipeline.put(frame(1), 0.0, payload=1)
+        assert pipeline.get(block=True, timeout=30, frame_id=frame_id)[0].results
+        stale = pipeline._ring.metadata()
+        stale.update({"seq": 0, "frame_id": frame_id, "args": (0.0,)})
+        # a new frame shape replaces the ring
+        frame_id = pipeline.put([np.ones((24, 32, 3), dtype=np.uint8)], 0.0, payload=2)
+        frames = pipeline.get(block=True, timeout=10, frame_id=frame_id)
+        assert frames[0].results == {"fast": 24 * 32 * 3}
+        pipeline._send_queues["fast"].put(stale)
+        time.sleep(0.5)
+        frame_id = pipeline.put(frame(3), 0.0, payload=3)
+        frames = pipeline.get(block=True, timeout=10, frame_id=frame_id)
+        assert frames[0].results == {"fast": 48 * 64 * 3 * 3}
+        assert pipeline.stats()["fast"]["dropped"] == 1
+        pipeline.stop()
+
 if __name__ == "__main__":
     foo = Foo()
     foo.forward()
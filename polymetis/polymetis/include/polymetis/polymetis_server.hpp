@@ -29,6 +29,7 @@
 #define MAX_MODEL_BYTES 1048576         // 1 megabyte
 #define THRESHOLD_NS 1000000000         // 1s
 #define SPIN_INTERVAL_USEC 20000        // 0.02s (50hz)
+#define LOG_CHUNK_SIZE 1000             // robot states per RobotStateChunk
 
 using grpc::Server;
 using grpc::ServerBuilder;
@@ -104,6 +105,14 @@ public:
   Status ControlUpdate(ServerContext *context, const RobotState *robot_state,
                        TorqueCommand *torque_command) override;
 
+  /**
+  Runs ControlUpdate on each robot state of the stream, and writes the torque
+  commands in order, without the overhead of one call per control step.
+  */
+  Status ControlUpdateStream(
+      ServerContext *context,
+      ServerReaderWriter<TorqueCommand, RobotState> *stream) override;
+
   // User client methods
 
   /**
@@ -130,6 +139,14 @@ public:
   Status GetRobotStateLog(ServerContext *context, const LogInterval *interval,
                           ServerWriter<RobotState> *writer) override;
 
+  /**
+  Streams the robot states of the interval in RobotStateChunks of
+  LOG_CHUNK_SIZE states.
+  */
+  Status GetRobotStateLogChunks(ServerContext *context,
+                                const LogInterval *interval,
+                                ServerWriter<RobotStateChunk> *writer) override;
+
   /**
   TODO
   */
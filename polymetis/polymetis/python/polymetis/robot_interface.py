@@ -4,7 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 import io
 import signal
-from typing import Dict, Generator, List, Tuple
+from typing import Dict, Generator, List, Tuple, Union
 import time
 import tempfile
 import threading
@@ -16,6 +16,7 @@ from polymetis_pb2 import LogInterval, RobotState, ControllerChunk, Empty
 from polymetis_pb2_grpc import PolymetisControllerServerStub
 
 import torchcontrol as toco
+from polymetis.robot_state_log import RobotStateLog, EpisodeRecorder
 
 
 # Maximum bytes we send per message to server (so as not to overload it).
@@ -57,9 +58,18 @@ class BaseRobotInterface:
     Args:
         ip_address: IP address of the gRPC-based controller manager server.
         port: Port to connect to on the IP address.
+        packed_log: If True, logs of RobotStates are retrieved in chunks of packed arrays
+                    and returned as a RobotStateLog instead of a list of RobotStates.
+        log_dir: If given, each log retrieved is also saved there (see EpisodeRecorder).
     """
 
-    def __init__(self, ip_address: str = "localhost", port: int = 50051):
+    def __init__(
+        self,
+        ip_address: str = "localhost",
+        port: int = 50051,
+        packed_log: bool = False,
+        log_dir: str = None,
+    ):
         # Create connection
         self.channel = grpc.insecure_channel(f"{ip_address}:{port}")
         self.grpc_connection = PolymetisControllerServerStub(self.channel)
@@ -67,6 +77,9 @@ class BaseRobotInterface:
         # Get metadata
         self.metadata = self.grpc_connection.GetRobotClientMetadata(EMPTY)
 
+        self.packed_log = packed_log
+        self.recorder = EpisodeRecorder(log_dir) if log_dir is not None else None
+
     def __del__(self):
         # Close connection in destructor
         self.channel.close()
@@ -93,30 +106,25 @@ class BaseRobotInterface:
 
         return msg_generator
 
-    def _get_robot_state_log(
-        self, log_interval: LogInterval, timeout: float = None
-    ) -> List[RobotState]:
-        """A private helper method to get the states corresponding to a log_interval from the server.
-
-        Args:
-            log_interval: a message holding start and end indices for a trajectory of RobotStates.
-            timeout: Amount of time (in seconds) to wait before throwing a TimeoutError.
+    @staticmethod
+    def _read_stream(stream, timeout: float = None) -> Tuple[List, grpc.RpcError]:
+        """Reads all the messages of a response stream in a thread.
 
         Returns:
-            If successful, returns a list of RobotState objects.
+            The list of messages, and the error which ended the stream or None.
 
         """
-        robot_state_generator = self.grpc_connection.GetRobotStateLog(log_interval)
-        signal.signal(signal.SIGINT, lambda x, y: robot_state_generator.cancel())
+        signal.signal(signal.SIGINT, lambda x, y: stream.cancel())
 
         results = []
+        errors = []
 
         def read_stream():
             try:
-                for state in robot_state_generator:
-                    results.append(state)
+                for msg in stream:
+                    results.append(msg)
             except grpc.RpcError as exc:
-                print(exc)
+                errors.append(exc)
 
         read_thread = threading.Thread(target=read_stream)
         read_thread.start()
@@ -124,8 +132,50 @@ class BaseRobotInterface:
 
         if read_thread.is_alive():
             raise TimeoutError("Operation timed out.")
-        else:
-            return results
+        return results, errors[0] if errors else None
+
+    def _get_robot_state_log(
+        self, log_interval: LogInterval, timeout: float = None
+    ) -> Union[List[RobotState], RobotStateLog]:
+        """A private helper method to get the states corresponding to a log_interval from the server.
+
+        Args:
+            log_interval: a message holding start and end indices for a trajectory of RobotStates.
+            timeout: Amount of time (in seconds) to wait before throwing a TimeoutError.
+
+        Returns:
+            If successful, returns a list of RobotState objects (a RobotStateLog if packed_log).
+
+        """
+        if self.packed_log:
+            chunks, error = self._read_stream(
+                self.grpc_connection.GetRobotStateLogChunks(log_interval),
+                timeout=timeout,
+            )
+            if error is None:
+                robot_state_log = RobotStateLog.from_chunks(chunks)
+                self._record(log_interval, robot_state_log)
+                return robot_state_log
+            if error.code() != grpc.StatusCode.UNIMPLEMENTED:
+                print(error)
+                return RobotStateLog.from_chunks([])
+            # Older server without GetRobotStateLogChunks: pack the RobotStates
+
+        robot_states, error = self._read_stream(
+            self.grpc_connection.GetRobotStateLog(log_interval), timeout=timeout
+        )
+        if error is not None:
+            print(error)
+        if not self.packed_log and self.recorder is None:
+            return robot_states
+
+        robot_state_log = RobotStateLog.from_robot_states(robot_states)
+        self._record(log_interval, robot_state_log)
+        return robot_state_log if self.packed_log else robot_states
+
+    def _record(self, log_interval: LogInterval, robot_state_log: RobotStateLog):
+        if self.recorder is not None:
+            self.recorder.record(log_interval.start, log_interval.end, robot_state_log)
 
     def get_robot_state(self) -> RobotState:
         """Returns the latest RobotState."""
@@ -144,7 +194,7 @@ class BaseRobotInterface:
             timeout: Amount of time (in seconds) to wait before throwing a TimeoutError.
 
         Returns:
-            If successful, returns a list of RobotState objects.
+            If successful, returns a list of RobotState objects (a RobotStateLog if packed_log).
 
         """
         log_interval = self.get_previous_interval(timeout)
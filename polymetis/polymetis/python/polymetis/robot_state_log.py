@@ -0,0 +1,138 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+import os
+from typing import Dict, Iterable, List
+
+import numpy as np
+import torch
+
+from polymetis_pb2 import RobotState, RobotStateChunk
+
+
+# Repeated float fields of a RobotState, packed as float32 arrays in a RobotStateChunk
+ROBOT_STATE_FIELDS = (
+    "joint_positions",
+    "joint_velocities",
+    "joint_torques_computed",
+    "prev_joint_torques_computed",
+    "prev_joint_torques_computed_safened",
+    "motor_torques_measured",
+    "motor_torques_external",
+)
+
+
+class RobotStateLog:
+    """A log of RobotStates stored by column, as NumPy arrays.
+
+    Note:
+        The fields of the states which have less than num_dofs values are zero padded.
+
+    Args:
+        timestamps: int64 array [num_states] of the timestamps of the states, in ns.
+        fields: float32 array [num_states, num_dofs] of each field of ROBOT_STATE_FIELDS.
+    """
+
+    def __init__(self, timestamps: np.ndarray, fields: Dict[str, np.ndarray]):
+        self.timestamps = timestamps
+        self.fields = fields
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        fields = self.__dict__.get("fields", {})
+        if name in fields:
+            return fields[name]
+        raise AttributeError(name)
+
+    @property
+    def num_dofs(self) -> int:
+        return self.fields["joint_positions"].shape[1]
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[RobotStateChunk]) -> "RobotStateLog":
+        """Concatenates the arrays of the chunks streamed by GetRobotStateLogChunks."""
+        chunks = list(chunks)
+        num_dofs = chunks[0].num_dofs if chunks else 0
+        # bytearray, so that the arrays are writable and can be shared with torch
+        timestamps = np.frombuffer(
+            bytearray(b"".join(chunk.timestamps for chunk in chunks)), dtype="<i8"
+        )
+        fields = {
+            field: np.frombuffer(
+                bytearray(b"".join(getattr(chunk, field) for chunk in chunks)),
+                dtype="<f4",
+            ).reshape(len(timestamps), num_dofs)
+            for field in ROBOT_STATE_FIELDS
+        }
+        return cls(timestamps, fields)
+
+    @classmethod
+    def from_robot_states(cls, robot_states: List[RobotState]) -> "RobotStateLog":
+        """Packs a list of RobotStates, as returned by GetRobotStateLog."""
+        num_dofs = max((len(s.joint_positions) for s in robot_states), default=0)
+        timestamps = np.array(
+            [
+                state.timestamp.seconds * 1000000000 + state.timestamp.nanos
+                for state in robot_states
+            ],
+            dtype=np.int64,
+        )
+        fields = {}
+        for field in ROBOT_STATE_FIELDS:
+            values = np.zeros((len(robot_states), num_dofs), dtype=np.float32)
+            for i, state in enumerate(robot_states):
+                row = getattr(state, field)
+                values[i, : len(row)] = row
+            fields[field] = values
+        return cls(timestamps, fields)
+
+    def to_tensors(self) -> Dict[str, torch.Tensor]:
+        """Returns the timestamps and fields as tensors sharing the memory of the arrays."""
+        tensors = {"timestamps": torch.from_numpy(self.timestamps)}
+        for field, values in self.fields.items():
+            tensors[field] = torch.from_numpy(values)
+        return tensors
+
+    def to_robot_states(self) -> List[RobotState]:
+        """Returns the log as a list of RobotStates (with the padded fields)."""
+        robot_states = []
+        for i, timestamp in enumerate(self.timestamps.tolist()):
+            fields = {f: self.fields[f][i].tolist() for f in ROBOT_STATE_FIELDS}
+            state = RobotState(**fields)
+            seconds, nanos = divmod(timestamp, 1000000000)
+            state.timestamp.seconds, state.timestamp.nanos = seconds, nanos
+            robot_states.append(state)
+        return robot_states
+
+    def save(self, path: str):
+        """Saves the log in an uncompressed .npz file."""
+        np.savez(path, timestamps=self.timestamps, **self.fields)
+
+    @classmethod
+    def load(cls, path: str) -> "RobotStateLog":
+        with np.load(path) as data:
+            fields = {field: data[field] for field in ROBOT_STATE_FIELDS}
+            return cls(data["timestamps"], fields)
+
+
+class EpisodeRecorder:
+    """Saves each RobotStateLog retrieved by a RobotInterface in a directory.
+
+    The log of the interval [start, end] is saved as episode_<start>_<end>.npz.
+
+    Args:
+        log_dir: The directory of the episodes, created if it does not exist.
+    """
+
+    def __init__(self, log_dir: str):
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+
+    def record(self, start: int, end: int, robot_state_log: RobotStateLog) -> str:
+        """Saves an episode log, and returns its path."""
+        path = os.path.join(self.log_dir, f"episode_{start}_{end}.npz")
+        robot_state_log.save(path)
+        return path
@@ -1,3 +1,4 @@
 from .abstract_env import AbstractControlledEnv
 from .bullet_manipulator import BulletManipulatorEnv
 from .habitat_manipulator import HabitatManipulatorEnv
+from .batched_env import BatchedControlledEnv
@@ -0,0 +1,64 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from polysim.envs import AbstractControlledEnv
+
+
+class BatchedControlledEnv:
+    """A batch of simulation environments, stepped in lockstep with (B, N) tensors.
+
+    Provides the ``reset``/``step`` interface of the batched dynamics of
+    ``torchcontrol.rollout``, so that a ``BatchedRollout`` can run a policy in B
+    independent simulations (e.g. B ``BulletManipulatorEnv`` in DIRECT mode).
+
+    Args:
+        envs: The environments, which must have the same number of degrees of freedom.
+    """
+
+    def __init__(self, envs: List[AbstractControlledEnv]):
+        self.envs = envs
+        self.batch_size = len(envs)
+        self.num_dofs = envs[0].get_num_dofs()
+        assert all(env.get_num_dofs() == self.num_dofs for env in envs)
+
+        self.joint_pos = np.zeros((self.batch_size, self.num_dofs))
+        self.joint_vel = np.zeros((self.batch_size, self.num_dofs))
+
+    def _get_states(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        for i, env in enumerate(self.envs):
+            self.joint_pos[i], self.joint_vel[i] = env.get_current_joint_pos_vel()
+        return (
+            torch.from_numpy(self.joint_pos).float(),
+            torch.from_numpy(self.joint_vel).float(),
+        )
+
+    def reset(
+        self, joint_pos: torch.Tensor, joint_vel: Optional[torch.Tensor] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Resets the environments to joint positions of shape (B, N) or (N,), at rest
+        by default."""
+        shape = (self.batch_size, self.num_dofs)
+        joint_pos = np.broadcast_to(np.asarray(joint_pos, dtype=np.float64), shape)
+        if joint_vel is None:
+            joint_vel = np.zeros(shape)
+        joint_vel = np.broadcast_to(np.asarray(joint_vel, dtype=np.float64), shape)
+        for env, pos, vel in zip(self.envs, joint_pos, joint_vel):
+            env.reset(pos.tolist(), vel.tolist())
+        return self._get_states()
+
+    def step(self, torques: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Applies (B, N) joint torques to the environments for one time step.
+
+        Returns:
+            Joint positions & velocities of shape (B, N)
+        """
+        torques = torques.detach().numpy().astype(np.float64)
+        for env, torque in zip(self.envs, torques):
+            env.apply_joint_torques(torque)
+        return self._get_states()
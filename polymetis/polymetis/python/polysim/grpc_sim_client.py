@@ -5,7 +5,11 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Callable
+from typing import Callable, Dict
+import bisect
+import collections
+import queue
+import threading
 import time
 import numpy as np
 import hydra
@@ -25,6 +29,12 @@ import logging
 
 log = logging.getLogger(__name__)
 
+# Upper bounds (in ms) of the buckets of the ControlLoopStats histograms
+HISTOGRAM_BUCKETS_MS = (0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 50.0, 100.0)
+
+# Robot states a GrpcSimulationClient in async mode can have in flight
+MAX_IN_FLIGHT = 4
+
 
 class Spinner:
     """Sleeps the right amount of time to roughly maintain a specific frequency.
@@ -40,21 +50,92 @@ class Spinner:
         # Initialize
         self.t_spin_target = time.time() + self.dt
 
-    def spin(self):
-        """Called each time in a loop to sleep a duration which maintains a specific frequency."""
+    def spin(self) -> float:
+        """Called each time in a loop to sleep a duration which maintains a specific frequency.
+
+        Returns:
+            The time (in seconds) by which the computation exceeded the loop time, or 0.
+
+        """
         # No spinning if no time interval is specified
         if self.dt <= 0.0:
-            return
+            return 0.0
 
         # Spin: sleep until time
         t_sleep = self.t_spin_target - time.time()
         if t_sleep > 0:
             time.sleep(t_sleep)
         else:
-            # TODO: log warning without stuttering loop
-            # log.info("Warning: Computation time exceeded designated loop time.")
             self.t_spin_target += -t_sleep  # prevent accumulating errors
         self.t_spin_target += self.dt
+        return max(-t_sleep, 0.0)
+
+
+class ControlLoopStats:
+    """Statistics of the control loop of a GrpcSimulationClient.
+
+    Keeps histograms of the round trip times of the ControlUpdates and of the loop
+    overruns (time by which a step exceeded the loop time), and counts the deadline
+    misses: the steps whose torque command was not received within the deadline.
+
+    Args:
+        deadline: The deadline of a ControlUpdate, in ms.
+
+        buckets: The upper bounds (in ms) of the histogram buckets; the last bucket
+                 counts the times above the last bound.
+
+    """
+
+    def __init__(self, deadline: float, buckets=HISTOGRAM_BUCKETS_MS):
+        self.deadline = deadline
+        self.buckets = list(buckets)
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.deadline_misses = 0
+        self.overruns = 0
+        self.rtt_count = 0
+        self.rtt_sum = 0.0
+        self.rtt_max = 0.0
+        self.last_rtt = 0.0
+        self.rtt_histogram = np.zeros(len(self.buckets) + 1, dtype=np.int64)
+        self.overrun_histogram = np.zeros(len(self.buckets) + 1, dtype=np.int64)
+
+    def record_rtt(self, rtt: float):
+        """Records the round trip time (in ms) of a ControlUpdate."""
+        self.rtt_count += 1
+        self.last_rtt = rtt
+        self.rtt_sum += rtt
+        self.rtt_max = max(self.rtt_max, rtt)
+        self.rtt_histogram[bisect.bisect_left(self.buckets, rtt)] += 1
+
+    def record_step(self, missed: bool, overrun: float):
+        """Records a loop step, whether it missed its deadline and its overrun in ms."""
+        self.steps += 1
+        if missed:
+            self.deadline_misses += 1
+        if overrun > 0.0:
+            self.overruns += 1
+            self.overrun_histogram[bisect.bisect_left(self.buckets, overrun)] += 1
+
+    def summary(self) -> Dict:
+        """Returns the statistics as a dictionary."""
+        return {
+            "steps": self.steps,
+            "deadline_misses": self.deadline_misses,
+            "miss_rate": self.deadline_misses / max(self.steps, 1),
+            "overruns": self.overruns,
+            "rtt_mean": self.rtt_sum / max(self.rtt_count, 1),
+            "rtt_max": self.rtt_max,
+            "rtt_histogram": dict(zip(self._labels(), self.rtt_histogram.tolist())),
+            "overrun_histogram": dict(
+                zip(self._labels(), self.overrun_histogram.tolist())
+            ),
+        }
+
+    def _labels(self):
+        return [f"<={b}ms" for b in self.buckets] + [f">{self.buckets[-1]}ms"]
 
 
 class GrpcSimulationClient(AbstractRobotClient):
@@ -73,8 +154,13 @@ class GrpcSimulationClient(AbstractRobotClient):
 
         log_interval: Log every `log_interval` number of timesteps. 0 if no logging.
 
-        max_ping: The amount of time in seconds; if a request takes long than this,
-                  send a debug message warning.
+        max_ping: The amount of time in ms; if a request takes long than this,
+                  send a debug message warning, and count a deadline miss (see `stats`).
+                  0 for the loop time.
+
+        async_mode: If True, the robot states are sent over a ControlUpdateStream, and each
+                    step applies the latest torque command received by its deadline (or
+                    keeps the previous one) instead of blocking on a ControlUpdate.
 
     """
 
@@ -87,6 +173,7 @@ class GrpcSimulationClient(AbstractRobotClient):
         port: int = 50051,
         log_interval: int = 0,
         max_ping: float = 0.0,
+        async_mode: bool = False,
     ):
         super().__init__(metadata_cfg=metadata_cfg)
 
@@ -122,6 +209,14 @@ class GrpcSimulationClient(AbstractRobotClient):
         self.i = 0
         self.interval_log = []
 
+        # Deadline misses and histograms of the round trip and overrun times
+        self.async_mode = async_mode
+        deadline = self.max_ping if self.max_ping > 0.0 else 1000.0 / self.hz
+        self.stats = ControlLoopStats(deadline)
+
+        # Preallocated robot states, reused once their torque command is received
+        self.robot_states = [polymetis_pb2.RobotState() for _ in range(MAX_IN_FLIGHT)]
+
     def __del__(self):
         """Close connection in destructor"""
         self.channel.close()
@@ -135,32 +230,19 @@ class GrpcSimulationClient(AbstractRobotClient):
         """
         msg = self.connection.InitRobotClient(self.metadata.get_proto())
 
-        robot_state = polymetis_pb2.RobotState()
+        if self.async_mode:
+            self._run_async(time_horizon)
+            return
+
+        robot_state = self.robot_states[0]
         # Main loop
         t = 0
         spinner = Spinner(self.hz)
         while t < time_horizon:
             # Get robot state from env
-            joint_pos, joint_vel = self.env.get_current_joint_pos_vel()
-            robot_state.joint_positions[:] = joint_pos
-            robot_state.joint_velocities[:] = joint_vel
-
-            (
-                torques_commanded,
-                torques_applied,
-                torques_measured,
-                torques_external,
-            ) = self.env.get_current_joint_torques()
-            robot_state.prev_joint_torques_computed[:] = torques_commanded
-            robot_state.prev_joint_torques_computed_safened[:] = torques_applied
-            robot_state.motor_torques_measured[:] = torques_measured
-            robot_state.motor_torques_external[:] = torques_external
-
-            robot_state.timestamp.GetCurrentTime()
+            self._update_robot_state(robot_state)
 
             # Query controller manager server for action
-            # TODO: have option for async mode through async calls, see
-            # https://grpc.io/docs/languages/python/basics/#simple-rpc-1
             log_request_time = self.log_interval > 0 and t % self.log_interval == 0
             msg = self.execute_rpc_call(
                 self.connection.ControlUpdate,
@@ -169,12 +251,111 @@ class GrpcSimulationClient(AbstractRobotClient):
             )
 
             # Apply action to env
-            torque_command = np.array([t for t in msg.joint_torques])
-            self.env.apply_joint_torques(torque_command)
+            self.env.apply_joint_torques(np.array(msg.joint_torques))
 
             # Idle for the remainder of loop time
             t += 1
-            spinner.spin()
+            missed = self.stats.last_rtt > self.stats.deadline
+            self.stats.record_step(missed, 1000.0 * spinner.spin())
+
+    def _update_robot_state(self, robot_state):
+        """Fills a RobotState with the current state of the env."""
+        joint_pos, joint_vel = self.env.get_current_joint_pos_vel()
+        robot_state.joint_positions[:] = np.asarray(joint_pos).tolist()
+        robot_state.joint_velocities[:] = np.asarray(joint_vel).tolist()
+
+        (
+            torques_commanded,
+            torques_applied,
+            torques_measured,
+            torques_external,
+        ) = self.env.get_current_joint_torques()
+        robot_state.prev_joint_torques_computed[:] = np.asarray(
+            torques_commanded
+        ).tolist()
+        robot_state.prev_joint_torques_computed_safened[:] = np.asarray(
+            torques_applied
+        ).tolist()
+        robot_state.motor_torques_measured[:] = np.asarray(torques_measured).tolist()
+        robot_state.motor_torques_external[:] = np.asarray(torques_external).tolist()
+
+        robot_state.timestamp.GetCurrentTime()
+
+    def _run_async(self, time_horizon):
+        """The main loop of the async mode, see `async_mode`."""
+        requests = queue.Queue()
+        replies = queue.Queue()
+        responses = self.connection.ControlUpdateStream(iter(requests.get, None))
+
+        def read_replies():
+            try:
+                for msg in responses:
+                    replies.put((time.time_ns(), msg))
+            except grpc.RpcError as exc:
+                log.error(f"ControlUpdateStream failed: {exc}")
+            replies.put(None)
+
+        reader = threading.Thread(target=read_replies, daemon=True)
+        reader.start()
+
+        # Send times of the robot states in flight, in order
+        send_times = collections.deque()
+        torque_command = None
+
+        def receive(until=None):
+            # Receives the replies until there are none in flight or the time `until`,
+            # or waits for the next reply if `until` is None
+            nonlocal torque_command
+            while send_times:
+                try:
+                    timeout = None if until is None else until - time.time()
+                    if timeout is None or timeout > 0:
+                        reply = replies.get(timeout=timeout)
+                    else:
+                        reply = replies.get_nowait()
+                except queue.Empty:
+                    return
+                if reply is None:
+                    raise ConnectionError("ControlUpdateStream closed by the server")
+                recv_time, torque_command = reply
+                self.stats.record_rtt((recv_time - send_times.popleft()) / 1e6)
+                if until is None:
+                    return
+
+        # Main loop
+        t = 0
+        spinner = Spinner(self.hz)
+        try:
+            while t < time_horizon:
+                # Reuse a robot state only once its torque command was received
+                if len(send_times) == len(self.robot_states):
+                    receive()
+                robot_state = self.robot_states[t % len(self.robot_states)]
+                self._update_robot_state(robot_state)
+                send_times.append(time.time_ns())
+                requests.put(robot_state)
+
+                # Wait for the torque command until the deadline or the end of the step
+                deadline = time.time() + self.stats.deadline / 1000.0
+                receive(until=min(deadline, spinner.t_spin_target))
+                missed = len(send_times) > 0
+                if missed and self.max_ping > 0.0:
+                    log.debug(
+                        f"\n==== Warning: no torque command in {self.max_ping} ms! "
+                        "====\n"
+                    )
+                if torque_command is not None:
+                    torques = np.array(torque_command.joint_torques)
+                    self.env.apply_joint_torques(torques)
+
+                if self.log_interval > 0 and t % self.log_interval == 0:
+                    log.debug(f"\nControl loop stats: {self.stats.summary()}")
+
+                t += 1
+                self.stats.record_step(missed, 1000.0 * spinner.spin())
+        finally:
+            requests.put(None)
+            reader.join()
 
     def execute_rpc_call(self, request_func: Callable, args=[], log_request_time=False):
         """Executes an RPC call and performs round trip time intervals checks and logging
@@ -191,6 +372,7 @@ class GrpcSimulationClient(AbstractRobotClient):
         prev_time = time.time_ns()
         ret = request_func(*args)
         round_trip_time = (time.time_ns() - prev_time) / 1000.0 / 1000.0
+        self.stats.record_rtt(round_trip_time)
 
         # Check round trip time
         if self.max_ping > 0.0 and round_trip_time > self.max_ping:
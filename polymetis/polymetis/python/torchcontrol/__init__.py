@@ -7,3 +7,4 @@ from . import utils
 from . import models
 from . import modules
 from . import policies
+from . import rollout
@@ -31,13 +31,13 @@ class LinearFeedback(toco.ControlModule):
     def forward(self, x_current: torch.Tensor, x_desired: torch.Tensor) -> torch.Tensor:
         """
         Args:
-            x_current: Current state of shape (nS,)
-            x_desired: Desired state of shape (nS,)
+            x_current: Current state of shape (nS,), or (B, nS) for a batch of states
+            x_desired: Desired state of shape (nS,), or (B, nS)
 
         Returns:
-            Output action of shape (nA,)
+            Output action of shape (nA,), or (B, nA)
         """
-        return self.K @ (x_desired - x_current)
+        return (x_desired - x_current) @ self.K.T
 
 
 class JointSpacePD(toco.ControlModule):
@@ -75,17 +75,17 @@ class JointSpacePD(toco.ControlModule):
     ) -> torch.Tensor:
         """
         Args:
-            joint_pos_current: Current joint position of shape (N,)
-            joint_vel_current: Current joint velocity of shape (N,)
-            joint_pos_desired: Desired joint position of shape (N,)
-            joint_vel_desired: Desired joint velocity of shape (N,)
+            joint_pos_current: Current joint position of shape (N,), or (B, N) for a batch of states
+            joint_vel_current: Current joint velocity of shape (N,), or (B, N)
+            joint_pos_desired: Desired joint position of shape (N,), or (B, N)
+            joint_vel_desired: Desired joint velocity of shape (N,), or (B, N)
 
         Returns:
-            Output action of shape (nA,)
+            Output action of shape (nA,), or (B, nA)
         """
-        return self.Kp @ (joint_pos_desired - joint_pos_current) + self.Kd @ (
+        return (joint_pos_desired - joint_pos_current) @ self.Kp.T + (
             joint_vel_desired - joint_vel_current
-        )
+        ) @ self.Kd.T
 
 
 class CartesianSpacePD(toco.ControlModule):
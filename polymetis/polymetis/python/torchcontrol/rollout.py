@@ -0,0 +1,190 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""Batched rollouts of policies, for gain tuning and offline evaluation.
+
+A rollout steps B robots in lockstep: at each step the policy is evaluated on the
+(B, N) joint positions & velocities of the batch, and the (B, N) joint torques are
+applied to a batched dynamics model, which is either the pure-torch
+:class:`DoubleIntegrator` or any object with the same ``reset``/``step`` methods
+(e.g. ``polysim.envs.BatchedControlledEnv``, a batch of simulations).
+"""
+import copy
+import time
+from typing import Dict, List, Optional, Tuple
+
+import torch
+
+from torchcontrol.utils.tensor_utils import to_tensor
+
+
+class DoubleIntegrator:
+    """Pure-torch stand-in for the dynamics of a batch of gravity compensated robots.
+
+    Each joint is an independent double integrator with viscous damping:
+    ``qdd = (clip(tau) - damping * qd) / inertia``, integrated with semi-implicit Euler.
+
+    Args:
+        num_dofs: Number of degrees of freedom N
+        batch_size: Number of robots B
+        dt: Integration time step in seconds
+        inertia: Inertia of the joints, scalar or of shape (N,)
+        damping: Viscous damping of the joints, scalar or of shape (N,)
+        torque_limits: Absolute torque limits, scalar or of shape (N,)
+    """
+
+    def __init__(
+        self,
+        num_dofs: int,
+        batch_size: int,
+        dt: float = 0.001,
+        inertia=1.0,
+        damping=0.1,
+        torque_limits=float("inf"),
+    ):
+        self.num_dofs = num_dofs
+        self.batch_size = batch_size
+        self.dt = dt
+        self.inv_inertia = 1.0 / to_tensor(inertia).expand(num_dofs)
+        self.damping = to_tensor(damping).expand(num_dofs)
+        self.torque_limits = to_tensor(torque_limits).expand(num_dofs)
+
+        self.joint_pos = torch.zeros(batch_size, num_dofs)
+        self.joint_vel = torch.zeros(batch_size, num_dofs)
+
+    def reset(
+        self, joint_pos: torch.Tensor, joint_vel: Optional[torch.Tensor] = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Resets the robots to joint positions of shape (B, N) or (N,), at rest by
+        default."""
+        self.joint_pos.copy_(to_tensor(joint_pos).expand_as(self.joint_pos))
+        if joint_vel is None:
+            self.joint_vel.zero_()
+        else:
+            self.joint_vel.copy_(to_tensor(joint_vel).expand_as(self.joint_vel))
+        return self.joint_pos, self.joint_vel
+
+    def step(self, torques: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Applies (B, N) joint torques for one time step.
+
+        Returns:
+            Joint positions & velocities of shape (B, N), updated in place
+        """
+        torques = torch.clamp(torques, -self.torque_limits, self.torque_limits)
+        joint_acc = (torques - self.damping * self.joint_vel) * self.inv_inertia
+        self.joint_vel.add_(joint_acc, alpha=self.dt)
+        self.joint_pos.add_(self.joint_vel, alpha=self.dt)
+        return self.joint_pos, self.joint_vel
+
+
+class BatchedRollout:
+    """Runs a policy over a batch of robots, and collects the trajectories as tensors.
+
+    Policies written for a single state vector are evaluated on the whole batch at
+    once when they broadcast over a leading batch dimension (e.g. policies built on
+    ``LinearFeedback`` or ``JointSpacePD``), and otherwise with one copy of the policy
+    per robot. Scripted and eager policies are both supported. The policy itself is
+    not modified: each rollout runs on fresh copies of it.
+
+    Args:
+        policy: The policy (a ``toco.PolicyModule``, possibly scripted)
+        dynamics: Batched dynamics, e.g. a :class:`DoubleIntegrator`
+        vectorize: Whether to evaluate the policy on the whole batch at once;
+                   by default, checks whether the policy broadcasts correctly.
+    """
+
+    def __init__(
+        self, policy: torch.nn.Module, dynamics, vectorize: Optional[bool] = None
+    ):
+        self.policy = policy
+        self.dynamics = dynamics
+        if vectorize is None:
+            vectorize = self.is_vectorizable(policy, dynamics.num_dofs)
+        self.vectorize = vectorize
+
+    @staticmethod
+    def is_vectorizable(policy: torch.nn.Module, num_dofs: int) -> bool:
+        """Checks that the policy returns the same torques for a batch of two random
+        states as for each of them, on copies of the policy."""
+        joint_pos = torch.rand(2, num_dofs)
+        joint_vel = torch.rand(2, num_dofs)
+        with torch.no_grad():
+            try:
+                batched = copy.deepcopy(policy)(
+                    {"joint_positions": joint_pos, "joint_velocities": joint_vel}
+                )["joint_torques"]
+            except Exception:
+                return False
+            rows = [
+                copy.deepcopy(policy)(
+                    {"joint_positions": joint_pos[i], "joint_velocities": joint_vel[i]}
+                )["joint_torques"]
+                for i in range(2)
+            ]
+        return batched.shape == (2, num_dofs) and torch.allclose(
+            batched, torch.stack(rows)
+        )
+
+    def _forward(self, policies: List[torch.nn.Module], joint_pos, joint_vel, out):
+        if self.vectorize:
+            torques = policies[0](
+                {"joint_positions": joint_pos, "joint_velocities": joint_vel}
+            )["joint_torques"]
+            out.copy_(torques)
+        else:
+            for i, policy in enumerate(policies):
+                out[i] = policy(
+                    {"joint_positions": joint_pos[i], "joint_velocities": joint_vel[i]}
+                )["joint_torques"]
+        return out
+
+    def run(
+        self,
+        num_steps: int,
+        joint_pos: torch.Tensor,
+        joint_vel: Optional[torch.Tensor] = None,
+    ) -> Dict[str, torch.Tensor]:
+        """Rolls out the policy from the given initial states, for num_steps steps or
+        until the policy terminates.
+
+        Args:
+            num_steps: Maximum number of steps T
+            joint_pos: Initial joint positions of shape (B, N), or (N,) for all robots
+            joint_vel: Initial joint velocities of shape (B, N) or (N,), zero by default
+
+        Returns:
+            A dictionary of the trajectories, truncated to the T' executed steps:
+                - joint_positions: (T' + 1, B, N)
+                - joint_velocities: (T' + 1, B, N)
+                - joint_torques: (T', B, N)
+                - steps_per_second: Robot steps per second, i.e. B * T' / time
+        """
+        B, N = self.dynamics.batch_size, self.dynamics.num_dofs
+        policies = [
+            copy.deepcopy(self.policy) for _ in range(1 if self.vectorize else B)
+        ]
+        joint_positions = torch.empty(num_steps + 1, B, N)
+        joint_velocities = torch.empty(num_steps + 1, B, N)
+        joint_torques = torch.empty(num_steps, B, N)
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            pos, vel = self.dynamics.reset(joint_pos, joint_vel)
+            joint_positions[0] = pos
+            joint_velocities[0] = vel
+            t = 0
+            while t < num_steps and not policies[0].is_terminated():
+                torques = self._forward(policies, pos, vel, joint_torques[t])
+                pos, vel = self.dynamics.step(torques)
+                t += 1
+                joint_positions[t] = pos
+                joint_velocities[t] = vel
+        elapsed = time.perf_counter() - start
+
+        return {
+            "joint_positions": joint_positions[: t + 1],
+            "joint_velocities": joint_velocities[: t + 1],
+            "joint_torques": joint_torques[:t],
+            "steps_per_second": torch.tensor(B * t / elapsed),
+        }
@@ -2,10 +2,51 @@
 
 // This source code is licensed under the MIT license found in the
 // LICENSE file in the root directory of this source tree.
+#include <algorithm>
+#include <cstring>
 #include <string>
 
 #include "polymetis/polymetis_server.hpp"
 
+namespace {
+
+// Appends num_dofs floats of values to out, zero padded.
+void appendFloats(const google::protobuf::RepeatedField<float> &values,
+                  int num_dofs, std::string *out) {
+  size_t offset = out->size();
+  out->resize(offset + num_dofs * sizeof(float), 0);
+  int n = std::min(values.size(), num_dofs);
+  if (n > 0) {
+    std::memcpy(&(*out)[offset], values.data(), n * sizeof(float));
+  }
+}
+
+void appendToChunk(const RobotState &robot_state, int num_dofs,
+                   RobotStateChunk *chunk) {
+  int64_t timestamp_ns =
+      robot_state.timestamp().seconds() * 1000000000L +
+      robot_state.timestamp().nanos();
+  chunk->mutable_timestamps()->append(
+      reinterpret_cast<const char *>(&timestamp_ns), sizeof(timestamp_ns));
+  appendFloats(robot_state.joint_positions(), num_dofs,
+               chunk->mutable_joint_positions());
+  appendFloats(robot_state.joint_velocities(), num_dofs,
+               chunk->mutable_joint_velocities());
+  appendFloats(robot_state.joint_torques_computed(), num_dofs,
+               chunk->mutable_joint_torques_computed());
+  appendFloats(robot_state.prev_joint_torques_computed(), num_dofs,
+               chunk->mutable_prev_joint_torques_computed());
+  appendFloats(robot_state.prev_joint_torques_computed_safened(), num_dofs,
+               chunk->mutable_prev_joint_torques_computed_safened());
+  appendFloats(robot_state.motor_torques_measured(), num_dofs,
+               chunk->mutable_motor_torques_measured());
+  appendFloats(robot_state.motor_torques_external(), num_dofs,
+               chunk->mutable_motor_torques_external());
+  chunk->set_num_states(chunk->num_states() + 1);
+}
+
+} // namespace
+
 PolymetisControllerServerImpl::PolymetisControllerServerImpl() {
   controller_model_buffer_.reserve(MAX_MODEL_BYTES);
   updates_model_buffer_.reserve(MAX_MODEL_BYTES);
@@ -69,6 +110,38 @@ Status PolymetisControllerServerImpl::GetRobotStateLog(
   return Status::OK;
 }
 
+Status PolymetisControllerServerImpl::GetRobotStateLogChunks(
+    ServerContext *context, const LogInterval *interval,
+    ServerWriter<RobotStateChunk> *writer) {
+  // Stream until latest if end == -1
+  uint end = interval->end();
+  if (interval->end() == -1) {
+    end = robot_state_buffer_.size() - 1;
+  }
+
+  // Stream interval from robot state buffer, LOG_CHUNK_SIZE states at a time
+  RobotStateChunk chunk;
+  chunk.set_num_dofs(num_dofs_);
+  for (uint i = interval->start(); i <= end; i++) {
+    RobotState *robot_state_ptr = robot_state_buffer_.get(i);
+    if (robot_state_ptr != NULL) {
+      appendToChunk(*robot_state_ptr, num_dofs_, &chunk);
+    }
+    if (chunk.num_states() == LOG_CHUNK_SIZE ||
+        (i == end && chunk.num_states() > 0)) {
+      writer->Write(chunk);
+      chunk.Clear();
+      chunk.set_num_dofs(num_dofs_);
+    }
+
+    // Break if request cancelled
+    if (context->IsCancelled()) {
+      break;
+    }
+  }
+  return Status::OK;
+}
+
 Status PolymetisControllerServerImpl::InitRobotClient(
     ServerContext *context, const RobotClientMetadata *robot_client_metadata,
     Empty *) {
@@ -226,6 +299,22 @@ PolymetisControllerServerImpl::ControlUpdate(ServerContext *context,
   return Status::OK;
 }
 
+Status PolymetisControllerServerImpl::ControlUpdateStream(
+    ServerContext *context,
+    ServerReaderWriter<TorqueCommand, RobotState> *stream) {
+  RobotState robot_state;
+  TorqueCommand torque_command;
+  while (stream->Read(&robot_state)) {
+    torque_command.Clear();
+    Status status = ControlUpdate(context, &robot_state, &torque_command);
+    if (!status.ok()) {
+      return status;
+    }
+    stream->Write(torque_command);
+  }
+  return Status::OK;
+}
+
 Status PolymetisControllerServerImpl::SetController(
     ServerContext *context, ServerReader<ControllerChunk> *stream,
     LogInterval *interval) {
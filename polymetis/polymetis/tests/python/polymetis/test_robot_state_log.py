@@ -0,0 +1,113 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+import numpy as np
+import pytest
+import torch
+
+from polymetis_pb2 import RobotState, RobotStateChunk
+from polymetis.robot_state_log import (
+    ROBOT_STATE_FIELDS,
+    RobotStateLog,
+    EpisodeRecorder,
+)
+
+NUM_DOFS = 7
+LOG_CHUNK_SIZE = 1000
+
+
+def random_robot_states(num_states):
+    robot_states = []
+    for i in range(num_states):
+        state = RobotState(
+            **{
+                field: np.random.randn(NUM_DOFS).astype(np.float32).tolist()
+                for field in ROBOT_STATE_FIELDS
+            }
+        )
+        state.timestamp.seconds = 1600000000 + i // 1000
+        state.timestamp.nanos = (i % 1000) * 1000000
+        robot_states.append(state)
+    # The first state of an episode has no previous torques
+    del robot_states[0].prev_joint_torques_computed[:]
+    return robot_states
+
+
+def pack_chunks(robot_states):
+    """Packs RobotStates in RobotStateChunks, as GetRobotStateLogChunks does."""
+    chunks = []
+    for start in range(0, len(robot_states), LOG_CHUNK_SIZE):
+        chunk = RobotStateChunk(num_dofs=NUM_DOFS)
+        for state in robot_states[start : start + LOG_CHUNK_SIZE]:
+            ns = state.timestamp.seconds * 1000000000 + state.timestamp.nanos
+            chunk.timestamps += np.array(ns, dtype="<i8").tobytes()
+            for field in ROBOT_STATE_FIELDS:
+                values = np.zeros(NUM_DOFS, dtype="<f4")
+                values[: len(getattr(state, field))] = getattr(state, field)
+                setattr(chunk, field, getattr(chunk, field) + values.tobytes())
+            chunk.num_states += 1
+        chunks.append(chunk)
+    return chunks
+
+
+def test_robot_state_log(tmp_path):
+    robot_states = random_robot_states(2500)
+    chunks = pack_chunks(robot_states)
+    assert [chunk.num_states for chunk in chunks] == [1000, 1000, 500]
+
+    log = RobotStateLog.from_chunks(chunks)
+    assert len(log) == 2500 and log.num_dofs == NUM_DOFS
+    expected = RobotStateLog.from_robot_states(robot_states)
+    assert np.array_equal(log.timestamps, expected.timestamps)
+    for field in ROBOT_STATE_FIELDS:
+        assert np.array_equal(getattr(log, field), expected.fields[field])
+    assert not log.prev_joint_torques_computed[0].any()
+
+    tensors = log.to_tensors()
+    assert tensors["joint_positions"].shape == (2500, NUM_DOFS)
+    velocities = torch.Tensor(robot_states[10].joint_velocities)
+    assert torch.equal(tensors["joint_velocities"][10], velocities)
+
+    assert log.to_robot_states()[1:] == robot_states[1:]
+    assert len(RobotStateLog.from_chunks([])) == 0
+
+    recorder = EpisodeRecorder(str(tmp_path / "episodes"))
+    path = recorder.record(3, 2502, log)
+    loaded = RobotStateLog.load(path)
+    assert np.array_equal(loaded.timestamps, log.timestamps)
+    assert np.array_equal(loaded.motor_torques_external, log.motor_torques_external)
+
+
+@pytest.fixture(scope="module")
+def serialized_log():
+    # A 10s episode at 1kHz, as sent over the wire
+    robot_states = random_robot_states(10000)
+    messages = [state.SerializeToString() for state in robot_states]
+    chunks = [chunk.SerializeToString() for chunk in pack_chunks(robot_states)]
+    return messages, chunks
+
+
+def per_message_log(messages):
+    robot_states = [RobotState.FromString(message) for message in messages]
+    return {
+        field: torch.Tensor([list(getattr(state, field)) for state in robot_states])
+        for field in ["joint_positions", "joint_velocities", "joint_torques_computed"]
+    }
+
+
+def chunked_log(chunks):
+    log = RobotStateLog.from_chunks(RobotStateChunk.FromString(c) for c in chunks)
+    return log.to_tensors()
+
+
+@pytest.mark.benchmark(group="robot_state_log")
+def test_per_message_log_performance(serialized_log, benchmark):
+    messages, _ = serialized_log
+    benchmark(per_message_log, messages)
+
+
+@pytest.mark.benchmark(group="robot_state_log")
+def test_chunked_log_performance(serialized_log, benchmark):
+    _, chunks = serialized_log
+    benchmark(chunked_log, chunks)
@@ -0,0 +1,136 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+#
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+import pytest
+import torch
+
+import torchcontrol as toco
+from torchcontrol.rollout import BatchedRollout, DoubleIntegrator
+from torchcontrol.utils.test_utils import FakeRobotModel
+
+num_dofs = 7
+num_steps = 100
+robot_model = FakeRobotModel(num_dofs)
+
+
+def joint_impedance():
+    return toco.policies.JointImpedanceControl(
+        joint_pos_current=torch.zeros(num_dofs),
+        Kp=torch.rand(num_dofs) * 10,
+        Kd=torch.rand(num_dofs),
+        robot_model=robot_model,
+    )
+
+
+def cartesian_impedance():
+    return toco.policies.CartesianImpedanceControl(
+        joint_pos_current=torch.zeros(num_dofs),
+        Kp=torch.rand(6),
+        Kd=torch.rand(6),
+        robot_model=robot_model,
+    )
+
+
+def ilqr(time_horizon=num_steps // 2):
+    return toco.policies.iLQR(
+        Kxs=torch.rand(time_horizon, num_dofs, 2 * num_dofs),
+        x_desireds=torch.rand(time_horizon, 2 * num_dofs),
+        u_ffs=torch.rand(time_horizon, num_dofs),
+    )
+
+
+@pytest.mark.parametrize("scripted", [False, True])
+@pytest.mark.parametrize("make_policy", [joint_impedance, ilqr])
+def test_vectorized_rollout(make_policy, scripted):
+    policy = make_policy()
+    if scripted:
+        policy = torch.jit.script(policy)
+    joint_pos = torch.rand(8, num_dofs)
+
+    rollout = BatchedRollout(policy, DoubleIntegrator(num_dofs, 8))
+    assert rollout.vectorize
+    batched = rollout.run(num_steps, joint_pos)
+    per_row = BatchedRollout(policy, DoubleIntegrator(num_dofs, 8), vectorize=False)
+    expected = per_row.run(num_steps, joint_pos)
+
+    T = batched["joint_torques"].shape[0]
+    assert T == (num_steps // 2 if make_policy is ilqr else num_steps)
+    assert batched["joint_positions"].shape == (T + 1, 8, num_dofs)
+    assert batched["joint_velocities"].shape == (T + 1, 8, num_dofs)
+    for key in ["joint_positions", "joint_velocities", "joint_torques"]:
+        assert torch.allclose(batched[key], expected[key], atol=1e-5)
+    assert not policy.is_terminated()
+
+
+def test_per_row_fallback():
+    policy = cartesian_impedance()
+    rollout = BatchedRollout(policy, DoubleIntegrator(num_dofs, 4))
+    assert not rollout.vectorize
+
+    joint_pos = torch.rand(4, num_dofs)
+    traj = rollout.run(10, joint_pos)
+    for i in range(4):
+        inputs = {"joint_positions": joint_pos[i], "joint_velocities": torch.zeros(7)}
+        row = policy(inputs)
+        assert torch.allclose(traj["joint_torques"][0, i], row["joint_torques"])
+
+
+def test_double_integrator():
+    dynamics = DoubleIntegrator(num_dofs, 2, dt=0.01, damping=0.0, torque_limits=1.0)
+    dynamics.reset(torch.zeros(num_dofs))
+    for _ in range(100):
+        joint_pos, joint_vel = dynamics.step(torch.full((2, num_dofs), 2.0))
+    # Torques are clipped to 1, so that the joints accelerate at 1 rad/s^2 for 1s
+    assert torch.allclose(joint_vel, torch.ones(2, num_dofs), atol=1e-5)
+    assert torch.allclose(joint_pos, torch.full((2, num_dofs), 0.505), atol=1e-5)
+
+
+def test_bullet_rollout():
+    from polysim.envs import BatchedControlledEnv, BulletManipulatorEnv
+    from ..polysim.test_env import franka_panda
+
+    envs = [
+        BulletManipulatorEnv(franka_panda, gui=False, use_grav_comp=True)
+        for _ in range(2)
+    ]
+    dynamics = BatchedControlledEnv(envs)
+    policy = toco.policies.JointImpedanceControl(
+        joint_pos_current=torch.Tensor(franka_panda.rest_pose),
+        Kp=torch.ones(num_dofs) * 40,
+        Kd=torch.ones(num_dofs) * 4,
+        robot_model=robot_model,
+        ignore_gravity=True,
+    )
+    joint_pos = torch.Tensor(franka_panda.rest_pose) + 0.1 * torch.rand(2, num_dofs)
+    traj = BatchedRollout(policy, dynamics).run(num_steps, joint_pos)
+
+    assert traj["joint_positions"].shape == (num_steps + 1, 2, num_dofs)
+    assert torch.allclose(traj["joint_positions"][0], joint_pos, atol=1e-5)
+    # Each environment is simulated independently
+    final_joint_pos = traj["joint_positions"][-1]
+    assert not torch.allclose(final_joint_pos[0], final_joint_pos[1])
+
+
+@pytest.mark.parametrize("batch_size", [1, 16, 256, 4096])
+@pytest.mark.benchmark(group="rollout-vectorized")
+def test_rollout_performance(batch_size, benchmark):
+    policy = torch.jit.script(joint_impedance())
+    rollout = BatchedRollout(policy, DoubleIntegrator(num_dofs, batch_size))
+    joint_pos = torch.rand(batch_size, num_dofs)
+
+    traj = benchmark(rollout.run, num_steps, joint_pos)
+    benchmark.extra_info["steps_per_second"] = traj["steps_per_second"].item()
+
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+@pytest.mark.benchmark(group="rollout-per-row")
+def test_per_row_rollout_performance(batch_size, benchmark):
+    policy = torch.jit.script(joint_impedance())
+    rollout = BatchedRollout(
+        policy, DoubleIntegrator(num_dofs, batch_size), vectorize=False
+    )
+    joint_pos = torch.rand(batch_size, num_dofs)
+
+    traj = benchmark(rollout.run, num_steps, joint_pos)
+    benchmark.extra_info["steps_per_second"] = traj["steps_per_second"].item()
@@ -3,6 +3,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import time
+from concurrent import futures
 import pytest
 
 import grpc
@@ -50,12 +51,67 @@ class FakeConnection:
     def ControlUpdate(self, robot_state):
         return polymetis_pb2.TorqueCommand()
 
+    def ControlUpdateStream(self, robot_states):
+        for robot_state in robot_states:
+            yield polymetis_pb2.TorqueCommand()
+
     def InitRobotClient(self, metadata):
         pass
 
 
+class FakeServer(polymetis_pb2_grpc.PolymetisControllerServerServicer):
+    """Replies to each robot state with torques -joint_positions, after `delay` s"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def _torques(self, robot_state):
+        if self.delay > 0.0:
+            time.sleep(self.delay)
+        return polymetis_pb2.TorqueCommand(
+            joint_torques=[-q for q in robot_state.joint_positions]
+        )
+
+    def ControlUpdate(self, robot_state, context):
+        return self._torques(robot_state)
+
+    def ControlUpdateStream(self, robot_states, context):
+        for robot_state in robot_states:
+            yield self._torques(robot_state)
+
+    def InitRobotClient(self, metadata, context):
+        return polymetis_pb2.Empty()
+
+
+class RecordingEnv(FakeEnv):
+    def __init__(self):
+        self.steps = 0
+        self.torques = []
+
+    def get_current_joint_pos_vel(self):
+        self.steps += 1
+        return np.full(N_DIM, float(self.steps)), np.zeros(N_DIM)
+
+    def apply_joint_torques(self, torques):
+        self.torques.append(torques)
+
+
+@pytest.fixture
+def fake_server():
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=2))
+    servicer = FakeServer()
+    polymetis_pb2_grpc.add_PolymetisControllerServerServicer_to_server(
+        servicer, server
+    )
+    port = server.add_insecure_port("localhost:0")
+    server.start()
+    yield servicer, port
+    server.stop(None)
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
 @pytest.mark.parametrize("hz, steps", [(60, 30), (250, 100)])
-def test_spinner(monkeypatch, hz, steps):
+def test_spinner(monkeypatch, hz, steps, async_mode):
     # Patch grpc connection
     monkeypatch.setattr(grpc, "insecure_channel", FakeChannel)
     monkeypatch.setattr(
@@ -66,7 +122,9 @@ def test_spinner(monkeypatch, hz, steps):
     dt = 1.0 / hz
     env = FakeEnv()
     fake_metadata_cfg.hz = hz
-    sim = GrpcSimulationClient(env=env, metadata_cfg=fake_metadata_cfg)
+    sim = GrpcSimulationClient(
+        env=env, metadata_cfg=fake_metadata_cfg, async_mode=async_mode
+    )
 
     # Run env
     sim.run(time_horizon=5)  # warmup
@@ -85,3 +143,51 @@ def test_spinner(monkeypatch, hz, steps):
     print(f"Percentage error per step: {error*100.0}%")
 
     assert error < 0.03
+
+
+@pytest.mark.parametrize("async_mode", [False, True])
+def test_control_loop(fake_server, async_mode):
+    servicer, port = fake_server
+    env = RecordingEnv()
+    fake_metadata_cfg.hz = 1000
+    sim = GrpcSimulationClient(
+        env=env, metadata_cfg=fake_metadata_cfg, port=port, async_mode=async_mode
+    )
+    sim.metadata.get_proto = lambda: polymetis_pb2.RobotClientMetadata(hz=1000)
+
+    # Sustains 1kHz
+    steps = 1000
+    t0 = time.time()
+    sim.run(time_horizon=steps)
+    t_actual = time.time() - t0
+    stats = sim.stats.summary()
+    print(f"async_mode={async_mode}: {steps} steps in {t_actual}s, stats: {stats}")
+
+    assert len(env.torques) == steps and stats["steps"] == steps
+    assert sum(stats["rtt_histogram"].values()) == steps
+    assert np.allclose(env.torques[0], -1.0)
+    # The torques reply to the states of the same step, or of a previous one if late
+    for step, torques in enumerate(env.torques, 1):
+        assert 1 <= -torques[0] <= step
+    assert stats["deadline_misses"] < 0.25 * steps
+    assert t_actual < 1.1 * steps / 1000
+
+
+def test_deadline_misses(fake_server):
+    # A server slower than the loop: async mode keeps the loop rate and counts misses
+    servicer, port = fake_server
+    servicer.delay = 0.005
+    env = RecordingEnv()
+    fake_metadata_cfg.hz = 1000
+    sim = GrpcSimulationClient(
+        env=env, metadata_cfg=fake_metadata_cfg, port=port, async_mode=True
+    )
+    sim.metadata.get_proto = lambda: polymetis_pb2.RobotClientMetadata(hz=1000)
+
+    sim.run(time_horizon=100)
+    stats = sim.stats.summary()
+
+    assert stats["deadline_misses"] > 50
+    assert stats["rtt_mean"] > 5.0
+    # Only the steps before the first torque command received apply nothing
+    assert len(env.torques) > 90